@@ -8,6 +8,12 @@ def create_app(config_name='default'):
     app = Flask(__name__)
     app.config.from_object(config[config_name])
 
+    # Client addresses (rate limits, audit) come from X-Forwarded-For only as set by trusted proxies
+    if app.config.get('TRUSTED_PROXIES'):
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'],
+                                x_proto=app.config['TRUSTED_PROXIES'])
+
     # Initialize extensions
     db.init_app(app)
     migrate.init_app(app, db)
@@ -21,6 +27,55 @@ def create_app(config_name='default'):
     from src.api.endpoints import api_simple
     app.register_blueprint(api_simple, url_prefix='/')
 
+    # Register bulk and batch terminology operations
+    from src.api.operations import api_ops
+    app.register_blueprint(api_ops, url_prefix='/')
+
+    # Prometheus metrics (GET /metrics); first, so request timing covers the other hooks
+    from src.services import metrics
+    metrics.init_app(app)
+
+    # Terminology change notifications and in-memory lookup structures
+    from src.services import terminology, search_backends, translation_cache, hierarchy, http_cache
+    terminology.init_app(app)
+    # Memory-mapped snapshot of codes and mappings shared by all workers; before the search index it seeds
+    from src.services import terminology_snapshot
+    terminology_snapshot.init_app(app)
+    search_backends.init_app(app)
+    translation_cache.init_app(app)
+    hierarchy.init_app(app)
+    # Release counter for ETag/304 on terminology reads, and response compression
+    http_cache.init_app(app)
+
+    # Background job queue for long-running ingest/sync
+    from src.services import jobs
+    jobs.init_app(app)
+
+    # NAMASTE -> ICD-11 candidate mappings for curators (flask mappings suggest)
+    from src.services import mapping_suggestions
+    mapping_suggestions.init_app(app)
+
+    # ABHA bearer token validation (local JWT verification, cached results)
+    from src.services import abha_auth
+    abha_auth.init_app(app)
+
+    # Token-bucket rate limits per client and endpoint (RATELIMIT_*)
+    from src.services import rate_limit
+    rate_limit.init_app(app)
+
+    # Consent decisions, loaded in bulk per request and cached per patient
+    from src.services import consent
+    consent.init_app(app)
+
+    # Audit events, written in batches off the request path
+    from src.services import audit
+    audit.init_app(app)
+
+    # CLI commands (flask icd11 import ..., flask fhir compact)
+    from src.services import icd11_import, versioning
+    icd11_import.init_app(app)
+    versioning.init_app(app)
+
     return app
 
 
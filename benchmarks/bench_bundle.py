@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Benchmark of set-based Bundle processing on in-memory SQLite
+
+Seeds NAMASTE and ICD-11 codes, then posts dual-coded Condition Bundles of
+the given size to /bundle/process as batch and transaction Bundles, twice
+each so the second round writes new versions of existing resources.
+
+    python benchmarks/bench_bundle.py --entries 1000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from src.extensions import db
+from src.services.terminology import NAMASTE_SYSTEM, ICD11_SYSTEM
+
+
+def seed(count):
+    from src.models import NAMASTECode, ICD11Code, ConsentRecord
+
+    db.session.execute(db.insert(NAMASTECode),
+                       [{'code': f'NAM{i:06d}', 'display': f'NAMASTE concept {i}'} for i in range(count)])
+    db.session.execute(db.insert(ICD11Code),
+                       [{'code': f'TM2.{i:06d}', 'title': f'ICD-11 concept {i}'} for i in range(count)])
+    # CONSENT_REQUIRED is on, so the benchmark patient needs a consent
+    db.session.add(ConsentRecord(patient_id='example', purpose='treatment', status='active'))
+    db.session.commit()
+
+
+def condition_bundle(bundle_type, count):
+    entries = []
+    for i in range(count):
+        entry = {
+            'fullUrl': f'urn:uuid:condition-{i}',
+            'resource': {
+                'resourceType': 'Condition',
+                'id': f'bench-{i}',
+                'subject': {'reference': 'Patient/example'},
+                'code': {'coding': [
+                    {'system': NAMASTE_SYSTEM, 'code': f'NAM{i:06d}'},
+                    {'system': ICD11_SYSTEM, 'code': f'TM2.{i:06d}'},
+                ]},
+            },
+            'request': {'method': 'PUT', 'url': f'Condition/bench-{i}'},
+        }
+        entries.append(entry)
+    return {'resourceType': 'Bundle', 'type': bundle_type, 'entry': entries}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--entries', type=int, default=1000)
+    args = parser.parse_args()
+
+    app = create_app('testing')
+    app.config['SQLALCHEMY_ECHO'] = False
+    with app.app_context():
+        db.create_all()
+        seed(args.entries)
+    client = app.test_client()
+
+    print(f'{args.entries}-entry Bundles')
+    for bundle_type in ('batch', 'transaction'):
+        bundle = condition_bundle(bundle_type, args.entries)
+        for round_no in (1, 2):
+            started = time.perf_counter()
+            response = client.post('/bundle/process', json=bundle)
+            elapsed = time.perf_counter() - started
+            statuses = {}
+            for entry in response.json.get('entry', []):
+                status = entry['response']['status']
+                statuses[status] = statuses.get(status, 0) + 1
+            print(f'  {bundle_type:11} round {round_no}: {elapsed * 1000:7.1f} ms  {statuses}')
+
+
+if __name__ == '__main__':
+    main()
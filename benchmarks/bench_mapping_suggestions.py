@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the NAMASTE -> ICD-11 mapping suggestion engine
+
+Builds TF-IDF vectors for synthetic vocabularies and scores every NAMASTE
+code against every ICD-11 code, as a full $suggest-mappings run does
+(without the database). Words are made up from syllables so the
+vocabulary is large enough for document frequencies to be realistic. Each
+NAMASTE code has one ICD-11 code whose title is a respelling of its
+display ("jvara" / "jwara"); recall reports how often that code is in the
+top 1 and top k.
+
+    python benchmarks/bench_mapping_suggestions.py --namaste 10000 --icd11 50000 --workers 4
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.services import mapping_suggestions
+from src.services.terminology import Concept, NAMASTE_SYSTEM, ICD11_SYSTEM
+
+SYLLABLES = ['ka', 'ra', 'ta', 'va', 'dha', 'sha', 'ma', 'pi', 'na', 'jva', 'la', 'ha', 'ya', 'ro', 'gu',
+             'su', 'ti', 'pa', 'kri', 'me', 'ni', 'do', 'bha', 'sa']
+COMMON = ['disorder', 'of', 'the', 'due', 'to', 'chronic', 'acute', 'pain', 'fever', 'syndrome']
+RESPELLINGS = [('v', 'w'), ('sh', 's'), ('aa', 'a'), ('i', 'ee')]
+
+
+def vocabularies(namaste, icd11, seed=42):
+    """(NAMASTE concepts, ICD-11 concepts); ICD-11 code i respells NAMASTE code i"""
+    rng = random.Random(seed)
+    words = sorted({''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(40000)})
+
+    def text(count):
+        return ' '.join(rng.choice(words) if rng.random() < 0.7 else rng.choice(COMMON) for _ in range(count))
+
+    sources = [Concept(NAMASTE_SYSTEM, f'NAM{i:07d}', text(3), text(12), None) for i in range(namaste)]
+    targets = []
+    for i in range(icd11):
+        if i < namaste:
+            old, new = rng.choice(RESPELLINGS)
+            title = sources[i].display.replace(old, new) + ' ' + rng.choice(COMMON)
+        else:
+            title = text(4)
+        targets.append(Concept(ICD11_SYSTEM, f'TM2.{i:07d}', title, text(15), None))
+    return sources, targets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--namaste', type=int, default=10000)
+    parser.add_argument('--icd11', type=int, default=50000)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--max-df', type=float, default=0.05)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    sources, targets = vocabularies(args.namaste, args.icd11)
+    started = time.perf_counter()
+    model = mapping_suggestions.Model(sources, targets, args.max_df)
+    built = time.perf_counter() - started
+    print(f'Vectorized {len(sources)} + {len(targets)} concepts ({len(model.vectorizer.vocabulary)} features, '
+          f'{len(model.postings.targets)} ICD-11 postings) in {built:.2f}s')
+
+    started = time.perf_counter()
+    first = in_top_k = 0
+    for code, candidates in model.suggest_all(args.top_k, 0.0, args.workers):
+        expected = int(code[3:])
+        ranked = [target for target, _ in candidates]
+        first += bool(ranked) and ranked[0] == expected
+        in_top_k += expected in ranked
+    scored = time.perf_counter() - started
+    blocks = len(mapping_suggestions.blocks(model.sources, model.postings))
+    print(f'Scored {len(sources)} x {len(targets)} in {scored:.2f}s ({blocks} blocks, {args.workers} workers)')
+    print(f'  recall@1 {first / len(sources):.3f}  recall@{args.top_k} {in_top_k / len(sources):.3f}')
+    print(f'  total {built + scored:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
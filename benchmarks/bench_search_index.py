@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the in-memory /valueset/search index
+
+Builds a SearchIndex over synthetic NAMASTE/ICD-11 concepts and reports
+build time and per-query latency percentiles. No database is needed.
+
+    python benchmarks/bench_search_index.py --concepts 200000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.services.search_index import SearchIndex
+from src.services.terminology import Concept, NAMASTE_SYSTEM, ICD11_SYSTEM
+
+WORDS = [
+    'vata', 'pitta', 'kapha', 'dosha', 'dhatu', 'rasa', 'rakta', 'mamsa', 'meda', 'asthi',
+    'majja', 'shukra', 'agni', 'ama', 'ojas', 'prana', 'vyana', 'udana', 'samana', 'apana',
+    'jwara', 'kasa', 'shwasa', 'prameha', 'amlapitta', 'grahani', 'arsha', 'kushtha', 'pandu',
+    'mizaj', 'balgham', 'safra', 'sauda', 'vatham', 'pitham', 'kapham', 'fever', 'cough',
+    'disorder', 'imbalance', 'syndrome', 'chronic', 'acute', 'pain', 'infection', 'tissue',
+]
+
+
+def synthetic_concepts(count, seed=42):
+    rng = random.Random(seed)
+    for i in range(count):
+        words = rng.sample(WORDS, rng.randint(2, 4))
+        display = ' '.join(word.capitalize() for word in words) + f' {i % 97}'
+        definition = ' '.join(rng.sample(WORDS, 8))
+        if i % 2:
+            yield Concept(NAMASTE_SYSTEM, f'NAM{i:06d}', display, definition, None)
+        else:
+            yield Concept(ICD11_SYSTEM, f'{i % 10}A{i:05d}', display, definition, None)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--concepts', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=5000)
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    index = SearchIndex()
+    started = time.perf_counter()
+    index.build(synthetic_concepts(args.concepts))
+    print(f'Built index over {len(index)} concepts in {time.perf_counter() - started:.2f}s')
+
+    rng = random.Random(7)
+    queries = []
+    for _ in range(args.queries):
+        word = rng.choice(WORDS)
+        kind = rng.random()
+        if kind < 0.5:
+            queries.append(word[:rng.randint(1, len(word))])
+        elif kind < 0.7:
+            queries.append(f'{word} {rng.choice(WORDS)[:3]}')
+        elif kind < 0.85:
+            queries.append(f'NAM{rng.randint(0, 999)}')
+        else:
+            queries.append(word[1:] + 'x')
+
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        index.search(query, limit=args.limit)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    print(f'{len(queries)} queries, limit={args.limit}')
+    print(f'  mean {statistics.mean(timings):.3f} ms')
+    for pct in (50, 95, 99):
+        print(f'  p{pct}  {percentile(timings, pct):.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Benchmark of app startup: import profile, worker start time and worker memory
+
+Seeds a file SQLite database, then profiles `create_app()` with
+`python -X importtime` (the slowest imports by cumulative time) and
+starts --workers workers the two ways gunicorn can: each worker importing
+and building the app after the fork, and workers forked from a master that
+preloaded it (gunicorn.conf.py). Every worker answers a few $translate
+requests and searches before its memory is read from
+/proc/self/smaps_rollup, so this needs Linux. Private memory is what a
+worker does not share with the master or its siblings.
+
+    python benchmarks/bench_startup.py --scale 10k --workers 4
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import results
+
+CONFIG = 'production'
+
+PROFILE = (
+    'import time; started = time.perf_counter(); '
+    f'from app import create_app; create_app({CONFIG!r}); '
+    'print(time.perf_counter() - started)'
+)
+
+
+def environment(directory):
+    """Settings for the child processes: the seeded database, no Redis, threads started in the workers"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT] + sys.path), DEFER_WORKER_THREADS='true',
+               DATABASE_URL=f'sqlite:///{os.path.join(directory, "startup.db")}',
+               TERMINOLOGY_SNAPSHOT_DIR=os.path.join(directory, 'snapshots'),
+               AUDIT_SPOOL_DIR=os.path.join(directory, 'audit-spool'))
+    for name in ('REDIS_URL', 'PROMETHEUS_MULTIPROC_DIR'):
+        env.pop(name, None)
+    return env
+
+
+def seed(env, size):
+    script = (
+        'from app import create_app; from src.extensions import db; import datasets; '
+        f'app = create_app({CONFIG!r}); ctx = app.app_context(); ctx.push(); '
+        f'db.create_all(); datasets.seed_database({size})'
+    )
+    env = dict(env, PYTHONPATH=os.pathsep.join([os.path.dirname(os.path.abspath(__file__)), env['PYTHONPATH']]))
+    subprocess.run([sys.executable, '-c', script], env=env, check=True, capture_output=True)
+
+
+def parse_importtime(stderr):
+    """[(module, depth, self_us, cumulative_us)] from python -X importtime output"""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), depth, int(own), int(cumulative)))
+    return imports
+
+
+def profile(env, top):
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROFILE], env=env, cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    imports = parse_importtime(output.stderr)
+    # Depth 0 is imported by app.py or create_app(), depth 1 by those modules
+    slowest = sorted((entry for entry in imports if entry[1] <= 1), key=lambda entry: -entry[3])[:top]
+    return {
+        'create_app_seconds': round(float(output.stdout.split()[-1]), 3),
+        'import_seconds': round(sum(entry[3] for entry in imports if entry[1] == 0) / 1e6, 3),
+        'modules': len(imports),
+        'slowest': {name: round(cumulative / 1e3, 1) for name, _, _, cumulative in slowest},
+    }
+
+
+def memory():
+    """Rss, Pss and private kB of this process"""
+    fields = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if value.strip().endswith('kB'):
+                fields[name] = int(value.split()[0])
+    return {'rss_kb': fields['Rss'], 'pss_kb': fields['Pss'],
+            'private_kb': fields['Private_Clean'] + fields['Private_Dirty']}
+
+
+def serve(app, requests):
+    """The work a worker does before it is measured"""
+    import datasets
+    from src.services import search_backends
+    from src.services.terminology import NAMASTE_SYSTEM, ICD11_SYSTEM
+
+    client = app.test_client()
+    for i in range(requests):
+        client.get('/ConceptMap/$translate', query_string={
+            'system': NAMASTE_SYSTEM, 'code': datasets.namaste_code(i), 'targetsystem': ICD11_SYSTEM})
+        with app.app_context():
+            search_backends.search(app, datasets.namaste_code(i)[:6])
+
+
+def run_workers(preloaded, workers, requests):
+    """Child process: start workers like gunicorn and print one JSON line per worker, then the master's"""
+    started = time.perf_counter()
+    if preloaded:
+        from app import create_app
+        from src.services import preload
+
+        app = create_app(CONFIG)
+        preload.warm(app)
+    loaded = time.perf_counter() - started
+    reports, done = os.pipe(), os.pipe()
+    for _ in range(workers):
+        if os.fork() == 0:
+            os.close(reports[0])
+            os.close(done[1])
+            started = time.perf_counter()
+            if not preloaded:
+                from app import create_app
+                from src.services import preload
+
+                app = create_app(CONFIG)
+            preload.after_fork(app)
+            ready = time.perf_counter() - started
+            serve(app, requests)
+            os.write(reports[1], (json.dumps(dict(memory(), ready_seconds=ready)) + '\n').encode())
+            # Stay alive until every worker is measured, so shared pages stay shared
+            os.read(done[0], 1)
+            os._exit(0)
+    with os.fdopen(reports[0]) as f:
+        lines = [f.readline() for _ in range(workers)]
+    master = memory()
+    os.close(done[1])
+    for _ in range(workers):
+        os.wait()
+    print(''.join(lines), end='')
+    print(json.dumps(dict(master, ready_seconds=loaded)))
+
+
+def start(env, preloaded, workers, requests):
+    command = [sys.executable, os.path.abspath(__file__), '--child', 'preload' if preloaded else 'fork',
+               '--workers', str(workers), '--requests', str(requests)]
+    output = subprocess.run(command, env=env, cwd=ROOT, capture_output=True, text=True, check=True)
+    *reports, master = [json.loads(line) for line in output.stdout.splitlines() if line.startswith('{')]
+    ready = [report['ready_seconds'] for report in reports]
+    private = [report['private_kb'] for report in reports]
+    return {
+        'master_seconds': round(master['ready_seconds'], 3),
+        'worker_ready_seconds': round(max(ready), 3),
+        'worker_rss_mb': round(max(report['rss_kb'] for report in reports) / 1024, 1),
+        'worker_private_mb': round(max(private) / 1024, 1),
+        # Everything the master and its workers hold, counting shared pages once
+        'total_mb': round((master['rss_kb'] + sum(private)) / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scale', default='10k', help='10k, 100k or 1m (datasets.py)')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=50, help='$translate requests and searches per worker')
+    parser.add_argument('--top', type=int, default=15, help='slowest imports to list')
+    parser.add_argument('--child', choices=('preload', 'fork'), help=argparse.SUPPRESS)
+    parser.add_argument('--output', help='result file (default: benchmarks/results/startup-<commit>-<scale>.json)')
+    args = parser.parse_args()
+
+    if args.child:
+        run_workers(args.child == 'preload', args.workers, args.requests)
+        return
+    # Not at the top: a --child master must start with nothing of the app imported
+    import datasets
+
+    with tempfile.TemporaryDirectory(prefix='medisync-startup-') as directory:
+        env = environment(directory)
+        seed(env, datasets.scale_size(args.scale))
+        measured = {'imports': profile(env, args.top)}
+        for name, preloaded in (('per_worker', False), ('preloaded', True)):
+            measured[name] = start(env, preloaded, args.workers, args.requests)
+
+    imports = measured['imports']
+    print(f'{args.scale}: create_app() {imports["create_app_seconds"]:.2f}s cold, '
+          f'{imports["import_seconds"]:.2f}s of it importing {imports["modules"]} modules')
+    for name, milliseconds in imports['slowest'].items():
+        print(f'  {milliseconds:8.1f} ms  {name}')
+    print(f'{args.workers} workers        master      worker ready   worker private   worker rss   total')
+    for name in ('per_worker', 'preloaded'):
+        m = measured[name]
+        print(f'  {name:14} {m["master_seconds"]:7.2f}s  {m["worker_ready_seconds"]:12.3f}s  '
+              f'{m["worker_private_mb"]:12.1f} MB  {m["worker_rss_mb"]:8.1f} MB  {m["total_mb"]:6.1f} MB')
+    path = results.save('startup', args.scale, measured, args.output, scale=args.scale, workers=args.workers,
+                        requests=args.requests)
+    print(f'  -> {path}')
+
+
+if __name__ == '__main__':
+    main()
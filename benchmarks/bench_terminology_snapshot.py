@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the memory-mapped terminology snapshot
+
+Writes a snapshot of the synthetic NAMASTE/ICD-11 codes and mappings from
+datasets.py (no database needed), then reports its size, the time to map
+it, concept and $translate lookup latency, and the Python heap the same
+data takes when every worker holds it in dicts instead.
+
+    python benchmarks/bench_terminology_snapshot.py --scale 100k
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import datasets
+import results
+from src.services import terminology_snapshot
+from src.services.terminology import Concept, NAMASTE_SYSTEM, ICD11_SYSTEM
+
+
+def load(size):
+    concepts = {
+        NAMASTE_SYSTEM: [Concept(NAMASTE_SYSTEM, row['code'], row['display'], row['definition'],
+                                 row['parent_code'] or None) for row in datasets.namaste_rows(size)],
+        ICD11_SYSTEM: [Concept(ICD11_SYSTEM, row['code'], row['title'], '', None)
+                       for row in datasets.icd11_rows(size)],
+    }
+    mappings = [tuple(row[name] for name in terminology_snapshot.MAPPING_COLUMNS)
+                for row in datasets.mapping_rows(size)]
+    return concepts, mappings
+
+
+def dict_heap(concepts, mappings):
+    """Bytes of Python heap for the same lookups held as dicts"""
+    tracemalloc.start()
+    by_code = {(c.system, c.code): c for system in concepts.values() for c in system}
+    by_key = {}
+    for source_system, source_code, target_system, target_code, display, equivalence in mappings:
+        by_key.setdefault((source_system, source_code, target_system), []).append(
+            {'system': target_system, 'code': target_code, 'display': display, 'equivalence': equivalence})
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del by_code, by_key
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scale', choices=list(datasets.SCALES), default='100k')
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--output', help='result file (default: benchmarks/results/snapshot-<commit>-<scale>.json)')
+    args = parser.parse_args()
+
+    size = datasets.scale_size(args.scale)
+    concepts, mappings = load(size)
+    measured = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'terminology.snap')
+        started = time.perf_counter()
+        terminology_snapshot.write(path, concepts, mappings, generation=1, release=1)
+        measured['write'] = {'seconds': round(time.perf_counter() - started, 3), 'bytes': os.path.getsize(path),
+                             'codes_per_second': round(2 * size / (time.perf_counter() - started), 1)}
+
+        started = time.perf_counter()
+        snapshot = terminology_snapshot.Snapshot(path)
+        measured['open'] = {'seconds': round(time.perf_counter() - started, 6)}
+
+        rng = random.Random(5)
+        codes = [datasets.namaste_code(rng.randrange(size)) for _ in range(args.lookups)]
+        samples = []
+        for code in codes:
+            started = time.perf_counter()
+            snapshot.concept(NAMASTE_SYSTEM, code)
+            samples.append(time.perf_counter() - started)
+        measured['concept'] = results.summarize(samples)
+        samples = []
+        for code in codes:
+            started = time.perf_counter()
+            snapshot.matches(NAMASTE_SYSTEM, code, ICD11_SYSTEM)
+            samples.append(time.perf_counter() - started)
+        measured['matches'] = results.summarize(samples)
+        del snapshot
+    measured['dict_heap'] = {'bytes': dict_heap(concepts, mappings)}
+
+    print(f'{args.scale}: {2 * size} codes, {len(mappings)} mappings')
+    print(f'  snapshot   {measured["write"]["bytes"] / 1e6:8.1f} MB on disk, shared by every worker '
+          f'(written in {measured["write"]["seconds"]:.2f}s, mapped in {measured["open"]["seconds"] * 1e3:.3f} ms)')
+    print(f'  dicts      {measured["dict_heap"]["bytes"] / 1e6:8.1f} MB of heap per worker')
+    for name in ('concept', 'matches'):
+        print(f'  {name:10} p50 {measured[name]["p50_ms"] * 1e3:7.1f} us  p99 {measured[name]["p99_ms"] * 1e3:7.1f} us')
+    path = results.save('snapshot', args.scale, measured, args.output, scale=args.scale, lookups=args.lookups)
+    print(f'  -> {path}')
+
+
+if __name__ == '__main__':
+    main()
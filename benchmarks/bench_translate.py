@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark of one-code-per-request $translate against the batch operation
+
+Seeds an in-memory database with synthetic NAMASTE -> ICD-11 mappings and
+translates the same codes through POST /ConceptMap/$translate (one request
+per code) and POST /ConceptMap/$translate/batch, with a cold and a warm
+translation cache.
+
+    python benchmarks/bench_translate.py --mappings 20000 --codes 1000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from src.extensions import db
+from src.services.terminology import NAMASTE_SYSTEM, ICD11_SYSTEM
+
+
+def seed(count):
+    from src.models import ConceptMapping
+
+    db.session.execute(db.insert(ConceptMapping), [
+        {
+            'source_system': NAMASTE_SYSTEM,
+            'source_code': f'NAM{i:06d}',
+            'target_system': ICD11_SYSTEM,
+            'target_code': f'TM2.{i:06d}',
+            'target_display': f'Synthetic disorder {i}',
+            'equivalence': 'equivalent',
+        }
+        for i in range(count)
+    ])
+    db.session.commit()
+
+
+def timed(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--mappings', type=int, default=20000)
+    parser.add_argument('--codes', type=int, default=1000)
+    args = parser.parse_args()
+
+    app = create_app('testing')
+    app.config['SQLALCHEMY_ECHO'] = False
+    with app.app_context():
+        db.create_all()
+        seed(args.mappings)
+
+    rng = random.Random(7)
+    # Roughly one in ten codes has no mapping
+    codes = [f'NAM{rng.randint(0, int(args.mappings * 1.1)):06d}' for _ in range(args.codes)]
+    client = app.test_client()
+    cache = app.extensions['translation_cache']
+
+    def single():
+        for code in codes:
+            client.get('/ConceptMap/$translate',
+                       query_string={'system': NAMASTE_SYSTEM, 'code': code, 'targetsystem': ICD11_SYSTEM})
+
+    def batch():
+        body = [{'source_system': NAMASTE_SYSTEM, 'source_code': code, 'target_system': ICD11_SYSTEM}
+                for code in codes]
+        response = client.post('/ConceptMap/$translate/batch', json=body)
+        assert len(response.json['entry']) == len(codes)
+
+    print(f'{len(codes)} codes against {args.mappings} mappings')
+    for name, fn in (('single', single), ('batch', batch)):
+        cache.local.clear()
+        cold = timed(fn)
+        warm = timed(fn)
+        print(f'  {name:6}  cold {cold * 1000:8.1f} ms ({len(codes) / cold:8.0f} codes/s)'
+              f'  warm {warm * 1000:8.1f} ms ({len(codes) / warm:8.0f} codes/s)')
+
+
+if __name__ == '__main__':
+    main()
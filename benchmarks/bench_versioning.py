@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark of FHIRResource version storage on in-memory SQLite
+
+Writes the given number of versions of one Condition through
+/bundle/process (each edit changes a note, a date or a coding), then
+compares stored bytes and read, vread and _history latency for full
+documents per version (the previous behaviour), snapshots plus JSON Patch
+deltas, and deltas with compressed payloads.
+
+    python benchmarks/bench_versioning.py --versions 50
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from src.extensions import db
+from src.services.terminology import NAMASTE_SYSTEM
+
+MODES = (
+    ('full documents', 0, False),
+    ('snapshot + deltas', 10, False),
+    ('deltas, compressed', 10, True),
+)
+
+
+def condition(version):
+    notes = [{'time': f'2024-01-{day % 28 + 1:02d}T10:00:00Z', 'text': f'Follow-up visit {day}: symptoms reviewed, '
+              f'dosha assessment recorded and diet advice given.'} for day in range(version // 5 + 1)]
+    return {
+        'resourceType': 'Condition',
+        'id': 'bench-history',
+        'text': {'status': 'generated', 'div': '<div xmlns="http://www.w3.org/1999/xhtml">' + 'Vata imbalance '
+                 'with joint pain and disturbed sleep, managed with Panchakarma therapy. ' * 8 + '</div>'},
+        'clinicalStatus': {'coding': [{'system': 'http://terminology.hl7.org/CodeSystem/condition-clinical',
+                                       'code': 'active' if version % 7 else 'recurrence'}]},
+        'verificationStatus': {'coding': [{'system': 'http://terminology.hl7.org/CodeSystem/condition-ver-status',
+                                           'code': 'confirmed'}]},
+        'category': [{'coding': [{'system': 'http://terminology.hl7.org/CodeSystem/condition-category',
+                                  'code': 'encounter-diagnosis', 'display': 'Encounter Diagnosis'}]}],
+        'code': {'coding': [{'system': NAMASTE_SYSTEM, 'code': f'NAM{version % 3:06d}',
+                             'display': f'NAMASTE concept {version % 3}'}]},
+        'subject': {'reference': 'Patient/example', 'display': 'Example Patient'},
+        'recordedDate': f'2024-02-{version % 28 + 1:02d}',
+        'note': notes,
+    }
+
+
+def measure(label, interval, compress, versions, reads):
+    from src.models import FHIRResource, NAMASTECode
+
+    app = create_app('testing')
+    app.config.update(SQLALCHEMY_ECHO=False, CONSENT_REQUIRED=False, VERSION_SNAPSHOT_INTERVAL=interval,
+                      VERSION_COMPRESS_PAYLOADS=compress)
+    with app.app_context():
+        db.create_all()
+        db.session.execute(db.insert(NAMASTECode), [{'code': f'NAM{i:06d}', 'display': f'c{i}'} for i in range(3)])
+        db.session.commit()
+        client = app.test_client()
+
+        started = time.perf_counter()
+        for version in range(1, versions + 1):
+            response = client.post('/bundle/process', json={'resourceType': 'Bundle', 'type': 'batch', 'entry': [
+                {'resource': condition(version), 'request': {'method': 'PUT', 'url': 'Condition/bench-history'}}]})
+            assert response.json['entry'][0]['response']['status'] in ('200 OK', '201 Created')
+        write = (time.perf_counter() - started) / versions
+
+        stored = db.session.execute(db.select(db.func.sum(db.func.length(FHIRResource.resource_data)))).scalar()
+
+        def timed(path):
+            samples = []
+            for _ in range(reads):
+                started = time.perf_counter()
+                response = client.get(path)
+                samples.append(time.perf_counter() - started)
+                assert response.status_code == 200, response.json
+            return statistics.median(samples) * 1000
+
+        latest = timed('/fhir/Condition/bench-history')
+        vread = statistics.mean(timed(f'/fhir/Condition/bench-history/_history/{version}')
+                                for version in range(1, versions + 1))
+        history = timed('/fhir/Condition/bench-history/_history')
+        check = client.get(f'/fhir/Condition/bench-history/_history/{versions // 2}').json
+        assert check['recordedDate'] == condition(versions // 2)['recordedDate']
+    print(f'  {label:20} {stored:9,} bytes  write {write * 1000:5.2f} ms  read {latest:5.2f} ms  '
+          f'vread {vread:5.2f} ms  _history {history:6.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--versions', type=int, default=50)
+    parser.add_argument('--reads', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f'{args.versions} versions of one Condition (median latency per request)')
+    for label, interval, compress in MODES:
+        measure(label, interval, compress, args.versions, args.reads)
+
+
+if __name__ == '__main__':
+    main()
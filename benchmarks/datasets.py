@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Synthetic NAMASTE/ICD-11 datasets for the benchmark suite
+
+Generates NAMASTE codes in the sample_namaste_codes.csv layout (code,
+display, definition, category, parent_code, with a ten-way hierarchy),
+ICD-11 TM2 codes and NAMASTE -> ICD-11 mappings at a named scale. The same
+scale and seed always give the same data. CSVs are cached under
+benchmarks/data/ so repeated runs only pay for generation once.
+
+    python benchmarks/datasets.py --scale 100k
+    DATABASE_URL=mysql+pymysql://... python benchmarks/datasets.py --scale 100k --seed
+"""
+
+import argparse
+import csv
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_search_index import WORDS
+from src.extensions import db
+from src.services import hierarchy
+from src.services.terminology import NAMASTE_SYSTEM, ICD11_SYSTEM
+
+SCALES = {'10k': 10000, '100k': 100000, '1m': 1000000}
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+CSV_COLUMNS = ('code', 'display', 'definition', 'category', 'parent_code')
+CATEGORIES = ('Ayurveda', 'Siddha', 'Unani')
+
+# Codes per level of the generated hierarchy
+BRANCHING = 10
+
+# Rows per bulk insert
+INSERT_CHUNK = 5000
+
+
+def scale_size(scale):
+    try:
+        return SCALES[scale.lower()]
+    except KeyError:
+        raise ValueError(f'Unknown scale {scale!r}; expected one of {", ".join(SCALES)}') from None
+
+
+def namaste_code(i):
+    return f'NAM{i:07d}'
+
+
+def icd11_code(i):
+    return f'TM2.{i:07d}'
+
+
+def namaste_rows(count, seed=42):
+    """Dicts in the CSV layout; every code but the first BRANCHING has a parent"""
+    rng = random.Random(seed)
+    for i in range(count):
+        words = rng.sample(WORDS, rng.randint(2, 4))
+        yield {
+            'code': namaste_code(i),
+            'display': ' '.join(word.capitalize() for word in words),
+            'definition': ' '.join(rng.sample(WORDS, 8)).capitalize(),
+            'category': CATEGORIES[i % len(CATEGORIES)],
+            'parent_code': namaste_code(i // BRANCHING - 1) if i >= BRANCHING else '',
+        }
+
+
+def icd11_rows(count, seed=43):
+    rng = random.Random(seed)
+    for i in range(count):
+        yield {
+            'code': icd11_code(i),
+            'title': ' '.join(word.capitalize() for word in rng.sample(WORDS, 3)) + ' disorder (TM2)',
+            'module': 'tm2',
+        }
+
+
+def mapping_rows(count):
+    """One equivalent ICD-11 target for nine in ten NAMASTE codes"""
+    for i in range(count):
+        if i % 10 == 9:
+            continue
+        yield {
+            'source_system': NAMASTE_SYSTEM,
+            'source_code': namaste_code(i),
+            'target_system': ICD11_SYSTEM,
+            'target_code': icd11_code(i),
+            'target_display': f'ICD-11 concept {i}',
+            'equivalence': 'equivalent',
+        }
+
+
+def namaste_csv(scale, directory=DATA_DIR):
+    """Path of the NAMASTE CSV for scale, written on first use"""
+    path = os.path.join(directory, f'namaste_{scale.lower()}.csv')
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        partial = f'{path}.{os.getpid()}.tmp'
+        with open(partial, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, CSV_COLUMNS)
+            writer.writeheader()
+            writer.writerows(namaste_rows(scale_size(scale)))
+        os.replace(partial, path)
+    return path
+
+
+def _insert(model, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= INSERT_CHUNK:
+            db.session.execute(db.insert(model), batch)
+            batch = []
+    if batch:
+        db.session.execute(db.insert(model), batch)
+
+
+def seed_database(count, namaste=True):
+    """
+    Bulk insert count ICD-11 codes and their mappings (and NAMASTE codes
+    unless namaste is False, e.g. when they were ingested from the CSV),
+    plus an active consent for Patient/example.
+    """
+    from src.models import NAMASTECode, ICD11Code, ConceptMapping, ConsentRecord
+
+    if namaste:
+        _insert(NAMASTECode, ({**row, 'parent_code': row['parent_code'] or None} for row in namaste_rows(count)))
+    _insert(ICD11Code, icd11_rows(count))
+    _insert(ConceptMapping, mapping_rows(count))
+    db.session.add(ConsentRecord(patient_id='example', purpose='treatment', status='active'))
+    db.session.commit()
+    if namaste:
+        # Bulk inserts bypass codes_changed, which keeps the closure table current
+        hierarchy.rebuild(NAMASTE_SYSTEM)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scale', choices=list(SCALES), action='append',
+                        help='dataset size (repeatable; default: all)')
+    parser.add_argument('--directory', default=DATA_DIR)
+    parser.add_argument('--seed', action='store_true',
+                        help='load the first scale into the database of create_app() (DATABASE_URL) instead, '
+                             'e.g. for benchmarks/load.py --url')
+    args = parser.parse_args()
+
+    if args.seed:
+        from app import create_app
+
+        scale = (args.scale or ['10k'])[0]
+        app = create_app()
+        with app.app_context():
+            db.create_all()
+            started = time.perf_counter()
+            seed_database(scale_size(scale))
+        print(f'Seeded {scale} codes, ICD-11 codes and mappings in {time.perf_counter() - started:.1f}s; '
+              f'restart the server (or run "flask search reindex") so its search index picks them up')
+        return
+
+    for scale in args.scale or list(SCALES):
+        started = time.perf_counter()
+        path = namaste_csv(scale, args.directory)
+        print(f'{scale:>5}: {path} ({os.path.getsize(path) / 1e6:.1f} MB, {time.perf_counter() - started:.1f}s)')
+
+
+if __name__ == '__main__':
+    main()
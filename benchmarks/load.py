@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Concurrent load driver for the terminology and Bundle endpoints
+
+Runs a weighted mix of /valueset/search, $translate, hierarchy $expand and
+/bundle/process requests from many threads for a fixed time and reports
+throughput and p50/p95/p99 latency per endpoint. Without --url it starts
+the app in-process on a file-backed SQLite database seeded with the
+synthetic dataset; with --url it loads a running server that holds the
+same dataset (see datasets.py --seed). Results are written as JSON to
+benchmarks/results/.
+
+    python benchmarks/load.py --scale 100k --concurrency 16 --duration 60
+    python benchmarks/load.py --url http://localhost:5000 --scale 100k --mix search=70,translate=30
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import datasets
+import results
+from bench_search_index import WORDS
+from src.services.terminology import NAMASTE_SYSTEM, ICD11_SYSTEM
+
+DEFAULT_MIX = 'search=40,translate=30,expand=20,bundle=10'
+
+BUNDLE_ENTRIES = 10
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f'Unknown scenario {name!r}; expected one of {", ".join(SCENARIOS)}')
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'Invalid weight in {item!r}') from None
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError('The mix needs at least one positive weight')
+    return mix
+
+
+# -- scenarios: (method, path, keyword arguments for requests) -----------
+
+def search(rng, size):
+    word = rng.choice(WORDS)
+    return 'GET', '/valueset/search', {'params': {'q': word[:rng.randint(2, len(word))], 'limit': 20}}
+
+
+def translate(rng, size):
+    return 'GET', '/ConceptMap/$translate', {'params': {
+        'system': NAMASTE_SYSTEM, 'code': datasets.namaste_code(rng.randrange(size)), 'targetsystem': ICD11_SYSTEM}}
+
+
+def expand(rng, size):
+    # Roots and upper levels of the ten-way hierarchy, so expansions have real subtrees
+    code = datasets.namaste_code(rng.randrange(max(1, size // datasets.BRANCHING ** 2)))
+    return 'GET', '/ValueSet/$expand', {'params': {'url': f'{NAMASTE_SYSTEM}?fhir_vs=isa/{code}', 'count': 100}}
+
+
+def bundle(rng, size):
+    entries = []
+    for _ in range(BUNDLE_ENTRIES):
+        i = rng.randrange(size)
+        entries.append({
+            'resource': {
+                'resourceType': 'Condition',
+                'id': f'load-{i}',
+                'subject': {'reference': 'Patient/example'},
+                'code': {'coding': [{'system': NAMASTE_SYSTEM, 'code': datasets.namaste_code(i)},
+                                    {'system': ICD11_SYSTEM, 'code': datasets.icd11_code(i)}]},
+            },
+            'request': {'method': 'PUT', 'url': f'Condition/load-{i}'},
+        })
+    return 'POST', '/bundle/process', {'json': {'resourceType': 'Bundle', 'type': 'batch', 'entry': entries}}
+
+
+SCENARIOS = {'search': search, 'translate': translate, 'expand': expand, 'bundle': bundle}
+
+
+# -- in-process server ---------------------------------------------------
+
+def start_server(scale):
+    """Serve the app on a free local port with a seeded SQLite file; returns (base URL, stop function)"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    from app import create_app
+    from config import config, TestingConfig
+    from src.extensions import db
+    from src.services import search_backends
+
+    directory = tempfile.mkdtemp(prefix='medisync-load-')
+    # A file rather than :memory:, so every server thread gets its own connection
+    config['load'] = type('LoadConfig', (TestingConfig,), {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(directory, "load.db")}',
+        'AUDIT_SPOOL_DIR': os.path.join(directory, 'audit-spool'),
+    })
+    app = create_app('load')
+    started = time.perf_counter()
+    with app.app_context():
+        db.create_all()
+        datasets.seed_database(datasets.scale_size(scale))
+        # The index built at startup saw empty tables
+        search_backends.get_backend(app).start(app)
+    print(f'Seeded {scale} dataset in {time.perf_counter() - started:.1f}s ({directory})')
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, name='load-server', daemon=True).start()
+
+    def stop():
+        server.shutdown()
+        if app.extensions.get('audit') is not None:
+            app.extensions['audit'].stop()
+        shutil.rmtree(directory, ignore_errors=True)
+    return f'http://127.0.0.1:{server.server_port}', stop
+
+
+# -- driver --------------------------------------------------------------
+
+def worker(base_url, mix, size, seed, deadline, warmup_until, samples, lock):
+    rng = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    session = requests.Session()
+    local = {name: ([], [0]) for name in names}
+    while True:
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+        name = rng.choices(names, weights)[0]
+        method, path, kwargs = SCENARIOS[name](rng, size)
+        started = time.perf_counter()
+        try:
+            ok = session.request(method, base_url + path, timeout=30, **kwargs).status_code < 400
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - started
+        if started < warmup_until:
+            continue
+        timings, errors = local[name]
+        timings.append(elapsed)
+        errors[0] += not ok
+    with lock:
+        for name, (timings, errors) in local.items():
+            samples[name][0].extend(timings)
+            samples[name][1] += errors[0]
+
+
+def run(base_url, mix, size, concurrency, duration, warmup):
+    samples = {name: [[], 0] for name in mix}
+    lock = threading.Lock()
+    start = time.perf_counter()
+    warmup_until = start + warmup
+    deadline = warmup_until + duration
+    threads = [threading.Thread(target=worker, args=(base_url, mix, size, index, deadline, warmup_until,
+                                                     samples, lock))
+               for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    measured = {name: results.summarize(timings, duration, errors) for name, (timings, errors) in samples.items()}
+    measured['total'] = results.summarize([t for timings, _ in samples.values() for t in timings], duration,
+                                          sum(errors for _, errors in samples.values()))
+    return measured
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--url', help='base URL of a running server (default: start one in-process)')
+    parser.add_argument('--scale', choices=list(datasets.SCALES), default='10k')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=5, help='seconds of unmeasured requests first')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'scenario weights (default: {DEFAULT_MIX})')
+    parser.add_argument('--output', help='result file (default: benchmarks/results/load-<commit>-<scale>-c<N>.json)')
+    args = parser.parse_args()
+
+    stop = None
+    base_url = args.url.rstrip('/') if args.url else None
+    if base_url is None:
+        base_url, stop = start_server(args.scale)
+
+    print(f'{args.concurrency} threads for {args.duration:.0f}s against {base_url}')
+    measured = run(base_url, args.mix, datasets.scale_size(args.scale), args.concurrency, args.duration,
+                   args.warmup)
+    if stop is not None:
+        stop()
+
+    for name, values in measured.items():
+        if not values['count']:
+            print(f'  {name:10} no requests')
+            continue
+        print(f'  {name:10} {values["requests_per_second"]:8.1f} req/s  p50 {values["p50_ms"]:8.2f} ms  '
+              f'p95 {values["p95_ms"]:8.2f} ms  p99 {values["p99_ms"]:8.2f} ms  errors {values["errors"]}')
+    path = results.save('load', f'{args.scale}-c{args.concurrency}', measured, args.output, url=args.url,
+                        scale=args.scale, concurrency=args.concurrency, duration=args.duration, mix=args.mix)
+    print(f'  -> {path}')
+
+
+if __name__ == '__main__':
+    main()
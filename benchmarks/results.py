@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Benchmark result files: latency summaries, JSON output and comparison
+
+Every result file records the commit, the environment and, per scenario,
+throughput and latency percentiles in milliseconds. Comparing two files
+shows how each metric moved, so a regression between commits is one
+command away:
+
+    python benchmarks/results.py benchmarks/results/a1b2c3d-10k.json benchmarks/results/e4f5a6b-10k.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# Timing metrics by name suffix; anything else (counts, sizes) is a setting, not a result
+TIMINGS = ('_ms', 'seconds', '_per_second')
+# Where a larger number is better; for latencies and durations smaller is better
+HIGHER_IS_BETTER = ('_per_second',)
+
+# Changes smaller than this are reported as noise
+THRESHOLD = 0.05
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(samples, elapsed=None, errors=0):
+    """Latency summary (ms) of per-operation samples in seconds; throughput over elapsed seconds"""
+    timings = [sample * 1000 for sample in samples]
+    summary = {'count': len(timings), 'errors': errors}
+    if timings:
+        summary.update({
+            'mean_ms': round(statistics.mean(timings), 3),
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'p99_ms': round(percentile(timings, 99), 3),
+            'max_ms': round(max(timings), 3),
+        })
+    elapsed = sum(samples) if elapsed is None else elapsed
+    if elapsed:
+        summary['requests_per_second'] = round(len(timings) / elapsed, 1)
+    return summary
+
+
+def commit():
+    """Short hash of HEAD (with a -dirty suffix for local changes), or 'unknown'"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        head = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root, capture_output=True,
+                              text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return f'{head}-dirty' if dirty else head
+
+
+def environment():
+    return {
+        'commit': commit(),
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def save(kind, name, results, path=None, **settings):
+    """Write {environment, settings, results} as JSON; returns the path"""
+    document = dict(environment(), kind=kind, settings=settings, results=results)
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f'{kind}-{document["commit"]}-{name}.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+        f.write('\n')
+    return path
+
+
+def _metrics(results, prefix=''):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from _metrics(value, f'{prefix}{key}.')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f'{prefix}{key}', value
+
+
+def compare(base, current, threshold=THRESHOLD):
+    """[(metric, base, current, relative change, verdict)] for metrics present in both results"""
+    before = dict(_metrics(base['results']))
+    rows = []
+    for metric, value in _metrics(current['results']):
+        old = before.get(metric)
+        if old is None or not metric.endswith(TIMINGS):
+            continue
+        change = (value - old) / old if old else 0.0
+        better = change > 0 if metric.endswith(HIGHER_IS_BETTER) else change < 0
+        verdict = 'same' if abs(change) < threshold else 'better' if better else 'WORSE'
+        rows.append((metric, old, value, change, verdict))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('base')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='relative change below which a metric counts as unchanged')
+    args = parser.parse_args()
+
+    with open(args.base, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)
+    print(f'{base["commit"]} ({base["created"]}) -> {current["commit"]} ({current["created"]})')
+    if base.get('settings') != current.get('settings'):
+        print(f'warning: different settings {base.get("settings")} -> {current.get("settings")}')
+    rows = compare(base, current, args.threshold)
+    width = max((len(row[0]) for row in rows), default=0)
+    for metric, old, value, change, verdict in rows:
+        print(f'  {metric:{width}}  {old:12.3f} -> {value:12.3f}  {change:+7.1%}  {verdict}')
+    regressions = sum(1 for row in rows if row[4] == 'WORSE')
+    print(f'{regressions} regression(s) beyond {args.threshold:.0%}')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark suite for ingest, search, translate and Bundle upload
+
+For each dataset scale, runs the core operations in-process against
+create_app('testing') on in-memory SQLite: streams the synthetic NAMASTE
+CSV through /ingest/csv/stream, builds the search index and runs
+autocomplete queries through the configured search backend (what
+/valueset/search calls), translates codes through /ConceptMap/$translate
+and its batch form, and posts dual-coded Condition Bundles to
+/bundle/process. Results are written as JSON to benchmarks/results/
+(see results.py to compare two runs).
+
+    python benchmarks/suite.py --scale 10k --scale 100k
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import datasets
+import results
+from app import create_app
+from bench_search_index import WORDS
+from src.extensions import db
+from src.services import search_backends, terminology
+from src.services.terminology import NAMASTE_SYSTEM, ICD11_SYSTEM
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    value = fn(*args, **kwargs)
+    return time.perf_counter() - started, value
+
+
+def flush_audit(app):
+    if app.extensions.get('audit') is not None:
+        with app.app_context():
+            app.extensions['audit'].flush()
+
+
+def search_queries(count, size, seed=7):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        word = rng.choice(WORDS)
+        kind = rng.random()
+        if kind < 0.6:
+            queries.append(word[:rng.randint(2, len(word))])
+        elif kind < 0.8:
+            queries.append(f'{word} {rng.choice(WORDS)[:3]}')
+        else:
+            queries.append(datasets.namaste_code(rng.randrange(size))[:rng.randint(6, 10)])
+    return queries
+
+
+def condition_bundle(entries, size, rng):
+    bundle = []
+    for _ in range(entries):
+        i = rng.randrange(size)
+        bundle.append({
+            'resource': {
+                'resourceType': 'Condition',
+                'id': f'bench-{i}',
+                'subject': {'reference': 'Patient/example'},
+                'code': {'coding': [
+                    {'system': NAMASTE_SYSTEM, 'code': datasets.namaste_code(i)},
+                    {'system': ICD11_SYSTEM, 'code': datasets.icd11_code(i)},
+                ]},
+            },
+            'request': {'method': 'PUT', 'url': f'Condition/bench-{i}'},
+        })
+    return {'resourceType': 'Bundle', 'type': 'batch', 'entry': bundle}
+
+
+def run_scale(scale, args):
+    size = datasets.scale_size(scale)
+    path = datasets.namaste_csv(scale)
+    app = create_app('testing')
+    app.config['SQLALCHEMY_ECHO'] = False
+    # In-memory SQLite is a single connection, so the audit writer thread must not
+    # share it with requests; queued events are written between phases instead
+    audit_writer = app.extensions.get('audit')
+    if audit_writer is not None:
+        audit_writer.stop()
+    client = app.test_client()
+    rng = random.Random(11)
+    measured = {}
+
+    with app.app_context():
+        db.create_all()
+
+        with open(path, 'rb') as f:
+            seconds, response = timed(client.post, '/ingest/csv/stream', data=f, content_type='text/csv')
+        assert response.status_code == 201, response.get_data(as_text=True)[:500]
+        measured['ingest'] = {'rows': size, 'seconds': round(seconds, 3),
+                              'rows_per_second': round(size / seconds, 1)}
+
+        seconds, _ = timed(datasets.seed_database, size, namaste=False)
+        measured['seed_icd11_and_mappings'] = {'seconds': round(seconds, 3)}
+
+        backend = search_backends.get_backend(app)
+        seconds, indexed = timed(backend.rebuild, terminology.iter_concepts())
+        measured['search_index_build'] = {'concepts': indexed, 'seconds': round(seconds, 3)}
+
+        samples = []
+        for query in search_queries(args.queries, size):
+            seconds, _ = timed(search_backends.search, app, query, limit=20)
+            samples.append(seconds)
+        measured['search'] = results.summarize(samples)
+
+    codes = [datasets.namaste_code(rng.randrange(size)) for _ in range(args.queries)]
+    samples, errors = [], 0
+    for code in codes:
+        seconds, response = timed(client.get, '/ConceptMap/$translate', query_string={
+            'system': NAMASTE_SYSTEM, 'code': code, 'targetsystem': ICD11_SYSTEM})
+        samples.append(seconds)
+        errors += response.status_code != 200
+    measured['translate'] = results.summarize(samples, errors=errors)
+    flush_audit(app)
+
+    body = [{'source_system': NAMASTE_SYSTEM, 'source_code': code, 'target_system': ICD11_SYSTEM}
+            for code in codes[:args.batch]]
+    app.extensions['translation_cache'].local.clear()
+    seconds, response = timed(client.post, '/ConceptMap/$translate/batch', json=body)
+    assert response.status_code == 200, response.get_data(as_text=True)[:500]
+    measured['translate_batch'] = {'codes': len(body), 'seconds': round(seconds, 3),
+                                   'codes_per_second': round(len(body) / seconds, 1)}
+
+    samples, errors = [], 0
+    for _ in range(args.bundles):
+        bundle = condition_bundle(args.entries, size, rng)
+        seconds, response = timed(client.post, '/bundle/process', json=bundle)
+        samples.append(seconds)
+        errors += response.status_code != 200
+    flush_audit(app)
+    measured['bundle'] = dict(results.summarize(samples, errors=errors), entries=args.entries,
+                              entries_per_second=round(args.bundles * args.entries / sum(samples), 1))
+    return measured
+
+
+def report(scale, measured):
+    print(f'{scale}:')
+    for name, values in measured.items():
+        if 'p50_ms' in values:
+            print(f'  {name:24} p50 {values["p50_ms"]:8.3f} ms  p95 {values["p95_ms"]:8.3f} ms  '
+                  f'p99 {values["p99_ms"]:8.3f} ms  {values.get("requests_per_second", 0):9.1f}/s')
+        else:
+            rate = next((f'  {value:10.1f} {key.replace("_per_second", "")}/s'
+                         for key, value in values.items() if key.endswith('_per_second')), '')
+            print(f'  {name:24} {values["seconds"]:8.3f} s{rate}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scale', choices=list(datasets.SCALES), action='append',
+                        help='dataset size (repeatable; default: 10k)')
+    parser.add_argument('--queries', type=int, default=2000, help='search and translate requests per scale')
+    parser.add_argument('--batch', type=int, default=1000, help='codes in the $translate/batch request')
+    parser.add_argument('--bundles', type=int, default=20)
+    parser.add_argument('--entries', type=int, default=100, help='entries per Bundle')
+    parser.add_argument('--output', help='result file (default: benchmarks/results/suite-<commit>-<scale>.json)')
+    args = parser.parse_args()
+
+    for scale in args.scale or ['10k']:
+        measured = run_scale(scale, args)
+        report(scale, measured)
+        path = results.save('suite', scale, measured, args.output, scale=scale, queries=args.queries,
+                            batch=args.batch, bundles=args.bundles, entries=args.entries)
+        print(f'  -> {path}')
+
+
+if __name__ == '__main__':
+    main()
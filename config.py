@@ -49,31 +49,130 @@ class Config:
     FHIR_VERSION = 'R4'
     
     # WHO ICD-11 API
-    ICD11_API_BASE_URL = 'https://id.who.int/icd'
+    ICD11_API_BASE_URL = os.environ.get('ICD11_API_BASE_URL', 'https://id.who.int/icd')
     ICD11_CLIENT_ID = os.environ.get('ICD11_CLIENT_ID')
     ICD11_CLIENT_SECRET = os.environ.get('ICD11_CLIENT_SECRET')
-    ICD11_TOKEN_ENDPOINT = 'https://icdaccessmanagement.who.int/connect/token'
+    ICD11_TOKEN_ENDPOINT = os.environ.get('ICD11_TOKEN_ENDPOINT', 'https://icdaccessmanagement.who.int/connect/token')
+    
+    # ICD-11 sync engine (release defaults to the latest; checkpoint allows resume)
+    ICD11_RELEASE_ID = os.environ.get('ICD11_RELEASE_ID')
+    ICD11_LINEARIZATION = os.environ.get('ICD11_LINEARIZATION', 'mms')
+    ICD11_SYNC_CONCURRENCY = int(os.environ.get('ICD11_SYNC_CONCURRENCY', 8))
+    ICD11_SYNC_MAX_RETRIES = int(os.environ.get('ICD11_SYNC_MAX_RETRIES', 6))
+    ICD11_SYNC_BATCH_SIZE = int(os.environ.get('ICD11_SYNC_BATCH_SIZE', 500))
+    ICD11_SYNC_TIMEOUT = float(os.environ.get('ICD11_SYNC_TIMEOUT', 30))
+    ICD11_SYNC_CHECKPOINT = os.environ.get('ICD11_SYNC_CHECKPOINT', 'instance/icd11_sync.json')
     
     # OAuth 2.0 / ABHA
     ABHA_AUTH_URL = os.environ.get('ABHA_AUTH_URL', 'https://healthidsbx.abdm.gov.in/api/v1/auth')
     ABHA_CLIENT_ID = os.environ.get('ABHA_CLIENT_ID')
     ABHA_CLIENT_SECRET = os.environ.get('ABHA_CLIENT_SECRET')
     TOKEN_EXPIRY_HOURS = 24
+    # Bearer tokens: JWTs verified locally with cached JWKS keys, opaque tokens introspected
+    ABHA_JWKS_URL = os.environ.get('ABHA_JWKS_URL', 'https://dev.abdm.gov.in/gateway/v0.5/certs')
+    ABHA_INTROSPECTION_URL = os.environ.get('ABHA_INTROSPECTION_URL')
+    ABHA_ISSUER = os.environ.get('ABHA_ISSUER')
+    ABHA_AUDIENCE = os.environ.get('ABHA_AUDIENCE')
+    ABHA_JWKS_REFRESH = int(os.environ.get('ABHA_JWKS_REFRESH', 300))
+    ABHA_AUTH_TIMEOUT = float(os.environ.get('ABHA_AUTH_TIMEOUT', 5))
+    ABHA_TOKEN_CACHE_SIZE = int(os.environ.get('ABHA_TOKEN_CACHE_SIZE', 10000))
+    ABHA_TOKEN_CACHE_TTL = int(os.environ.get('ABHA_TOKEN_CACHE_TTL', 300))
+    ABHA_NEGATIVE_CACHE_TTL = int(os.environ.get('ABHA_NEGATIVE_CACHE_TTL', 30))
+    # Ingest, sync, bundle writes and mapping runs need a bearer token; 'false' only for local testing
+    ABHA_AUTH_REQUIRED = os.environ.get('ABHA_AUTH_REQUIRED', 'true').lower() == 'true'
     
     # Elasticsearch (optional for scalable search)
     ELASTICSEARCH_URL = os.environ.get('ELASTICSEARCH_URL')
+    ELASTICSEARCH_INDEX = os.environ.get('ELASTICSEARCH_INDEX', 'medisync-concepts')
+    ELASTICSEARCH_BULK_SIZE = int(os.environ.get('ELASTICSEARCH_BULK_SIZE', 1000))
+    ELASTICSEARCH_TIMEOUT = float(os.environ.get('ELASTICSEARCH_TIMEOUT', 10))
+    
+    # /valueset/search backend: 'memory' (per-worker index), 'elasticsearch' or 'database'
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'elasticsearch' if os.environ.get('ELASTICSEARCH_URL') else 'memory')
+    SEARCH_INDEX_BUILD_ON_STARTUP = os.environ.get('SEARCH_INDEX_BUILD_ON_STARTUP', 'true').lower() == 'true'
+    
+    # Streaming CSV ingestion
+    INGEST_CHUNK_SIZE = int(os.environ.get('INGEST_CHUNK_SIZE', 1000))
+    UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
+    
+    # Redis (shared job queue and caches across gunicorn workers)
+    REDIS_URL = os.environ.get('REDIS_URL')
+    
+    # Background jobs for ingest/sync: 'local' (in-process) or 'redis'
+    JOB_BACKEND = os.environ.get('JOB_BACKEND', 'local')
+    JOB_MAX_WORKERS = int(os.environ.get('JOB_MAX_WORKERS', 2))
+    JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', 16))
+    JOB_RESULT_TTL = 86400
+    
+    # Translation cache: per-process LRU, plus Redis when REDIS_URL is set
+    TRANSLATION_CACHE_SIZE = int(os.environ.get('TRANSLATION_CACHE_SIZE', 10000))
+    TRANSLATION_CACHE_TTL = int(os.environ.get('TRANSLATION_CACHE_TTL', 3600))
+    TRANSLATION_CACHE_SHARED = os.environ.get('TRANSLATION_CACHE_SHARED', 'true').lower() == 'true'
+    TRANSLATE_BATCH_MAX = int(os.environ.get('TRANSLATE_BATCH_MAX', 5000))
+    
+    # Terminology reads carry ETags from a release counter bumped by every ingest/sync
+    TERMINOLOGY_RELEASE_TTL = float(os.environ.get('TERMINOLOGY_RELEASE_TTL', 1.0))
+    TERMINOLOGY_RELEASE_BUMP_INTERVAL = float(os.environ.get('TERMINOLOGY_RELEASE_BUMP_INTERVAL', 1.0))
+    TERMINOLOGY_CACHE_CONTROL = os.environ.get('TERMINOLOGY_CACHE_CONTROL', 'public, no-cache')
+    # Memory-mapped snapshot of codes and mappings, shared by all workers and rewritten after ingest/sync
+    TERMINOLOGY_SNAPSHOT_ENABLED = os.environ.get('TERMINOLOGY_SNAPSHOT_ENABLED', 'true').lower() == 'true'
+    TERMINOLOGY_SNAPSHOT_DIR = os.environ.get('TERMINOLOGY_SNAPSHOT_DIR', 'instance/snapshots')
+    TERMINOLOGY_SNAPSHOT_TTL = float(os.environ.get('TERMINOLOGY_SNAPSHOT_TTL', 1.0))
+    TERMINOLOGY_SNAPSHOT_DELAY = float(os.environ.get('TERMINOLOGY_SNAPSHOT_DELAY', 2.0))
+    # gzip (or brotli, if installed) for responses of at least this many bytes
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+    
+    # Render expansions from rows with precompiled JSON templates (same bytes as jsonify)
+    FHIR_FAST_SERIALIZER = os.environ.get('FHIR_FAST_SERIALIZER', 'false').lower() == 'true'
+    
+    # ValueSet/$expand paging (count/offset) and streaming (_stream=true)
+    EXPAND_DEFAULT_COUNT = int(os.environ.get('EXPAND_DEFAULT_COUNT', 1000))
+    EXPAND_MAX_COUNT = int(os.environ.get('EXPAND_MAX_COUNT', 10000))
+    EXPAND_STREAM_BATCH = int(os.environ.get('EXPAND_STREAM_BATCH', 2000))
+    
+    # ConceptMap/$suggest-mappings: TF-IDF candidates per NAMASTE code (workers 0 = one per CPU)
+    SUGGEST_TOP_K = int(os.environ.get('SUGGEST_TOP_K', 10))
+    SUGGEST_MIN_SCORE = float(os.environ.get('SUGGEST_MIN_SCORE', 0.1))
+    SUGGEST_MAX_DF = float(os.environ.get('SUGGEST_MAX_DF', 0.05))
+    SUGGEST_WORKERS = int(os.environ.get('SUGGEST_WORKERS', 0))
     
     # Audit & Compliance
     ENABLE_AUDIT_LOGGING = True
     AUDIT_LOG_RETENTION_DAYS = 365
+    # Audit events are queued and written in bulk by a background writer
+    AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', 500))
+    AUDIT_FLUSH_INTERVAL = float(os.environ.get('AUDIT_FLUSH_INTERVAL', 2.0))
+    AUDIT_QUEUE_SIZE = int(os.environ.get('AUDIT_QUEUE_SIZE', 10000))
+    AUDIT_SPOOL_DIR = os.environ.get('AUDIT_SPOOL_DIR', 'instance/audit-spool')
     
     # ISO 22600 Compliance
     CONSENT_REQUIRED = True
+    # Consent decisions are cached per patient; changes to ConsentRecord evict them
+    CONSENT_DEFAULT_PURPOSE = os.environ.get('CONSENT_DEFAULT_PURPOSE', 'treatment')
+    CONSENT_CACHE_SIZE = int(os.environ.get('CONSENT_CACHE_SIZE', 10000))
+    CONSENT_CACHE_TTL = int(os.environ.get('CONSENT_CACHE_TTL', 300))
     VERSION_CONTROL_ENABLED = True
+    # Versions are stored as JSON Patches with a full snapshot at least every N versions (0 = always full)
+    VERSION_SNAPSHOT_INTERVAL = int(os.environ.get('VERSION_SNAPSHOT_INTERVAL', 10))
+    VERSION_COMPRESS_PAYLOADS = os.environ.get('VERSION_COMPRESS_PAYLOADS', 'false').lower() == 'true'
     
     # API Rate Limiting
     RATELIMIT_ENABLED = True
     RATELIMIT_DEFAULT = "100/hour"
+    # Token buckets per client and endpoint: 'memory' (per-process) or 'redis' (shared by all workers)
+    RATELIMIT_STORAGE = os.environ.get('RATELIMIT_STORAGE', 'redis' if os.environ.get('REDIS_URL') else 'memory')
+    # Per-endpoint overrides, e.g. "api_ops.process_bundle=20/minute;api_ops.concept_map_translate=unlimited"
+    RATELIMIT_ENDPOINTS = os.environ.get('RATELIMIT_ENDPOINTS', '')
+    # Endpoints never limited: the Prometheus scrape and static files
+    RATELIMIT_EXEMPT = os.environ.get('RATELIMIT_EXEMPT', 'metrics,static')
+    # Reverse proxies in front of the app whose X-Forwarded-For entries are trusted (0 = use the peer address)
+    TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+    
+    # Prometheus metrics at /metrics (set PROMETHEUS_MULTIPROC_DIR when running several workers)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    
+    # Background threads start in each worker after the fork, not in a preloading master (set by gunicorn.conf.py)
+    DEFER_WORKER_THREADS = os.environ.get('DEFER_WORKER_THREADS', 'false').lower() == 'true'
     
     # CORS
     CORS_ORIGINS = os.environ.get('CORS_ORIGINS', '*').split(',')
@@ -92,6 +191,14 @@ class TestingConfig(Config):
     """Testing configuration."""
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    # In-memory SQLite uses a static pool, which rejects the pool sizing options
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    # Test scripts and benchmarks send bursts of requests; test_rate_limit.py turns it back on
+    RATELIMIT_ENABLED = False
+    # A file snapshot would outlive the in-memory database; test_terminology_snapshot.py turns it on
+    TERMINOLOGY_SNAPSHOT_ENABLED = False
+    # Test scripts write through the API without a token; test_abha_auth.py and test_jobs.py turn it back on
+    ABHA_AUTH_REQUIRED = False
     
 config = {
     'development': DevelopmentConfig,
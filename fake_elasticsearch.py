@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+In-process stand-in for the Elasticsearch client, for testing the search backend
+
+Implements the slice of the elasticsearch-py 8.x API that
+src/services/search_elasticsearch.py uses: index create/delete/refresh,
+aliases, bulk and search. Indices honour refresh_interval=-1 (documents
+become searchable on refresh) and aliases with several indices reject
+writes, as on a real cluster. Scoring is a rough imitation of the real
+analyzers (prefix, phrase, transliteration-folded and definition matches);
+relevance itself is best checked against a real node:
+
+    docker compose --profile search up -d elasticsearch
+    SEARCH_BACKEND=elasticsearch ELASTICSEARCH_URL=http://localhost:9200 python app.py
+"""
+
+import re
+import unicodedata
+
+from elastic_transport import ApiResponseMeta, ConnectionError, HttpHeaders, NodeConfig
+from elasticsearch import BadRequestError, NotFoundError
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def _error(cls, status, message):
+    meta = ApiResponseMeta(status=status, http_version='1.1', headers=HttpHeaders(), duration=0.0,
+                           node=NodeConfig('http', 'localhost', 9200))
+    return cls(message, meta, {'error': {'type': message}, 'status': status})
+
+
+def _fold(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in text if not unicodedata.combining(char)).lower()
+
+
+def _words(text):
+    return _WORD_RE.findall(_fold(text))
+
+
+def _translit(word):
+    word = re.sub(r'([aeiou])\1+', r'\1', word)
+    return re.sub(r'([bcdgkpst])h', r'\1', word).replace('w', 'v')
+
+
+def _match(clause, document):
+    """Whether one query clause from search_elasticsearch.build_query matches a document"""
+    kind, spec = next(iter(clause.items()))
+    field, options = next(iter(spec.items()))
+    value = options.get('value', options.get('query', ''))
+    if kind == 'term':
+        return _fold(document.get(field)) == _fold(value)
+    if kind == 'prefix':
+        return _fold(document.get(field)).startswith(_fold(value))
+    words = _words(document.get(field.split('.')[0]))
+    wanted = _words(value)
+    if not wanted:
+        return False
+    if kind == 'match_phrase':
+        return any(words[i:i + len(wanted)] == wanted for i in range(len(words)))
+    if field == 'display.translit':
+        words, wanted = [_translit(word) for word in words], [_translit(word) for word in wanted]
+        return all(word in words for word in wanted)
+    if field == 'display':
+        # Edge n-grams: every query word is a prefix of some display word
+        return all(any(word.startswith(term) for word in words) for term in wanted)
+    return all(term in words for term in wanted)
+
+
+class _Index:
+    def __init__(self, settings, mappings):
+        self.settings = settings or {}
+        self.mappings = mappings or {}
+        self.documents = {}
+        self.searchable = {}
+
+    @property
+    def refresh_on_write(self):
+        return self.settings.get('refresh_interval') != '-1'
+
+    def refresh(self):
+        self.searchable = dict(self.documents)
+
+
+class _Indices:
+    def __init__(self, cluster):
+        self._cluster = cluster
+
+    def create(self, index, settings=None, mappings=None, aliases=None):
+        cluster = self._cluster
+        cluster._request('indices.create')
+        if index in cluster.data or index in cluster.aliases:
+            raise _error(BadRequestError, 400, 'resource_already_exists_exception')
+        cluster.data[index] = _Index(settings, mappings)
+        for alias in aliases or ():
+            cluster.aliases.setdefault(alias, set()).add(index)
+        return {'acknowledged': True, 'index': index}
+
+    def delete(self, index):
+        cluster = self._cluster
+        cluster._request('indices.delete')
+        if index not in cluster.data:
+            raise _error(NotFoundError, 404, 'index_not_found_exception')
+        del cluster.data[index]
+        for members in cluster.aliases.values():
+            members.discard(index)
+        cluster.aliases = {alias: members for alias, members in cluster.aliases.items() if members}
+        return {'acknowledged': True}
+
+    def refresh(self, index):
+        self._cluster._request('indices.refresh')
+        for name in self._cluster._resolve(index):
+            self._cluster.data[name].refresh()
+        return {}
+
+    def put_settings(self, index, settings):
+        self._cluster._request('indices.put_settings')
+        for name in self._cluster._resolve(index):
+            target = self._cluster.data[name]
+            for key, value in settings.items():
+                if value is None:
+                    target.settings.pop(key, None)
+                else:
+                    target.settings[key] = value
+        return {'acknowledged': True}
+
+    def exists_alias(self, name):
+        self._cluster._request('indices.exists_alias')
+        return name in self._cluster.aliases
+
+    def get_alias(self, name):
+        self._cluster._request('indices.get_alias')
+        if name not in self._cluster.aliases:
+            raise _error(NotFoundError, 404, f'alias [{name}] missing')
+        return {index: {'aliases': {name: {}}} for index in self._cluster.aliases[name]}
+
+    def update_aliases(self, actions):
+        """All actions are applied together, or none if one refers to a missing index"""
+        cluster = self._cluster
+        cluster._request('indices.update_aliases')
+        aliases = {alias: set(members) for alias, members in cluster.aliases.items()}
+        for action in actions:
+            kind, spec = next(iter(action.items()))
+            if spec['index'] not in cluster.data:
+                raise _error(NotFoundError, 404, 'index_not_found_exception')
+            if kind == 'add':
+                aliases.setdefault(spec['alias'], set()).add(spec['index'])
+            else:
+                aliases.get(spec['alias'], set()).discard(spec['index'])
+        cluster.aliases = {alias: members for alias, members in aliases.items() if members}
+        return {'acknowledged': True}
+
+
+class FakeElasticsearch:
+    """Single-node cluster held in memory; set down=True to simulate an outage"""
+
+    def __init__(self):
+        self.data = {}
+        self.aliases = {}
+        self.down = False
+        self.requests = {}
+        self.indices = _Indices(self)
+
+    def _request(self, name):
+        if self.down:
+            raise ConnectionError('Connection refused (fake cluster is down)')
+        self.requests[name] = self.requests.get(name, 0) + 1
+
+    def _resolve(self, name):
+        if name in self.aliases:
+            return sorted(self.aliases[name])
+        if name in self.data:
+            return [name]
+        raise _error(NotFoundError, 404, 'index_not_found_exception')
+
+    def ping(self):
+        return not self.down
+
+    def bulk(self, operations, refresh=None):
+        self._request('bulk')
+        items, errors = [], False
+        position = 0
+        while position < len(operations):
+            action = operations[position]
+            kind, meta = next(iter(action.items()))
+            document = operations[position + 1] if kind == 'index' else None
+            position += 2 if kind == 'index' else 1
+            names = self.aliases.get(meta['_index'])
+            if names is not None and len(names) > 1:
+                errors = True
+                items.append({kind: {'_id': meta['_id'], 'status': 400, 'error': {
+                    'type': 'illegal_argument_exception', 'reason': 'alias has more than one index, no write index'}}})
+                continue
+            name = next(iter(names)) if names else meta['_index']
+            # Like a real cluster, writing to a missing index creates it
+            index = self.data.setdefault(name, _Index(None, None))
+            if kind == 'index':
+                index.documents[meta['_id']] = dict(document)
+                items.append({kind: {'_id': meta['_id'], 'status': 201, 'result': 'created'}})
+            elif index.documents.pop(meta['_id'], None) is None:
+                items.append({kind: {'_id': meta['_id'], 'status': 404, 'result': 'not_found'}})
+            else:
+                items.append({kind: {'_id': meta['_id'], 'status': 200, 'result': 'deleted'}})
+            if index.refresh_on_write:
+                index.refresh()
+        return {'errors': errors, 'items': items}
+
+    def search(self, index, query, sort=None, size=10, source=None, track_scores=False):
+        self._request('search')
+        bool_query = query['bool']
+        hits = []
+        for name in self._resolve(index):
+            for doc_id, document in self.data[name].searchable.items():
+                if not all(_match(clause, document) for clause in bool_query.get('filter', ())):
+                    continue
+                score = sum(next(iter(next(iter(clause.values())).values())).get('boost', 1.0)
+                            for clause in bool_query['should'] if _match(clause, document))
+                if score:
+                    hits.append((score, document, doc_id, name))
+        hits.sort(key=lambda hit: (-hit[0], hit[1].get('display_length', 0), hit[1]['code']))
+        return {'hits': {
+            'total': {'value': len(hits), 'relation': 'eq'},
+            'hits': [
+                {'_index': name, '_id': doc_id, '_score': score,
+                 '_source': {key: document.get(key) for key in (source or document)}}
+                for score, document, doc_id, name in hits[:size]
+            ],
+        }}
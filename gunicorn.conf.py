@@ -0,0 +1,46 @@
+"""
+gunicorn settings for MEDISYNC (read automatically from the working directory).
+
+Workers share Prometheus metrics through files in PROMETHEUS_MULTIPROC_DIR,
+which is emptied when the master starts.
+
+The app is preloaded (GUNICORN_PRELOAD=false turns it off): the master
+builds it once and forks the workers from it, so they start without
+importing or indexing anything and share those pages copy-on-write.
+Threads and connections are set up in each worker by post_worker_init
+(see src/services/preload.py).
+"""
+
+import os
+import shutil
+
+prometheus_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/medisync-metrics')
+# A preloaded app records samples while loading, before on_starting runs
+os.makedirs(prometheus_dir, exist_ok=True)
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+# Read by config.py; also right without preloading, as post_worker_init starts the threads either way
+os.environ['DEFER_WORKER_THREADS'] = 'true'
+
+
+def on_starting(server):
+    # Samples left by a previous run would be added to this one's
+    shutil.rmtree(prometheus_dir, ignore_errors=True)
+    os.makedirs(prometheus_dir, exist_ok=True)
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        from src.services import preload
+        preload.warm(server.app.wsgi())
+
+
+def post_worker_init(worker):
+    from src.services import preload
+    preload.after_fork(worker.wsgi)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    # Drops the worker's live gauges (checked-out connections); its counters stay in the totals
+    multiprocess.mark_process_dead(worker.pid)
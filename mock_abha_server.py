@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Local stub of the ABHA/ABDM auth endpoints for testing token validation
+
+Issues RS256-signed JWT access tokens and opaque tokens, publishes its
+signing keys as a JWKS and answers RFC 7662 token introspection. Keys can
+be rotated and tokens revoked; request counters show how often the app
+actually calls out.
+
+    python mock_abha_server.py --port 8098
+    ABHA_JWKS_URL=http://localhost:8098/certs \\
+    ABHA_INTROSPECTION_URL=http://localhost:8098/introspect python app.py
+"""
+
+import argparse
+import base64
+import json
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+
+class MockABHAServer:
+    """Threaded stub server; use as a context manager or call start()/stop()"""
+
+    def __init__(self, port=0, client_id='mock-client', client_secret='mock-secret', issuer='mock-abha'):
+        self.port = port
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.issuer = issuer
+        self.signing_keys = {}
+        self.current_kid = None
+        self.opaque_tokens = {}
+        self.revoked = set()
+        self.jwks_requests = 0
+        self.introspection_requests = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self.rotate_key()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    def rotate_key(self, keep_old=True):
+        """Start signing with a new key; the old one stays published unless keep_old is False"""
+        kid = f'key-{len(self.signing_keys) + 1}'
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        with self._lock:
+            if not keep_old:
+                self.signing_keys.clear()
+            self.signing_keys[kid] = key
+            self.current_kid = kid
+        return kid
+
+    def issue_jwt(self, subject='91-1234-5678-9012', expires_in=3600, **claims):
+        now = int(time.time())
+        payload = dict({'iss': self.issuer, 'sub': subject, 'iat': now, 'exp': now + expires_in}, **claims)
+        return jwt.encode(payload, self.signing_keys[self.current_kid], algorithm='RS256',
+                          headers={'kid': self.current_kid})
+
+    def issue_opaque(self, subject='91-1234-5678-9012', expires_in=3600):
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self.opaque_tokens[token] = {'sub': subject, 'exp': int(time.time()) + expires_in}
+        return token
+
+    def revoke(self, token):
+        with self._lock:
+            self.revoked.add(token)
+
+    def jwks(self):
+        keys = []
+        for kid, key in self.signing_keys.items():
+            numbers = key.public_key().public_numbers()
+            keys.append({
+                'kty': 'RSA', 'use': 'sig', 'alg': 'RS256', 'kid': kid,
+                'n': _b64_int(numbers.n), 'e': _b64_int(numbers.e),
+            })
+        return {'keys': keys}
+
+    def introspect(self, token):
+        with self._lock:
+            data = self.opaque_tokens.get(token)
+            if data is None or token in self.revoked or data['exp'] <= time.time():
+                return {'active': False}
+        return dict(data, active=True, iss=self.issuer, client_id=self.client_id, token_type='Bearer')
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', self.port), _handler(self))
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _b64_int(value):
+    raw = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _handler(mock):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body, headers=None):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/certs':
+                return self._send(404, {'error': 'not found'})
+            with mock._lock:
+                mock.jwks_requests += 1
+            self._send(200, mock.jwks())
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            form = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+            if self.path != '/introspect':
+                return self._send(404, {'error': 'not found'})
+            expected = base64.b64encode(f'{mock.client_id}:{mock.client_secret}'.encode()).decode()
+            if self.headers.get('Authorization') != f'Basic {expected}':
+                return self._send(401, {'error': 'invalid_client'}, {'WWW-Authenticate': 'Basic'})
+            with mock._lock:
+                mock.introspection_requests += 1
+            self._send(200, mock.introspect(form.get('token', '')))
+
+    return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--port', type=int, default=8098)
+    args = parser.parse_args()
+
+    server = MockABHAServer(port=args.port).start()
+    print(f'Mock ABHA auth at {server.url} (JWKS {server.url}/certs, introspection {server.url}/introspect)')
+    print(f'client_id={server.client_id} client_secret={server.client_secret}')
+    print(f'Sample JWT (1 hour): {server.issue_jwt()}')
+    print(f'Sample opaque token (1 hour): {server.issue_opaque()}')
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
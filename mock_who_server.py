@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Local mock of the WHO ICD-11 API for testing the sync engine offline
+
+Serves a synthetic MMS linearization (a Biomedicine chapter and the TM2
+chapter 26) with the same URL layout, language-tagged values and OAuth
+client-credentials token endpoint as the real API. It sends ETags and
+honours If-None-Match, and can inject 429/503 responses or a full outage.
+
+    python mock_who_server.py --port 8099
+    ICD11_API_BASE_URL=http://localhost:8099/icd \\
+    ICD11_TOKEN_ENDPOINT=http://localhost:8099/connect/token python app.py
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+WHO_BASE = 'http://id.who.int/icd'
+
+
+def build_tree(blocks=4, categories=10, subcategories=3):
+    """Synthetic linearization: entity id -> entity fields, '' being the root"""
+    tree = {'': {'classKind': None, 'title': 'ICD-11 for Mortality and Morbidity Statistics', 'child': []}}
+    next_id = [1000]
+
+    def add(parent, **fields):
+        next_id[0] += 1
+        entity_id = str(next_id[0])
+        tree[entity_id] = dict(fields, child=[])
+        tree[parent]['child'].append(entity_id)
+        return entity_id
+
+    for chapter_code, prefix, name in (('01', '1', 'Certain infectious or parasitic diseases'),
+                                       ('26', 'S', 'Traditional medicine conditions - Module I')):
+        chapter = add('', classKind='chapter', code=chapter_code, title=name)
+        for b in range(blocks):
+            block = add(chapter, classKind='block', title=f'{name} block {b}')
+            for c in range(categories):
+                code = f'{prefix}{chr(65 + b)}{c:02d}'
+                category = add(block, classKind='category', code=code, title=f'{name} condition {b}.{c}',
+                               definition=f'Synthetic definition of {code}')
+                for s in range(subcategories):
+                    add(category, classKind='category', code=f'{code}.{s}', title=f'{name} condition {b}.{c}.{s}')
+    return tree
+
+
+class MockWHOServer:
+    """Threaded mock server; use as a context manager or call start()/stop()"""
+
+    def __init__(self, port=0, release_id='2024-01', client_id='mock-client', client_secret='mock-secret',
+                 token_ttl=3600, throttle_rate=0.0, error_rate=0.0, seed=1, **tree_options):
+        self.port = port
+        self.releases = {release_id: build_tree(**tree_options)}
+        self.latest = release_id
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token_ttl = token_ttl
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        # Answer 503 to every entity request after this many (None: never)
+        self.down_after = None
+        self.tokens = {}
+        self.token_requests = 0
+        self.entity_requests = 0
+        self.not_modified = 0
+        self.injected_failures = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    @property
+    def categories(self):
+        return sum(1 for entity in self.releases[self.latest].values() if entity['classKind'] == 'category')
+
+    def publish(self, release_id, changed=()):
+        """New latest release copying the current one, retitling the given entity ids"""
+        tree = json.loads(json.dumps(self.releases[self.latest]))
+        for entity_id in changed:
+            tree[entity_id]['title'] += f' (revised {release_id})'
+        self.releases[release_id] = tree
+        self.latest = release_id
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', self.port), _handler(self))
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def entity(self, release_id, entity_id):
+        """WHO-style JSON for one entity, or None"""
+        entity = self.releases.get(release_id, {}).get(entity_id)
+        if entity is None:
+            return None
+        uri = f'{WHO_BASE}/release/11/{release_id}/mms'
+        data = {
+            '@id': f'{uri}/{entity_id}' if entity_id else uri,
+            'title': {'@language': 'en', '@value': entity['title']},
+            'child': [f'{uri}/{child}' for child in entity['child']],
+        }
+        if entity_id:
+            data['classKind'] = entity['classKind']
+        else:
+            data['releaseId'] = release_id
+        if entity.get('code'):
+            data['code'] = entity['code']
+        if entity.get('definition'):
+            data['definition'] = {'@language': 'en', '@value': entity['definition']}
+        return data
+
+    def fault(self):
+        """Status code to inject for this request, if any"""
+        with self._lock:
+            self.entity_requests += 1
+            if self.down_after is not None and self.entity_requests > self.down_after:
+                self.injected_failures += 1
+                return 503
+            roll = self._random.random()
+            if roll < self.throttle_rate:
+                self.injected_failures += 1
+                return 429
+            if roll < self.throttle_rate + self.error_rate:
+                self.injected_failures += 1
+                return 503
+        return None
+
+    def issue_token(self):
+        with self._lock:
+            self.token_requests += 1
+            token = f'mock-token-{self.token_requests}'
+            self.tokens[token] = time.monotonic() + self.token_ttl
+        return token
+
+    def token_valid(self, header):
+        token = header[len('Bearer '):] if header.startswith('Bearer ') else None
+        return token is not None and self.tokens.get(token, 0) > time.monotonic()
+
+
+def _handler(mock):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body=None, headers=None):
+            payload = json.dumps(body).encode() if body is not None else b''
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            if body is not None:
+                self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            form = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+            if self.path != '/connect/token':
+                return self._send(404, {'error': 'not found'})
+            if form.get('client_id') != mock.client_id or form.get('client_secret') != mock.client_secret:
+                return self._send(400, {'error': 'invalid_client'})
+            self._send(200, {'access_token': mock.issue_token(), 'expires_in': mock.token_ttl,
+                             'token_type': 'Bearer', 'scope': 'icdapi_access'})
+
+        def do_GET(self):
+            if not mock.token_valid(self.headers.get('Authorization', '')):
+                return self._send(401, {'error': 'invalid_token'})
+            parts = self.path.split('?')[0].strip('/').split('/')
+            # icd/release/11/mms  or  icd/release/11/<release>/mms[/<entity id>]
+            if parts[:3] != ['icd', 'release', '11']:
+                return self._send(404, {'error': 'not found'})
+            if parts[3:] == ['mms']:
+                return self._send(200, {
+                    'latestRelease': f'{WHO_BASE}/release/11/{mock.latest}/mms',
+                    'release': [f'{WHO_BASE}/release/11/{release}/mms' for release in mock.releases],
+                })
+            if len(parts) < 5 or parts[4] != 'mms':
+                return self._send(404, {'error': 'not found'})
+            status = mock.fault()
+            if status is not None:
+                return self._send(status, {'error': 'injected'}, {'Retry-After': '0'} if status == 429 else None)
+            data = mock.entity(parts[3], '/'.join(parts[5:]))
+            if data is None:
+                return self._send(404, {'error': 'not found'})
+            # Release-independent, so unchanged entities keep their ETag across releases
+            content = {key: value for key, value in data.items() if key not in ('@id', 'child', 'releaseId')}
+            content['child'] = [uri.rsplit('/', 1)[-1] for uri in data['child']]
+            etag = '"' + hashlib.sha1(json.dumps(content, sort_keys=True).encode()).hexdigest() + '"'
+            if self.headers.get('If-None-Match') == etag:
+                with mock._lock:
+                    mock.not_modified += 1
+                return self._send(304, headers={'ETag': etag})
+            self._send(200, data, {'ETag': etag})
+
+    return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = MockWHOServer(port=args.port, throttle_rate=args.throttle_rate, error_rate=args.error_rate).start()
+    print(f'Mock WHO ICD-11 API at {server.url}/icd (token endpoint {server.url}/connect/token)')
+    print(f'client_id={server.client_id} client_secret={server.client_secret}; '
+          f'{server.categories} categories in release {server.latest}')
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
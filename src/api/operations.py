@@ -0,0 +1,478 @@
+"""
+Bulk and batch terminology operations (plain Flask, without Flask-RESTX).
+"""
+
+import os
+import shutil
+
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context, url_for
+
+from src.services import (abha_auth, audit, bundle_processor, consent, expansion, fhir_json, hierarchy, http_cache,
+                          icd11_import, icd11_sync, jobs, mapping_suggestions, namaste_loader, translation,
+                          versioning)
+
+api_ops = Blueprint('api_ops', __name__)
+
+
+@api_ops.after_request
+def _audit_request(response):
+    """Queue an audit event per operation; the writer stores them in bulk"""
+    audit.log(
+        (request.endpoint or '').rsplit('.', 1)[-1],
+        resource_type=request.path.strip('/').split('/')[0] or None,
+        resource_id=next(iter((request.view_args or {}).values()), None),
+        details={'method': request.method, 'path': request.full_path.rstrip('?'), 'status': response.status_code},
+    )
+    return response
+
+
+def _outcome(severity, code, text):
+    return {
+        'resourceType': 'OperationOutcome',
+        'issue': [{'severity': severity, 'code': code, 'details': {'text': text}}],
+    }
+
+
+def _upload_stream():
+    """Binary stream for a CSV sent as multipart 'file' or as a raw text/csv body"""
+    if request.mimetype == 'text/csv':
+        return request.stream
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return None
+    return upload.stream
+
+
+def _spool_upload(prefix, suffix):
+    """Save a multipart 'file' or raw request body under UPLOAD_FOLDER; returns the path or None"""
+    upload = request.files.get('file')
+    if upload is not None and upload.filename:
+        stream = upload.stream
+        suffix = os.path.splitext(upload.filename)[1] or suffix
+    elif request.content_length and not request.form:
+        stream = request.stream
+    else:
+        return None
+    folder = current_app.config['UPLOAD_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f'{prefix}-{os.urandom(8).hex()}{suffix}')
+    with open(path, 'wb') as f:
+        shutil.copyfileobj(stream, f)
+    return path
+
+
+def _prefers_async():
+    return 'respond-async' in request.headers.get('Prefer', '')
+
+
+def _accepted(job):
+    """202 Accepted pointing at the job's status endpoint"""
+    response = jsonify(job.to_task())
+    response.status_code = 202
+    response.headers['Content-Location'] = url_for('api_ops.get_job', job_id=job.id)
+    return response
+
+
+def _queue_full():
+    response = jsonify(_outcome('error', 'throttled', 'Too many background jobs queued; retry later'))
+    response.status_code = 503
+    response.headers['Retry-After'] = '30'
+    return response
+
+
+@api_ops.route('/ingest/csv/stream', methods=['POST'])
+@abha_auth.require_token
+def ingest_csv_stream():
+    """Stream a NAMASTE CSV into NAMASTECode in fixed-size bulk-upserted chunks"""
+    stream = _upload_stream()
+    if stream is None:
+        return jsonify(_outcome('error', 'required', 'No CSV file provided')), 400
+
+    chunk_size = max(1, request.args.get('chunk_size', current_app.config['INGEST_CHUNK_SIZE'], type=int))
+
+    if _prefers_async():
+        # Spool to the shared upload folder so any job worker can read it
+        folder = current_app.config['UPLOAD_FOLDER']
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f'ingest-{os.urandom(8).hex()}.csv')
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(stream, f)
+        try:
+            job = jobs.submit(current_app, 'ingest-csv', path=path, chunk_size=chunk_size)
+        except jobs.JobQueueFull:
+            os.remove(path)
+            return _queue_full()
+        return _accepted(job)
+
+    result = namaste_loader.load_csv(stream, chunk_size=chunk_size)
+    status = 201 if result.rows_written else 400
+    return jsonify(result.to_operation_outcome()), status
+
+
+@api_ops.route('/sync/icd11/jobs', methods=['POST'])
+@abha_auth.require_token
+def sync_icd11():
+    """Start a background ICD-11 sync (?full=true ignores the checkpoint and ETags)"""
+    full = request.args.get('full', 'false').lower() == 'true'
+    try:
+        job = jobs.submit(current_app, icd11_sync.JOB_KIND, full=full)
+    except jobs.JobQueueFull:
+        return _queue_full()
+    return _accepted(job)
+
+
+@api_ops.route('/ingest/icd11/release', methods=['POST'])
+@abha_auth.require_token
+def ingest_icd11_release():
+    """Import an ICD-11 release from an uploaded WHO tabulation (.txt/.tsv or .zip), writing only changes"""
+    path = _spool_upload('icd11-release', '.zip' if request.mimetype == 'application/zip' else '.txt')
+    if path is None:
+        return jsonify(_outcome('error', 'required', 'No release file provided')), 400
+    params = {
+        'release': request.args.get('release'),
+        'chunk_size': max(1, request.args.get('chunk_size', current_app.config['INGEST_CHUNK_SIZE'], type=int)),
+        'prune': request.args.get('prune', 'false').lower() == 'true',
+    }
+
+    if _prefers_async():
+        try:
+            job = jobs.submit(current_app, icd11_import.JOB_KIND, path=path, **params)
+        except jobs.JobQueueFull:
+            os.remove(path)
+            return _queue_full()
+        return _accepted(job)
+
+    try:
+        result = icd11_import.import_release(path, **params)
+    except (ValueError, OSError) as e:
+        return jsonify(_outcome('error', 'invalid', f'Cannot read release file: {e}')), 400
+    finally:
+        os.remove(path)
+    status = 400 if not result.rows_read else 200
+    return jsonify(result.to_operation_outcome()), status
+
+
+@api_ops.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Progress of a background ingest or sync job as a FHIR Task"""
+    job = jobs.get_job(current_app, job_id)
+    if job is None:
+        return jsonify(_outcome('error', 'not-found', f'Job {job_id} not found')), 404
+    return jsonify(job.to_task())
+
+
+def _translate_request(body):
+    """(source_system, source_code, target_system) from Parameters or plain JSON"""
+    if body.get('resourceType') == 'Parameters':
+        values = {}
+        for parameter in body.get('parameter', []):
+            if 'valueCoding' in parameter:
+                values['system'] = parameter['valueCoding'].get('system')
+                values['code'] = parameter['valueCoding'].get('code')
+            else:
+                values[parameter.get('name')] = next(
+                    (v for k, v in parameter.items() if k.startswith('value')), None)
+        return values.get('system'), values.get('code'), values.get('targetsystem')
+    return body.get('source_system'), body.get('source_code'), body.get('target_system')
+
+
+@api_ops.route('/bundle/process', methods=['POST'])
+@abha_auth.require_token
+def process_bundle():
+    """Store a collection, batch or transaction Bundle with set-based validation and writes"""
+    try:
+        response, status = bundle_processor.process_bundle(request.get_json(silent=True),
+                                                           consent_purpose=_consent_purpose())
+    except bundle_processor.BundleError as e:
+        return jsonify(_outcome('error', 'invalid', str(e))), 400
+    return jsonify(response), status
+
+
+def _consent_purpose():
+    """Purpose to check consent for, or None when CONSENT_REQUIRED is off"""
+    if not current_app.config.get('CONSENT_REQUIRED'):
+        return None
+    return request.args.get('purpose') or current_app.config['CONSENT_DEFAULT_PURPOSE']
+
+
+def _consented(resource):
+    purpose = _consent_purpose()
+    return purpose is None or consent.get_engine().evaluate([resource], purpose)[0] is not False
+
+
+def _resource_response(version, resource):
+    if not _consented(resource):
+        return jsonify(_outcome('error', 'forbidden', 'No active consent covers this resource for this purpose')), 403
+    response = jsonify(resource)
+    response.headers['ETag'] = f'W/"{version}"'
+    return response
+
+
+@api_ops.route('/fhir/<resource_type>/<resource_id>', methods=['GET'])
+def read_resource(resource_type, resource_id):
+    """FHIR read: the latest version of a stored resource"""
+    found = versioning.read(resource_type, resource_id)
+    if found is None:
+        return jsonify(_outcome('error', 'not-found', f'{resource_type}/{resource_id} not found')), 404
+    return _resource_response(*found)
+
+
+@api_ops.route('/fhir/<resource_type>/<resource_id>/_history/<int:version>', methods=['GET'])
+def vread_resource(resource_type, resource_id, version):
+    """FHIR vread: one version, rebuilt from the nearest snapshot"""
+    found = versioning.read(resource_type, resource_id, version)
+    if found is None:
+        text = f'{resource_type}/{resource_id}/_history/{version} not found'
+        return jsonify(_outcome('error', 'not-found', text)), 404
+    return _resource_response(*found)
+
+
+@api_ops.route('/fhir/<resource_type>/<resource_id>/_history', methods=['GET'])
+def resource_history(resource_type, resource_id):
+    """FHIR history of one resource as a history Bundle, newest version first"""
+    versions = versioning.history(resource_type, resource_id)
+    if not versions:
+        return jsonify(_outcome('error', 'not-found', f'{resource_type}/{resource_id} not found')), 404
+    if not _consented(versions[0][2]):
+        return jsonify(_outcome('error', 'forbidden', 'No active consent covers this resource for this purpose')), 403
+    return jsonify({
+        'resourceType': 'Bundle',
+        'type': 'history',
+        'total': len(versions),
+        'entry': [{
+            'fullUrl': f'{resource_type}/{resource_id}/_history/{version}',
+            'resource': resource,
+            'response': {
+                'status': '201 Created' if version == 1 else '200 OK',
+                'etag': f'W/"{version}"',
+                'lastModified': created_at.isoformat() if created_at else None,
+            },
+        } for version, created_at, resource in versions],
+    })
+
+
+@api_ops.route('/ConceptMap/$translate', methods=['GET', 'POST'])
+@http_cache.conditional
+def concept_map_translate():
+    """FHIR ConceptMap/$translate backed by the two-tier translation cache"""
+    if request.method == 'GET':
+        key = (request.args.get('system'), request.args.get('code'), request.args.get('targetsystem'))
+    else:
+        key = _translate_request(request.get_json(silent=True) or {})
+    if not all(key):
+        return jsonify(_outcome('error', 'required', 'system, code and targetsystem are required')), 400
+    return jsonify(translation.translation_parameters(translation.translate(*key)))
+
+
+def _batch_translate_requests(body):
+    """
+    Keys from a JSON array of objects, or Parameters with repeated 'item' groups.
+
+    In Parameters form each item carries system/code (or a coding) and an
+    optional targetsystem; a top-level targetsystem applies to the others.
+    """
+    if isinstance(body, list):
+        return [_translate_request(item if isinstance(item, dict) else {}) for item in body]
+    if body.get('resourceType') != 'Parameters':
+        return None
+    default_target = next(
+        (p.get('valueUri') for p in body.get('parameter', []) if p.get('name') == 'targetsystem'), None)
+    keys = []
+    for parameter in body.get('parameter', []):
+        if parameter.get('name') == 'item':
+            part = {'resourceType': 'Parameters', 'parameter': parameter.get('part', [])}
+            system, code, target = _translate_request(part)
+            keys.append((system, code, target or default_target))
+        elif parameter.get('name') in ('coding', 'sourceCoding'):
+            coding = parameter.get('valueCoding', {})
+            keys.append((coding.get('system'), coding.get('code'), default_target))
+    return keys
+
+
+@api_ops.route('/ConceptMap/$translate/batch', methods=['POST'])
+def concept_map_translate_batch():
+    """Translate many codes in one request; one batch-response entry per input, in order"""
+    keys = _batch_translate_requests(request.get_json(silent=True) or {})
+    if not keys:
+        return jsonify(_outcome('error', 'required', 'Send a JSON array or Parameters with item/coding entries')), 400
+    limit = current_app.config['TRANSLATE_BATCH_MAX']
+    if len(keys) > limit:
+        return jsonify(_outcome('error', 'too-costly', f'At most {limit} codes per batch; got {len(keys)}')), 413
+
+    valid = [key for key in keys if all(key)]
+    results = dict(zip(valid, translation.translate_many(valid)))
+    entries = []
+    for key in keys:
+        if key in results:
+            entries.append({
+                'resource': translation.translation_parameters(results[key]),
+                'response': {'status': '200 OK'},
+            })
+        else:
+            entries.append({
+                'response': {
+                    'status': '400 Bad Request',
+                    'outcome': _outcome('error', 'required', 'system, code and targetsystem are required'),
+                },
+            })
+    return jsonify({'resourceType': 'Bundle', 'type': 'batch-response', 'total': len(entries), 'entry': entries})
+
+
+def _parameters(body):
+    """{name: value} from a FHIR Parameters resource (first value of each name)"""
+    values = {}
+    for parameter in (body or {}).get('parameter', []):
+        value = next((v for k, v in parameter.items() if k.startswith('value') or k == 'resource'), None)
+        values.setdefault(parameter.get('name'), value)
+    return values
+
+
+@api_ops.route('/ConceptMap/$suggest-mappings', methods=['GET'])
+@http_cache.conditional
+def concept_map_suggest_mappings():
+    """Ranked ICD-11 candidates for one NAMASTE code, or (POST without code) a background run over all codes"""
+    if request.method == 'GET':
+        values = request.args
+    else:
+        values = {**request.args.to_dict(), **_parameters(request.get_json(silent=True))}
+    try:
+        count = _int_parameter(values.get('count'), None, 'count', current_app.config['EXPAND_MAX_COUNT'])
+    except ValueError as e:
+        return jsonify(_outcome('error', 'invalid', str(e))), 400
+
+    code = values.get('code')
+    if code:
+        candidates = mapping_suggestions.suggest(code, count)
+        if candidates is None:
+            return jsonify(_outcome('error', 'not-found', f'NAMASTE code {code} not found')), 404
+        return jsonify(mapping_suggestions.suggestion_parameters(candidates))
+    if request.method != 'POST':
+        return jsonify(_outcome('error', 'required', 'code is required; POST without code starts a full run')), 400
+    try:
+        job = jobs.submit(current_app, mapping_suggestions.JOB_KIND, top_k=count or None)
+    except jobs.JobQueueFull:
+        return _queue_full()
+    return _accepted(job)
+
+
+@api_ops.route('/ConceptMap/$suggest-mappings', methods=['POST'])
+@abha_auth.require_token
+def concept_map_suggest_mappings_run():
+    """POSTed $suggest-mappings, which can start a full run, needs a token"""
+    return concept_map_suggest_mappings()
+
+
+@api_ops.route('/CodeSystem/$subsumes', methods=['GET', 'POST'])
+@http_cache.conditional
+def code_system_subsumes():
+    """FHIR CodeSystem/$subsumes answered with one closure-table lookup"""
+    if request.method == 'GET':
+        system, code_a, code_b = (request.args.get(name) for name in ('system', 'codeA', 'codeB'))
+    else:
+        values = _parameters(request.get_json(silent=True))
+        coding_a, coding_b = values.get('codingA') or {}, values.get('codingB') or {}
+        system = values.get('system') or coding_a.get('system') or coding_b.get('system')
+        code_a = values.get('codeA') or coding_a.get('code')
+        code_b = values.get('codeB') or coding_b.get('code')
+    if not (system and code_a and code_b):
+        return jsonify(_outcome('error', 'required', 'system, codeA and codeB are required')), 400
+    if hierarchy.code_model(system)[0] is None:
+        return jsonify(_outcome('error', 'not-supported', f'Unknown code system {system}')), 400
+    outcome = hierarchy.subsumes(system, code_a, code_b)
+    if outcome is None:
+        return jsonify(_outcome('error', 'not-found', f'{code_a} or {code_b} is not a known {system} code')), 404
+    return jsonify({'resourceType': 'Parameters', 'parameter': [{'name': 'outcome', 'valueCode': outcome}]})
+
+
+def _expansion_spec(value_set=None, url=None):
+    """
+    Expansion for an implicit ValueSet URL or a ValueSet resource, or None.
+
+    URLs: <system> or <system>?fhir_vs (every code) and
+    <system>?fhir_vs=isa/<code>. A ValueSet's first compose.include gives the
+    system, narrowed by a concept is-a/descendent-of filter if it has one.
+    """
+    if url:
+        system, _, query = url.partition('?')
+        if query in ('', 'fhir_vs'):
+            return expansion.Expansion(system)
+        code = query[len('fhir_vs=isa/'):] if query.startswith('fhir_vs=isa/') else None
+        return expansion.Expansion(system, code) if code else None
+    for include in ((value_set or {}).get('compose') or {}).get('include', [])[:1]:
+        if not include.get('system'):
+            return None
+        for item in include.get('filter', []):
+            if item.get('property') == 'concept' and item.get('op') in ('is-a', 'descendent-of') and item.get('value'):
+                return expansion.Expansion(include['system'], item['value'], item['op'] == 'is-a')
+        return None if include.get('filter') else expansion.Expansion(include['system'])
+    return None
+
+
+def _int_parameter(value, default, name, maximum=None):
+    """Non-negative int from a request parameter; raises ValueError naming it"""
+    if value in (None, ''):
+        return default
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        number = -1
+    if number < 0 or (maximum is not None and number > maximum):
+        limit = f' and at most {maximum}' if maximum is not None else ''
+        raise ValueError(f'{name} must be a non-negative integer{limit}')
+    return number
+
+
+@api_ops.route('/ValueSet/$expand', methods=['GET', 'POST'])
+@http_cache.conditional
+def value_set_expand():
+    """
+    ValueSet expansion of a whole code system or an is-a hierarchy, paged or streamed.
+
+    count (or _count) and offset page the expansion; expansion.next links to
+    the following page by keyset cursor. _stream=true writes the whole
+    expansion incrementally instead.
+    """
+    if request.method == 'GET':
+        values = request.args
+        spec = _expansion_spec(url=values.get('url'))
+    else:
+        body = request.get_json(silent=True) or {}
+        if body.get('resourceType') == 'Parameters':
+            values = _parameters(body)
+            spec = _expansion_spec(values.get('valueSet'), values.get('url'))
+        else:
+            values = request.args
+            spec = _expansion_spec(body)
+    if spec is None:
+        return jsonify(_outcome('error', 'required',
+                                'Give url=<system>[?fhir_vs[=isa/<code>]] or a ValueSet with a compose.include')), 400
+    if hierarchy.code_model(spec.system)[0] is None:
+        return jsonify(_outcome('error', 'not-supported', f'Unknown code system {spec.system}')), 400
+    if not spec.exists():
+        return jsonify(_outcome('error', 'not-found', f'{spec.code} is not a known {spec.system} code')), 404
+
+    if str(request.args.get('_stream', '')).lower() == 'true':
+        chunks = expansion.stream(spec, current_app.config['EXPAND_STREAM_BATCH'],
+                                  fast=current_app.config.get('FHIR_FAST_SERIALIZER', False))
+        return Response(stream_with_context(chunks), mimetype='application/json')
+
+    try:
+        count = _int_parameter(values.get('count', values.get('_count')), current_app.config['EXPAND_DEFAULT_COUNT'],
+                               'count', current_app.config['EXPAND_MAX_COUNT'])
+        offset = _int_parameter(values.get('offset'), 0, 'offset')
+        fast = fhir_json.enabled()
+        value_set = expansion.page(
+            spec, count, offset, cursor=values.get('cursor'),
+            next_url=lambda cursor: url_for('api_ops.value_set_expand', url=spec.url, count=count, cursor=cursor,
+                                            _external=True),
+            fast=fast,
+        )
+        return fhir_json.response(value_set) if fast else jsonify(value_set)
+    except ValueError as e:
+        return jsonify(_outcome('error', 'invalid', str(e))), 400
+
+
+@api_ops.route('/translate/cache/stats', methods=['GET'])
+def translation_cache_stats():
+    """Hit/miss/eviction counters for sizing the translation cache"""
+    return jsonify(current_app.extensions['translation_cache'].stats())
@@ -0,0 +1,263 @@
+"""
+ABHA bearer token validation without a remote call per request.
+
+JWT access tokens are verified locally against the ABHA signing keys
+(JWKS), which are held in memory and refreshed by a background thread, and
+straight away when a token names a key id not seen yet. Opaque tokens are
+checked against the introspection endpoint (RFC 7662). Either way the
+outcome is cached under a hash of the token: valid tokens until they
+expire (capped at ABHA_TOKEN_CACHE_TTL), rejected ones for
+ABHA_NEGATIVE_CACHE_TTL seconds, so a repeated token costs one dictionary
+lookup.
+
+The auth middleware (src/middleware/auth.py) calls validate(); views can
+also use the require_token decorator directly.
+"""
+
+import functools
+import hashlib
+import logging
+import threading
+import time
+
+from flask import current_app, g, jsonify, request
+
+from src.services.translation_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Asymmetric algorithms only; a JWKS never legitimately carries HMAC secrets
+ALLOWED_ALGORITHMS = ('RS256', 'RS384', 'RS512', 'PS256', 'PS384', 'PS512', 'ES256', 'ES384')
+
+
+class TokenInvalid(Exception):
+    """The token is malformed, expired, revoked or signed by an unknown key"""
+
+
+class AuthUnavailable(Exception):
+    """The token could not be checked (JWKS or introspection endpoint unreachable)"""
+
+
+class JWKSCache:
+    """Signing keys by kid, refreshed in the background"""
+
+    def __init__(self, url, refresh_interval=300, min_refresh_interval=30, timeout=5.0):
+        self.url = url
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self.keys = {}
+        self.fetches = 0
+        self._fetched_at = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def refresh(self):
+        """Fetch the key set; on failure the keys already held stay in use"""
+        # httpx and PyJWT are imported on first use so workers without ABHA auth never load them
+        import httpx
+        import jwt
+
+        with self._lock:
+            self._fetched_at = time.monotonic()
+            self.fetches += 1
+            try:
+                response = httpx.get(self.url, timeout=self.timeout)
+                response.raise_for_status()
+                jwks = response.json()
+            except (httpx.HTTPError, ValueError) as e:
+                raise AuthUnavailable(f'JWKS fetch from {self.url} failed: {e}')
+            keys = {}
+            for data in jwks.get('keys', []):
+                if data.get('use', 'sig') != 'sig' or not data.get('kid'):
+                    continue
+                try:
+                    keys[data['kid']] = jwt.PyJWK(data)
+                except jwt.PyJWKError as e:
+                    logger.warning('Skipping unusable JWKS key %s: %s', data.get('kid'), e)
+            self.keys = keys
+
+    def get(self, kid):
+        """Key for kid, fetching the key set if kid is new (rate-limited)"""
+        self._ensure_refresher()
+        key = self.keys.get(kid)
+        if key is None and (self._fetched_at is None
+                            or time.monotonic() - self._fetched_at >= self.min_refresh_interval):
+            self.refresh()
+            key = self.keys.get(kid)
+        return key
+
+    def _ensure_refresher(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='medisync-jwks-refresh', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except AuthUnavailable as e:
+                logger.warning('%s; keeping %d cached keys', e, len(self.keys))
+
+
+class TokenValidator:
+    """Validates ABHA tokens and caches the outcome"""
+
+    def __init__(self, jwks=None, introspection_url=None, client_id=None, client_secret=None, issuer=None,
+                 audience=None, cache_size=10000, max_ttl=300, negative_ttl=30, leeway=30, timeout=5.0):
+        self.jwks = jwks
+        self.introspection_url = introspection_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.issuer = issuer
+        self.audience = audience
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.leeway = leeway
+        self.timeout = timeout
+        self.cache = LRUCache(cache_size, max_ttl)
+        self.stats = {'hits': 0, 'misses': 0, 'verified': 0, 'introspected': 0, 'rejected': 0}
+
+    @classmethod
+    def from_config(cls, config):
+        jwks = None
+        if config.get('ABHA_JWKS_URL'):
+            jwks = JWKSCache(config['ABHA_JWKS_URL'], refresh_interval=config['ABHA_JWKS_REFRESH'],
+                             timeout=config['ABHA_AUTH_TIMEOUT'])
+        return cls(
+            jwks=jwks,
+            introspection_url=config.get('ABHA_INTROSPECTION_URL'),
+            client_id=config.get('ABHA_CLIENT_ID'),
+            client_secret=config.get('ABHA_CLIENT_SECRET'),
+            issuer=config.get('ABHA_ISSUER'),
+            audience=config.get('ABHA_AUDIENCE'),
+            cache_size=config['ABHA_TOKEN_CACHE_SIZE'],
+            max_ttl=config['ABHA_TOKEN_CACHE_TTL'],
+            negative_ttl=config['ABHA_NEGATIVE_CACHE_TTL'],
+            timeout=config['ABHA_AUTH_TIMEOUT'],
+        )
+
+    def validate(self, token):
+        """Claims of a valid token; raises TokenInvalid or AuthUnavailable"""
+        key = hashlib.sha256(token.encode()).digest()
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.stats['hits'] += 1
+            if isinstance(cached, str):
+                raise TokenInvalid(cached)
+            return cached
+        self.stats['misses'] += 1
+        try:
+            if token.count('.') == 2:
+                claims = self._verify(token)
+                self.stats['verified'] += 1
+            else:
+                claims = self._introspect(token)
+                self.stats['introspected'] += 1
+            ttl = min(self.max_ttl, claims['exp'] + self.leeway - time.time())
+            if ttl <= 0:
+                raise TokenInvalid('Token has expired')
+        except TokenInvalid as e:
+            # Short, so a token that becomes valid (clock skew, key rotation) recovers quickly
+            self.stats['rejected'] += 1
+            self.cache.set(key, str(e), ttl=self.negative_ttl)
+            raise
+        self.cache.set(key, claims, ttl=ttl)
+        return claims
+
+    def cached(self, token):
+        """Claims of a token already validated and still cached, else None; never fetches anything"""
+        claims = self.cache.get(hashlib.sha256(token.encode()).digest())
+        return None if isinstance(claims, str) else claims
+
+    def _verify(self, token):
+        import jwt
+
+        if self.jwks is None:
+            raise TokenInvalid('JWT tokens are not accepted (ABHA_JWKS_URL is not set)')
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.InvalidTokenError as e:
+            raise TokenInvalid(f'Malformed token: {e}')
+        if header.get('alg') not in ALLOWED_ALGORITHMS:
+            raise TokenInvalid(f'Signing algorithm {header.get("alg")} is not allowed')
+        signing_key = self.jwks.get(header.get('kid'))
+        if signing_key is None:
+            raise TokenInvalid(f'Unknown signing key {header.get("kid")}')
+        try:
+            return jwt.decode(
+                token, signing_key.key, algorithms=[header['alg']], audience=self.audience, issuer=self.issuer,
+                leeway=self.leeway,
+                options={'require': ['exp'], 'verify_aud': self.audience is not None},
+            )
+        except jwt.ExpiredSignatureError:
+            raise TokenInvalid('Token has expired')
+        except jwt.InvalidTokenError as e:
+            raise TokenInvalid(f'Token rejected: {e}')
+
+    def _introspect(self, token):
+        import httpx
+
+        if not self.introspection_url:
+            raise TokenInvalid('Opaque tokens are not accepted (ABHA_INTROSPECTION_URL is not set)')
+        try:
+            response = httpx.post(
+                self.introspection_url, data={'token': token, 'token_type_hint': 'access_token'},
+                auth=(self.client_id or '', self.client_secret or ''), timeout=self.timeout,
+            )
+            response.raise_for_status()
+            result = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            raise AuthUnavailable(f'Token introspection failed: {e}')
+        if not result.get('active'):
+            raise TokenInvalid('Token is not active')
+        if 'exp' not in result:
+            # Without an expiry the result is only trusted for the cache TTL
+            result['exp'] = time.time() + self.max_ttl
+        return result
+
+
+def _unauthorized(status, code, text):
+    response = jsonify({
+        'resourceType': 'OperationOutcome',
+        'issue': [{'severity': 'error', 'code': code, 'details': {'text': text}}],
+    })
+    response.status_code = status
+    if status == 401:
+        response.headers['WWW-Authenticate'] = 'Bearer'
+    return response
+
+
+def validate(token):
+    """Validate a token with the app's validator"""
+    return current_app.extensions['abha_auth'].validate(token)
+
+
+def require_token(view):
+    """Reject requests without a valid ABHA bearer token; sets g.user_id and g.token_claims
+
+    A no-op when ABHA_AUTH_REQUIRED is off (TestingConfig).
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_app.config.get('ABHA_AUTH_REQUIRED', True):
+            return view(*args, **kwargs)
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not token:
+            return _unauthorized(401, 'login', 'Authorization: Bearer <ABHA token> is required')
+        try:
+            claims = validate(token.strip())
+        except TokenInvalid as e:
+            return _unauthorized(401, 'security', str(e))
+        except AuthUnavailable as e:
+            logger.warning('%s', e)
+            return _unauthorized(503, 'transient', 'Token could not be verified; try again shortly')
+        g.token_claims = claims
+        g.user_id = claims.get('sub') or claims.get('username')
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def init_app(app):
+    app.extensions['abha_auth'] = TokenValidator.from_config(app.config)
@@ -0,0 +1,462 @@
+"""
+Batched, asynchronous audit logging.
+
+log() appends the event to this process's journal (one JSON line in a
+file under AUDIT_SPOOL_DIR, written straight through to the OS) and to an
+in-memory queue; a background writer inserts queued events into AuditLog
+in bulk, once AUDIT_BATCH_SIZE events have gathered or
+AUDIT_FLUSH_INTERVAL seconds have passed. A journal file is deleted once
+every event in it has been written. When the queue is full or the database
+rejects a batch, events are appended to a spool file instead of being
+dropped; the writer replays spooled files once the database accepts writes
+again, including the spool and journal files left behind by a worker that
+died, so a killed process loses no events. Journals have unique names and
+their writer holds an flock on them while they are open, so an unlocked
+journal is an orphan even if a new worker has taken over the dead one's
+pid. An event whose batch was
+inserted just before the process died may be written twice (at least
+once, never lost). On shutdown the queue is drained to the database or,
+failing that, to the spool.
+
+purge_expired() enforces AUDIT_LOG_RETENTION_DAYS by dropping whole
+partitions where the table is range-partitioned by day (MySQL) and
+otherwise by deleting bounded id ranges, one short transaction each.
+"""
+
+import atexit
+import fcntl
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app, g, has_request_context, request
+from flask.cli import AppGroup
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from src.extensions import db
+from src.services import jobs, preload
+
+logger = logging.getLogger(__name__)
+
+RETENTION_JOB_KIND = 'audit-retention'
+
+# Seconds between looks at the spool directory while the queue is idle
+REPLAY_INTERVAL = 30
+
+# Events per journal file before a new one is started, so that under
+# constant load finished files can be deleted while the queue never empties
+JOURNAL_EVENTS = 10000
+
+
+def _utcnow():
+    # AuditLog.timestamp is naive UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _audit_table():
+    from src.models import AuditLog
+    return AuditLog.__table__
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class _Journal:
+    """One append-only journal file, locked while open, and how many of its events are still queued"""
+
+    def __init__(self, directory):
+        self.pid = os.getpid()
+        self.path = os.path.join(directory, f'{self.pid}.{uuid.uuid4().hex}.journal')
+        # Locked under a temporary name first, so no replayer ever finds it unlocked
+        new_path = self.path + '.new'
+        self.file = open(new_path, 'x', encoding='utf-8')
+        fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.rename(new_path, self.path)
+        self.written = 0
+        self.pending = 0
+
+    def append(self, line):
+        self.file.write(line)
+        # Into the OS page cache, so it survives the process being killed
+        self.file.flush()
+        self.written += 1
+        self.pending += 1
+
+    def remove(self):
+        # Unlinked before the lock goes, so a replayer cannot claim events already written
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        self.file.close()
+
+
+class AuditWriter:
+    """Queue plus background thread writing audit events in bulk"""
+
+    def __init__(self, app, batch_size=500, flush_interval=2.0, queue_size=10000, spool_dir='instance/audit-spool'):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spool_dir = spool_dir
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stats = {'queued': 0, 'written': 0, 'batches': 0, 'spooled': 0, 'replayed': 0, 'failed_batches': 0}
+        self._spool_lock = threading.Lock()
+        self._journal_lock = threading.Lock()
+        self._journal = None
+        self._stopping = threading.Event()
+        self._thread = None
+        self._columns = None
+        self._next_replay = 0
+
+    # -- producers -----------------------------------------------------
+
+    def record(self, event):
+        """Journal and queue one event (a dict of AuditLog columns); never blocks the caller"""
+        line = json.dumps(event, default=str) + '\n'
+        with self._journal_lock:
+            # Producers only add under this lock, so the queue cannot fill up before the put
+            if self.queue.full():
+                self._spool([event])
+                return
+            try:
+                journal = self._current_journal()
+                journal.append(line)
+            except OSError as e:
+                logger.warning('Audit event not journaled: %s', e)
+                journal = None
+            self.queue.put_nowait((journal, event))
+        self.stats['queued'] += 1
+
+    def _current_journal(self):
+        journal = self._journal
+        if journal is not None and journal.pid == os.getpid() and journal.written < JOURNAL_EVENTS:
+            return journal
+        # A full file is deleted by _settle() once its last event is written;
+        # one inherited through fork belongs to the parent, which keeps it locked
+        if journal is not None and journal.pid != os.getpid():
+            journal.file.close()
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._journal = _Journal(self.spool_dir)
+        return self._journal
+
+    def _settle(self, batch):
+        """Delete journal files whose events are all in AuditLog or the spool now"""
+        with self._journal_lock:
+            finished = set()
+            for journal, _ in batch:
+                if journal is not None:
+                    journal.pending -= 1
+                    finished.add(journal)
+            for journal in finished:
+                if journal.pending == 0 and journal.pid == os.getpid():
+                    journal.remove()
+                    if journal is self._journal:
+                        self._journal = None
+
+    # -- writer thread -------------------------------------------------
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='medisync-audit-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout=10):
+        """Stop the writer and flush (or spool) whatever is still queued"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+        batch = self._drain(self.batch_size)
+        while batch:
+            self._flush(batch)
+            batch = self._drain(self.batch_size)
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _take(self):
+        """Block for the first event, then gather until the batch is full or the interval has passed"""
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._take()
+            if batch:
+                self._flush(batch)
+            elif time.monotonic() >= self._next_replay:
+                self._next_replay = time.monotonic() + REPLAY_INTERVAL
+                self.replay_spool()
+
+    def flush(self):
+        """Write everything queued so far from the calling thread (tests, CLI)"""
+        batch = self._drain(self.batch_size)
+        while batch:
+            self._flush(batch)
+            batch = self._drain(self.batch_size)
+
+    def _rows(self, events):
+        """Events as insert rows restricted to AuditLog's columns"""
+        if self._columns is None:
+            self._columns = set(_audit_table().c.keys())
+        rows = []
+        for event in events:
+            row = {key: value for key, value in event.items() if key in self._columns}
+            if isinstance(row.get('timestamp'), str):
+                row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+            rows.append(row)
+        return rows
+
+    def _insert(self, events):
+        with self.app.app_context():
+            with db.engine.begin() as connection:
+                connection.execute(_audit_table().insert(), self._rows(events))
+
+    def _flush(self, batch):
+        """Insert a batch of queued (journal, event) pairs, or spool them if the database refuses"""
+        events = [event for _, event in batch]
+        try:
+            self._insert(events)
+        except SQLAlchemyError as e:
+            self.stats['failed_batches'] += 1
+            logger.warning('Audit batch of %d events spooled to disk: %s', len(events), e)
+            self._spool(events)
+        else:
+            self.stats['written'] += len(events)
+            self.stats['batches'] += 1
+        self._settle(batch)
+
+    # -- spool ---------------------------------------------------------
+
+    def _spool_path(self):
+        return os.path.join(self.spool_dir, f'{os.getpid()}.jsonl')
+
+    def _spool(self, events):
+        lines = ''.join(json.dumps(event, default=str) + '\n' for event in events)
+        with self._spool_lock:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            with open(self._spool_path(), 'a', encoding='utf-8') as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            self.stats['spooled'] += len(events)
+
+    def _claimable(self):
+        """Spool files of this process or of processes that are gone, and every journal (claimed if unlocked)"""
+        try:
+            names = sorted(os.listdir(self.spool_dir))
+        except FileNotFoundError:
+            return []
+        own = os.getpid()
+        claimable = []
+        for name in names:
+            # <pid>.jsonl being spooled to, <pid>.<uuid>.replay.jsonl claimed by a
+            # replayer, or <pid>.<uuid>.journal of events queued in a writer
+            pid = name.split('.', 1)[0]
+            if not pid.isdigit():
+                continue
+            if name.endswith('.journal'):
+                claimable.append(name)
+            elif name.endswith('.jsonl') and (int(pid) == own or not _pid_alive(int(pid))):
+                claimable.append(name)
+        return claimable
+
+    def replay_spool(self):
+        """Insert spooled events into AuditLog; returns how many were written"""
+        replayed = 0
+        for name in self._claimable():
+            path = os.path.join(self.spool_dir, name)
+            claimed = os.path.join(self.spool_dir, f'{os.getpid()}.{uuid.uuid4().hex}.replay.jsonl')
+            with self._spool_lock:
+                try:
+                    if name.endswith('.journal'):
+                        if not _claim_journal(path, claimed):
+                            continue
+                    else:
+                        # Atomic, so a replayer in another worker cannot claim the same file
+                        os.rename(path, claimed)
+                except FileNotFoundError:
+                    continue
+            events = _read_events(claimed)
+            try:
+                # One transaction per file, so a failed replay leaves no duplicates behind
+                if events:
+                    self._insert(events)
+            except SQLAlchemyError as e:
+                logger.warning('Audit spool %s not replayed yet: %s', claimed, e)
+                break
+            os.remove(claimed)
+            replayed += len(events)
+        self.stats['replayed'] += replayed
+        return replayed
+
+
+def _claim_journal(path, claimed):
+    """Rename a journal to claimed unless its writer (in this or any live process) still holds its lock"""
+    with open(path, encoding='utf-8') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        os.rename(path, claimed)
+    return True
+
+
+def _read_events(path):
+    """Events of a spool or journal file; a line cut short by a crash is skipped"""
+    events = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                if line.strip():
+                    logger.warning('Skipping a partial audit event in %s', path)
+    return events
+
+
+def log(action, resource_type=None, resource_id=None, details=None, user_id=None):
+    """Queue an audit event for the current request; a no-op when ENABLE_AUDIT_LOGGING is off"""
+    writer = current_app.extensions.get('audit')
+    if writer is None:
+        return
+    event = {
+        'timestamp': _utcnow(),
+        'user_id': user_id,
+        'action': action,
+        'resource_type': resource_type,
+        'resource_id': resource_id,
+        'details': details if details is None or isinstance(details, str) else json.dumps(details, default=str),
+    }
+    if has_request_context():
+        # X-Forwarded-For only counts through ProxyFix (TRUSTED_PROXIES); clients can set the header themselves
+        event['ip_address'] = request.remote_addr
+        if user_id is None:
+            event['user_id'] = getattr(g, 'user_id', None)
+    writer.record(event)
+
+
+# -- retention ---------------------------------------------------------
+
+def _drop_expired_partitions(connection, table, cutoff):
+    """Drop MySQL RANGE(TO_DAYS(timestamp)) partitions wholly before cutoff; returns their names"""
+    if connection.dialect.name != 'mysql':
+        return []
+    names = connection.execute(text(
+        "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_METHOD = 'RANGE' "
+        "AND LOWER(PARTITION_EXPRESSION) LIKE 'to_days(%%' AND PARTITION_DESCRIPTION <> 'MAXVALUE' "
+        "AND CAST(PARTITION_DESCRIPTION AS UNSIGNED) <= TO_DAYS(:cutoff)"
+    ), {'table': table.name, 'cutoff': cutoff}).scalars().all()
+    if names:
+        connection.execute(text(f'ALTER TABLE {table.name} DROP PARTITION {", ".join(names)}'))
+    return names
+
+
+def purge_expired(days=None, chunk_size=10000):
+    """Delete audit events older than the retention period; returns (rows deleted, partitions dropped)"""
+    table = _audit_table()
+    days = current_app.config['AUDIT_LOG_RETENTION_DAYS'] if days is None else days
+    cutoff = _utcnow() - timedelta(days=days)
+    with db.engine.begin() as connection:
+        dropped = _drop_expired_partitions(connection, table, cutoff)
+        low, high = connection.execute(
+            db.select(db.func.min(table.c.id), db.func.max(table.c.id)).where(table.c.timestamp < cutoff)
+        ).one()
+    deleted = 0
+    if low is None:
+        return deleted, dropped
+    # Ids grow with time, so expired rows form a leading id range; each slice
+    # is deleted by primary key in its own transaction to keep locks short
+    for start in range(low, high + 1, chunk_size):
+        with db.engine.begin() as connection:
+            deleted += connection.execute(table.delete().where(
+                table.c.id >= start, table.c.id < start + chunk_size, table.c.timestamp < cutoff,
+            )).rowcount
+    return deleted, dropped
+
+
+@jobs.job_kind(RETENTION_JOB_KIND)
+def retention_job(job, days=None):
+    """Enforce AUDIT_LOG_RETENTION_DAYS as a background job"""
+    deleted, dropped = purge_expired(days)
+    job.progress(rows_processed=deleted)
+    summary = f'Deleted {deleted} audit events'
+    if dropped:
+        summary += f' and dropped partitions {", ".join(dropped)}'
+    return {
+        'resourceType': 'OperationOutcome',
+        'issue': [{'severity': 'information', 'code': 'informational', 'details': {'text': summary}}],
+    }
+
+
+audit_cli = AppGroup('audit', help='Audit log maintenance.')
+
+
+@audit_cli.command('purge')
+def purge_command():
+    """Delete audit events older than AUDIT_LOG_RETENTION_DAYS."""
+    started = time.perf_counter()
+    deleted, dropped = purge_expired()
+    print(f'Deleted {deleted} audit events, dropped {len(dropped)} partitions in {time.perf_counter() - started:.2f}s')
+
+
+@audit_cli.command('replay')
+def replay_command():
+    """Write spooled audit events (from outages or crashed workers) to the database."""
+    writer = current_app.extensions.get('audit')
+    if writer is None:
+        print('Audit logging is disabled (ENABLE_AUDIT_LOGGING)')
+        return
+    print(f'Replayed {writer.replay_spool()} spooled audit events')
+
+
+def init_app(app):
+    """Start the audit writer when ENABLE_AUDIT_LOGGING is on"""
+    app.cli.add_command(audit_cli)
+    if not app.config.get('ENABLE_AUDIT_LOGGING'):
+        return
+    writer = AuditWriter(
+        app,
+        batch_size=app.config['AUDIT_BATCH_SIZE'],
+        flush_interval=app.config['AUDIT_FLUSH_INTERVAL'],
+        queue_size=app.config['AUDIT_QUEUE_SIZE'],
+        spool_dir=app.config['AUDIT_SPOOL_DIR'],
+    )
+    app.extensions['audit'] = writer
+    preload.start_in_worker(app, writer.start)
@@ -0,0 +1,241 @@
+"""
+Set-based processing for uploaded FHIR Bundles.
+
+Every NAMASTE/ICD-11 coding in the Bundle is validated with one bulk
+lookup per code system (or against the terminology snapshot when it is
+current), current resource versions are read with one
+query, and the new FHIRResource versions (stored as snapshots or patches,
+see versioning) are written with a single
+bulk insert inside one transaction. collection and batch Bundles succeed or
+fail per entry; transaction Bundles are all-or-nothing.
+
+When a consent purpose is given, the consents of every patient the Bundle
+references are loaded with one query and entries without a covering
+consent are refused with 403.
+"""
+
+import uuid
+from datetime import datetime, timezone
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from src.extensions import db
+from src.services import terminology_snapshot, versioning
+from src.services.terminology import NAMASTE_SYSTEM, ICD11_SYSTEM
+
+SUPPORTED_TYPES = ('collection', 'batch', 'transaction')
+
+# Values per IN (...) query
+BULK_QUERY_CHUNK = 500
+
+
+class BundleError(Exception):
+    """Raised when the Bundle itself, rather than one entry, is unusable"""
+
+
+def _outcome(severity, code, text):
+    return {
+        'resourceType': 'OperationOutcome',
+        'issue': [{'severity': severity, 'code': code, 'details': {'text': text}}],
+    }
+
+
+class _Entry:
+    """One Bundle entry on its way through validation and storage"""
+
+    def __init__(self, index, entry):
+        self.index = index
+        self.full_url = entry.get('fullUrl')
+        self.resource = entry.get('resource')
+        self.request = entry.get('request') or {}
+        self.resource_type = None
+        self.resource_id = None
+        self.version = None
+        self.status = None
+        self.outcome = None
+
+    def fail(self, status, code, text):
+        self.status = status
+        self.outcome = _outcome('error', code, f'Entry {self.index}: {text}')
+
+    def response(self):
+        if self.outcome is not None:
+            return {'response': {'status': self.status, 'outcome': self.outcome}}
+        return {
+            'fullUrl': f'{self.resource_type}/{self.resource_id}',
+            'response': {
+                'status': self.status,
+                'location': f'{self.resource_type}/{self.resource_id}/_history/{self.version}',
+                'etag': f'W/"{self.version}"',
+            },
+        }
+
+
+def _iter_codings(node):
+    """Every NAMASTE/ICD-11 coding anywhere in a resource"""
+    if isinstance(node, dict):
+        if node.get('system') in (NAMASTE_SYSTEM, ICD11_SYSTEM) and 'code' in node:
+            yield node['system'], node['code']
+        for value in node.values():
+            if isinstance(value, (dict, list)):
+                yield from _iter_codings(value)
+    elif isinstance(node, list):
+        for item in node:
+            yield from _iter_codings(item)
+
+
+def _rewrite_references(node, references):
+    """Point urn:uuid references at the ids assigned in this Bundle"""
+    if isinstance(node, dict):
+        reference = node.get('reference')
+        if isinstance(reference, str) and reference in references:
+            node['reference'] = references[reference]
+        for value in node.values():
+            if isinstance(value, (dict, list)):
+                _rewrite_references(value, references)
+    elif isinstance(node, list):
+        for item in node:
+            _rewrite_references(item, references)
+
+
+def _chunks(values):
+    values = list(values)
+    for start in range(0, len(values), BULK_QUERY_CHUNK):
+        yield values[start:start + BULK_QUERY_CHUNK]
+
+
+def _known_codes(codings):
+    """The subset of (system, code) pairs present in NAMASTECode/ICD11Code"""
+    from src.models import NAMASTECode, ICD11Code
+
+    snapshot = terminology_snapshot.current()
+    if snapshot is not None:
+        return {(system, code) for system, code in codings if snapshot.contains(system, code)}
+    known = set()
+    for system, model in ((NAMASTE_SYSTEM, NAMASTECode), (ICD11_SYSTEM, ICD11Code)):
+        codes = {code for coding_system, code in codings if coding_system == system}
+        for chunk in _chunks(codes):
+            rows = db.session.execute(db.select(model.code).where(model.code.in_(chunk))).scalars()
+            known.update((system, code) for code in rows)
+    return known
+
+
+def _prepare(entry, bundle_type):
+    """Resolve type, id and method for one entry; False if it is rejected"""
+    resource = entry.resource
+    if not isinstance(resource, dict) or not resource.get('resourceType'):
+        entry.fail('400 Bad Request', 'required', 'entry has no resource')
+        return False
+    entry.resource_type = resource['resourceType']
+    if bundle_type == 'collection':
+        method = 'PUT' if resource.get('id') else 'POST'
+    else:
+        method = (entry.request.get('method') or '').upper()
+    if method == 'PUT':
+        url = (entry.request.get('url') or '').split('?')[0].strip('/')
+        parts = url.split('/') if url else [entry.resource_type, resource.get('id')]
+        if len(parts) != 2 or parts[0] != entry.resource_type or not parts[1]:
+            entry.fail('400 Bad Request', 'invalid', 'PUT requires a request.url of the form Type/id')
+            return False
+        entry.resource_id = parts[1]
+    elif method == 'POST':
+        entry.resource_id = str(uuid.uuid4())
+    else:
+        entry.fail('405 Method Not Allowed', 'not-supported', f'request.method {method or "(none)"} is not supported')
+        return False
+    return True
+
+
+def _check_consent(entries, purpose):
+    """Refuse entries whose patient has not consented to this purpose and resource type"""
+    from src.services import consent
+
+    decisions = consent.get_engine().evaluate([entry.resource for entry in entries], purpose)
+    allowed = []
+    for entry, decision in zip(entries, decisions):
+        if decision is False:
+            entry.fail('403 Forbidden', 'forbidden',
+                       f'no active consent of {consent.patient_of(entry.resource)} covers '
+                       f'{entry.resource_type} for purpose {purpose}')
+        else:
+            allowed.append(entry)
+    return allowed
+
+
+def process_bundle(bundle, consent_purpose=None):
+    """
+    Validate and store a collection, batch or transaction Bundle.
+
+    Returns (response, http_status); the response is a batch-response or
+    transaction-response Bundle, or an OperationOutcome when a transaction
+    is rejected. With consent_purpose set, entries are also checked against
+    the patients' consents.
+    """
+    from src.models import FHIRResource
+
+    if not isinstance(bundle, dict) or bundle.get('resourceType') != 'Bundle':
+        raise BundleError('Request body must be a FHIR Bundle')
+    bundle_type = bundle.get('type')
+    if bundle_type not in SUPPORTED_TYPES:
+        raise BundleError(f'Bundle type must be one of: {", ".join(SUPPORTED_TYPES)}')
+
+    entries = [_Entry(index, entry) for index, entry in enumerate(bundle.get('entry') or [])]
+    pending = [entry for entry in entries if _prepare(entry, bundle_type)]
+    if consent_purpose is not None:
+        pending = _check_consent(pending, consent_purpose)
+
+    # One lookup per code system for every coding in the Bundle
+    codings = {entry.index: set(_iter_codings(entry.resource)) for entry in pending}
+    known = _known_codes(set().union(*codings.values()))
+    valid = []
+    for entry in pending:
+        unknown = sorted(codings[entry.index] - known)
+        if unknown:
+            entry.fail('422 Unprocessable Entity', 'code-invalid',
+                       'unknown codes ' + ', '.join(f'{system}|{code}' for system, code in unknown))
+        else:
+            valid.append(entry)
+
+    if bundle_type == 'transaction' and len(valid) != len(entries):
+        issues = [issue for entry in entries if entry.outcome for issue in entry.outcome['issue']]
+        return {'resourceType': 'OperationOutcome', 'issue': issues}, 400
+
+    references = {entry.full_url: f'{entry.resource_type}/{entry.resource_id}'
+                  for entry in valid if entry.full_url}
+    heads = versioning.heads({(entry.resource_type, entry.resource_id) for entry in valid})
+    now = datetime.now(timezone.utc)
+    rows = []
+    for entry in valid:
+        key = (entry.resource_type, entry.resource_id)
+        head = heads.get(key)
+        entry.version = (head.version if head else 0) + 1
+        resource = dict(entry.resource, id=entry.resource_id)
+        resource['meta'] = dict(resource.get('meta') or {}, versionId=str(entry.version),
+                                lastUpdated=now.isoformat())
+        _rewrite_references(resource, references)
+        resource_data, heads[key] = versioning.encode_version(head, entry.version, resource)
+        rows.append({
+            'resource_type': entry.resource_type,
+            'resource_id': entry.resource_id,
+            'version': entry.version,
+            'resource_data': resource_data,
+        })
+        entry.status = '201 Created' if entry.version == 1 else '200 OK'
+
+    if rows:
+        try:
+            db.session.execute(db.insert(FHIRResource), rows)
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            if bundle_type == 'transaction':
+                return _outcome('error', 'exception', f'Transaction failed: {e}'), 500
+            for entry in valid:
+                entry.fail('500 Internal Server Error', 'exception', f'storage failed: {e}')
+
+    response_type = 'transaction-response' if bundle_type == 'transaction' else 'batch-response'
+    return {
+        'resourceType': 'Bundle',
+        'type': response_type,
+        'entry': [entry.response() for entry in entries],
+    }, 200
@@ -0,0 +1,288 @@
+"""
+Consent evaluation for FHIR resource access.
+
+ConsentEngine.load() fetches the active ConsentRecords of every patient a
+request touches with one query (chunked IN list), and decide() answers from
+memory afterwards. Decisions are memoized per (patient, purpose, resource
+type) until the next valid_from/valid_until boundary or CONSENT_CACHE_TTL,
+whichever comes first. Any committed change to a ConsentRecord evicts that
+patient, in this worker through the session hooks and in the others
+through Redis pub/sub when REDIS_URL is set. As in the translation cache,
+each eviction advances a generation, and load() keeps what it read only if
+the generation it started from is still current, so a consent revoked
+while it was being read is not cached as active.
+
+The time spent on consent checks is added to each response as a
+Server-Timing entry ("consent;dur=<ms>;desc=...").
+"""
+
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import current_app, g, has_app_context, has_request_context
+from sqlalchemy import event
+
+from src.extensions import db
+from src.services import preload
+from src.services.translation_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Values per IN (...) query
+BULK_QUERY_CHUNK = 500
+
+# Resource fields that name the patient a resource belongs to
+PATIENT_FIELDS = ('subject', 'patient', 'beneficiary')
+
+
+def _utcnow():
+    # ConsentRecord validity columns are naive UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def patient_of(resource):
+    """Patient id a FHIR resource belongs to, or None"""
+    if not isinstance(resource, dict):
+        return None
+    if resource.get('resourceType') == 'Patient':
+        return resource.get('id')
+    for field in PATIENT_FIELDS:
+        value = resource.get(field)
+        reference = value.get('reference') if isinstance(value, dict) else None
+        if isinstance(reference, str) and reference.startswith('Patient/'):
+            return reference[len('Patient/'):]
+    return None
+
+
+class _Consent:
+    """The parts of one ConsentRecord a decision needs"""
+
+    __slots__ = ('purpose', 'resource_types', 'valid_from', 'valid_until')
+
+    def __init__(self, record):
+        self.purpose = (record.purpose or '').strip() or None
+        types = {value.strip() for value in (record.resource_types or '').split(',') if value.strip()}
+        # No listed types (or '*') means every resource type
+        self.resource_types = None if not types or '*' in types else types
+        self.valid_from = record.valid_from
+        self.valid_until = record.valid_until
+
+    def covers(self, purpose, resource_type, now):
+        return ((self.purpose is None or self.purpose in ('*', purpose))
+                and (self.resource_types is None or resource_type in self.resource_types)
+                and (self.valid_from is None or self.valid_from <= now)
+                and (self.valid_until is None or now < self.valid_until))
+
+
+class ConsentEngine:
+    """Active consents per patient, loaded in bulk, with memoized decisions"""
+
+    CHANNEL = 'medisync:consent:invalidate'
+
+    def __init__(self, max_patients=10000, ttl=300, redis_client=None):
+        self.ttl = ttl
+        # patient_id -> ([_Consent], {(purpose, resource_type): (allowed, expires)})
+        self.patients = LRUCache(max_patients, ttl)
+        self.redis = redis_client
+        self.queries = 0
+        self.invalidations = 0
+        self.stale_loads = 0
+        self.generation = 0
+        self._generation_lock = threading.Lock()
+        self._subscriber = None
+
+    def load(self, patient_ids):
+        """Entries of these patients as {patient_id: entry}, with one query for all not in memory"""
+        entries = {}
+        missing = []
+        for patient_id in set(patient_ids):
+            if patient_id:
+                entry = self.patients.get(patient_id)
+                if entry is None:
+                    missing.append(patient_id)
+                else:
+                    entries[patient_id] = entry
+        if not missing:
+            return entries
+        from src.models import ConsentRecord
+
+        started = time.perf_counter()
+
+        generation = self.generation
+        found = {patient_id: [] for patient_id in missing}
+        for start in range(0, len(missing), BULK_QUERY_CHUNK):
+            self.queries += 1
+            rows = db.session.execute(
+                db.select(ConsentRecord).where(
+                    ConsentRecord.patient_id.in_(missing[start:start + BULK_QUERY_CHUNK]),
+                    ConsentRecord.status == 'active',
+                )
+            ).scalars()
+            for record in rows:
+                found[record.patient_id].append(_Consent(record))
+        loaded = {patient_id: (consents, {}) for patient_id, consents in found.items()}
+        with self._generation_lock:
+            # Cached only if nothing was invalidated since the rows were read
+            if generation == self.generation:
+                for patient_id, entry in loaded.items():
+                    self.patients.set(patient_id, entry)
+            else:
+                self.stale_loads += 1
+        entries.update(loaded)
+        _record_timing(started)
+        return entries
+
+    def decide(self, patient_id, purpose, resource_type):
+        """True if an active consent of the patient covers this purpose and resource type"""
+        started = time.perf_counter()
+        entry = self.patients.get(patient_id)
+        if entry is None:
+            entry = self.load([patient_id])[patient_id]
+        return self._decide(entry, purpose, resource_type, started)
+
+    def _decide(self, entry, purpose, resource_type, started):
+        consents, decisions = entry
+        now = _utcnow()
+        key = (purpose, resource_type)
+        cached = decisions.get(key)
+        if cached is not None and now < cached[1]:
+            allowed = cached[0]
+            _record_timing(started, checks=1, hits=1)
+            return allowed
+        allowed = any(consent.covers(purpose, resource_type, now) for consent in consents)
+        # The decision can only change at the next validity boundary
+        boundaries = [moment for consent in consents for moment in (consent.valid_from, consent.valid_until)
+                      if moment is not None and moment > now]
+        decisions[key] = (allowed, min(boundaries) if boundaries else datetime.max)
+        _record_timing(started, checks=1)
+        return allowed
+
+    def evaluate(self, resources, purpose):
+        """
+        Consent decisions for many resources at once.
+
+        Returns a list parallel to resources: True (allowed), False (denied)
+        or None (not tied to a patient).
+        """
+        patients = [patient_of(resource) for resource in resources]
+        entries = self.load(patients)
+        return [None if patient_id is None
+                else self._decide(entries[patient_id], purpose, resource.get('resourceType'), time.perf_counter())
+                for patient_id, resource in zip(patients, resources)]
+
+    def invalidate(self, patient_ids, broadcast=True):
+        """Forget these patients' consents (here and, via Redis, in other workers)"""
+        patient_ids = [patient_id for patient_id in patient_ids if patient_id]
+        if patient_ids:
+            # Advanced before evicting, as in TranslationCache.invalidate()
+            with self._generation_lock:
+                self.generation += 1
+        for patient_id in patient_ids:
+            if self.patients.delete(patient_id):
+                self.invalidations += 1
+        if broadcast and self.redis is not None and patient_ids:
+            try:
+                self.redis.publish(self.CHANNEL, json.dumps(patient_ids))
+            except Exception as e:
+                logger.warning('Consent invalidation not broadcast: %s', e)
+
+    def listen_for_invalidations(self):
+        """Drop patients whose consents other workers changed"""
+        if self.redis is None or self._subscriber is not None:
+            return
+
+        def listen():
+            while True:
+                try:
+                    pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                    pubsub.subscribe(self.CHANNEL)
+                    for message in pubsub.listen():
+                        self.invalidate(json.loads(message['data']), broadcast=False)
+                except Exception as e:
+                    logger.warning('Consent invalidation listener restarting: %s', e)
+                    # Anything missed while disconnected may be stale
+                    with self._generation_lock:
+                        self.generation += 1
+                    self.patients.clear()
+                    time.sleep(5)
+
+        self._subscriber = threading.Thread(target=listen, name='consent-invalidation', daemon=True)
+        self._subscriber.start()
+
+
+def _record_timing(started, checks=0, hits=0):
+    if not has_request_context():
+        return
+    timing = g.setdefault('consent_timing', {'checks': 0, 'hits': 0, 'seconds': 0.0})
+    timing['checks'] += checks
+    timing['hits'] += hits
+    timing['seconds'] += time.perf_counter() - started
+
+
+def get_engine():
+    return current_app.extensions['consent']
+
+
+def _collect_changes(session, flush_context):
+    from src.models import ConsentRecord
+
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, ConsentRecord):
+            patients = session.info.setdefault('consent_patients', set())
+            patients.add(obj.patient_id)
+            history = db.inspect(obj).attrs.patient_id.history
+            patients.update(history.deleted or ())
+
+
+def _publish_changes(session):
+    patients = session.info.pop('consent_patients', None)
+    if patients and has_app_context():
+        engine = current_app.extensions.get('consent')
+        if engine is not None:
+            engine.invalidate(patients)
+
+
+def _discard_changes(session, previous_transaction):
+    session.info.pop('consent_patients', None)
+
+
+def _reset_timing():
+    # g outlives the request when the app context was pushed beforehand (CLI, tests)
+    g.pop('consent_timing', None)
+
+
+def _server_timing(response):
+    timing = g.get('consent_timing')
+    if timing:
+        entry = (f'consent;dur={timing["seconds"] * 1000:.3f};'
+                 f'desc="{timing["checks"]} checks, {timing["hits"]} cached"')
+        existing = response.headers.get('Server-Timing')
+        response.headers['Server-Timing'] = f'{existing}, {entry}' if existing else entry
+    return response
+
+
+def init_app(app):
+    """Attach a ConsentEngine and evict patients whenever their ConsentRecords change"""
+    redis_client = None
+    if app.config.get('REDIS_URL'):
+        import redis
+        redis_client = redis.Redis.from_url(app.config['REDIS_URL'])
+
+    engine = ConsentEngine(
+        max_patients=app.config.get('CONSENT_CACHE_SIZE', 10000),
+        ttl=app.config.get('CONSENT_CACHE_TTL', 300),
+        redis_client=redis_client,
+    )
+    app.extensions['consent'] = engine
+    app.before_request(_reset_timing)
+    app.after_request(_server_timing)
+    preload.start_in_worker(app, engine.listen_for_invalidations)
+
+    # Session listeners are process-wide, so only attach them once
+    if not event.contains(db.session, 'after_flush', _collect_changes):
+        event.listen(db.session, 'after_flush', _collect_changes)
+        event.listen(db.session, 'after_commit', _publish_changes)
+        event.listen(db.session, 'after_soft_rollback', _discard_changes)
@@ -0,0 +1,181 @@
+"""
+Paged and streamed ValueSet expansions.
+
+An expansion is either a whole code system or the descendants of one code
+(from the closure table). Pages follow the FHIR $expand count/offset
+parameters, but the link to the next page carries a keyset cursor (the
+sort key of the last code returned), so deep pages are an index seek
+rather than an OFFSET scan. Streaming mode writes the expansion JSON as
+rows come off a server-side cursor, so exporting a large code system keeps
+memory flat and sends the first bytes straight away.
+"""
+
+import base64
+import functools
+import json
+from datetime import datetime, timezone
+
+from sqlalchemy import and_, func, or_
+
+from src.extensions import db
+from src.services import fhir_json, hierarchy
+
+
+class CursorError(ValueError):
+    """A paging cursor that cannot be decoded or belongs to another expansion"""
+
+
+class Expansion:
+    """What to expand: all codes of system, or the codes under code"""
+
+    def __init__(self, system, code=None, include_self=True):
+        self.system = system
+        self.code = code
+        self.include_self = include_self
+
+    @property
+    def url(self):
+        """Implicit ValueSet URL identifying this expansion"""
+        if self.code is None:
+            return f'{self.system}?fhir_vs'
+        return f'{self.system}?fhir_vs=isa/{self.code}'
+
+    def _query(self):
+        """(select of (code, display, *sort key), sort key columns)"""
+        if self.code is None:
+            model, display = hierarchy.code_model(self.system)
+            return db.select(model.code, display).order_by(model.code), (model.code,)
+        query = hierarchy.descendants_query(self.system, self.code, self.include_self)
+        code, _, depth = query.selected_columns
+        return query, (depth, code)
+
+    def select(self, after=None):
+        """Ordered select of (code, display, ...), starting after the sort key `after`"""
+        query, keys = self._query()
+        if after is not None:
+            query = query.where(_after(keys, after))
+        return query
+
+    def count(self):
+        query, _ = self._query()
+        return db.session.execute(db.select(func.count()).select_from(query.order_by(None).subquery())).scalar()
+
+    def exists(self):
+        """False if the expansion's root code is unknown"""
+        if self.code is None:
+            return True
+        return hierarchy.subsumes(self.system, self.code, self.code) is not None
+
+
+def _after(keys, values):
+    """Keyset predicate (k1, k2, ...) > (v1, v2, ...) spelled out for every dialect"""
+    first, rest = keys[0], keys[1:]
+    if not rest:
+        return first > values[0]
+    return or_(first > values[0], and_(first == values[0], _after(rest, values[1:])))
+
+
+def encode_cursor(expansion, key, offset):
+    """Opaque cursor for the page starting after sort key `key`, at position offset"""
+    state = {'u': expansion.url, 'k': list(key), 'o': offset}
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(expansion, cursor):
+    """(sort key, offset) from a cursor issued for this expansion"""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        key, offset = state['k'], int(state['o'])
+    except (ValueError, TypeError, KeyError):
+        raise CursorError('Malformed paging cursor')
+    if state.get('u') != expansion.url:
+        raise CursorError('Paging cursor was issued for a different expansion')
+    return key, offset
+
+
+def _sort_key(expansion, row):
+    # Whole-system pages sort by code; hierarchy pages by (depth, code)
+    return [row[0]] if expansion.code is None else [row[2], row[0]]
+
+
+def _contains(expansion, row):
+    return {'system': expansion.system, 'code': row[0], 'display': row[1]}
+
+
+@functools.lru_cache(maxsize=64)
+def _contains_template(system, sort_keys=True, separators=fhir_json.COMPACT, ensure_ascii=True):
+    """Template rendering (code, display) rows exactly as _contains() would be serialized"""
+    return fhir_json.Template(('code', 'display'), {'system': system}, sort_keys=sort_keys,
+                              separators=separators, ensure_ascii=ensure_ascii)
+
+
+def _envelope(expansion, **expansion_fields):
+    return {
+        'resourceType': 'ValueSet',
+        'status': 'active',
+        'url': expansion.url,
+        'expansion': dict({'timestamp': datetime.now(timezone.utc).isoformat()}, **expansion_fields),
+    }
+
+
+def page(expansion, count, offset=0, cursor=None, next_url=None, fast=False):
+    """
+    One page of an expansion as a FHIR ValueSet.
+
+    With a cursor, offset is taken from it and the page starts after the
+    cursor's key. next_url, if given, is called with the next cursor to
+    build expansion.next. With fast set, contains is a pre-rendered
+    fhir_json.Fragment for fhir_json.response().
+    """
+    if cursor:
+        after, offset = decode_cursor(expansion, cursor)
+        query = expansion.select(after)
+    else:
+        query = expansion.select().offset(offset)
+    rows = db.session.execute(query.limit(count + 1)).all()
+    more = len(rows) > count
+    rows = rows[:count]
+
+    fields = {
+        'total': expansion.count(),
+        'offset': offset,
+        'parameter': [{'name': 'count', 'valueInteger': count}, {'name': 'offset', 'valueInteger': offset}],
+        'contains': _fast_contains(expansion, rows) if fast else [_contains(expansion, row) for row in rows],
+    }
+    if more and next_url is not None:
+        fields['next'] = next_url(encode_cursor(expansion, _sort_key(expansion, rows[-1]), offset + count))
+    return _envelope(expansion, **fields)
+
+
+def _fast_contains(expansion, rows):
+    sort_keys, ensure_ascii = fhir_json.settings()
+    template = _contains_template(expansion.system, sort_keys=sort_keys, ensure_ascii=ensure_ascii)
+    return fhir_json.Fragment(template.render_list([row[:2] for row in rows]))
+
+
+def stream(expansion, batch_size=2000, fast=False):
+    """
+    Yield the full expansion as JSON text, batch by batch, from a server-side cursor.
+
+    total is written after contains, once every row has been counted.
+    """
+    envelope = _envelope(expansion, contains=[])
+    head = json.dumps(envelope)
+    # Split the serialized envelope at the empty contains array
+    marker = '"contains": []'
+    before, after = head[:head.index(marker)], head[head.index(marker) + len(marker):]
+    yield before + '"contains": ['
+
+    # Same bytes as json.dumps(_contains(...)) with its default formatting
+    template = _contains_template(expansion.system, sort_keys=False, separators=(', ', ': ')) if fast else None
+    total = 0
+    with db.engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(expansion.select())
+        for rows in result.partitions():
+            if template is not None:
+                items = template.join([row[:2] for row in rows])
+            else:
+                items = ','.join(json.dumps(_contains(expansion, row)) for row in rows)
+            yield (',' if total else '') + items
+            total += len(rows)
+    yield f'], "total": {total}' + after
@@ -0,0 +1,144 @@
+"""
+Fast JSON for FHIR responses the server builds itself.
+
+Large responses (ValueSet expansions) are lists of objects with a fixed
+shape. A Template compiles that shape once into a format string, with
+keys, constant values and separators already encoded, and fills it per
+row using the C string escaper from the json module. No per-row dict is
+built and no keys are sorted. The rendered list is embedded in the
+surrounding resource as a Fragment by dumps(), which otherwise behaves
+like json.dumps.
+
+The output is byte-for-byte what Flask's jsonify() produces for the same
+resource with the app's JSON settings (sort_keys, ensure_ascii, compact).
+With pretty-printing on (debug), response() falls back to jsonify(). The
+fast path is opt-in through FHIR_FAST_SERIALIZER. Inbound resources are
+not affected.
+"""
+
+import json
+from itertools import chain
+from json.encoder import encode_basestring, encode_basestring_ascii
+
+from flask import current_app, jsonify
+from flask.json.provider import DefaultJSONProvider
+
+COMPACT = (',', ':')
+
+
+class Fragment:
+    """Already-rendered JSON, embedded verbatim by dumps()"""
+
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+
+def _value_encoder(ensure_ascii, separators, sort_keys):
+    encode_string = encode_basestring_ascii if ensure_ascii else encode_basestring
+
+    def encode(value):
+        if value.__class__ is str:
+            return encode_string(value)
+        return json.dumps(value, ensure_ascii=ensure_ascii, separators=separators, sort_keys=sort_keys)
+    return encode
+
+
+class Template:
+    """
+    JSON text for objects with the given fields, compiled once.
+
+    fields are filled in by render() in the order given; constants are
+    fixed {key: value} members. Keys are emitted sorted when sort_keys is
+    set, otherwise constants first and then fields (the order a dict
+    literal with that layout would have).
+    """
+
+    def __init__(self, fields, constants=None, sort_keys=True, separators=COMPACT, ensure_ascii=True):
+        constants = constants or {}
+        self.encode = _value_encoder(ensure_ascii, separators, sort_keys)
+        self.encode_string = encode_key = encode_basestring_ascii if ensure_ascii else encode_basestring
+        item_separator, key_separator = separators
+        keys = list(constants) + [field for field in fields if field not in constants]
+        if sort_keys:
+            keys.sort()
+        members = []
+        self._order = []
+        for key in keys:
+            if key in constants:
+                value = self.encode(constants[key]).replace('%', '%%')
+            else:
+                value = '%s'
+                self._order.append(fields.index(key))
+            members.append(encode_key(key).replace('%', '%%') + key_separator + value)
+        self._format = '{' + item_separator.join(members) + '}'
+        self._identity = self._order == sorted(self._order)
+
+    def render(self, *values):
+        encode = self.encode
+        if self._identity:
+            return self._format % tuple([encode(value) for value in values])
+        return self._format % tuple([encode(values[index]) for index in self._order])
+
+    def join(self, rows, separator=','):
+        """Rendered objects for many rows of field values (one per field, in order), joined by separator"""
+        if not rows:
+            return ''
+        if self._identity:
+            # One % over every value at once; rows of strings only (the usual case) skip the type check
+            fmt = separator.join([self._format] * len(rows))
+            try:
+                return fmt % tuple(map(self.encode_string, chain.from_iterable(rows)))
+            except TypeError:
+                return fmt % tuple(map(self.encode, chain.from_iterable(rows)))
+        encode = self.encode
+        order = self._order
+        return separator.join([self._format % tuple([encode(row[index]) for index in order]) for row in rows])
+
+    def render_list(self, rows):
+        """A JSON array with one rendered object per row of field values"""
+        return '[' + self.join(rows) + ']'
+
+
+def dumps(document, sort_keys=True, separators=COMPACT, ensure_ascii=True):
+    """json.dumps(document) with any Fragment values spliced in as-is"""
+    fragments = []
+
+    def default(value):
+        if isinstance(value, Fragment):
+            fragments.append(value.text)
+            return f'\x00fragment-{len(fragments) - 1}\x00'
+        raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+    text = json.dumps(document, default=default, sort_keys=sort_keys, separators=separators,
+                      ensure_ascii=ensure_ascii)
+    for index, fragment in enumerate(fragments):
+        placeholder = json.dumps(f'\x00fragment-{index}\x00', ensure_ascii=ensure_ascii)
+        text = text.replace(placeholder, fragment, 1)
+    return text
+
+
+def settings():
+    """(sort_keys, ensure_ascii) of the app's JSON provider, or None if its output cannot be matched"""
+    provider = current_app.json
+    if not isinstance(provider, DefaultJSONProvider):
+        return None
+    if provider.compact is False or (provider.compact is None and current_app.debug):
+        return None
+    return provider.sort_keys, provider.ensure_ascii
+
+
+def enabled():
+    """True when FHIR_FAST_SERIALIZER is on and the app's JSON output is compact"""
+    return current_app.config.get('FHIR_FAST_SERIALIZER', False) and settings() is not None
+
+
+def response(document):
+    """Like jsonify(document), but renders Fragment values (only built when enabled()) as they are"""
+    options = settings()
+    if options is None:
+        return jsonify(document)
+    sort_keys, ensure_ascii = options
+    text = dumps(document, sort_keys=sort_keys, ensure_ascii=ensure_ascii)
+    return current_app.response_class(f'{text}\n', mimetype=current_app.json.mimetype)
@@ -0,0 +1,289 @@
+"""
+Closure table for the NAMASTE and ICD-11 code hierarchies.
+
+CodeClosure holds one (ancestor, descendant, depth) row per ancestor of
+every code, including a depth-0 row for the code itself, so "all
+descendants of X" and subsumption tests are single indexed lookups. The
+table is kept in step with codes_changed: each batch is applied by
+recomputing ancestry only for the subtrees whose parent actually changed.
+
+A parent that is not loaded yet (a CSV child listed before its parent) is
+kept as a placeholder root, so its children are attached once it arrives.
+A parent link that would close a cycle is not applied; check() reports
+those links and orphan parents after an ingest.
+"""
+
+import logging
+import time
+
+from flask.cli import AppGroup
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import SQLAlchemyError
+
+from src.extensions import db
+from src.services import terminology
+
+logger = logging.getLogger(__name__)
+
+# Values per IN (...) query
+BULK_QUERY_CHUNK = 500
+
+
+class CodeClosure(db.Model):
+    """Transitive is-a relation: ancestor subsumes descendant at the given depth"""
+    __tablename__ = 'code_closure'
+
+    system = db.Column(db.String(200), primary_key=True)
+    ancestor = db.Column(db.String(50), primary_key=True)
+    descendant = db.Column(db.String(50), primary_key=True)
+    depth = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_code_closure_descendant', 'system', 'descendant', 'depth'),
+    )
+
+
+def code_model(system):
+    """(model, display column) holding the codes of a system, or (None, None)"""
+    from src.models import NAMASTECode, ICD11Code
+
+    if system == terminology.NAMASTE_SYSTEM:
+        return NAMASTECode, NAMASTECode.display
+    if system == terminology.ICD11_SYSTEM:
+        return ICD11Code, ICD11Code.title
+    return None, None
+
+
+def _chunks(values):
+    values = list(values)
+    for start in range(0, len(values), BULK_QUERY_CHUNK):
+        yield values[start:start + BULK_QUERY_CHUNK]
+
+
+def _rows(connection, system, where, columns):
+    """Closure rows of a system for a column IN (values) filter, chunked"""
+    column, values = where
+    table = CodeClosure.__table__
+    for chunk in _chunks(values):
+        yield from connection.execute(
+            db.select(*(table.c[name] for name in columns))
+            .where(table.c.system == system, table.c[column].in_(chunk))
+        )
+
+
+def apply_changes(connection, system, parents, deleted=()):
+    """
+    Apply parent changes {code: parent_code or None} and deletions to the closure.
+
+    Returns the (code, parent_code) links that were not applied because they
+    would create a cycle.
+    """
+    table = CodeClosure.__table__
+    codes = set(parents) | set(deleted)
+    current = {}
+    existing = set()
+    for ancestor, descendant, depth in _rows(connection, system, ('descendant', codes),
+                                             ('ancestor', 'descendant', 'depth')):
+        if depth == 0:
+            existing.add(descendant)
+        elif depth == 1:
+            current[descendant] = ancestor
+
+    moved = {code: parent for code, parent in parents.items()
+             if code not in existing or current.get(code) != parent}
+    moved.update({code: None for code in deleted if code in existing})
+    if not moved:
+        return []
+
+    # Only the subtrees under moved codes change ancestry
+    region = set(moved)
+    region.update(descendant for (descendant,) in _rows(connection, system, ('ancestor', moved), ('descendant',)))
+    parent_of = {descendant: ancestor
+                 for ancestor, descendant, depth in _rows(connection, system, ('descendant', region),
+                                                          ('ancestor', 'descendant', 'depth'))
+                 if depth == 1}
+
+    cycles = []
+    for code, parent in moved.items():
+        # Walk up from the new parent; outside the region nothing can lead back
+        node = parent
+        while node is not None and node in region and node != code:
+            node = parent_of.get(node)
+        if parent is not None and node == code:
+            cycles.append((code, parent))
+            parent_of.pop(code, None)
+        elif parent is None:
+            parent_of.pop(code, None)
+        else:
+            parent_of[code] = parent
+
+    # Ancestry of parents outside the region is unaffected by this batch
+    outside = {parent for code, parent in parent_of.items() if code in region and parent not in region}
+    chains = {}
+    for ancestor, descendant, depth in _rows(connection, system, ('descendant', outside),
+                                             ('ancestor', 'descendant', 'depth')):
+        chains.setdefault(descendant, []).append((ancestor, depth))
+    placeholders = outside - set(chains)
+    for parent in placeholders:
+        chains[parent] = [(parent, 0)]
+
+    ancestry = {}
+
+    def ancestors_of(code):
+        # Iterative, so a long parent chain cannot hit the recursion limit
+        path = []
+        node = code
+        while node not in ancestry:
+            path.append(node)
+            parent = parent_of.get(node)
+            if parent is None:
+                above = []
+                break
+            if parent not in region:
+                above = chains[parent]
+                break
+            node = parent
+        else:
+            above = ancestry[node]
+        for node in reversed(path):
+            above = [(node, 0)] + [(ancestor, depth + 1) for ancestor, depth in above]
+            ancestry[node] = above
+        return ancestry[code]
+
+    has_children = {parent for code, parent in parent_of.items() if code in region}
+    rows = [{'system': system, 'ancestor': parent, 'descendant': parent, 'depth': 0} for parent in placeholders]
+    for code in region:
+        # A deleted code stays as a placeholder while codes still name it as parent
+        if code in deleted and code not in has_children:
+            continue
+        rows.extend({'system': system, 'ancestor': ancestor, 'descendant': code, 'depth': depth}
+                    for ancestor, depth in ancestors_of(code))
+
+    for chunk in _chunks(region):
+        connection.execute(table.delete().where(table.c.system == system, table.c.descendant.in_(chunk)))
+    if rows:
+        connection.execute(table.insert(), rows)
+    return cycles
+
+
+def rebuild(system):
+    """Recompute the closure of one system from its codes table"""
+    model, _ = code_model(system)
+    parents = dict(db.session.execute(db.select(model.code, model.parent_code)).all())
+    with db.engine.begin() as connection:
+        connection.execute(CodeClosure.__table__.delete().where(CodeClosure.system == system))
+        cycles = apply_changes(connection, system, {code: parent or None for code, parent in parents.items()})
+    return len(parents), cycles
+
+
+def subsumes(system, code_a, code_b):
+    """FHIR $subsumes outcome for two codes, or None if either is unknown"""
+    rows = db.session.execute(
+        db.select(CodeClosure.ancestor, CodeClosure.descendant).where(
+            CodeClosure.system == system,
+            or_(
+                and_(CodeClosure.ancestor == code_a, CodeClosure.descendant == code_b),
+                and_(CodeClosure.ancestor == code_b, CodeClosure.descendant == code_a),
+                and_(CodeClosure.depth == 0, CodeClosure.descendant.in_((code_a, code_b))),
+            ),
+        )
+    ).all()
+    known = {descendant for ancestor, descendant in rows if ancestor == descendant}
+    if code_a not in known or code_b not in known:
+        return None
+    if code_a == code_b:
+        return 'equivalent'
+    pairs = set(rows)
+    if (code_a, code_b) in pairs:
+        return 'subsumes'
+    if (code_b, code_a) in pairs:
+        return 'subsumed-by'
+    return 'not-subsumed'
+
+
+def descendants_query(system, code, include_self=True):
+    """Select (code, display, depth) of every loaded code under code, shallowest first"""
+    model, display = code_model(system)
+    query = (
+        db.select(model.code, display, CodeClosure.depth)
+        .join(CodeClosure, and_(CodeClosure.system == system, CodeClosure.descendant == model.code))
+        .where(CodeClosure.ancestor == code)
+        .order_by(CodeClosure.depth, model.code)
+    )
+    if not include_self:
+        query = query.where(CodeClosure.depth > 0)
+    return query
+
+
+def check(system):
+    """Orphan parents and cycle-breaking links currently in a system's codes table"""
+    model, _ = code_model(system)
+    parent = db.aliased(model)
+    orphans = db.session.execute(
+        db.select(model.code, model.parent_code)
+        .outerjoin(parent, parent.code == model.parent_code)
+        .where(model.parent_code.isnot(None), model.parent_code != '', parent.code.is_(None))
+    ).all()
+    node = db.aliased(CodeClosure)
+    link = db.aliased(CodeClosure)
+    # Codes in the closure whose existing parent is not linked to them
+    unlinked = db.session.execute(
+        db.select(model.code, model.parent_code)
+        .join(parent, parent.code == model.parent_code)
+        .join(node, and_(node.system == system, node.descendant == model.code, node.ancestor == model.code))
+        .outerjoin(link, and_(link.system == system, link.descendant == model.code,
+                              link.ancestor == model.parent_code, link.depth == 1))
+        .where(link.ancestor.is_(None))
+    ).all()
+    issues = [('warning', 'not-found', f'Code {code} has parent_code {parent_code}, which is not loaded')
+              for code, parent_code in orphans]
+    issues += [('error', 'business-rule', f'parent_code {parent_code} of {code} would create a cycle; link ignored')
+               for code, parent_code in unlinked]
+    return issues
+
+
+def add_issues(system, result):
+    """Append check() findings for a system to a LoadResult"""
+    try:
+        problems = check(system)
+    except SQLAlchemyError as e:
+        logger.warning('Hierarchy check for %s skipped: %s', system, e)
+        return
+    for severity, code, text in problems:
+        result.add_issue(severity, code, text)
+
+
+def _on_codes_changed(app, upserted=(), deleted=()):
+    by_system = {}
+    for concept in upserted:
+        by_system.setdefault(concept.system, ({}, set()))[0][concept.code] = concept.parent_code or None
+    for system, code in deleted:
+        by_system.setdefault(system, ({}, set()))[1].add(code)
+    for system, (parents, removed) in by_system.items():
+        try:
+            # Own transaction: this may run from the session's after_commit hook
+            with db.engine.begin() as connection:
+                cycles = apply_changes(connection, system, parents, removed)
+        except SQLAlchemyError as e:
+            logger.warning('Closure table update for %s failed; run "flask hierarchy rebuild": %s', system, e)
+            continue
+        for code, parent in cycles:
+            logger.warning('Ignored parent_code %s of %s (%s): it would create a cycle', parent, code, system)
+
+
+hierarchy_cli = AppGroup('hierarchy', help='Code hierarchy (closure table) maintenance.')
+
+
+@hierarchy_cli.command('rebuild')
+def rebuild_command():
+    """Recompute the closure table for NAMASTE and ICD-11 from the codes tables."""
+    for system in (terminology.NAMASTE_SYSTEM, terminology.ICD11_SYSTEM):
+        started = time.perf_counter()
+        count, cycles = rebuild(system)
+        print(f'{system}: {count} codes in {time.perf_counter() - started:.2f}s, {len(cycles)} cycle links ignored')
+
+
+def init_app(app):
+    """Keep the closure table in step with ingest/sync"""
+    terminology.codes_changed.connect(_on_codes_changed, sender=app, weak=False)
+    app.cli.add_command(hierarchy_cli)
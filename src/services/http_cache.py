@@ -0,0 +1,275 @@
+"""
+HTTP caching for terminology reads.
+
+Terminology only changes when an ingest or sync commits, so every read can
+be identified by a release number: a one-row counter (terminology_release)
+bumped on codes_changed and mappings_changed. A chunked ingest sends those
+once per chunk; each worker bumps at most once per
+TERMINOLOGY_RELEASE_BUMP_INTERVAL seconds, and a change inside that interval
+schedules one trailing bump at its end (run early when the app context that
+made it, such as a request, job or CLI command, ends), so every committed
+chunk reaches the release within the interval. Views decorated
+with @conditional answer GET requests with a strong ETag derived from it,
+plus Last-Modified, and return 304 Not Modified for a matching
+If-None-Match (or an If-Modified-Since not older than the release) before
+the view runs. Each worker trusts its cached release number for
+TERMINOLOGY_RELEASE_TTL seconds; the worker that ran the ingest sees the
+new number straight away.
+
+Responses of COMPRESS_MIN_SIZE bytes or more are compressed with brotli
+(when the brotli package is installed) or gzip, according to
+Accept-Encoding. Streamed expansions are compressed chunk by chunk.
+"""
+
+import functools
+import gzip
+import logging
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+from flask import current_app, make_response, request
+from sqlalchemy.exc import SQLAlchemyError
+
+from src.extensions import db
+from src.services import terminology
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/fhir+json', 'application/xml', 'application/fhir+xml')
+
+GZIP_LEVEL = 6
+# Brotli qualities above 5 cost far more CPU for little gain on dynamic responses
+BROTLI_QUALITY = 5
+
+
+class TerminologyRelease(db.Model):
+    """Counter bumped whenever terminology content changes"""
+    __tablename__ = 'terminology_release'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime)
+
+
+class ReleaseCounter:
+    """Process-local view of the terminology release, refreshed every ttl seconds"""
+
+    def __init__(self, ttl=1.0, interval=1.0):
+        self.ttl = ttl
+        self.interval = interval
+        self._current = None
+        self._checked_at = 0
+        self._bumped_at = float('-inf')
+        self._trailing = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        """(version, updated_at as aware UTC or None), or None if the counter cannot be read"""
+        if self._current is not None and time.monotonic() - self._checked_at < self.ttl:
+            return self._current
+        try:
+            row = db.session.get(TerminologyRelease, 1)
+        except SQLAlchemyError as e:
+            logger.warning('Terminology release unavailable, responses not cached: %s', e)
+            db.session.rollback()
+            return None
+        self._remember(row.version if row else 0, row.updated_at if row else None)
+        return self._current
+
+    def bump(self):
+        """Advance the release in its own transaction (signals arrive after the ingest commit)"""
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        table = TerminologyRelease.__table__
+        with db.engine.begin() as connection:
+            updated = connection.execute(
+                table.update().where(table.c.id == 1).values(version=table.c.version + 1, updated_at=now)
+            ).rowcount
+            if not updated:
+                connection.execute(table.insert().values(id=1, version=1, updated_at=now))
+            version = connection.execute(db.select(table.c.version).where(table.c.id == 1)).scalar_one()
+        self._remember(version, now)
+        return version
+
+    def changed(self, app):
+        """Bump for a committed change now, or once the interval since the last bump is over"""
+        with self._lock:
+            wait = self._bumped_at + self.interval - time.monotonic()
+            if wait > 0:
+                if self._trailing is None:
+                    self._trailing = threading.Timer(wait, self._trailing_bump, (app,))
+                    self._trailing.daemon = True
+                    self._trailing.start()
+                return
+            self._bumped_at = time.monotonic()
+        _bump(self)
+
+    def flush(self):
+        """Run a scheduled trailing bump now"""
+        with self._lock:
+            trailing, self._trailing = self._trailing, None
+            if trailing is None:
+                return
+            trailing.cancel()
+            self._bumped_at = time.monotonic()
+        _bump(self)
+
+    def _trailing_bump(self, app):
+        with self._lock:
+            # Timer runs this in its own thread; skip if flush() got there first
+            if self._trailing is not threading.current_thread():
+                return
+            self._trailing = None
+            self._bumped_at = time.monotonic()
+        with app.app_context():
+            _bump(self)
+
+    def _remember(self, version, updated_at):
+        if updated_at is not None:
+            # HTTP dates have whole seconds
+            updated_at = updated_at.replace(tzinfo=timezone.utc, microsecond=0)
+        with self._lock:
+            self._current = (version, updated_at)
+            self._checked_at = time.monotonic()
+
+
+def release_etag(version):
+    return f'terminology-{version}'
+
+
+def _not_modified(etag, updated_at):
+    """The tag to echo in a 304 if the client's copy is current, else None"""
+    if request.if_none_match:
+        if request.if_none_match.star_tag:
+            return etag
+        for tag in request.if_none_match.as_set(include_weak=True):
+            # Compressed representations carry the encoding as a suffix
+            if tag == etag or tag.startswith(etag + '-'):
+                return tag
+        return None
+    since = request.if_modified_since
+    if since is not None and updated_at is not None and updated_at <= since:
+        return etag
+    return None
+
+
+def conditional(view):
+    """ETag/Last-Modified from the terminology release and 304s for GET requests that are still current"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(*args, **kwargs)
+        release = current_app.extensions['terminology_release'].current()
+        if release is None:
+            return view(*args, **kwargs)
+        version, updated_at = release
+        etag = release_etag(version)
+        matched = _not_modified(etag, updated_at)
+        if matched is not None:
+            response = current_app.response_class(status=304)
+            etag = matched
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        if updated_at is not None:
+            response.last_modified = updated_at
+        response.headers['Cache-Control'] = current_app.config['TERMINOLOGY_CACHE_CONTROL']
+        response.vary.add('Accept-Encoding')
+        return response
+    return wrapper
+
+
+# -- compression ---------------------------------------------------------
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def _negotiate():
+    """'br', 'gzip' or None, by the client's Accept-Encoding preferences"""
+    accepted = request.accept_encodings
+    gzip_quality = accepted.quality('gzip')
+    brotli_quality = accepted.quality('br')
+    if brotli_quality and brotli_quality >= gzip_quality and _brotli() is not None:
+        return 'br'
+    return 'gzip' if gzip_quality else None
+
+
+def _compressor(encoding):
+    if encoding == 'br':
+        compressor = _brotli().Compressor(quality=BROTLI_QUALITY)
+        return compressor.process, compressor.finish
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress, compressor.flush
+
+
+def _compress_stream(chunks, encoding):
+    compress, finish = _compressor(encoding)
+    for chunk in chunks:
+        data = compress(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+def _compressible(response):
+    mimetype = response.mimetype or ''
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+
+
+def _compress(response):
+    if (response.status_code != 200 or request.method == 'HEAD' or 'Content-Encoding' in response.headers
+            or response.direct_passthrough or not _compressible(response)):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = _negotiate()
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+            return response
+        if encoding == 'br':
+            response.set_data(_brotli().compress(data, quality=BROTLI_QUALITY))
+        else:
+            response.set_data(gzip.compress(data, GZIP_LEVEL))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak)
+    return response
+
+
+def _bump(counter):
+    try:
+        counter.bump()
+    except SQLAlchemyError as e:
+        logger.warning('Terminology release not bumped: %s', e)
+
+
+def _on_terminology_changed(app, **changes):
+    app.extensions['terminology_release'].changed(app)
+
+
+def _flush_release(exc=None):
+    """When an app context ends: no need to wait out the interval for its last changes"""
+    current_app.extensions['terminology_release'].flush()
+
+
+def init_app(app):
+    app.extensions['terminology_release'] = ReleaseCounter(app.config.get('TERMINOLOGY_RELEASE_TTL', 1.0),
+                                                           app.config.get('TERMINOLOGY_RELEASE_BUMP_INTERVAL', 1.0))
+    terminology.codes_changed.connect(_on_terminology_changed, sender=app, weak=False)
+    terminology.mappings_changed.connect(_on_terminology_changed, sender=app, weak=False)
+    app.teardown_appcontext(_flush_release)
+    app.after_request(_compress)
@@ -0,0 +1,259 @@
+"""
+Offline import of an ICD-11 release from a WHO tabulation file.
+
+Reads the WHO "simple tabulation" TSV (MMS with the TM2 chapter), either
+as a plain file or straight out of the distributed zip without extracting
+it. Parent codes come from the depth dashes in Title. Rows are compared,
+a chunk at a time, against what ICD11Code already holds, and only new or
+changed rows are bulk-upserted. Re-importing a release therefore writes
+nothing, and a new release writes only what changed.
+"""
+
+import csv
+import io
+import os
+import time
+import zipfile
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy.exc import SQLAlchemyError
+
+from src.extensions import db
+from src.services import hierarchy, jobs, terminology
+from src.services.namaste_loader import LoadResult, upsert_statement
+
+REQUIRED_COLUMNS = ('Code', 'Title', 'ClassKind', 'ChapterNo')
+
+# Definitions are not part of the tabulation, so existing ones are kept
+IMPORT_UPDATE_COLUMNS = ('title', 'parent_code', 'module')
+
+TM2_CHAPTER = '26'
+
+JOB_KIND = 'import-icd11'
+
+
+class ImportResult(LoadResult):
+    """LoadResult plus the diff against the loaded release"""
+
+    def __init__(self):
+        super().__init__()
+        self.release = None
+        self.unchanged = 0
+        self.removed = 0
+        self.pruned = 0
+
+    def summary(self):
+        text = (
+            f'Imported ICD-11 release {self.release or "(unknown)"}: {self.rows_read} rows read, '
+            f'{self.rows_written} new or changed codes written, {self.unchanged} unchanged, '
+            f'{self.rows_rejected} rejected, {self.duplicates} duplicates in {self.chunks} chunks '
+            f'({self.elapsed:.2f}s, {self.rows_per_second:.0f} rows/sec)'
+        )
+        if self.removed:
+            text += (f'; {self.pruned} codes no longer in the release were deleted' if self.pruned
+                     else f'; {self.removed} loaded codes are not in this release (kept)')
+        return text
+
+
+def _strip_depth(title):
+    """('Cholera', 2) from '- - Cholera'"""
+    depth = 0
+    while title.startswith('-'):
+        title = title[1:].lstrip()
+        depth += 1
+    return title.strip(), depth
+
+
+def iter_tabulation(text, result):
+    """(line, row) for each coded category of a tabulation, with parent_code and module"""
+    reader = csv.DictReader(text, delimiter='\t', quoting=csv.QUOTE_NONE)
+    missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or ())]
+    if missing:
+        result.add_issue('fatal', 'structure', f'Tabulation is missing required columns: {", ".join(missing)}')
+        return
+
+    # Code of the category at each depth above the current row (None for chapters/blocks)
+    ancestors = []
+    for record in reader:
+        title, depth = _strip_depth(record.get('Title') or '')
+        kind = (record.get('ClassKind') or '').strip().lower()
+        code = (record.get('Code') or '').strip() or None
+        del ancestors[depth:]
+        parent_code = next((ancestor for ancestor in reversed(ancestors) if ancestor), None)
+        ancestors.extend([None] * (depth - len(ancestors)))
+        ancestors.append(code if kind == 'category' else None)
+        if kind != 'category':
+            continue
+        result.rows_read += 1
+        if not code or not title:
+            result.rows_rejected += 1
+            result.add_issue('error', 'required', 'Category row is missing Code or Title', result.chunks + 1,
+                             reader.line_num)
+            continue
+        chapter = (record.get('ChapterNo') or '').strip()
+        yield reader.line_num, {
+            'code': code,
+            'title': title,
+            'parent_code': parent_code,
+            'module': 'tm2' if chapter == TM2_CHAPTER else 'biomedicine',
+        }
+
+
+def _changed_rows(rows):
+    """The rows whose title/parent/module differ from ICD11Code (or are new)"""
+    from src.models import ICD11Code
+
+    current = {
+        code: (title, parent_code, module)
+        for code, title, parent_code, module in db.session.execute(
+            db.select(ICD11Code.code, ICD11Code.title, ICD11Code.parent_code, ICD11Code.module)
+            .where(ICD11Code.code.in_([row['code'] for row in rows]))
+        )
+    }
+    return [row for row in rows
+            if current.get(row['code']) != (row['title'], row['parent_code'], row['module'])]
+
+
+def _write_changes(rows, statement, result):
+    changed = _changed_rows(rows)
+    result.unchanged += len(rows) - len(changed)
+    if not changed:
+        return
+    try:
+        db.session.execute(statement, changed)
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        result.rows_rejected += len(changed)
+        result.add_issue('error', 'exception', f'Chunk failed to load: {e}', result.chunks)
+        return
+    result.rows_written += len(changed)
+    terminology.codes_changed.send(
+        current_app._get_current_object(),
+        upserted=[
+            terminology.Concept(terminology.ICD11_SYSTEM, row['code'], row['title'], '', row['parent_code'])
+            for row in changed
+        ],
+        deleted=[],
+    )
+
+
+def _prune(seen, prune, result):
+    """Count (and with prune=True delete) loaded codes missing from the release"""
+    from src.models import ICD11Code
+
+    stale = [code for code in db.session.execute(db.select(ICD11Code.code)).scalars() if code not in seen]
+    result.removed = len(stale)
+    if not stale or not prune:
+        return
+    for start in range(0, len(stale), 500):
+        db.session.execute(db.delete(ICD11Code).where(ICD11Code.code.in_(stale[start:start + 500])))
+    db.session.commit()
+    result.pruned = len(stale)
+    terminology.codes_changed.send(current_app._get_current_object(), upserted=[],
+                                   deleted=[(terminology.ICD11_SYSTEM, code) for code in stale])
+
+
+def _open_release(path):
+    """(binary stream, uncompressed size) for a tabulation file or the tabulation inside a zip"""
+    if not zipfile.is_zipfile(path):
+        return open(path, 'rb'), os.path.getsize(path)
+    archive = zipfile.ZipFile(path)
+    members = [info for info in archive.infolist()
+               if info.filename.lower().endswith(('.txt', '.tsv')) and not info.is_dir()]
+    if not members:
+        archive.close()
+        raise ValueError('No .txt/.tsv tabulation found in the zip archive')
+    # Prefer the simple tabulation when the archive carries several files
+    member = next((info for info in members if 'tabulation' in info.filename.lower()), members[0])
+    # The member stream decompresses on the fly; nothing is extracted to disk.
+    # It keeps the archive's file open until it is itself closed.
+    stream = archive.open(member)
+    archive.close()
+    return stream, member.file_size
+
+
+def import_release(path, release=None, chunk_size=1000, prune=False, on_chunk=None):
+    """
+    Import a WHO tabulation (plain or zipped) into ICD11Code, writing only changed rows.
+
+    on_chunk, if given, is called with (result, fraction_done) after every chunk.
+    """
+    from src.models import ICD11Code
+
+    result = ImportResult()
+    result.release = release
+    statement = upsert_statement(ICD11Code.__table__, db.engine.dialect.name, IMPORT_UPDATE_COLUMNS)
+    stream, size = _open_release(path)
+    seen = set()
+    chunk = {}
+
+    def flush():
+        result.chunks += 1
+        _write_changes(list(chunk.values()), statement, result)
+        chunk.clear()
+        result.elapsed = time.perf_counter() - result.started
+        if on_chunk is not None:
+            on_chunk(result, stream.tell() / (size or 1))
+
+    try:
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace', newline='')
+        for line, row in iter_tabulation(text, result):
+            if row['code'] in seen:
+                result.duplicates += 1
+                result.add_issue('warning', 'duplicate', f'Duplicate code {row["code"]}; last occurrence kept',
+                                 result.chunks + 1, line)
+            seen.add(row['code'])
+            chunk[row['code']] = row
+            if len(chunk) >= chunk_size:
+                flush()
+        if chunk:
+            flush()
+    finally:
+        stream.close()
+    if seen:
+        _prune(seen, prune, result)
+        hierarchy.add_issues(terminology.ICD11_SYSTEM, result)
+    result.elapsed = time.perf_counter() - result.started
+    return result
+
+
+@jobs.job_kind(JOB_KIND)
+def import_icd11_job(job, path, release=None, chunk_size=1000, prune=False, remove=True):
+    """Import a spooled release file as a background job"""
+    def report(result, fraction):
+        job.progress(rows_processed=result.rows_read, errors=result.rows_rejected, fraction=fraction)
+
+    try:
+        result = import_release(path, release=release, chunk_size=chunk_size, prune=prune, on_chunk=report)
+    finally:
+        if remove:
+            os.remove(path)
+    job.progress(rows_processed=result.rows_read, errors=result.rows_rejected)
+    return result.to_operation_outcome()
+
+
+icd11_cli = AppGroup('icd11', help='ICD-11 terminology maintenance.')
+
+
+@icd11_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--release', help='Release id to report, e.g. 2024-01 (defaults to the file name).')
+@click.option('--chunk-size', default=None, type=int, help='Rows per bulk write.')
+@click.option('--prune', is_flag=True, help='Delete loaded codes that are not in this release.')
+def import_command(path, release, chunk_size, prune):
+    """Import an ICD-11 release from a local WHO tabulation file (.txt/.tsv or .zip)."""
+    def report(result, fraction):
+        click.echo(f'  {fraction * 100:5.1f}%  {result.rows_read} rows, {result.rows_written} written')
+
+    result = import_release(path, release=release or os.path.splitext(os.path.basename(path))[0],
+                            prune=prune, on_chunk=report,
+                            chunk_size=chunk_size or current_app.config['INGEST_CHUNK_SIZE'])
+    for issue in result.to_operation_outcome()['issue']:
+        click.echo(f'{issue["severity"]}: {issue["details"]["text"]}')
+
+
+def init_app(app):
+    app.cli.add_command(icd11_cli)
@@ -0,0 +1,500 @@
+"""
+Concurrent, incremental sync of ICD-11 (TM2 and Biomedicine) from the WHO API.
+
+The engine walks the linearization tree with one pooled async httpx client
+and a shared, auto-refreshed OAuth token. Requests run under an adaptive
+concurrency window that halves on 429/5xx (honouring Retry-After) and
+grows back as requests succeed. Coded categories are bulk-upserted into
+ICD11Code in batches, and after every batch a checkpoint file records the
+discovered/done frontier so a crashed sync resumes where it stopped.
+
+The checkpoint also keeps each entity's ETag and children. A re-sync of the
+same release is skipped outright; a new release is walked with conditional
+requests, and entities answering 304 Not Modified are not written.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+
+from src.extensions import db
+from src.services import jobs, terminology
+from src.services.namaste_loader import upsert_statement
+
+logger = logging.getLogger(__name__)
+
+ICD11_UPDATE_COLUMNS = ('title', 'definition', 'parent_code', 'module')
+
+# Chapter 26 of the MMS is Traditional Medicine conditions - Module 1
+TM2_CHAPTER = '26'
+
+# Entity id of the linearization root
+ROOT = ''
+
+MAX_BACKOFF = 60.0
+
+# Consecutive failed entities after which the walk stops (the API is likely down)
+ABORT_AFTER_FAILURES = 25
+
+JOB_KIND = 'sync-icd11'
+
+
+class SyncError(Exception):
+    """Raised when an entity cannot be fetched after all retries"""
+
+
+class SyncStats:
+    """Counters for one sync run"""
+
+    def __init__(self):
+        self.release_id = None
+        self.fetched = 0
+        self.written = 0
+        self.unchanged = 0
+        self.errors = 0
+        self.retries = 0
+        self.token_refreshes = 0
+        self.resumed = False
+        self.up_to_date = False
+        self.complete = False
+        self.failures = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def to_operation_outcome(self):
+        if self.up_to_date:
+            text = f'ICD-11 release {self.release_id} is already synced; nothing to do'
+        else:
+            text = (
+                f'{"Resumed" if self.resumed else "Synced"} ICD-11 release {self.release_id}: '
+                f'{self.fetched} entities fetched, {self.written} codes written, {self.unchanged} unchanged, '
+                f'{self.errors} errors, {self.retries} retries ({self.elapsed:.1f}s)'
+            )
+        issues = [{'severity': 'information', 'code': 'informational', 'details': {'text': text}}]
+        if not self.complete and not self.up_to_date:
+            issues.append({'severity': 'warning', 'code': 'incomplete',
+                           'details': {'text': 'Sync incomplete; run it again to resume from the checkpoint'}})
+        issues += [{'severity': 'error', 'code': 'exception', 'details': {'text': failure}}
+                   for failure in self.failures]
+        return {'resourceType': 'OperationOutcome', 'issue': issues}
+
+
+class TokenProvider:
+    """Client-credentials token shared by all requests, refreshed before it expires"""
+
+    REFRESH_MARGIN = 60
+
+    def __init__(self, endpoint, client_id, client_secret, scope='icdapi_access'):
+        self.endpoint = endpoint
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.scope = scope
+        self.refreshes = 0
+        self._token = None
+        self._refresh_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _valid(self):
+        return self._token is not None and time.monotonic() < self._refresh_at
+
+    async def get(self, client):
+        if not self.client_id:
+            return None
+        if self._valid():
+            return self._token
+        async with self._lock:
+            # Another request may have refreshed it while we waited
+            if not self._valid():
+                response = await client.post(self.endpoint, data={
+                    'client_id': self.client_id,
+                    'client_secret': self.client_secret,
+                    'scope': self.scope,
+                    'grant_type': 'client_credentials',
+                })
+                response.raise_for_status()
+                data = response.json()
+                self._token = data['access_token']
+                lifetime = float(data.get('expires_in', 3600))
+                self._refresh_at = time.monotonic() + lifetime - min(self.REFRESH_MARGIN, lifetime / 2)
+                self.refreshes += 1
+            return self._token
+
+    def invalidate(self, token):
+        if self._token == token:
+            self._token = None
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency window for outgoing requests.
+
+    Throttled or failed requests halve the window and can pause every
+    request for a Retry-After interval; each full window of successes
+    widens it again by one, up to max_limit.
+    """
+
+    def __init__(self, max_limit):
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self.in_flight = 0
+        self._successes = 0
+        self._resume_at = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def release(self, throttled=False, retry_after=None):
+        async with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+                if retry_after:
+                    self._resume_at = max(self._resume_at, time.monotonic() + retry_after)
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_limit:
+                    self.limit += 1
+                    self._successes = 0
+            self._condition.notify_all()
+
+
+def _retry_after(response):
+    if response is None:
+        return None
+    try:
+        return min(MAX_BACKOFF, max(0.0, float(response.headers.get('Retry-After', ''))))
+    except ValueError:
+        return None
+
+
+def _value(node):
+    """Text of a WHO language-tagged value ({'@language': ..., '@value': ...})"""
+    if isinstance(node, dict):
+        return node.get('@value')
+    return node
+
+
+class ICD11SyncEngine:
+    """Walks one ICD-11 linearization release into ICD11Code"""
+
+    def __init__(self, base_url, token_endpoint=None, client_id=None, client_secret=None,
+                 linearization='mms', release_id=None, checkpoint_path=None, concurrency=8,
+                 max_retries=6, batch_size=500, timeout=30.0, on_progress=None):
+        self.base_url = base_url.rstrip('/')
+        self.linearization = linearization
+        self.release_id = release_id
+        self.checkpoint_path = checkpoint_path
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.on_progress = on_progress
+        self.tokens = TokenProvider(token_endpoint, client_id, client_secret)
+        self.stats = SyncStats()
+        self.client = None
+        self.limiter = None
+        self._reset_walk()
+
+    @classmethod
+    def from_config(cls, config, **overrides):
+        options = {
+            'base_url': config['ICD11_API_BASE_URL'],
+            'token_endpoint': config['ICD11_TOKEN_ENDPOINT'],
+            'client_id': config.get('ICD11_CLIENT_ID'),
+            'client_secret': config.get('ICD11_CLIENT_SECRET'),
+            'linearization': config['ICD11_LINEARIZATION'],
+            'release_id': config.get('ICD11_RELEASE_ID'),
+            'checkpoint_path': config['ICD11_SYNC_CHECKPOINT'],
+            'concurrency': config['ICD11_SYNC_CONCURRENCY'],
+            'max_retries': config['ICD11_SYNC_MAX_RETRIES'],
+            'batch_size': config['ICD11_SYNC_BATCH_SIZE'],
+            'timeout': config['ICD11_SYNC_TIMEOUT'],
+        }
+        options.update(overrides)
+        return cls(**options)
+
+    def _reset_walk(self):
+        # entity id -> [module, parent_code] for everything seen in this release
+        self.discovered = {}
+        self.done = set()
+        # entity id -> {'etag', 'code', 'module', 'children'}, kept across releases
+        self.entities = {}
+        self._rows = {}
+        self._pending_done = []
+        self._consecutive_failures = 0
+
+    # -- URLs ---------------------------------------------------------------
+
+    def _release_url(self, release_id):
+        return f'{self.base_url}/release/11/{release_id}/{self.linearization}'
+
+    def _entity_url(self, entity_id):
+        url = self._release_url(self.stats.release_id)
+        return f'{url}/{entity_id}' if entity_id else url
+
+    def _entity_id(self, uri):
+        """Entity id (e.g. '1435254666' or '1435254666/other') from a WHO URI"""
+        marker = f'/{self.linearization}/'
+        index = uri.find(marker)
+        return uri[index + len(marker):] if index >= 0 else uri.rstrip('/').rsplit('/', 1)[-1]
+
+    # -- HTTP -----------------------------------------------------------------
+
+    def _backoff(self, attempt, retry_after):
+        if retry_after is not None:
+            return retry_after
+        return min(MAX_BACKOFF, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    async def _get(self, url, etag=None):
+        """GET under the limiter with token handling and backoff; returns a 2xx or 304 response"""
+        import httpx
+
+        failure = None
+        for attempt in range(self.max_retries + 1):
+            headers = {'Accept': 'application/json', 'Accept-Language': 'en', 'API-Version': 'v2'}
+            token = await self.tokens.get(self.client)
+            if token:
+                headers['Authorization'] = f'Bearer {token}'
+            if etag:
+                headers['If-None-Match'] = etag
+
+            await self.limiter.acquire()
+            try:
+                response = await self.client.get(url, headers=headers)
+            except httpx.TransportError as e:
+                response, failure = None, f'{type(e).__name__}: {e}'
+            throttled = response is None or response.status_code == 429 or response.status_code >= 500
+            await self.limiter.release(throttled, _retry_after(response))
+
+            if response is not None and response.status_code == 401 and token:
+                # Revoked or expired early; fetch a fresh token and retry
+                self.tokens.invalidate(token)
+                failure = 'HTTP 401'
+            elif not throttled:
+                if response.status_code >= 400:
+                    raise SyncError(f'{url}: HTTP {response.status_code}')
+                return response
+            elif response is not None:
+                failure = f'HTTP {response.status_code}'
+
+            if attempt < self.max_retries:
+                self.stats.retries += 1
+                await asyncio.sleep(self._backoff(attempt, _retry_after(response)))
+        raise SyncError(f'{url}: giving up after {self.max_retries + 1} attempts ({failure})')
+
+    async def _latest_release(self):
+        response = await self._get(f'{self.base_url}/release/11/{self.linearization}')
+        data = response.json()
+        latest = data.get('latestRelease') or ''
+        return data.get('releaseId') or latest.rstrip('/').split('/')[-2]
+
+    # -- Checkpoint -----------------------------------------------------------
+
+    def _load_checkpoint(self):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return {}
+        try:
+            with open(self.checkpoint_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning('Ignoring unreadable ICD-11 sync checkpoint %s: %s', self.checkpoint_path, e)
+            return {}
+
+    def _save_checkpoint(self, state):
+        if not self.checkpoint_path:
+            return
+        checkpoint = {'release_id': self.stats.release_id, 'state': state, 'entities': self.entities}
+        if state == 'running':
+            checkpoint['discovered'] = self.discovered
+            checkpoint['done'] = sorted(self.done)
+        folder = os.path.dirname(self.checkpoint_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        # Write then rename, so a crash never leaves a truncated checkpoint
+        temp_path = f'{self.checkpoint_path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f, separators=(',', ':'))
+        os.replace(temp_path, self.checkpoint_path)
+
+    # -- Walk -----------------------------------------------------------------
+
+    def _discover(self, children, module, parent_code, queue):
+        for child in children:
+            if child not in self.discovered:
+                self.discovered[child] = [module, parent_code]
+                queue.put_nowait(child)
+
+    async def _visit(self, entity_id, queue):
+        module, parent_code = self.discovered[entity_id]
+        known = self.entities.get(entity_id)
+        response = await self._get(self._entity_url(entity_id), etag=known and known.get('etag'))
+        self.stats.fetched += 1
+
+        if response.status_code == 304 and known:
+            self.stats.unchanged += 1
+            self._discover(known['children'], known['module'], known['code'] or parent_code, queue)
+            self._pending_done.append(entity_id)
+            return
+
+        data = response.json()
+        kind = data.get('classKind')
+        code = data.get('code') or None
+        if kind == 'chapter':
+            module = 'tm2' if code == TM2_CHAPTER else 'biomedicine'
+        category_code = code if kind not in ('chapter', 'block', 'window') else None
+        children = [self._entity_id(uri) for uri in data.get('child', [])]
+        self.entities[entity_id] = {
+            'etag': response.headers.get('ETag'),
+            'code': category_code,
+            'module': module,
+            'children': children,
+        }
+        if category_code:
+            self._rows[category_code] = {
+                'code': category_code,
+                'title': _value(data.get('title')) or category_code,
+                'definition': _value(data.get('definition')),
+                'parent_code': parent_code,
+                'module': module,
+            }
+        self._discover(children, module, category_code or parent_code, queue)
+        self._pending_done.append(entity_id)
+        if len(self._rows) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        """Bulk-upsert fetched codes, then checkpoint what is now durable"""
+        from src.models import ICD11Code
+
+        rows, self._rows = list(self._rows.values()), {}
+        done, self._pending_done = self._pending_done, []
+        if rows:
+            statement = upsert_statement(ICD11Code.__table__, db.engine.dialect.name, ICD11_UPDATE_COLUMNS)
+            try:
+                db.session.execute(statement, rows)
+                db.session.commit()
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                # Left out of `done` and forgotten, so a resumed sync fetches them in full again
+                for entity_id in done:
+                    self.entities.pop(entity_id, None)
+                self.stats.errors += len(rows)
+                self.stats.failures.append(f'Batch of {len(rows)} codes failed to load: {e}')
+                return
+            self.stats.written += len(rows)
+            terminology.codes_changed.send(
+                current_app._get_current_object(),
+                upserted=[
+                    terminology.Concept(terminology.ICD11_SYSTEM, row['code'], row['title'],
+                                        row['definition'] or '', row['parent_code'])
+                    for row in rows
+                ],
+                deleted=[],
+            )
+        self.done.update(done)
+        self._save_checkpoint('running')
+        self.stats.elapsed = time.perf_counter() - self.stats.started
+        if self.on_progress is not None:
+            self.on_progress(self)
+
+    async def _worker(self, queue):
+        while True:
+            entity_id = await queue.get()
+            try:
+                if self._consecutive_failures >= ABORT_AFTER_FAILURES:
+                    # Left for the next run to resume
+                    continue
+                await self._visit(entity_id, queue)
+                self._consecutive_failures = 0
+            except Exception as e:
+                self.stats.errors += 1
+                self._consecutive_failures += 1
+                if len(self.stats.failures) < 100:
+                    self.stats.failures.append(str(e))
+                logger.warning('ICD-11 sync failed for entity %r: %s', entity_id, e)
+                if self._consecutive_failures == ABORT_AFTER_FAILURES:
+                    logger.error('ICD-11 sync stopping after %d consecutive failures', ABORT_AFTER_FAILURES)
+            finally:
+                queue.task_done()
+
+    async def run(self, full=False):
+        """Sync one release; full=True ignores the checkpoint and ETags"""
+        # Imported here: httpx is only needed by a sync, not by every worker at startup
+        import httpx
+
+        checkpoint = {} if full else self._load_checkpoint()
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(timeout=self.timeout, limits=limits) as client:
+            self.client = client
+            self.limiter = AdaptiveLimiter(self.concurrency)
+            release_id = self.release_id or await self._latest_release()
+            self.stats.release_id = release_id
+            self._reset_walk()
+            self.entities = dict(checkpoint.get('entities') or {})
+
+            same_release = checkpoint.get('release_id') == release_id
+            if same_release and checkpoint.get('state') == 'complete':
+                self.stats.up_to_date = True
+            else:
+                if same_release and checkpoint.get('state') == 'running':
+                    self.stats.resumed = True
+                    self.discovered = checkpoint['discovered']
+                    self.done = set(checkpoint['done'])
+                else:
+                    self.discovered = {ROOT: [None, None]}
+                await self._walk()
+        self.stats.token_refreshes = self.tokens.refreshes
+        self.stats.elapsed = time.perf_counter() - self.stats.started
+        return self.stats
+
+    async def _walk(self):
+        queue = asyncio.Queue()
+        for entity_id in self.discovered:
+            if entity_id not in self.done:
+                queue.put_nowait(entity_id)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+        try:
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        self._flush()
+        if len(self.done) == len(self.discovered):
+            self.stats.complete = True
+            # Drop entities that are no longer part of the release
+            self.entities = {entity_id: self.entities[entity_id] for entity_id in self.done
+                             if entity_id in self.entities}
+            self._save_checkpoint('complete')
+
+
+def sync(app=None, full=False, on_progress=None, **overrides):
+    """Run a sync to completion in the current app context; returns SyncStats"""
+    app = app or current_app
+    engine = ICD11SyncEngine.from_config(app.config, on_progress=on_progress, **overrides)
+    return asyncio.run(engine.run(full=full))
+
+
+@jobs.job_kind(JOB_KIND)
+def sync_icd11_job(job, full=False):
+    """Sync ICD-11 from the WHO API as a background job"""
+    def report(engine):
+        job.progress(rows_processed=engine.stats.fetched, errors=engine.stats.errors,
+                     fraction=len(engine.done) / max(1, len(engine.discovered)))
+
+    stats = sync(full=full, on_progress=report)
+    job.progress(rows_processed=stats.fetched, errors=stats.errors)
+    return stats.to_operation_outcome()
@@ -0,0 +1,292 @@
+"""
+Background jobs for long-running ingest and sync operations.
+
+Handlers register a job kind; requests enqueue jobs and get an id back
+straight away, and GET /jobs/<id> reports progress as a FHIR Task. Work runs
+on a dedicated, bounded thread pool so it never competes with request
+threads. The default backend keeps jobs in process; with JOB_BACKEND=redis
+the queue and job state live in Redis so any gunicorn worker can pick up a
+job or answer a progress poll. Finished jobs are kept for JOB_RESULT_TTL
+seconds in either backend.
+"""
+
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from blinker import Namespace
+
+from src.services import preload
+
+logger = logging.getLogger(__name__)
+
+_KINDS = {}
+
+# Sent with sender=app, job=Job, seconds=run time once a job has completed or failed
+job_finished = Namespace().signal('job-finished')
+
+# Task.status values used for job states
+QUEUED = 'requested'
+RUNNING = 'in-progress'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+
+class JobQueueFull(Exception):
+    """Raised when the bounded job queue cannot take more work"""
+
+
+def job_kind(name):
+    """Register a function(job, **params) as the handler for a job kind"""
+    def decorator(fn):
+        _KINDS[name] = fn
+        return fn
+    return decorator
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+class Job:
+    """State of one job; progress() persists updates through its backend"""
+
+    def __init__(self, kind, params=None, id=None):
+        self.id = id or uuid.uuid4().hex
+        self.kind = kind
+        self.params = params or {}
+        self.status = QUEUED
+        self.created = _now().isoformat()
+        self.started = None
+        self.finished = None
+        self.rows_processed = 0
+        self.errors = 0
+        self.fraction = None
+        self.message = None
+        self.outcome = None
+        self._backend = None
+
+    def to_dict(self):
+        return {key: value for key, value in self.__dict__.items() if not key.startswith('_')}
+
+    @classmethod
+    def from_dict(cls, data):
+        job = cls(data['kind'], data.get('params'), data['id'])
+        job.__dict__.update(data)
+        return job
+
+    def progress(self, rows_processed=None, errors=None, fraction=None):
+        if rows_processed is not None:
+            self.rows_processed = rows_processed
+        if errors is not None:
+            self.errors = errors
+        if fraction is not None:
+            self.fraction = max(0.0, min(1.0, fraction))
+        if self._backend is not None:
+            self._backend.save(self)
+
+    def eta(self):
+        """Estimated completion time from the fraction done so far"""
+        if self.status != RUNNING or not self.fraction or not self.started:
+            return None
+        started = datetime.fromisoformat(self.started)
+        elapsed = (_now() - started).total_seconds()
+        return started + timedelta(seconds=elapsed / self.fraction)
+
+    def to_task(self):
+        """Render the job as a FHIR Task"""
+        outputs = [
+            ('rowsProcessed', 'valueInteger', self.rows_processed),
+            ('errors', 'valueInteger', self.errors),
+        ]
+        if self.fraction is not None:
+            outputs.append(('percentComplete', 'valueDecimal', round(self.fraction * 100, 1)))
+        eta = self.eta()
+        if eta is not None:
+            outputs.append(('estimatedCompletion', 'valueDateTime', eta.isoformat()))
+        task = {
+            'resourceType': 'Task',
+            'id': self.id,
+            'status': self.status,
+            'intent': 'order',
+            'code': {'text': self.kind},
+            'authoredOn': self.created,
+            'output': [{'type': {'text': name}, key: value} for name, key, value in outputs],
+        }
+        if self.started:
+            task['executionPeriod'] = {'start': self.started}
+            if self.finished:
+                task['executionPeriod']['end'] = self.finished
+        if self.message:
+            task['statusReason'] = {'text': self.message}
+        if self.outcome:
+            task['contained'] = [dict(self.outcome, id='outcome')]
+            task['output'].append({'type': {'text': 'outcome'}, 'valueReference': {'reference': '#outcome'}})
+        return task
+
+
+class _LocalBackend:
+    """Jobs held in this process and run on its own thread pool"""
+
+    # Seconds between scans for expired results
+    EVICT_INTERVAL = 60
+
+    def __init__(self, app):
+        self.app = app
+        self.max_workers = app.config['JOB_MAX_WORKERS']
+        self.ttl = app.config['JOB_RESULT_TTL']
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(app.config['JOB_QUEUE_SIZE'])
+        self._executor = None
+        self._next_eviction = 0
+
+    def save(self, job):
+        with self._lock:
+            self._evict()
+            self._jobs[job.id] = job.to_dict()
+
+    def load(self, job_id):
+        with self._lock:
+            self._evict()
+            data = self._jobs.get(job_id)
+        return Job.from_dict(data) if data else None
+
+    def _evict(self):
+        """Drop jobs that finished more than JOB_RESULT_TTL ago (called with _lock held)"""
+        if time.monotonic() < self._next_eviction:
+            return
+        self._next_eviction = time.monotonic() + min(self.EVICT_INTERVAL, self.ttl)
+        cutoff = _now() - timedelta(seconds=self.ttl)
+        expired = [job_id for job_id, data in self._jobs.items()
+                   if data['finished'] and datetime.fromisoformat(data['finished']) < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def dispatch(self, job):
+        if not self._slots.acquire(blocking=False):
+            raise JobQueueFull('Job queue is full')
+        self.save(job)
+        with self._lock:
+            # Created lazily so a preloading master never owns the threads
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='medisync-job')
+        self._executor.submit(self._run, job.id)
+
+    def _run(self, job_id):
+        try:
+            run_job(self.app, self, job_id)
+        finally:
+            self._slots.release()
+
+    def start(self):
+        pass
+
+
+class _RedisBackend:
+    """Queue and job state shared through Redis (REDIS_URL)"""
+
+    QUEUE_KEY = 'medisync:jobs:queue'
+    JOB_KEY = 'medisync:jobs:{}'
+
+    # Check the queue length, store the job and queue it in one step, so
+    # concurrent dispatches cannot overfill the queue or leave a job behind
+    DISPATCH_SCRIPT = """
+if redis.call('llen', KEYS[1]) >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('set', KEYS[2], ARGV[3], 'EX', ARGV[4])
+redis.call('rpush', KEYS[1], ARGV[2])
+return 1
+"""
+
+    def __init__(self, app):
+        import redis
+
+        self.app = app
+        self.client = redis.Redis.from_url(app.config['REDIS_URL'])
+        self.max_workers = app.config['JOB_MAX_WORKERS']
+        self.queue_size = app.config['JOB_QUEUE_SIZE']
+        self.ttl = app.config['JOB_RESULT_TTL']
+        self._dispatch = self.client.register_script(self.DISPATCH_SCRIPT)
+        self._threads = []
+
+    def save(self, job):
+        self.client.set(self.JOB_KEY.format(job.id), json.dumps(job.to_dict()), ex=self.ttl)
+
+    def load(self, job_id):
+        data = self.client.get(self.JOB_KEY.format(job_id))
+        return Job.from_dict(json.loads(data)) if data else None
+
+    def dispatch(self, job):
+        queued = self._dispatch(keys=[self.QUEUE_KEY, self.JOB_KEY.format(job.id)],
+                                args=[self.queue_size, job.id, json.dumps(job.to_dict()), self.ttl])
+        if not queued:
+            raise JobQueueFull('Job queue is full')
+
+    def start(self):
+        """Start the consumer threads for this process"""
+        if self._threads:
+            return
+        for number in range(self.max_workers):
+            thread = threading.Thread(target=self._consume, name=f'medisync-job-{number}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _consume(self):
+        while True:
+            try:
+                item = self.client.blpop(self.QUEUE_KEY, timeout=5)
+            except Exception:
+                logger.exception('Job queue unavailable; retrying')
+                time.sleep(5)
+                continue
+            if item is not None:
+                run_job(self.app, self, item[1].decode())
+
+
+def run_job(app, backend, job_id):
+    """Execute a queued job inside an application context"""
+    with app.app_context():
+        job = backend.load(job_id)
+        if job is None:
+            return
+        job._backend = backend
+        job.status = RUNNING
+        job.started = _now().isoformat()
+        backend.save(job)
+        started = time.perf_counter()
+        try:
+            job.outcome = _KINDS[job.kind](job, **job.params)
+            job.status = COMPLETED
+            job.fraction = 1.0
+        except Exception as e:
+            logger.exception('Job %s (%s) failed', job.id, job.kind)
+            job.status = FAILED
+            job.message = str(e)
+        job.finished = _now().isoformat()
+        backend.save(job)
+        job_finished.send(app, job=job, seconds=time.perf_counter() - started)
+
+
+def submit(app, kind, **params):
+    """Queue a job of a registered kind; raises JobQueueFull when saturated"""
+    if kind not in _KINDS:
+        raise ValueError(f'Unknown job kind: {kind}')
+    job = Job(kind, params)
+    app.extensions['jobs'].dispatch(job)
+    return job
+
+
+def get_job(app, job_id):
+    return app.extensions['jobs'].load(job_id)
+
+
+def init_app(app):
+    backend = _RedisBackend(app) if app.config.get('JOB_BACKEND') == 'redis' else _LocalBackend(app)
+    app.extensions['jobs'] = backend
+    preload.start_in_worker(app, backend.start)
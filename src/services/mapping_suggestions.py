@@ -0,0 +1,446 @@
+"""
+Candidate NAMASTE -> ICD-11 mappings for curator review.
+
+Every concept becomes a sparse TF-IDF vector over the words of its display
+and definition and the character trigrams of those words (so "jvara" still
+meets "jwara"), with the display weighted above the definition. Rows are
+L2-normalised, so a dot product is the cosine similarity. Features found in
+only one concept cannot match anything, and features in more than
+SUGGEST_MAX_DF of all concepts match almost everything; both are dropped,
+which also keeps the products small.
+
+Scores for a block of NAMASTE rows against every ICD-11 concept are one
+sparse product computed with NumPy: each NAMASTE feature is expanded into
+the ICD-11 postings for that feature and the products are summed per
+(row, target) cell with bincount. argpartition then picks the top k per
+row. Blocks are sized to bound memory and spread over SUGGEST_WORKERS
+processes. NumPy is imported by the functions that use it, so a worker
+only loads it once it scores something.
+
+A full run (POST /ConceptMap/$suggest-mappings, or `flask mappings
+suggest`) replaces the proposed rows of mapping_suggestion with ranked
+candidates. Pairs a curator has accepted or rejected, and pairs already in
+ConceptMapping, are not proposed again. GET ...?code= scores one code live
+against a model kept per process until the next codes_changed.
+"""
+
+import math
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from src.extensions import db
+from src.services import jobs, terminology
+from src.services.search_index import tokenize, trigrams
+
+JOB_KIND = 'suggest-mappings'
+
+PROPOSED = 'proposed'
+ACCEPTED = 'accepted'
+REJECTED = 'rejected'
+
+DEFINITION_WEIGHT = 0.5
+TRIGRAM_WEIGHT = 0.5
+
+# Score cells (and expanded postings) per block: about 32 MB of float64 each
+BLOCK_CELLS = 1 << 22
+
+# Rows per bulk insert
+INSERT_CHUNK = 1000
+
+# Compressed sparse rows: row i has features indices[indptr[i]:indptr[i + 1]] with weights data[...]
+Matrix = namedtuple('Matrix', ['indptr', 'indices', 'data'])
+
+# Per-feature target lists, the transpose of the ICD-11 Matrix
+Postings = namedtuple('Postings', ['indptr', 'targets', 'data', 'n_targets'])
+
+
+class MappingSuggestion(db.Model):
+    """A ranked ICD-11 candidate for a NAMASTE code, awaiting curator review"""
+    __tablename__ = 'mapping_suggestion'
+
+    id = db.Column(db.Integer, primary_key=True)
+    source_code = db.Column(db.String(50), nullable=False)
+    target_code = db.Column(db.String(50), nullable=False)
+    target_display = db.Column(db.String(500))
+    rank = db.Column(db.Integer, nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default=PROPOSED)
+    run_id = db.Column(db.String(32))
+    created_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_mapping_suggestion_source', 'source_code', 'status', 'rank'),
+    )
+
+
+# -- vectors -------------------------------------------------------------
+
+def features(display, definition=''):
+    """{feature: term weight} for a concept: 'w:' words and 'c:' word trigrams"""
+    weights = Counter()
+    for text, weight in ((display, 1.0), (definition, DEFINITION_WEIGHT)):
+        for token in tokenize(text):
+            weights['w:' + token] += weight
+            for gram in trigrams(token):
+                weights['c:' + gram] += weight * TRIGRAM_WEIGHT
+    return weights
+
+
+class Vectorizer:
+    """TF-IDF over features(), fitted on both vocabularies together"""
+
+    def __init__(self, max_df=0.05):
+        import numpy as np
+
+        self.max_df = max_df
+        self.vocabulary = {}
+        self.idf = np.zeros(0)
+
+    def fit(self, documents):
+        import numpy as np
+
+        frequency = Counter()
+        for document in documents:
+            frequency.update(document.keys())
+        limit = max(2, self.max_df * len(documents))
+        kept = sorted(feature for feature, count in frequency.items() if 2 <= count <= limit)
+        self.vocabulary = {feature: index for index, feature in enumerate(kept)}
+        # Smoothed idf, as in most TF-IDF implementations
+        self.idf = np.array([math.log((1 + len(documents)) / (1 + frequency[feature])) + 1 for feature in kept])
+        return self
+
+    def transform(self, documents):
+        """L2-normalised Matrix with one row per document"""
+        import numpy as np
+
+        indptr = [0]
+        indices = []
+        weights = []
+        vocabulary = self.vocabulary
+        for document in documents:
+            for feature, weight in document.items():
+                index = vocabulary.get(feature)
+                if index is not None:
+                    indices.append(index)
+                    # Sublinear tf: a word repeated in a long definition should not dominate
+                    weights.append(1 + math.log(weight) if weight > 1 else weight)
+            indptr.append(len(indices))
+        indptr = np.array(indptr, dtype=np.int64)
+        indices = np.array(indices, dtype=np.int64)
+        data = np.array(weights, dtype=np.float64) * self.idf[indices]
+        norms = np.sqrt(np.add.reduceat(data * data, indptr[:-1])) if len(data) else np.zeros(len(indptr) - 1)
+        # reduceat returns the next row's value for empty rows
+        lengths = np.diff(indptr)
+        norms[lengths == 0] = 1
+        data /= np.repeat(norms, lengths)
+        return Matrix(indptr, indices, data)
+
+
+def transpose(matrix, n_features):
+    """Postings of a Matrix: the rows holding each feature"""
+    import numpy as np
+
+    rows = np.repeat(np.arange(len(matrix.indptr) - 1), np.diff(matrix.indptr))
+    order = np.argsort(matrix.indices, kind='stable')
+    indptr = np.zeros(n_features + 1, dtype=np.int64)
+    np.cumsum(np.bincount(matrix.indices, minlength=n_features), out=indptr[1:])
+    return Postings(indptr, rows[order], matrix.data[order], len(matrix.indptr) - 1)
+
+
+def row_slice(matrix, start, stop):
+    indptr = matrix.indptr[start:stop + 1]
+    first, last = indptr[0], indptr[-1]
+    return Matrix(indptr - first, matrix.indices[first:last], matrix.data[first:last])
+
+
+def blocks(matrix, postings, cells=BLOCK_CELLS):
+    """(start, stop) row ranges whose score grid and expanded postings each fit in about `cells`"""
+    import numpy as np
+
+    lengths = np.diff(postings.indptr)
+    expanded = np.concatenate(([0], np.cumsum(lengths[matrix.indices])))
+    per_row = (expanded[matrix.indptr[1:]] - expanded[matrix.indptr[:-1]]).tolist()
+    n_rows = len(per_row)
+    max_rows = max(1, cells // max(1, postings.n_targets))
+    ranges = []
+    start = 0
+    while start < n_rows:
+        stop = start + 1
+        total = per_row[start]
+        while stop < n_rows and stop - start < max_rows and total + per_row[stop] <= cells:
+            total += per_row[stop]
+            stop += 1
+        ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+def top_k(rows, postings, k, min_score=0.0):
+    """(row, target, score) arrays of the k best targets per row, best first within a row"""
+    import numpy as np
+
+    n_rows = len(rows.indptr) - 1
+    starts = postings.indptr[rows.indices]
+    counts = postings.indptr[rows.indices + 1] - starts
+    total = int(counts.sum())
+    k = min(k, postings.n_targets)
+    if not total or not k:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    # Position in the postings of every (row feature, target) pair the block touches
+    run_starts = np.cumsum(counts) - counts
+    positions = np.arange(total) - np.repeat(run_starts - starts, counts)
+    row_of = np.repeat(np.arange(n_rows), np.diff(rows.indptr))
+    cells = np.repeat(row_of, counts) * postings.n_targets + postings.targets[positions]
+    scores = np.bincount(cells, weights=np.repeat(rows.data, counts) * postings.data[positions],
+                         minlength=n_rows * postings.n_targets).reshape(n_rows, postings.n_targets)
+    best = np.argpartition(scores, -k, axis=1)[:, -k:]
+    best_scores = np.take_along_axis(scores, best, axis=1)
+    order = np.argsort(-best_scores, axis=1, kind='stable')
+    best = np.take_along_axis(best, order, axis=1)
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+    keep = best_scores > max(min_score, 0)
+    return np.nonzero(keep)[0], best[keep], best_scores[keep]
+
+
+# Worker process state, set once by the pool initializer rather than pickled per block
+_worker = {}
+
+
+def _init_worker(postings, k, min_score):
+    _worker.update(postings=postings, k=k, min_score=min_score)
+
+
+def _score_block(block):
+    return top_k(block, _worker['postings'], _worker['k'], _worker['min_score'])
+
+
+# -- model ---------------------------------------------------------------
+
+class Model:
+    """Vectors of every NAMASTE and ICD-11 concept, ready for scoring"""
+
+    def __init__(self, sources, targets, max_df=0.05):
+        documents = [features(c.display, c.definition) for c in sources + targets]
+        self.vectorizer = Vectorizer(max_df).fit(documents)
+        self.source_codes = [c.code for c in sources]
+        self.source_index = {code: index for index, code in enumerate(self.source_codes)}
+        self.target_codes = [c.code for c in targets]
+        self.target_displays = [c.display for c in targets]
+        self.sources = self.vectorizer.transform(documents[:len(sources)])
+        self.postings = transpose(self.vectorizer.transform(documents[len(sources):]),
+                                  len(self.vectorizer.vocabulary))
+
+    @classmethod
+    def load(cls, max_df=0.05):
+        sources, targets = [], []
+        for concept in terminology.iter_concepts():
+            if concept.system == terminology.NAMASTE_SYSTEM:
+                sources.append(concept)
+            elif concept.system == terminology.ICD11_SYSTEM:
+                targets.append(concept)
+        return cls(sources, targets, max_df)
+
+    def suggest(self, code, k, min_score=0.0):
+        """[(target_code, target_display, score)] for one NAMASTE code, or None if it is not loaded"""
+        index = self.source_index.get(code)
+        if index is None:
+            return None
+        _, targets, scores = top_k(row_slice(self.sources, index, index + 1), self.postings, k, min_score)
+        return [(self.target_codes[t], self.target_displays[t], float(s)) for t, s in zip(targets, scores)]
+
+    def suggest_all(self, k, min_score=0.0, workers=1, on_block=None):
+        """Yield (source_code, [(target_index, score)]) for every NAMASTE code with candidates"""
+        import numpy as np
+
+        if not self.source_codes:
+            return
+        ranges = blocks(self.sources, self.postings, BLOCK_CELLS)
+        pieces = (row_slice(self.sources, start, stop) for start, stop in ranges)
+        if workers > 1 and len(ranges) > 1:
+            # spawn: the app runs threads (jobs, audit writer), which fork would copy mid-lock
+            pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=_init_worker, initargs=(self.postings, k, min_score))
+            results = pool.map(_score_block, pieces)
+        else:
+            pool = None
+            results = (top_k(piece, self.postings, k, min_score) for piece in pieces)
+        try:
+            for done, ((start, _), (rows, targets, scores)) in enumerate(zip(ranges, results), 1):
+                # rows is sorted, so each row's candidates are one run
+                bounds = np.flatnonzero(np.diff(rows)) + 1
+                for first, row_targets, row_scores in zip(np.concatenate(([0], bounds)).tolist(),
+                                                          np.split(targets, bounds), np.split(scores, bounds)):
+                    if len(row_targets):
+                        yield (self.source_codes[start + int(rows[first])],
+                               list(zip(row_targets.tolist(), row_scores.tolist())))
+                if on_block is not None:
+                    on_block(done, len(ranges))
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+
+def _settings():
+    config = current_app.config
+    return (config.get('SUGGEST_TOP_K', 10), config.get('SUGGEST_MIN_SCORE', 0.1),
+            config.get('SUGGEST_MAX_DF', 0.05))
+
+
+# -- live suggestions ----------------------------------------------------
+
+def model():
+    """This process's Model, built on first use after startup or a terminology change"""
+    state = current_app.extensions['mapping_suggestions']
+    # Built under the lock so concurrent first requests do not each load every concept
+    with state['lock']:
+        if state['model'] is None:
+            state['model'] = Model.load(_settings()[2])
+        return state['model']
+
+
+def suggest(code, count=None):
+    """[(target_code, target_display, score)] best first, or None if code is not a loaded NAMASTE code"""
+    k, min_score, _ = _settings()
+    return model().suggest(code, k if count is None else count, min_score)
+
+
+def suggestion_parameters(candidates):
+    """FHIR Parameters for $suggest-mappings: $translate-style matches with score and rank"""
+    parameters = [{'name': 'result', 'valueBoolean': bool(candidates)}]
+    if not candidates:
+        parameters.append({'name': 'message', 'valueString': 'No candidates found'})
+    for rank, (code, display, score) in enumerate(candidates, 1):
+        coding = {'system': terminology.ICD11_SYSTEM, 'code': code}
+        if display:
+            coding['display'] = display
+        parameters.append({
+            'name': 'match',
+            'part': [
+                {'name': 'equivalence', 'valueCode': 'relatedto'},
+                {'name': 'concept', 'valueCoding': coding},
+                {'name': 'score', 'valueDecimal': round(score, 4)},
+                {'name': 'rank', 'valueInteger': rank},
+            ],
+        })
+    return {'resourceType': 'Parameters', 'parameter': parameters}
+
+
+# -- full runs -----------------------------------------------------------
+
+def _excluded_pairs():
+    """{source_code: {target_code}} that must not be proposed: reviewed or already mapped"""
+    from src.models import ConceptMapping
+
+    excluded = {}
+    reviewed = db.select(MappingSuggestion.source_code, MappingSuggestion.target_code).where(
+        MappingSuggestion.status != PROPOSED)
+    forward = db.select(ConceptMapping.source_code, ConceptMapping.target_code).where(
+        ConceptMapping.source_system == terminology.NAMASTE_SYSTEM,
+        ConceptMapping.target_system == terminology.ICD11_SYSTEM)
+    reverse = db.select(ConceptMapping.target_code, ConceptMapping.source_code).where(
+        ConceptMapping.source_system == terminology.ICD11_SYSTEM,
+        ConceptMapping.target_system == terminology.NAMASTE_SYSTEM)
+    for query in (reviewed, forward, reverse):
+        for source, target in db.session.execute(query):
+            excluded.setdefault(source, set()).add(target)
+    return excluded
+
+
+def run(top_k=None, min_score=None, workers=None, on_progress=None):
+    """
+    Score every NAMASTE code against all of ICD-11 and replace the proposed suggestions.
+
+    on_progress(blocks_done, blocks_total) is called as blocks finish.
+    Returns counts of sources, targets, features and candidates written,
+    and the run id and time taken.
+    """
+    default_k, default_min_score, max_df = _settings()
+    k = top_k or default_k
+    min_score = default_min_score if min_score is None else min_score
+    workers = workers or current_app.config.get('SUGGEST_WORKERS') or os.cpu_count() or 1
+    started = time.perf_counter()
+
+    built = Model.load(max_df)
+    excluded = _excluded_pairs()
+    # Enough extra candidates that dropping a code's excluded pairs still leaves k
+    extra = max(map(len, excluded.values()), default=0)
+    run_id = uuid.uuid4().hex
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    table = MappingSuggestion.__table__
+
+    # One transaction, so readers see the previous proposals until the new ones are complete
+    db.session.execute(table.delete().where(table.c.status == PROPOSED))
+    written = 0
+    rows = []
+    for source_code, candidates in built.suggest_all(k + extra, min_score, workers, on_progress):
+        skip = excluded.get(source_code, ())
+        ranked = [(target, score) for target, score in candidates if built.target_codes[target] not in skip][:k]
+        rows.extend({
+            'source_code': source_code, 'target_code': built.target_codes[target],
+            'target_display': built.target_displays[target], 'rank': rank, 'score': score,
+            'status': PROPOSED, 'run_id': run_id, 'created_at': now,
+        } for rank, (target, score) in enumerate(ranked, 1))
+        if len(rows) >= INSERT_CHUNK:
+            db.session.execute(table.insert(), rows)
+            written += len(rows)
+            rows = []
+    if rows:
+        db.session.execute(table.insert(), rows)
+        written += len(rows)
+    db.session.commit()
+    return {
+        'run_id': run_id, 'sources': len(built.source_codes), 'targets': len(built.target_codes),
+        'features': len(built.vectorizer.vocabulary), 'candidates': written,
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def _summary(stats):
+    return (f'Proposed {stats["candidates"]} ICD-11 candidates for {stats["sources"]} NAMASTE codes '
+            f'against {stats["targets"]} ICD-11 codes in {stats["seconds"]:.1f}s (run {stats["run_id"]})')
+
+
+@jobs.job_kind(JOB_KIND)
+def suggest_mappings_job(job, top_k=None):
+    """Run the full suggestion pass as a background job"""
+    def report(done, total):
+        job.progress(fraction=done / total)
+
+    stats = run(top_k=top_k, on_progress=report)
+    job.progress(rows_processed=stats['sources'])
+    return {
+        'resourceType': 'OperationOutcome',
+        'issue': [{'severity': 'information', 'code': 'informational', 'details': {'text': _summary(stats)}}],
+    }
+
+
+mappings_cli = AppGroup('mappings', help='NAMASTE to ICD-11 mapping curation.')
+
+
+@mappings_cli.command('suggest')
+@click.option('--top-k', default=None, type=int, help='Candidates per NAMASTE code (default SUGGEST_TOP_K).')
+@click.option('--min-score', default=None, type=float, help='Lowest cosine similarity to propose.')
+@click.option('--workers', default=None, type=int, help='Scoring processes (default SUGGEST_WORKERS).')
+def suggest_command(top_k, min_score, workers):
+    """Propose ranked ICD-11 candidates for every NAMASTE code."""
+    print(_summary(run(top_k=top_k, min_score=min_score, workers=workers)))
+
+
+def _on_codes_changed(app, **changes):
+    app.extensions['mapping_suggestions']['model'] = None
+
+
+def init_app(app):
+    app.extensions['mapping_suggestions'] = {'lock': threading.Lock(), 'model': None}
+    terminology.codes_changed.connect(_on_codes_changed, sender=app, weak=False)
+    app.cli.add_command(mappings_cli)
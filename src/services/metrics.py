@@ -0,0 +1,252 @@
+"""
+Prometheus metrics for the API.
+
+Every request is timed per blueprint and endpoint, along with the number
+of SQL statements it ran and the time spent in them (SQLAlchemy cursor
+events); the database share is also sent as a Server-Timing entry
+("db;dur=<ms>;desc=..."). Connection pool checkouts are timed from the
+moment a connection is requested, so a pool that is too small for
+SQLALCHEMY_ENGINE_OPTIONS shows up as checkout wait. Cache hits and misses
+(translations, ABHA tokens, consent decisions) and ingest/sync throughput
+(codes written per system, background jobs) are counted as they happen.
+
+GET /metrics returns the text exposition format. Under gunicorn, set
+PROMETHEUS_MULTIPROC_DIR (gunicorn.conf.py does) so that each worker
+writes its samples to that directory and any worker answering a scrape
+reports the sum over all of them.
+"""
+
+import os
+import threading
+import time
+from collections import Counter as Tally
+
+from flask import current_app, g, has_request_context, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from src.extensions import db
+from src.services import jobs, terminology
+
+# Seconds; request latencies from a cached $translate up to a large Bundle
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+REQUESTS = Counter('medisync_http_requests_total', 'Requests handled',
+                   ['blueprint', 'endpoint', 'method', 'status'])
+REQUEST_LATENCY = Histogram('medisync_http_request_duration_seconds', 'Time to build the response',
+                            ['blueprint', 'endpoint', 'method'], buckets=LATENCY_BUCKETS)
+REQUEST_QUERIES = Histogram('medisync_http_request_db_queries', 'SQL statements per request',
+                            ['blueprint', 'endpoint'], buckets=QUERY_COUNT_BUCKETS)
+REQUEST_DB_TIME = Histogram('medisync_http_request_db_seconds', 'Time in SQL statements per request',
+                            ['blueprint', 'endpoint'], buckets=LATENCY_BUCKETS)
+
+QUERY_LATENCY = Histogram('medisync_db_query_duration_seconds', 'SQL statement execution time',
+                          buckets=QUERY_BUCKETS)
+POOL_WAIT = Histogram('medisync_db_pool_checkout_wait_seconds', 'Time to obtain a pooled connection',
+                      buckets=QUERY_BUCKETS)
+POOL_HELD = Histogram('medisync_db_pool_checkout_held_seconds', 'Time a connection stays checked out',
+                      buckets=LATENCY_BUCKETS)
+POOL_CHECKED_OUT = Gauge('medisync_db_pool_checked_out', 'Connections currently checked out',
+                         multiprocess_mode='livesum')
+POOL_SIZE = Gauge('medisync_db_pool_size', 'Configured pool size (without overflow)',
+                  multiprocess_mode='livesum')
+
+CACHE_LOOKUPS = Counter('medisync_cache_lookups_total', 'Cache lookups by result', ['cache', 'result'])
+
+TERMINOLOGY_CHANGES = Counter('medisync_terminology_codes_changed_total', 'Codes written or deleted by ingest/sync',
+                              ['system', 'change'])
+JOBS = Counter('medisync_jobs_total', 'Background jobs finished', ['kind', 'status'])
+JOB_ROWS = Counter('medisync_job_rows_total', 'Rows processed by finished background jobs', ['kind'])
+JOB_DURATION = Histogram('medisync_job_duration_seconds', 'Background job run time', ['kind'],
+                         buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600))
+
+
+def multiprocess_dir():
+    return os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir')
+
+
+def exposition():
+    """Current metrics in the text format, summed over all workers in multiprocess mode"""
+    if multiprocess_dir():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+
+def metrics_view():
+    return current_app.response_class(exposition(), mimetype=None, content_type=CONTENT_TYPE_LATEST)
+
+
+# -- requests ------------------------------------------------------------
+
+def _labels():
+    endpoint = request.url_rule.endpoint if request.url_rule is not None else 'unmatched'
+    return request.blueprint or '', endpoint
+
+
+def _start_request():
+    g.metrics = {'started': time.perf_counter(), 'queries': 0, 'db_seconds': 0.0}
+
+
+def _observe(status):
+    state = g.pop('metrics', None)
+    if state is None:
+        return None
+    blueprint, endpoint = _labels()
+    REQUESTS.labels(blueprint, endpoint, request.method, str(status)).inc()
+    REQUEST_LATENCY.labels(blueprint, endpoint, request.method).observe(time.perf_counter() - state['started'])
+    REQUEST_QUERIES.labels(blueprint, endpoint).observe(state['queries'])
+    REQUEST_DB_TIME.labels(blueprint, endpoint).observe(state['db_seconds'])
+    _count_cache_lookups()
+    return state
+
+
+def _finish_request(response):
+    state = _observe(response.status_code)
+    if state is not None and state['queries']:
+        entry = f'db;dur={state["db_seconds"] * 1000:.3f};desc="{state["queries"]} queries"'
+        existing = response.headers.get('Server-Timing')
+        response.headers['Server-Timing'] = f'{existing}, {entry}' if existing else entry
+    return response
+
+
+def _fail_request(error):
+    # after_request does not run when the view raised
+    if error is not None:
+        _observe(500)
+
+
+# -- SQL statements and the connection pool ------------------------------
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['metrics_query_started'] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('metrics_query_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    QUERY_LATENCY.observe(elapsed)
+    if has_request_context():
+        state = g.get('metrics')
+        if state is not None:
+            state['queries'] += 1
+            state['db_seconds'] += elapsed
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    connection_record.info['metrics_checked_out'] = time.perf_counter()
+    POOL_CHECKED_OUT.inc()
+
+
+def _on_checkin(dbapi_connection, connection_record):
+    started = connection_record.info.pop('metrics_checked_out', None)
+    if started is not None:
+        POOL_HELD.observe(time.perf_counter() - started)
+        POOL_CHECKED_OUT.dec()
+
+
+def _time_checkouts(pool):
+    """Wrap pool.connect so the wait for a free connection is measured (the pool has no event for it)"""
+    if getattr(pool.connect, 'metrics_timed', False):
+        return
+    connect = pool.connect
+
+    def timed_connect():
+        started = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - started)
+    timed_connect.metrics_timed = True
+    pool.connect = timed_connect
+
+
+def _on_engine_disposed(engine):
+    # dispose() replaces the pool; its event listeners carry over but the wrapper does not
+    _time_checkouts(engine.pool)
+
+
+def _instrument_engine(engine):
+    if event.contains(engine, 'checkout', _on_checkout):
+        return
+    event.listen(engine, 'checkout', _on_checkout)
+    event.listen(engine, 'checkin', _on_checkin)
+    event.listen(engine, 'engine_disposed', _on_engine_disposed)
+    _time_checkouts(engine.pool)
+    # Static and null pools (SQLite) have no size
+    if hasattr(engine.pool, 'size'):
+        POOL_SIZE.inc(engine.pool.size())
+
+
+# -- caches, ingest and jobs ---------------------------------------------
+
+def _cache_totals(app):
+    """{(cache, result): running total} from the per-process counters the caches keep"""
+    totals = {}
+    cache = app.extensions.get('translation_cache')
+    if cache is not None:
+        totals.update({('translation', 'hit'): cache.hits, ('translation', 'shared_hit'): cache.shared_hits,
+                       ('translation', 'miss'): cache.misses})
+    validator = app.extensions.get('abha_auth')
+    if validator is not None:
+        totals.update({('abha_token', 'hit'): validator.stats['hits'],
+                       ('abha_token', 'miss'): validator.stats['misses']})
+    return totals
+
+
+def _count_cache_lookups():
+    timing = g.get('consent_timing')
+    if timing and timing['checks']:
+        CACHE_LOOKUPS.labels('consent', 'hit').inc(timing['hits'])
+        CACHE_LOOKUPS.labels('consent', 'miss').inc(timing['checks'] - timing['hits'])
+    # The caches count in plain attributes; only what changed since the last request is added
+    state = current_app.extensions['metrics']
+    with state['lock']:
+        for key, total in _cache_totals(current_app).items():
+            seen = state['cache_totals'].get(key, 0)
+            if total > seen:
+                CACHE_LOOKUPS.labels(*key).inc(total - seen)
+            state['cache_totals'][key] = total
+
+
+def _on_codes_changed(app, upserted=(), deleted=()):
+    for system, count in Tally(concept.system for concept in upserted).items():
+        TERMINOLOGY_CHANGES.labels(system, 'upserted').inc(count)
+    for system, count in Tally(system for system, _ in deleted).items():
+        TERMINOLOGY_CHANGES.labels(system, 'deleted').inc(count)
+
+
+def _on_job_finished(app, job=None, seconds=None):
+    JOBS.labels(job.kind, job.status).inc()
+    JOB_ROWS.labels(job.kind).inc(job.rows_processed or 0)
+    JOB_DURATION.labels(job.kind).observe(seconds)
+
+
+def init_app(app):
+    """Time requests, SQL and pool checkouts, and serve GET /metrics"""
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    app.extensions['metrics'] = {'lock': threading.Lock(), 'cache_totals': {}}
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_fail_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+    # Engine listeners are process-wide, so only attach them once
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    with app.app_context():
+        for engine in db.engines.values():
+            _instrument_engine(engine)
+
+    terminology.codes_changed.connect(_on_codes_changed, sender=app, weak=False)
+    jobs.job_finished.connect(_on_job_finished, sender=app, weak=False)
@@ -0,0 +1,210 @@
+"""
+Streaming, chunked loader for NAMASTE CSV releases.
+
+Parses the upload row by row, validates a fixed-size chunk at a time and
+writes each chunk with a single bulk upsert (INSERT ... ON DUPLICATE KEY
+UPDATE on MySQL, ON CONFLICT DO UPDATE on SQLite/PostgreSQL). Only one
+chunk of rows is held in memory at any point, plus the set of codes
+already written, so a code repeated anywhere in the file is reported as a
+duplicate and its last occurrence kept.
+"""
+
+import csv
+import io
+import os
+import time
+
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+
+from src.extensions import db
+from src.services import hierarchy, jobs, terminology
+
+REQUIRED_COLUMNS = ('code', 'display')
+UPDATE_COLUMNS = ('display', 'definition', 'category', 'parent_code')
+MAX_CODE_LENGTH = 50
+
+# Issues beyond this are only counted, so a bad file cannot grow the response
+MAX_ISSUES = 1000
+
+
+class LoadResult:
+    """Running totals and OperationOutcome issues for one load"""
+
+    def __init__(self):
+        self.rows_read = 0
+        self.rows_written = 0
+        self.rows_rejected = 0
+        self.duplicates = 0
+        self.chunks = 0
+        self.issues = []
+        self.suppressed_issues = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows_read / self.elapsed if self.elapsed else 0.0
+
+    def add_issue(self, severity, code, text, chunk=None, row=None):
+        if len(self.issues) >= MAX_ISSUES:
+            self.suppressed_issues += 1
+            return
+        if chunk is not None:
+            text = f'Chunk {chunk}: {text}'
+        issue = {'severity': severity, 'code': code, 'details': {'text': text}}
+        if row is not None:
+            issue['location'] = [f'line {row}']
+        self.issues.append(issue)
+
+    def summary(self):
+        return (
+            f'Loaded {self.rows_written} of {self.rows_read} rows in {self.chunks} chunks '
+            f'({self.elapsed:.2f}s, {self.rows_per_second:.0f} rows/sec); '
+            f'{self.rows_rejected} rejected, {self.duplicates} duplicates'
+        )
+
+    def to_operation_outcome(self):
+        text = self.summary()
+        if self.suppressed_issues:
+            text += f'; {self.suppressed_issues} further issues not listed'
+        summary = {'severity': 'information', 'code': 'informational', 'details': {'text': text}}
+        return {'resourceType': 'OperationOutcome', 'issue': [summary] + self.issues}
+
+
+def upsert_statement(table, dialect_name, update_columns=UPDATE_COLUMNS):
+    """Bulk upsert keyed on the unique code column for the active dialect"""
+    if dialect_name == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table)
+        return stmt.on_duplicate_key_update({column: stmt.inserted[column] for column in update_columns})
+    if dialect_name in ('sqlite', 'postgresql'):
+        if dialect_name == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(table)
+        return stmt.on_conflict_do_update(
+            index_elements=['code'],
+            set_={column: stmt.excluded[column] for column in update_columns},
+        )
+    raise ValueError(f'Bulk upsert is not supported for {dialect_name}')
+
+
+def _clean(record, line, result, chunk_no):
+    """Validate one CSV record; return a row dict or None if rejected"""
+    code = (record.get('code') or '').strip()
+    display = (record.get('display') or '').strip()
+    if not code or not display:
+        result.add_issue('error', 'required', 'Row is missing code or display', chunk_no, line)
+        return None
+    if len(code) > MAX_CODE_LENGTH:
+        result.add_issue('error', 'too-long', f'Code {code[:20]}... exceeds {MAX_CODE_LENGTH} characters',
+                         chunk_no, line)
+        return None
+    return {
+        'code': code,
+        'display': display,
+        'definition': (record.get('definition') or '').strip() or None,
+        'category': (record.get('category') or '').strip() or None,
+        'parent_code': (record.get('parent_code') or '').strip() or None,
+    }
+
+
+def _write_chunk(rows, statement, result, chunk_no):
+    try:
+        db.session.execute(statement, rows)
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        result.rows_rejected += len(rows)
+        result.add_issue('error', 'exception', f'Chunk failed to load: {e}', chunk_no)
+        return False
+    return True
+
+
+def load_csv(stream, chunk_size=1000, encoding='utf-8-sig', on_chunk=None):
+    """
+    Load a NAMASTE CSV from a binary stream into NAMASTECode.
+
+    on_chunk, if given, is called with the LoadResult after every chunk.
+    """
+    from src.models import NAMASTECode
+
+    result = LoadResult()
+    statement = upsert_statement(NAMASTECode.__table__, db.engine.dialect.name)
+    text = io.TextIOWrapper(stream, encoding=encoding, errors='replace', newline='')
+    try:
+        _load_rows(csv.DictReader(text), statement, chunk_size, result, on_chunk)
+    finally:
+        # Leave the caller's stream open
+        text.detach()
+    if result.rows_written:
+        hierarchy.add_issues(terminology.NAMASTE_SYSTEM, result)
+    result.elapsed = time.perf_counter() - result.started
+    return result
+
+
+def _load_rows(reader, statement, chunk_size, result, on_chunk):
+    missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or ())]
+    if missing:
+        result.add_issue('fatal', 'structure', f'CSV is missing required columns: {", ".join(missing)}')
+        return
+
+    chunk = {}
+    # Codes of chunks already written; a later occurrence overwrites the row
+    # but is counted as a duplicate, not as another row written
+    written = set()
+
+    def flush():
+        result.chunks += 1
+        rows = list(chunk.values())
+        if _write_chunk(rows, statement, result, result.chunks):
+            result.rows_written += len(chunk.keys() - written)
+            written.update(chunk)
+            terminology.codes_changed.send(
+                current_app._get_current_object(),
+                upserted=[
+                    terminology.Concept(terminology.NAMASTE_SYSTEM, row['code'], row['display'],
+                                        row['definition'] or '', row['parent_code'])
+                    for row in rows
+                ],
+                deleted=[],
+            )
+        chunk.clear()
+        result.elapsed = time.perf_counter() - result.started
+        if on_chunk is not None:
+            on_chunk(result)
+
+    for record in reader:
+        line = reader.line_num
+        result.rows_read += 1
+        row = _clean(record, line, result, result.chunks + 1)
+        if row is None:
+            result.rows_rejected += 1
+            continue
+        if row['code'] in chunk or row['code'] in written:
+            result.duplicates += 1
+            result.add_issue('warning', 'duplicate', f'Duplicate code {row["code"]}; last occurrence kept',
+                             result.chunks + 1, line)
+        chunk[row['code']] = row
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+
+
+@jobs.job_kind('ingest-csv')
+def ingest_csv_job(job, path, chunk_size):
+    """Load a spooled CSV upload as a background job, then remove the file"""
+    size = os.path.getsize(path) or 1
+    try:
+        with open(path, 'rb') as f:
+            def report(result):
+                job.progress(rows_processed=result.rows_read, errors=result.rows_rejected, fraction=f.tell() / size)
+
+            result = load_csv(f, chunk_size=chunk_size, on_chunk=report)
+    finally:
+        os.remove(path)
+    job.progress(rows_processed=result.rows_read, errors=result.rows_rejected)
+    return result.to_operation_outcome()
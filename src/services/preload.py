@@ -0,0 +1,62 @@
+"""
+Worker startup under a forking server (gunicorn, see gunicorn.conf.py).
+
+With preload_app the gunicorn master builds the app once before forking,
+so the search index, the mapped terminology snapshot and every imported
+module are shared with the workers copy-on-write instead of being rebuilt
+in each. Two things must not cross the fork: threads (a child only has the
+thread that forked it) and open sockets (two processes would read from
+one connection). Services therefore start their threads through
+start_in_worker(), which holds them back while DEFER_WORKER_THREADS is set,
+and after_fork() drops the connections the master opened while loading
+before starting them.
+
+Dependencies only some requests need (NumPy, httpx, PyJWT) are imported on
+first use, which keeps `flask` commands and unpreloaded workers quick to
+start; warm() imports them in a preloading master so workers inherit them.
+"""
+
+import gc
+import importlib
+import logging
+
+from src.extensions import db
+
+logger = logging.getLogger(__name__)
+
+# Imported lazily by mapping_suggestions, icd11_sync and abha_auth
+WARM_MODULES = ('numpy', 'httpx', 'jwt')
+
+
+def start_in_worker(app, start):
+    """Call start() now, or from after_fork() when DEFER_WORKER_THREADS is set"""
+    if app.config.get('DEFER_WORKER_THREADS'):
+        app.extensions.setdefault('worker_starts', []).append(start)
+    else:
+        start()
+
+
+def warm(app):
+    """In the master, once loaded: import the lazy dependencies and freeze the heap before forking"""
+    for name in WARM_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            logger.info('%s is not installed; not preloaded', name)
+    # Frozen objects are never scanned by the collector, which would otherwise
+    # write to (and so copy) the pages of every shared object in every worker
+    gc.collect()
+    gc.freeze()
+
+
+def after_fork(app):
+    """In each worker: new database and search connections, then the deferred threads"""
+    with app.app_context():
+        for engine in db.engines.values():
+            # close=False: the pooled connections still belong to the master
+            engine.dispose(close=False)
+    backend = app.extensions.get('search_backend')
+    if backend is not None:
+        backend.after_fork(app)
+    for start in app.extensions.pop('worker_starts', []):
+        start()
@@ -0,0 +1,231 @@
+"""
+Token-bucket rate limiting for the API.
+
+Every client has one bucket per endpoint. A client is its ABHA subject when
+the request carries a bearer token that abha_auth has already validated
+(only its cache is consulted, so an unknown token never costs a JWKS fetch
+or an introspection call here) and its IP address otherwise. The address
+is request.remote_addr, which only reflects X-Forwarded-For when
+TRUSTED_PROXIES puts ProxyFix in front of the app (see create_app). An
+"N/period" limit gives a bucket of N tokens that refills continuously at N
+per period; each request takes one token, and a request finding the bucket
+empty gets 429 with Retry-After.
+
+RATELIMIT_DEFAULT applies to every endpoint; RATELIMIT_ENDPOINTS overrides
+it per endpoint ("api_ops.process_bundle=20/minute;api_ops.health=unlimited").
+Endpoints in RATELIMIT_EXEMPT (by default the Prometheus scrape and static
+files) are never limited.
+Buckets are kept in process memory, or in Redis when RATELIMIT_STORAGE is
+'redis': a Lua script then refills and takes tokens atomically, so all
+gunicorn workers share one count per client. If Redis cannot be reached,
+requests are let through rather than failed.
+"""
+
+import logging
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, jsonify, request
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+_LIMIT_PATTERN = re.compile(r'^\s*(\d+)\s*(?:/|per)\s*(\d*)\s*(second|minute|hour|day)s?\s*$', re.IGNORECASE)
+
+# Refills the bucket from the time elapsed (by the Redis clock, so workers
+# on different hosts agree), takes a token if one is left and expires the
+# bucket once it would be full again
+TAKE_TOKEN_SCRIPT = """
+redis.replicate_commands()
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+
+
+class Limit:
+    """N requests per period, as a bucket capacity and a refill rate"""
+
+    __slots__ = ('text', 'capacity', 'rate')
+
+    def __init__(self, text, capacity, period):
+        self.text = text
+        self.capacity = capacity
+        self.rate = capacity / period
+
+    def __repr__(self):
+        return f'Limit({self.text!r})'
+
+
+def parse_limit(text):
+    """Limit for "100/hour", "5 per 10 minutes" etc.; None for "unlimited" """
+    text = (text or '').strip()
+    if text.lower() in ('unlimited', 'none', ''):
+        return None
+    match = _LIMIT_PATTERN.match(text)
+    if match is None or int(match.group(1)) < 1:
+        raise ValueError(f'Invalid rate limit {text!r}; expected e.g. "100/hour" or "10 per 5 minutes"')
+    count, multiple, unit = match.groups()
+    return Limit(text, int(count), int(multiple or 1) * PERIODS[unit.lower()])
+
+
+def parse_endpoint_limits(spec):
+    """{endpoint: Limit or None} from "endpoint=limit;endpoint=limit" """
+    limits = {}
+    for item in (spec or '').split(';'):
+        if not item.strip():
+            continue
+        endpoint, separator, text = item.partition('=')
+        if not separator:
+            raise ValueError(f'Invalid RATELIMIT_ENDPOINTS entry {item!r}; expected endpoint=limit')
+        limits[endpoint.strip()] = parse_limit(text)
+    return limits
+
+
+class MemoryBackend:
+    """Buckets in this process; right for a single worker"""
+
+    def __init__(self, max_buckets=100000):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, limit):
+        """Take a token; returns (allowed, tokens left, seconds until the next token)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (limit.capacity, now))
+            tokens = min(limit.capacity, tokens + (now - updated) * limit.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            # The least recently used bucket has refilled the longest, so forgetting it loses the least
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        return allowed, int(tokens), 0 if allowed else (1 - tokens) / limit.rate
+
+
+class RedisBackend:
+    """Buckets in Redis, shared by every worker; one atomic script call per request"""
+
+    KEY_PREFIX = 'medisync:ratelimit:'
+
+    def __init__(self, client):
+        self.client = client
+        self._take = client.register_script(TAKE_TOKEN_SCRIPT)
+
+    def take(self, key, limit):
+        try:
+            allowed, tokens = self._take(keys=[self.KEY_PREFIX + key], args=[limit.capacity, limit.rate])
+        except Exception as e:
+            logger.warning('Rate limit store unavailable, request allowed: %s', e)
+            return True, None, 0
+        tokens = float(tokens)
+        return bool(allowed), int(tokens), 0 if allowed else (1 - tokens) / limit.rate
+
+
+class RateLimiter:
+    """Limits per endpoint on top of a bucket backend"""
+
+    def __init__(self, backend, default=None, endpoints=None, exempt=()):
+        self.backend = backend
+        self.default = default
+        self.endpoints = endpoints or {}
+        self.exempt = frozenset(exempt)
+        self.stats = {'allowed': 0, 'limited': 0}
+
+    @classmethod
+    def from_config(cls, config):
+        storage = config.get('RATELIMIT_STORAGE', 'memory')
+        if storage == 'redis':
+            import redis
+            backend = RedisBackend(redis.Redis.from_url(config['REDIS_URL']))
+        elif storage == 'memory':
+            backend = MemoryBackend()
+        else:
+            raise ValueError(f'Unknown RATELIMIT_STORAGE: {storage}')
+        exempt = [name.strip() for name in config.get('RATELIMIT_EXEMPT', '').split(',') if name.strip()]
+        return cls(backend, parse_limit(config.get('RATELIMIT_DEFAULT')),
+                   parse_endpoint_limits(config.get('RATELIMIT_ENDPOINTS')), exempt)
+
+    def limit_for(self, endpoint):
+        if endpoint in self.exempt:
+            return None
+        return self.endpoints.get(endpoint, self.default)
+
+    def take(self, endpoint, client):
+        """(limit, allowed, tokens left, retry after) for one request; limit is None when unlimited"""
+        limit = self.limit_for(endpoint)
+        if limit is None:
+            return None, True, None, 0
+        allowed, remaining, retry_after = self.backend.take(f'{endpoint}|{client}', limit)
+        self.stats['allowed' if allowed else 'limited'] += 1
+        return limit, allowed, remaining, retry_after
+
+
+def client_key():
+    """ABHA subject of the request's bearer token if already validated, else the client IP"""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    validator = current_app.extensions.get('abha_auth')
+    if validator is not None and scheme.lower() == 'bearer' and token.strip():
+        # Never validate here: this runs before auth, for every request
+        claims = validator.cached(token.strip()) or {}
+        subject = claims.get('sub') or claims.get('username')
+        if subject:
+            return f'sub:{subject}'
+    return f'ip:{request.remote_addr or ""}'
+
+
+def _enforce():
+    if not current_app.config.get('RATELIMIT_ENABLED') or request.method == 'OPTIONS':
+        return None
+    limiter = current_app.extensions['rate_limit']
+    limit, allowed, remaining, retry_after = limiter.take(request.endpoint or 'unmatched', client_key())
+    if limit is None:
+        return None
+    g.rate_limit = (limit, remaining)
+    if allowed:
+        return None
+    response = jsonify({
+        'resourceType': 'OperationOutcome',
+        'issue': [{'severity': 'error', 'code': 'throttled',
+                   'details': {'text': f'Rate limit of {limit.text} exceeded; retry in {math.ceil(retry_after)}s'}}],
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(math.ceil(retry_after))
+    return response
+
+
+def _add_headers(response):
+    state = g.get('rate_limit')
+    if state is not None:
+        limit, remaining = state
+        response.headers['RateLimit-Limit'] = str(limit.capacity)
+        if remaining is not None:
+            response.headers['RateLimit-Remaining'] = str(remaining)
+    return response
+
+
+def init_app(app):
+    app.extensions['rate_limit'] = RateLimiter.from_config(app.config)
+    app.before_request(_enforce)
+    app.after_request(_add_headers)
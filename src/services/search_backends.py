@@ -0,0 +1,207 @@
+"""
+Pluggable backends behind /valueset/search.
+
+SEARCH_BACKEND picks one per app: 'memory' (the per-worker SearchIndex),
+'elasticsearch' (one shared index, see search_elasticsearch) or 'database'
+(LIKE queries straight against the code tables, nothing to warm up). Every
+backend returns (Concept, rank) pairs, best match first, and is kept
+current from terminology.codes_changed. If the configured backend cannot
+answer, the query is served from the database instead.
+"""
+
+import logging
+import time
+
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import case, func, or_
+from sqlalchemy.exc import SQLAlchemyError
+
+from src.extensions import db
+from src.services import search_index, terminology, terminology_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+class SearchUnavailable(Exception):
+    """The backend could not answer (connection lost, index missing, ...)"""
+
+
+class SearchBackend:
+    """Interface every /valueset/search backend implements"""
+
+    name = None
+
+    def search(self, query, limit=20, system=None):
+        """Up to limit (Concept, rank) pairs, best first; raises SearchUnavailable"""
+        raise NotImplementedError
+
+    def upsert(self, concepts):
+        pass
+
+    def remove(self, keys):
+        pass
+
+    def rebuild(self, concepts):
+        """Replace the backend's contents with the given concepts; returns how many"""
+        return 0
+
+    def start(self, app):
+        """Prepare the backend when the app starts"""
+
+    def after_fork(self, app):
+        """Replace anything a preloading master opened that a forked worker must not share"""
+
+
+class MemoryBackend(SearchBackend):
+    """The in-process SearchIndex; each worker holds its own copy (shared copy-on-write when preloaded)"""
+
+    name = 'memory'
+
+    def __init__(self, index=None):
+        self.index = index if index is not None else search_index.SearchIndex()
+
+    def search(self, query, limit=20, system=None):
+        if self.index.built_at is None:
+            # Startup could not build it (e.g. tables not created yet)
+            try:
+                self.rebuild(terminology_snapshot.iter_concepts())
+            except SQLAlchemyError as e:
+                raise SearchUnavailable(f'Search index not built: {e}')
+        return self.index.search(query, limit=limit, system=system)
+
+    def upsert(self, concepts):
+        if self.index.built_at is not None:
+            self.index.upsert(concepts)
+
+    def remove(self, keys):
+        if self.index.built_at is not None:
+            self.index.remove(keys)
+
+    def rebuild(self, concepts):
+        self.index.build(concepts)
+        return len(self.index)
+
+    def start(self, app):
+        app.extensions['search_index'] = self.index
+        if app.config.get('SEARCH_INDEX_BUILD_ON_STARTUP', True):
+            started = time.perf_counter()
+            try:
+                # From the mapped snapshot when there is one, so workers do not all query the tables
+                count = self.rebuild(terminology_snapshot.iter_concepts())
+            except SQLAlchemyError as e:
+                logger.warning('Search index build deferred: %s', e)
+                return
+            logger.info('Search index built with %d concepts in %.2fs', count, time.perf_counter() - started)
+
+
+class DatabaseBackend(SearchBackend):
+    """LIKE queries against NAMASTECode/ICD11Code, ranked with the SearchIndex tiers"""
+
+    name = 'database'
+
+    def search(self, query, limit=20, system=None):
+        from src.models import NAMASTECode, ICD11Code
+
+        text = ' '.join(query.lower().split())
+        if not text or limit <= 0:
+            return []
+        escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        sources = (
+            (terminology.NAMASTE_SYSTEM, NAMASTECode, NAMASTECode.display, terminology.namaste_concept),
+            (terminology.ICD11_SYSTEM, ICD11Code, ICD11Code.title, terminology.icd11_concept),
+        )
+        hits = []
+        try:
+            for concept_system, model, display, to_concept in sources:
+                if system is not None and system != concept_system:
+                    continue
+                code, name = func.lower(model.code), func.lower(display)
+                tier = case(
+                    (code == text, search_index.TIER_CODE_EXACT),
+                    (code.like(f'{escaped}%', escape='\\'), search_index.TIER_CODE_PREFIX),
+                    (name == text, search_index.TIER_DISPLAY_EXACT),
+                    (or_(name.like(f'{escaped}%', escape='\\'), name.like(f'% {escaped}%', escape='\\')),
+                     search_index.TIER_DISPLAY_PREFIX),
+                    else_=search_index.TIER_DISPLAY_INFIX,
+                )
+                rows = db.session.execute(
+                    db.select(model, tier)
+                    .where(or_(code.like(f'{escaped}%', escape='\\'), name.like(f'%{escaped}%', escape='\\')))
+                    .order_by(tier, func.length(display), model.code)
+                    .limit(limit)
+                ).all()
+                hits.extend((to_concept(row), rank) for row, rank in rows)
+        except SQLAlchemyError as e:
+            raise SearchUnavailable(str(e))
+        hits.sort(key=lambda hit: (hit[1], len(hit[0].display), hit[0].code))
+        return hits[:limit]
+
+
+def create_backend(app):
+    """The backend named by SEARCH_BACKEND"""
+    name = app.config.get('SEARCH_BACKEND', 'memory')
+    if name == 'elasticsearch':
+        from src.services.search_elasticsearch import ElasticsearchBackend
+        return ElasticsearchBackend.from_config(app)
+    if name == 'database':
+        return DatabaseBackend()
+    if name != 'memory':
+        raise ValueError(f'Unknown SEARCH_BACKEND: {name}')
+    return MemoryBackend()
+
+
+def get_backend(app):
+    return app.extensions['search_backend']
+
+
+def set_backend(app, backend):
+    """Install a backend on the app (create_app does this; tests can swap in another)"""
+    app.extensions['search_backend'] = backend
+    with app.app_context():
+        backend.start(app)
+    return backend
+
+
+def search(app, query, limit=20, system=None):
+    """(Concept, rank) pairs from the app's backend, or from the database if it is down"""
+    backend = get_backend(app)
+    try:
+        return backend.search(query, limit=limit, system=system)
+    except SearchUnavailable as e:
+        if isinstance(backend, DatabaseBackend):
+            raise
+        logger.warning('%s search unavailable, answering from the database: %s', backend.name, e)
+        return DatabaseBackend().search(query, limit=limit, system=system)
+
+
+def _on_codes_changed(app, upserted=(), deleted=()):
+    backend = app.extensions.get('search_backend')
+    if backend is None:
+        return
+    try:
+        if deleted:
+            backend.remove(deleted)
+        if upserted:
+            backend.upsert(upserted)
+    except SearchUnavailable as e:
+        logger.warning('%s search index not updated; run "flask search reindex": %s', backend.name, e)
+
+
+search_cli = AppGroup('search', help='/valueset/search index maintenance.')
+
+
+@search_cli.command('reindex')
+def reindex_command():
+    """Rebuild the search index from the code tables (Elasticsearch: new index, then alias swap)."""
+    backend = get_backend(current_app)
+    started = time.perf_counter()
+    count = backend.rebuild(terminology.iter_concepts())
+    print(f'{backend.name}: indexed {count} concepts in {time.perf_counter() - started:.2f}s')
+
+
+def init_app(app):
+    """Attach the configured search backend and keep it in step with ingest/sync"""
+    set_backend(app, create_backend(app))
+    terminology.codes_changed.connect(_on_codes_changed, sender=app, weak=False)
+    app.cli.add_command(search_cli)
@@ -0,0 +1,272 @@
+"""
+Elasticsearch backend for /valueset/search.
+
+Concepts live in a versioned index (medisync-concepts-<timestamp>) reached
+through an alias, so every worker shares one index. Display text is indexed
+with edge n-grams for prefix-as-you-type matching, codes as normalized
+keywords, and a transliteration-folded copy of the display lets 'Shwasa',
+'Svasa' and 'Swaasa' meet. Ingest and sync changes arrive as bulk requests
+through codes_changed. A reindex loads a fresh index while the old one keeps
+serving; while it loads, every worker mirrors its writes into the new
+index (found through a second alias), then the alias is swapped atomically
+and the old index dropped.
+"""
+
+import logging
+from datetime import datetime, timezone
+
+from src.services import terminology
+from src.services.search_backends import SearchBackend, SearchUnavailable
+
+logger = logging.getLogger(__name__)
+
+# Native-script text (Devanagari, Tamil, Arabic/Urdu) is normalized per
+# script; romanized text is lowercased and stripped of diacritics (IAST).
+_BASE_FILTERS = ['lowercase', 'decimal_digit', 'indic_normalization', 'arabic_normalization', 'asciifolding']
+
+ANALYSIS = {
+    'filter': {
+        'autocomplete_ngram': {'type': 'edge_ngram', 'min_gram': 1, 'max_gram': 20},
+        # Spelling variants common in Sanskrit/Tamil/Urdu romanizations:
+        # doubled vowels (aa/ee/oo), aspirates (kh/sh/th/dh/bh) and w/v
+        'translit_vowels': {'type': 'pattern_replace', 'pattern': '([aeiou])\\1+', 'replacement': '$1'},
+        'translit_aspirates': {'type': 'pattern_replace', 'pattern': '([bcdgkpst])h', 'replacement': '$1'},
+        'translit_w': {'type': 'pattern_replace', 'pattern': 'w', 'replacement': 'v'},
+    },
+    'normalizer': {
+        'code': {'type': 'custom', 'filter': ['lowercase', 'asciifolding']},
+    },
+    'analyzer': {
+        'multilingual': {'type': 'custom', 'tokenizer': 'standard', 'filter': _BASE_FILTERS},
+        'autocomplete': {'type': 'custom', 'tokenizer': 'standard', 'filter': _BASE_FILTERS + ['autocomplete_ngram']},
+        'transliteration': {
+            'type': 'custom',
+            'tokenizer': 'standard',
+            'filter': _BASE_FILTERS + ['translit_vowels', 'translit_aspirates', 'translit_w'],
+        },
+    },
+}
+
+MAPPINGS = {
+    'dynamic': 'strict',
+    'properties': {
+        'system': {'type': 'keyword'},
+        'code': {'type': 'keyword', 'normalizer': 'code'},
+        'display': {
+            'type': 'text',
+            'analyzer': 'autocomplete',
+            'search_analyzer': 'multilingual',
+            'fields': {
+                'words': {'type': 'text', 'analyzer': 'multilingual'},
+                'translit': {'type': 'text', 'analyzer': 'transliteration'},
+            },
+        },
+        'display_length': {'type': 'integer'},
+        'definition': {'type': 'text', 'analyzer': 'multilingual'},
+        'parent_code': {'type': 'keyword', 'index': False},
+    },
+}
+
+
+def _document(concept):
+    return {
+        'system': concept.system,
+        'code': concept.code,
+        'display': concept.display,
+        'display_length': len(concept.display),
+        'definition': concept.definition,
+        'parent_code': concept.parent_code,
+    }
+
+
+def _doc_id(system, code):
+    return f'{system}|{code}'
+
+
+def build_query(query, system=None):
+    """bool query ranking code matches over display prefixes over definitions"""
+    text = ' '.join(query.split())
+    should = [
+        {'term': {'code': {'value': text.replace(' ', ''), 'boost': 20}}},
+        {'prefix': {'code': {'value': text.replace(' ', ''), 'case_insensitive': True, 'boost': 10}}},
+        {'match_phrase': {'display.words': {'query': text, 'boost': 6}}},
+        {'match': {'display': {'query': text, 'operator': 'and', 'boost': 4}}},
+        {'match': {'display.translit': {'query': text, 'operator': 'and', 'fuzziness': 'AUTO', 'boost': 2}}},
+        {'match': {'definition': {'query': text, 'operator': 'and', 'boost': 0.5}}},
+    ]
+    bool_query = {'should': should, 'minimum_should_match': 1}
+    if system is not None:
+        bool_query['filter'] = [{'term': {'system': system}}]
+    return {'bool': bool_query}
+
+
+class ElasticsearchBackend(SearchBackend):
+    """Search backend over an Elasticsearch alias"""
+
+    name = 'elasticsearch'
+
+    def __init__(self, client, alias='medisync-concepts', bulk_size=1000, build_on_start=True):
+        self.client = client
+        self.alias = alias
+        self.bulk_size = bulk_size
+        self.build_on_start = build_on_start
+
+    @staticmethod
+    def _connect(app):
+        from elasticsearch import Elasticsearch
+
+        return Elasticsearch(app.config['ELASTICSEARCH_URL'], request_timeout=app.config['ELASTICSEARCH_TIMEOUT'])
+
+    @classmethod
+    def from_config(cls, app):
+        return cls(
+            cls._connect(app),
+            alias=app.config['ELASTICSEARCH_INDEX'],
+            bulk_size=app.config['ELASTICSEARCH_BULK_SIZE'],
+            build_on_start=app.config.get('SEARCH_INDEX_BUILD_ON_STARTUP', True),
+        )
+
+    def _call(self, method, **kwargs):
+        from elasticsearch import ApiError, TransportError
+
+        try:
+            return method(**kwargs)
+        except (ApiError, TransportError) as e:
+            raise SearchUnavailable(f'Elasticsearch {method.__name__} failed: {e}') from e
+
+    # -- maintenance ---------------------------------------------------
+
+    def _create_index(self, name, aliases=None, **settings):
+        self._call(self.client.indices.create, index=name, settings=dict(settings, analysis=ANALYSIS),
+                   mappings=MAPPINGS, aliases=aliases)
+
+    def _bulk(self, operations):
+        """Send (action, document or None) pairs in bulk_size requests"""
+        batch = []
+        for action, document in operations:
+            batch.append(action)
+            if document is not None:
+                batch.append(document)
+            if len(batch) >= self.bulk_size * 2:
+                self._send(batch)
+                batch = []
+        if batch:
+            self._send(batch)
+
+    def _send(self, batch):
+        response = self._call(self.client.bulk, operations=batch)
+        if response.get('errors'):
+            failed = [item for item in response['items'] if next(iter(item.values())).get('error')]
+            # A delete of a document that was never indexed is not a failure
+            failed = [item for item in failed if next(iter(item.values())).get('status') != 404]
+            if failed:
+                raise SearchUnavailable(f'{len(failed)} bulk operations failed, e.g. {failed[0]}')
+
+    @property
+    def reindex_alias(self):
+        """Alias on the index a reindex is loading, so every worker mirrors its writes there"""
+        return f'{self.alias}-reindex'
+
+    def _aliased_indices(self, alias):
+        from elasticsearch import NotFoundError
+
+        try:
+            return list(self._call(self.client.indices.get_alias, name=alias).keys())
+        except SearchUnavailable as e:
+            if isinstance(e.__cause__, NotFoundError):
+                return []
+            raise
+
+    def _targets(self):
+        return [self.alias] + self._aliased_indices(self.reindex_alias)
+
+    def upsert(self, concepts):
+        targets = self._targets()
+        self._bulk(
+            ({'index': {'_index': index, '_id': _doc_id(concept.system, concept.code)}}, _document(concept))
+            for concept in concepts for index in targets
+        )
+
+    def remove(self, keys):
+        targets = self._targets()
+        self._bulk(
+            ({'delete': {'_index': index, '_id': _doc_id(system, code)}}, None)
+            for system, code in keys for index in targets
+        )
+
+    def rebuild(self, concepts):
+        """Load a new index, then point the alias at it in one atomic update"""
+        name = f'{self.alias}-{datetime.now(timezone.utc):%Y%m%d%H%M%S%f}'
+        # No refreshes while loading; the index is made searchable once at the end
+        self._create_index(name, aliases={self.reindex_alias: {}}, refresh_interval='-1')
+        count = 0
+
+        def documents():
+            nonlocal count
+            for concept in concepts:
+                count += 1
+                yield {'index': {'_index': name, '_id': _doc_id(concept.system, concept.code)}}, _document(concept)
+
+        try:
+            self._bulk(documents())
+            self._call(self.client.indices.put_settings, index=name, settings={'refresh_interval': None})
+            self._call(self.client.indices.refresh, index=name)
+            old = self._aliased_indices(self.alias)
+            actions = [{'remove': {'index': index, 'alias': self.alias}} for index in old]
+            actions += [
+                {'remove': {'index': name, 'alias': self.reindex_alias}},
+                {'add': {'index': name, 'alias': self.alias}},
+            ]
+            self._call(self.client.indices.update_aliases, actions=actions)
+        except SearchUnavailable:
+            self._call(self.client.indices.delete, index=name)
+            raise
+        for index in old:
+            self._call(self.client.indices.delete, index=index)
+        logger.info('Reindexed %d concepts into %s', count, name)
+        return count
+
+    def start(self, app):
+        """Create the alias and its first index if this cluster has none yet"""
+        from elasticsearch import BadRequestError
+
+        try:
+            if self._call(self.client.indices.exists_alias, name=self.alias):
+                return
+            # A fixed name, so concurrently starting workers create it only once
+            self._create_index(f'{self.alias}-initial', aliases={self.alias: {}})
+        except SearchUnavailable as e:
+            if isinstance(e.__cause__, BadRequestError):
+                return
+            logger.warning('Elasticsearch index %s not ready; searches use the database: %s', self.alias, e)
+            return
+        if self.build_on_start:
+            try:
+                self.upsert(terminology.iter_concepts())
+            except Exception as e:
+                logger.warning('Initial Elasticsearch load failed; run "flask search reindex": %s', e)
+
+    def after_fork(self, app):
+        # The master's pooled connections would otherwise be read by every worker at once
+        self.client = self._connect(app)
+
+    # -- queries -------------------------------------------------------
+
+    def search(self, query, limit=20, system=None):
+        if not query.strip() or limit <= 0:
+            return []
+        response = self._call(
+            self.client.search,
+            index=self.alias,
+            query=build_query(query, system),
+            sort=['_score', {'display_length': 'asc'}, {'code': 'asc'}],
+            track_scores=True,
+            size=limit,
+            source=['system', 'code', 'display', 'definition', 'parent_code'],
+        )
+        return [
+            (terminology.Concept(hit['_source']['system'], hit['_source']['code'], hit['_source']['display'],
+                                 hit['_source'].get('definition') or '', hit['_source'].get('parent_code')),
+             hit['_score'])
+            for hit in response['hits']['hits']
+        ]
@@ -0,0 +1,372 @@
+"""
+In-memory autocomplete index for /valueset/search.
+
+Each worker keeps its own index over NAMASTE and ICD-11 concepts so that a
+keystroke never turns into a database query. Prefix matches on codes and
+display words use sorted token vocabularies (a flattened trie searched with
+bisect); infix and typo-tolerant matches use a trigram index over the same
+vocabularies. search_backends.MemoryBackend builds it in create_app and
+keeps it current from the terminology.codes_changed signal.
+"""
+
+import heapq
+import re
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timezone
+from itertools import islice
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# Match tiers, best first
+TIER_CODE_EXACT = 0
+TIER_CODE_PREFIX = 1
+TIER_DISPLAY_EXACT = 2
+TIER_DISPLAY_PREFIX = 3
+TIER_DISPLAY_INFIX = 4
+TIER_DEFINITION = 5
+TIER_FUZZY = 6
+
+# Prefix/infix expansions merged per query term; shortest tokens win
+MAX_EXPANSIONS = 256
+# Driver postings probed with bisect before falling back to set intersection
+WALK_BUDGET = 2048
+FUZZY_MIN_SIMILARITY = 0.45
+
+# Postings are kept as sorted ints of (display length << 32 | concept id) so
+# the best-ranked matches for a token are always at the front of its list
+_ID_BITS = 32
+_ID_MASK = (1 << _ID_BITS) - 1
+
+_EMPTY = frozenset()
+
+
+def normalize(text):
+    """Casefold and strip diacritics so 'Śodhana' matches 'sodhana'"""
+    if not text:
+        return ''
+    if text.isascii():
+        return text.lower()
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(normalize(text))
+
+
+def trigrams(token):
+    padded = f' {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _Vocabulary:
+    """Sorted token list with per-token ranked postings and optional trigrams"""
+
+    def __init__(self, with_trigrams=False):
+        self.tokens = []
+        # token -> array of rank keys, sorted; 8 bytes per posting
+        self.postings = {}
+        self.trigrams = {} if with_trigrams else None
+        self._touched = set()
+        self._new_tokens = []
+
+    def add(self, token, key):
+        """Append a posting; finish() restores ordering afterwards"""
+        keys = self.postings.get(token)
+        if keys is None:
+            keys = self.postings[token] = array('Q')
+            self._new_tokens.append(token)
+        keys.append(key)
+        self._touched.add(token)
+
+    def finish(self):
+        """Re-sort whatever add() touched since the last call"""
+        for token in self._touched:
+            keys = self.postings.get(token)
+            if keys is not None and len(keys) > 1:
+                self.postings[token] = array('Q', sorted(keys))
+        new_tokens = [token for token in self._new_tokens if token in self.postings]
+        if new_tokens:
+            self.tokens.extend(new_tokens)
+            self.tokens.sort()
+            if self.trigrams is not None:
+                for token in new_tokens:
+                    for gram in trigrams(token):
+                        self.trigrams.setdefault(gram, set()).add(token)
+        self._touched = set()
+        self._new_tokens = []
+
+    def discard(self, token, key):
+        keys = self.postings.get(token)
+        if keys is None:
+            return
+        position = bisect_left(keys, key)
+        if position == len(keys) or keys[position] != key:
+            return
+        del keys[position]
+        if keys:
+            return
+        del self.postings[token]
+        del self.tokens[bisect_left(self.tokens, token)]
+        if self.trigrams is not None:
+            for gram in trigrams(token):
+                bucket = self.trigrams.get(gram)
+                if bucket is not None:
+                    bucket.discard(token)
+                    if not bucket:
+                        del self.trigrams[gram]
+
+    def prefixed(self, prefix):
+        """Tokens starting with prefix, shortest (closest) first"""
+        start = bisect_left(self.tokens, prefix)
+        end = bisect_left(self.tokens, prefix + '\uffff', start)
+        return sorted(self.tokens[start:end], key=len)
+
+    def iter_prefixed(self, prefix):
+        """Tokens starting with prefix in sorted order, lazily"""
+        tokens = self.tokens
+        for position in range(bisect_left(tokens, prefix), len(tokens)):
+            if not tokens[position].startswith(prefix):
+                return
+            yield tokens[position]
+
+    def containing(self, fragment):
+        """Tokens containing fragment anywhere (fragment of 3+ chars)"""
+        grams = [gram for gram in trigrams(fragment) if ' ' not in gram]
+        if not grams:
+            return []
+        buckets = sorted((self.trigrams.get(gram, _EMPTY) for gram in grams), key=len)
+        candidates = set(buckets[0])
+        for bucket in buckets[1:]:
+            candidates &= bucket
+            if not candidates:
+                return []
+        return sorted((token for token in candidates if fragment in token), key=len)
+
+    def similar(self, token, limit=20):
+        """Tokens sharing enough trigrams with token (typo tolerance)"""
+        grams = trigrams(token)
+        counts = {}
+        for gram in grams:
+            for candidate in self.trigrams.get(gram, ()):
+                counts[candidate] = counts.get(candidate, 0) + 1
+        scored = []
+        for candidate, shared in counts.items():
+            # Padded tokens have as many trigrams as characters
+            similarity = shared / (len(grams) + len(candidate) - shared)
+            if similarity >= FUZZY_MIN_SIMILARITY:
+                scored.append((similarity, candidate))
+        return [candidate for _, candidate in heapq.nlargest(limit, scored)]
+
+
+class SearchIndex:
+    """Ranked autocomplete over Concept records"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._concepts = []
+        self._free = []
+        self._ids = {}
+        self._codes = _Vocabulary()
+        self._display = _Vocabulary(with_trigrams=True)
+        self._definition = _Vocabulary(with_trigrams=True)
+        self.built_at = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    # -- maintenance ---------------------------------------------------
+
+    def build(self, concepts):
+        """Replace the whole index with the given concepts"""
+        fresh = SearchIndex()
+        for concept in concepts:
+            fresh._insert(concept)
+        fresh._finish()
+        with self._lock:
+            for name in ('_concepts', '_free', '_ids', '_codes', '_display', '_definition'):
+                setattr(self, name, getattr(fresh, name))
+            self.built_at = datetime.now(timezone.utc)
+
+    def upsert(self, concepts):
+        """Insert or replace concepts; large batches are re-sorted once"""
+        batch = {(concept.system, concept.code): concept for concept in concepts}
+        with self._lock:
+            for system, code in batch:
+                self._remove(system, code)
+            for concept in batch.values():
+                self._insert(concept)
+            self._finish()
+
+    def remove(self, keys):
+        with self._lock:
+            for system, code in keys:
+                self._remove(system, code)
+
+    def _finish(self):
+        for vocabulary in (self._codes, self._display, self._definition):
+            vocabulary.finish()
+
+    @staticmethod
+    def _fields(concept):
+        return (
+            ('_codes', (normalize(concept.code),)),
+            ('_display', set(tokenize(concept.display))),
+            ('_definition', set(tokenize(concept.definition))),
+        )
+
+    def _insert(self, concept):
+        if self._free:
+            concept_id = self._free.pop()
+            self._concepts[concept_id] = concept
+        else:
+            concept_id = len(self._concepts)
+            self._concepts.append(concept)
+        self._ids[(concept.system, concept.code)] = concept_id
+
+        key = (len(concept.display) << _ID_BITS) | concept_id
+        for name, tokens in self._fields(concept):
+            vocabulary = getattr(self, name)
+            for token in tokens:
+                vocabulary.add(token, key)
+
+    def _remove(self, system, code):
+        concept_id = self._ids.pop((system, code), None)
+        if concept_id is None:
+            return
+        concept = self._concepts[concept_id]
+        key = (len(concept.display) << _ID_BITS) | concept_id
+        for name, tokens in self._fields(concept):
+            vocabulary = getattr(self, name)
+            for token in tokens:
+                vocabulary.discard(token, key)
+        self._concepts[concept_id] = None
+        self._free.append(concept_id)
+
+    # -- queries -------------------------------------------------------
+
+    def search(self, query, limit=20, system=None):
+        """Return up to limit (Concept, tier) pairs, best match first"""
+        text = normalize(query).strip()
+        tokens = tokenize(query)
+        if not text or limit <= 0:
+            return []
+
+        with self._lock:
+            hits = []
+            seen = set()
+
+            def take(candidate_ids, tier):
+                """Accept candidates in the order given until limit is reached"""
+                for concept_id in candidate_ids:
+                    if concept_id in seen:
+                        continue
+                    concept = self._concepts[concept_id]
+                    if system is not None and concept.system != system:
+                        continue
+                    seen.add(concept_id)
+                    hits.append((concept, tier))
+                    if len(hits) >= limit:
+                        return True
+                return False
+
+            code_query = text.replace(' ', '')
+            codes = self._codes
+            if take((key & _ID_MASK for key in codes.postings.get(code_query, ())), TIER_CODE_EXACT):
+                return hits
+            # Code tokens come back from bisect in code order already
+            code_ids = (key & _ID_MASK for token in codes.iter_prefixed(code_query) for key in codes.postings[token])
+            if take(code_ids, TIER_CODE_PREFIX) or not tokens:
+                return hits
+
+            display = self._display
+            last = tokens[-1]
+            plans = [
+                (display, [[t] for t in tokens], TIER_DISPLAY_EXACT),
+                (display, [[t] for t in tokens[:-1]] + [display.prefixed(last)], TIER_DISPLAY_PREFIX),
+            ]
+            if len(last) >= 3:
+                plans.append((display, [[t] for t in tokens[:-1]] + [display.containing(last)], TIER_DISPLAY_INFIX))
+            plans.append((self._definition, [[t] for t in tokens[:-1]] + [self._definition.prefixed(last)],
+                          TIER_DEFINITION))
+            for vocabulary, terms, tier in plans:
+                if self._take_plan(take, vocabulary, terms, tier):
+                    return hits
+
+            if not hits and len(last) >= 3:
+                terms = [display.similar(token) for token in tokens]
+                self._take_plan(take, display, terms, TIER_FUZZY)
+            return hits
+
+    def _take_plan(self, take, vocabulary, terms, tier):
+        """Stream the rarest term in rank order and filter by the others"""
+        postings = vocabulary.postings
+        terms = [[t for t in term if t in postings][:MAX_EXPANSIONS] for term in terms]
+        if not terms or not all(terms):
+            return False
+        sizes = [sum(len(postings[t]) for t in term) for term in terms]
+        driver = sizes.index(min(sizes))
+        lists = [postings[t] for t in terms[driver]]
+        keys = iter(lists[0]) if len(lists) == 1 else heapq.merge(*lists)
+        if len(terms) == 1:
+            return take((key & _ID_MASK for key in keys), tier)
+
+        # Unions over prefix expansions are costly to materialise, and dense
+        # intersections fill up from the head of the driver list anyway, so
+        # probe those terms with bisect before building any sets
+        others = [[postings[t] for t in term] for i, term in enumerate(terms) if i != driver]
+        if any(len(arrays) > 1 for arrays in others):
+            head = (key & _ID_MASK for key in islice(keys, WALK_BUDGET)
+                    if all(_contains(arrays, key) for arrays in others))
+            if take(head, tier):
+                return True
+
+        # A concept has the same rank key in every posting, so keys can be
+        # intersected directly. Rank a small result outright, otherwise walk
+        # the driver list until enough members show up.
+        matched = None
+        for size, term in sorted(zip(sizes, terms), key=lambda pair: pair[0]):
+            keyset = set().union(*(postings[t] for t in term))
+            matched = keyset if matched is None else matched & keyset
+            if not matched:
+                return False
+        if len(matched) * 8 <= sizes[driver]:
+            return take((key & _ID_MASK for key in sorted(matched)), tier)
+        return take((key & _ID_MASK for key in keys if key in matched), tier)
+
+
+def _contains(arrays, key):
+    for keys in arrays:
+        position = bisect_left(keys, key)
+        if position < len(keys) and keys[position] == key:
+            return True
+    return False
+
+
+def build_valueset(query, hits, offset=0):
+    """Wrap search hits in the FHIR ValueSet expansion returned by /valueset/search"""
+    return {
+        'resourceType': 'ValueSet',
+        'status': 'active',
+        'expansion': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'total': len(hits),
+            'offset': offset,
+            'parameter': [{'name': 'filter', 'valueString': query}, {'name': 'offset', 'valueInteger': offset}],
+            'contains': [
+                {'system': concept.system, 'code': concept.code, 'display': concept.display}
+                for concept, _ in hits
+            ],
+        },
+    }
+
+
+def search_valueset(app, query, limit=20, system=None, offset=0):
+    """Answer /valueset/search through the app's search backend; offset skips the best-ranked hits"""
+    from src.services import search_backends
+
+    hits = search_backends.search(app, query, limit=offset + limit, system=system)
+    return build_valueset(query, hits[offset:], offset)
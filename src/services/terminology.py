@@ -0,0 +1,144 @@
+"""
+Shared terminology primitives for NAMASTE and ICD-11 codes.
+
+Defines the lightweight Concept record used by the in-process lookup
+structures and the signals that tell them when codes have changed.
+"""
+
+from collections import namedtuple
+
+from blinker import Namespace
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+
+NAMASTE_SYSTEM = 'http://terminology.india.gov.in/namaste'
+ICD11_SYSTEM = 'http://id.who.int/icd11/mms'
+
+Concept = namedtuple('Concept', ['system', 'code', 'display', 'definition', 'parent_code'])
+
+_signals = Namespace()
+
+# Sent with sender=app, upserted=[Concept, ...], deleted=[(system, code), ...]
+codes_changed = _signals.signal('codes-changed')
+
+# ConceptMap equivalence of a mapping read from its target's side; the
+# other codes (equivalent, equal, relatedto, inexact, disjoint, ...) are symmetric
+INVERSE_EQUIVALENCE = {
+    'wider': 'narrower',
+    'narrower': 'wider',
+    'subsumes': 'specializes',
+    'specializes': 'subsumes',
+}
+
+# Sent with sender=app, keys={(source_system, source_code, target_system), ...}
+# covering both directions of every ConceptMapping row that changed
+mappings_changed = _signals.signal('mappings-changed')
+
+
+def namaste_concept(row):
+    """Build a Concept from a NAMASTECode row"""
+    return Concept(NAMASTE_SYSTEM, row.code, row.display or '', row.definition or '', row.parent_code or None)
+
+
+def icd11_concept(row):
+    """Build a Concept from an ICD11Code row"""
+    return Concept(ICD11_SYSTEM, row.code, row.title or '', row.definition or '', row.parent_code or None)
+
+
+def iter_concepts(batch_size=5000):
+    """Stream every NAMASTE and ICD-11 code as Concept records"""
+    from src.extensions import db
+    from src.models import NAMASTECode, ICD11Code
+
+    for row in db.session.execute(db.select(NAMASTECode).execution_options(yield_per=batch_size)).scalars():
+        yield namaste_concept(row)
+    for row in db.session.execute(db.select(ICD11Code).execution_options(yield_per=batch_size)).scalars():
+        yield icd11_concept(row)
+
+
+def _row_concept(obj):
+    from src.models import NAMASTECode, ICD11Code
+
+    if isinstance(obj, NAMASTECode):
+        return namaste_concept(obj)
+    if isinstance(obj, ICD11Code):
+        return icd11_concept(obj)
+    return None
+
+
+def inverse_equivalence(equivalence):
+    """Equivalence of target -> source for a source -> target mapping"""
+    equivalence = equivalence or 'equivalent'
+    return INVERSE_EQUIVALENCE.get(equivalence, equivalence)
+
+
+def mapping_keys(source_system, source_code, target_system, target_code):
+    """Translation keys affected by one ConceptMapping row, in both directions"""
+    return {
+        (source_system, source_code, target_system),
+        (target_system, target_code, source_system),
+    }
+
+
+def _previous_values(obj, *names):
+    """Committed values of the given attributes before this flush"""
+    state = inspect(obj)
+    values = []
+    for name in names:
+        history = state.attrs[name].history
+        values.append(history.deleted[0] if history.deleted else getattr(obj, name))
+    return values
+
+
+def _collect_changes(session, flush_context):
+    from src.models import ConceptMapping
+
+    changes = session.info.setdefault('terminology_changes', {'upserted': {}, 'deleted': {}, 'mappings': set()})
+    columns = ('source_system', 'source_code', 'target_system', 'target_code')
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, ConceptMapping):
+            changes['mappings'] |= mapping_keys(*(getattr(obj, name) for name in columns))
+            if obj not in session.new:
+                changes['mappings'] |= mapping_keys(*_previous_values(obj, *columns))
+            continue
+        concept = _row_concept(obj)
+        if concept is None:
+            continue
+        key = (concept.system, concept.code)
+        if obj in session.deleted:
+            changes['upserted'].pop(key, None)
+            changes['deleted'][key] = True
+            continue
+        if obj not in session.new:
+            (previous_code,) = _previous_values(obj, 'code')
+            if previous_code != concept.code:
+                changes['upserted'].pop((concept.system, previous_code), None)
+                changes['deleted'][(concept.system, previous_code)] = True
+        changes['upserted'][key] = concept
+        changes['deleted'].pop(key, None)
+
+
+def _publish_changes(session):
+    changes = session.info.pop('terminology_changes', None)
+    if not changes or not has_app_context():
+        return
+    app = current_app._get_current_object()
+    if changes['upserted'] or changes['deleted']:
+        codes_changed.send(app, upserted=list(changes['upserted'].values()), deleted=list(changes['deleted'].keys()))
+    if changes['mappings']:
+        mappings_changed.send(app, keys=changes['mappings'])
+
+
+def _discard_changes(session, previous_transaction):
+    session.info.pop('terminology_changes', None)
+
+
+def init_app(app):
+    """Publish codes_changed/mappings_changed for ORM writes to terminology tables"""
+    from src.extensions import db
+
+    # Session listeners are process-wide, so only attach them once
+    if not event.contains(db.session, 'after_flush', _collect_changes):
+        event.listen(db.session, 'after_flush', _collect_changes)
+        event.listen(db.session, 'after_commit', _publish_changes)
+        event.listen(db.session, 'after_soft_rollback', _discard_changes)
@@ -0,0 +1,449 @@
+"""
+Read-only, memory-mapped snapshot of the code and mapping tables.
+
+NAMASTECode, ICD11Code and ConceptMapping are written to one binary file
+of array-backed columns. Every text value is an id into a deduplicated
+string pool: an offsets array plus one block of UTF-8 bytes. Concept rows
+are sorted by code and mapping rows by (source system, source code,
+target system), with a second sort order for reverse lookups, so a lookup
+is a binary search over the mapped pages. Every gunicorn worker maps the
+same file, so the pages live once in the OS page cache instead of once per
+worker, and opening a snapshot costs nothing however large it is.
+
+Each snapshot is written to a new generation file. A CURRENT file that
+names the newest one is then replaced atomically. Workers re-read CURRENT
+at most every TERMINOLOGY_SNAPSHOT_TTL seconds and switch to a new
+generation on their next lookup; requests still holding the old one finish
+with it. A snapshot records the terminology release (see http_cache) it
+was built from and is only used while that is still the current release.
+In between, callers get None and read the database, so an ingest is never
+hidden by a stale snapshot. The worker that commits a change writes the
+next generation TERMINOLOGY_SNAPSHOT_DELAY seconds after the last change,
+so a chunked ingest produces one snapshot rather than one per chunk.
+
+Columns are stored in native byte order; a snapshot is meant to be read on
+the host that wrote it.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy.exc import SQLAlchemyError
+
+from src.extensions import db
+from src.services import terminology
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'MSNAP\x00\x01\x00'
+# magic, section count, generation, terminology release
+HEADER = struct.Struct('=8sIqq')
+# name, offset, length in bytes
+SECTION = struct.Struct('=8sqq')
+
+POINTER = 'CURRENT'
+
+# String id 0 stands for None
+NONE = 0
+
+# Section name prefix per code system
+SYSTEM_PREFIXES = {terminology.NAMASTE_SYSTEM: b'n', terminology.ICD11_SYSTEM: b'i'}
+# Column -> section name suffix (section names are at most 8 bytes)
+CONCEPT_COLUMNS = {'code': b'code', 'display': b'disp', 'definition': b'defn', 'parent_code': b'prnt'}
+MAPPING_COLUMNS = {'source_system': b'ssys', 'source_code': b'scod', 'target_system': b'tsys',
+                   'target_code': b'tcod', 'target_display': b'tdsp', 'equivalence': b'equi'}
+
+# Generations kept on disk: the current one and the one before it, which
+# workers may still be using until their next CURRENT check
+KEEP_GENERATIONS = 2
+
+
+class SnapshotError(Exception):
+    """The file is not a readable snapshot"""
+
+
+class _StringPool:
+    """Deduplicated strings, numbered from 1 in order of first use"""
+
+    def __init__(self):
+        self.ids = {}
+        self.offsets = array('I', [0, 0])
+        self.chunks = []
+        self.size = 0
+
+    def add(self, value):
+        if value is None:
+            return NONE
+        found = self.ids.get(value)
+        if found is None:
+            data = value.encode('utf-8')
+            self.chunks.append(data)
+            self.size += len(data)
+            self.offsets.append(self.size)
+            found = self.ids[value] = len(self.offsets) - 2
+        return found
+
+
+def _sections(concepts, mappings):
+    """{name: bytes} for the concept columns per system, the mapping columns and the string pool"""
+    pool = _StringPool()
+    sections = {}
+    for system, prefix in SYSTEM_PREFIXES.items():
+        rows = sorted(concepts.get(system, ()), key=lambda concept: concept.code.encode('utf-8'))
+        for name, suffix in CONCEPT_COLUMNS.items():
+            sections[prefix + b'.' + suffix] = array('I', [pool.add(getattr(row, name)) for row in rows])
+
+    def key(row, *columns):
+        return tuple((row[column] or '').encode('utf-8') for column in columns)
+
+    # Stable sorts keep rows with the same key in table order, as the database returns them
+    forward = sorted(range(len(mappings)), key=lambda i: key(mappings[i], 0, 1, 2))
+    mappings = [mappings[i] for i in forward]
+    for index, suffix in enumerate(MAPPING_COLUMNS.values()):
+        sections[b'm.' + suffix] = array('I', [pool.add(row[index]) for row in mappings])
+    sections[b'm.rev'] = array('I', sorted(range(len(mappings)), key=lambda i: key(mappings[i], 2, 3, 0)))
+    sections[b's.offs'] = pool.offsets
+    sections[b's.pool'] = b''.join(pool.chunks)
+    return {name: value.tobytes() if isinstance(value, array) else value for name, value in sections.items()}
+
+
+def write(path, concepts, mappings, generation, release):
+    """
+    Write a snapshot file.
+
+    concepts is {system: [Concept]}; mappings is a list of tuples in
+    MAPPING_COLUMNS order. The file is written under a temporary name and
+    renamed, so readers never see a partial file.
+    """
+    sections = _sections(concepts, mappings)
+    offset = HEADER.size + SECTION.size * len(sections)
+    directory = []
+    for name, data in sections.items():
+        # 8-byte aligned, so every column can be cast in place
+        offset += -offset % 8
+        directory.append((name, offset, len(data)))
+        offset += len(data)
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(sections), generation, release))
+        for name, start, length in directory:
+            f.write(SECTION.pack(name, start, length))
+        for (name, start, length), data in zip(directory, sections.values()):
+            f.write(b'\x00' * (start - f.tell()))
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    return offset
+
+
+class Snapshot:
+    """One mapped snapshot file; lookups read the mapped pages directly"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotError(f'{path} is empty')
+        if len(self._map) < HEADER.size:
+            raise SnapshotError(f'{path} is truncated')
+        magic, count, self.generation, self.release = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise SnapshotError(f'{path} is not a terminology snapshot')
+        view = memoryview(self._map)
+        self._columns = {}
+        for index in range(count):
+            name, start, length = SECTION.unpack_from(self._map, HEADER.size + index * SECTION.size)
+            if start + length > len(self._map):
+                raise SnapshotError(f'{path} is truncated')
+            section = view[start:start + length]
+            name = name.rstrip(b'\x00')
+            self._columns[name] = section if name == b's.pool' else section.cast('I')
+        self._offsets = self._columns[b's.offs']
+        self._pool = self._columns[b's.pool']
+
+    @property
+    def size(self):
+        return len(self._map)
+
+    def __len__(self):
+        return sum(len(self._columns[prefix + b'.code']) for prefix in SYSTEM_PREFIXES.values())
+
+    def _bytes(self, string_id):
+        return self._pool[self._offsets[string_id]:self._offsets[string_id + 1]].tobytes()
+
+    def _string(self, string_id):
+        if string_id == NONE:
+            return None
+        return self._pool[self._offsets[string_id]:self._offsets[string_id + 1]].tobytes().decode('utf-8')
+
+    # -- concepts --------------------------------------------------------
+
+    def _concept_row(self, system, code):
+        prefix = SYSTEM_PREFIXES.get(system)
+        if prefix is None or code is None:
+            return None
+        codes = self._columns[prefix + b'.code']
+        target = code.encode('utf-8')
+        index = bisect_left(_Keys(len(codes), lambda i: self._bytes(codes[i])), target)
+        if index < len(codes) and self._bytes(codes[index]) == target:
+            return prefix, index
+        return None
+
+    def _concept(self, system, prefix, index):
+        code, display, definition, parent = (self._string(self._columns[prefix + b'.' + suffix][index])
+                                             for suffix in CONCEPT_COLUMNS.values())
+        return terminology.Concept(system, code, display or '', definition or '', parent)
+
+    def contains(self, system, code):
+        return self._concept_row(system, code) is not None
+
+    def concept(self, system, code):
+        """The Concept for (system, code), or None"""
+        found = self._concept_row(system, code)
+        return None if found is None else self._concept(system, *found)
+
+    def iter_concepts(self):
+        """Every concept, like terminology.iter_concepts()"""
+        for system, prefix in SYSTEM_PREFIXES.items():
+            for index in range(len(self._columns[prefix + b'.code'])):
+                yield self._concept(system, prefix, index)
+
+    # -- mappings --------------------------------------------------------
+
+    def _mapping_rows(self, columns, order, key):
+        """Row numbers whose (columns) equal key, in stored order"""
+        target = tuple((value or '').encode('utf-8') for value in key)
+        first, second, third = (self._columns[b'm.' + MAPPING_COLUMNS[name]] for name in columns)
+
+        def row_key(i):
+            row = order[i] if order is not None else i
+            return self._bytes(first[row]), self._bytes(second[row]), self._bytes(third[row])
+
+        count = len(first)
+        index = bisect_left(_Keys(count, row_key), target)
+        while index < count and row_key(index) == target:
+            yield order[index] if order is not None else index
+            index += 1
+
+    def _value(self, name, row):
+        return self._string(self._columns[b'm.' + MAPPING_COLUMNS[name]][row])
+
+    def matches(self, source_system, source_code, target_system):
+        """Translation matches for one key, as translation._load_matches returns them from the database"""
+        found = []
+        for row in self._mapping_rows(('source_system', 'source_code', 'target_system'), None,
+                                      (source_system, source_code, target_system)):
+            found.append({'system': self._value('target_system', row), 'code': self._value('target_code', row),
+                          'display': self._value('target_display', row),
+                          'equivalence': self._value('equivalence', row) or 'equivalent'})
+        for row in self._mapping_rows(('target_system', 'target_code', 'source_system'), self._columns[b'm.rev'],
+                                      (source_system, source_code, target_system)):
+            found.append({'system': self._value('source_system', row), 'code': self._value('source_code', row),
+                          'display': None,
+                          'equivalence': terminology.inverse_equivalence(self._value('equivalence', row))})
+        return found
+
+
+class _Keys:
+    """Sequence view of sort keys computed on access, for bisect"""
+
+    __slots__ = ('length', 'key')
+
+    def __init__(self, length, key):
+        self.length = length
+        self.key = key
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        return self.key(index)
+
+
+# -- generations on disk -------------------------------------------------
+
+def build(directory):
+    """Write a new generation from the database and point CURRENT at it; returns its path"""
+    from src.models import ConceptMapping
+    from src.services.http_cache import TerminologyRelease
+
+    # Read first: a change committed while the tables are read makes the
+    # snapshot look older than it is, which only means it is not used
+    release = db.session.execute(db.select(TerminologyRelease.version).where(TerminologyRelease.id == 1)).scalar()
+    concepts = {}
+    for concept in terminology.iter_concepts():
+        concepts.setdefault(concept.system, []).append(concept)
+    mappings = [tuple(row) for row in db.session.execute(
+        db.select(*(getattr(ConceptMapping, name) for name in MAPPING_COLUMNS)).order_by(ConceptMapping.id))]
+    db.session.rollback()
+
+    os.makedirs(directory, exist_ok=True)
+    generation = time.time_ns()
+    name = f'terminology-{generation}.snap'
+    write(os.path.join(directory, name), concepts, mappings, generation, release or 0)
+    pointer = os.path.join(directory, POINTER)
+    with open(f'{pointer}.{os.getpid()}.tmp', 'w') as f:
+        f.write(name)
+    os.replace(f'{pointer}.{os.getpid()}.tmp', pointer)
+    _remove_old(directory, name)
+    return os.path.join(directory, name)
+
+
+def _remove_old(directory, current):
+    names = sorted((name for name in os.listdir(directory)
+                    if name.startswith('terminology-') and name.endswith('.snap')), reverse=True)
+    # Unlinking a mapped file is safe: workers keep their mapping until they switch
+    for name in names[KEEP_GENERATIONS:]:
+        if name != current:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+class SnapshotStore:
+    """This worker's current generation, switched when CURRENT changes"""
+
+    def __init__(self, directory, ttl=1.0):
+        self.directory = directory
+        self.ttl = ttl
+        self._snapshot = None
+        self._name = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        """The newest snapshot on disk (re-checked every ttl seconds), or None"""
+        if self._checked_at is not None and time.monotonic() - self._checked_at < self.ttl:
+            return self._snapshot
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                with open(os.path.join(self.directory, POINTER)) as f:
+                    name = f.read().strip()
+            except OSError:
+                return self._snapshot
+            if name != self._name:
+                try:
+                    snapshot = Snapshot(os.path.join(self.directory, name))
+                except (OSError, SnapshotError) as e:
+                    # Generations never change once written, so it is not retried
+                    logger.warning('Terminology snapshot %s not loaded: %s', name, e)
+                    self._name = name
+                else:
+                    # The old mapping is released once no request holds it any more
+                    self._snapshot, self._name = snapshot, name
+            return self._snapshot
+
+
+def _release():
+    counter = current_app.extensions.get('terminology_release')
+    if counter is None:
+        from src.services.http_cache import ReleaseCounter
+        counter = current_app.extensions['terminology_release'] = ReleaseCounter(
+            current_app.config.get('TERMINOLOGY_RELEASE_TTL', 1.0))
+    return counter.current()
+
+
+def current():
+    """The worker's snapshot if it matches the current terminology release, else None (read the database)"""
+    store = current_app.extensions.get('terminology_snapshot')
+    if store is None:
+        return None
+    snapshot = store.current()
+    if snapshot is None:
+        return None
+    release = _release()
+    if release is None or release[0] != snapshot.release:
+        return None
+    return snapshot
+
+
+def iter_concepts():
+    """Every concept from the current snapshot if there is one, else from the database"""
+    snapshot = current()
+    return snapshot.iter_concepts() if snapshot is not None else terminology.iter_concepts()
+
+
+class _Rebuilder:
+    """Writes a new generation once changes have been quiet for delay seconds"""
+
+    def __init__(self, app, delay):
+        self.app = app
+        self.delay = delay
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def schedule(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.delay, self._run)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _run(self):
+        with self._lock:
+            self._timer = None
+        with self.app.app_context():
+            started = time.perf_counter()
+            try:
+                path = build(self.app.extensions['terminology_snapshot'].directory)
+            except (OSError, SQLAlchemyError) as e:
+                logger.warning('Terminology snapshot not written: %s', e)
+                db.session.rollback()
+                return
+            finally:
+                db.session.remove()
+            logger.info('Terminology snapshot %s written in %.2fs', os.path.basename(path),
+                        time.perf_counter() - started)
+
+
+def _on_terminology_changed(app, **changes):
+    app.extensions['terminology_snapshot_rebuilder'].schedule()
+
+
+snapshot_cli = AppGroup('terminology', help='Terminology snapshot maintenance.')
+
+
+@snapshot_cli.command('snapshot')
+def snapshot_command():
+    """Write a new terminology snapshot generation for the workers to map."""
+    started = time.perf_counter()
+    path = build(current_app.config['TERMINOLOGY_SNAPSHOT_DIR'])
+    snapshot = Snapshot(path)
+    print(f'Wrote {path}: {len(snapshot)} concepts, {snapshot.size} bytes in {time.perf_counter() - started:.2f}s')
+
+
+def init_app(app):
+    """Map the current snapshot (writing the first one if there is none) and rewrite it after changes"""
+    app.cli.add_command(snapshot_cli)
+    if not app.config.get('TERMINOLOGY_SNAPSHOT_ENABLED', False):
+        return
+    directory = app.config['TERMINOLOGY_SNAPSHOT_DIR']
+    store = app.extensions['terminology_snapshot'] = SnapshotStore(
+        directory, app.config.get('TERMINOLOGY_SNAPSHOT_TTL', 1.0))
+    app.extensions['terminology_snapshot_rebuilder'] = _Rebuilder(
+        app, app.config.get('TERMINOLOGY_SNAPSHOT_DELAY', 2.0))
+    terminology.codes_changed.connect(_on_terminology_changed, sender=app, weak=False)
+    terminology.mappings_changed.connect(_on_terminology_changed, sender=app, weak=False)
+    if store.current() is None:
+        with app.app_context():
+            try:
+                build(directory)
+            except (OSError, SQLAlchemyError) as e:
+                # e.g. tables not created yet; the first ingest writes it
+                logger.warning('Terminology snapshot deferred: %s', e)
+                db.session.rollback()
+        store._checked_at = None
@@ -0,0 +1,111 @@
+"""
+NAMASTE <-> ICD-11 translation through ConceptMapping.
+
+Lookups go through the two-tier translation cache; a miss reads the
+mappings for the code in both directions and stores the (possibly empty)
+match list. A mapping found from its target's side is reported with the
+inverse equivalence (wider becomes narrower, subsumes becomes
+specializes). Misses are answered from the memory-mapped terminology
+snapshot when it is current, and from the database otherwise.
+"""
+
+from flask import current_app
+from sqlalchemy import tuple_
+
+from src.extensions import db
+from src.services import terminology, terminology_snapshot
+
+# Keys per IN (...) query; three bound parameters each
+BULK_QUERY_CHUNK = 500
+
+
+def _match(target_system, target_code, display, equivalence):
+    return {'system': target_system, 'code': target_code, 'display': display,
+            'equivalence': equivalence or 'equivalent'}
+
+
+def _load_matches(source_system, source_code, target_system):
+    from src.models import ConceptMapping
+
+    snapshot = terminology_snapshot.current()
+    if snapshot is not None:
+        return snapshot.matches(source_system, source_code, target_system)
+    forward = db.session.execute(
+        db.select(ConceptMapping).filter_by(
+            source_system=source_system, source_code=source_code, target_system=target_system
+        )
+    ).scalars()
+    reverse = db.session.execute(
+        db.select(ConceptMapping).filter_by(
+            source_system=target_system, target_system=source_system, target_code=source_code
+        )
+    ).scalars()
+    matches = [_match(m.target_system, m.target_code, m.target_display, m.equivalence) for m in forward]
+    matches += [_match(m.source_system, m.source_code, None, terminology.inverse_equivalence(m.equivalence))
+                for m in reverse]
+    return matches
+
+
+def _load_matches_bulk(keys):
+    """Matches for many keys with set-based queries (both directions)"""
+    from src.models import ConceptMapping as M
+
+    snapshot = terminology_snapshot.current()
+    if snapshot is not None:
+        return {key: snapshot.matches(*key) for key in keys}
+    found = {key: [] for key in keys}
+    keys = list(found)
+    for start in range(0, len(keys), BULK_QUERY_CHUNK):
+        chunk = keys[start:start + BULK_QUERY_CHUNK]
+        forward = db.session.execute(
+            db.select(M).where(tuple_(M.source_system, M.source_code, M.target_system).in_(chunk))
+        ).scalars()
+        for m in forward:
+            found[(m.source_system, m.source_code, m.target_system)].append(
+                _match(m.target_system, m.target_code, m.target_display, m.equivalence))
+        reverse = db.session.execute(
+            db.select(M).where(tuple_(M.target_system, M.target_code, M.source_system).in_(chunk))
+        ).scalars()
+        for m in reverse:
+            found[(m.target_system, m.target_code, m.source_system)].append(
+                _match(m.source_system, m.source_code, None, terminology.inverse_equivalence(m.equivalence)))
+    return found
+
+
+def translate(source_system, source_code, target_system):
+    """Target-system matches for one code, served from cache where possible"""
+    cache = current_app.extensions['translation_cache']
+    key = (source_system, source_code, target_system)
+    return cache.get_or_load(key, lambda: _load_matches(*key))
+
+
+def translate_many(keys):
+    """Matches for each (source_system, source_code, target_system), in input order"""
+    cache = current_app.extensions['translation_cache']
+    results = cache.get_many(keys)
+    missing = [key for key in dict.fromkeys(keys) if key not in results]
+    if missing:
+        generation = cache.begin_load()
+        loaded = _load_matches_bulk(missing)
+        cache.set_many(loaded, generation)
+        results.update(loaded)
+    return [results[key] for key in keys]
+
+
+def translation_parameters(matches):
+    """FHIR Parameters output of ConceptMap/$translate for a match list"""
+    parameters = [{'name': 'result', 'valueBoolean': bool(matches)}]
+    if not matches:
+        parameters.append({'name': 'message', 'valueString': 'No mapping found'})
+    for match in matches:
+        coding = {'system': match['system'], 'code': match['code']}
+        if match.get('display'):
+            coding['display'] = match['display']
+        parameters.append({
+            'name': 'match',
+            'part': [
+                {'name': 'equivalence', 'valueCode': match['equivalence']},
+                {'name': 'concept', 'valueCoding': coding},
+            ],
+        })
+    return {'resourceType': 'Parameters', 'parameter': parameters}
@@ -0,0 +1,297 @@
+"""
+Two-tier cache for NAMASTE <-> ICD-11 translations.
+
+Tier 1 is a per-process LRU with a TTL; tier 2 is an optional Redis cache
+shared by every gunicorn worker. Entries are keyed by
+(source_system, source_code, target_system) and evicted precisely when the
+ConceptMapping rows behind them change. With Redis enabled, evictions are
+also broadcast so the other workers drop their tier-1 copies.
+
+Every eviction also advances an invalidation generation. A loader reads the
+generation before it goes to the database and stores its result only if it
+is unchanged, so a match list read just before a mapping commit cannot be
+cached after the eviction that commit caused. The Redis tier has a
+generation of its own, advanced by every worker's evictions, and a Lua
+script writes entries only while it still holds the value read before the
+load, so no worker can put a stale list back into the shared tier either.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from src.services import preload, terminology
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe LRU with a per-entry TTL"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store value; ttl overrides the cache-wide TTL for this entry"""
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, _MISSING) is not _MISSING
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class TranslationCache:
+    """Tier-1 LRU in front of an optional shared Redis tier"""
+
+    KEY_PREFIX = 'medisync:translate:'
+    CHANNEL = 'medisync:translate:invalidate'
+    GENERATION_KEY = 'medisync:translate:generation'
+
+    # KEYS: generation key, then entry keys; ARGV: expected generation, TTL, then values
+    STORE_SCRIPT = """
+if (redis.call('get', KEYS[1]) or '') ~= ARGV[1] then
+    return 0
+end
+for i = 2, #KEYS do
+    redis.call('set', KEYS[i], ARGV[i + 1], 'EX', ARGV[2])
+end
+return 1
+"""
+
+    def __init__(self, max_size=10000, ttl=3600, redis_client=None):
+        self.local = LRUCache(max_size, ttl)
+        self.ttl = ttl
+        self.redis = redis_client
+        self._store = redis_client.register_script(self.STORE_SCRIPT) if redis_client is not None else None
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.stale_loads = 0
+        self.generation = 0
+        self._generation_lock = threading.Lock()
+        self._subscriber = None
+
+    @staticmethod
+    def _redis_key(key):
+        return TranslationCache.KEY_PREFIX + '|'.join(key)
+
+    def get(self, key):
+        """Cached value for key, or None if neither tier has it"""
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+        if self.redis is not None:
+            try:
+                raw = self.redis.get(self._redis_key(key))
+            except Exception as e:
+                logger.warning('Shared translation cache unavailable: %s', e)
+                raw = None
+            if raw is not None:
+                value = json.loads(raw)
+                self.local.set(key, value)
+                self.shared_hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def get_many(self, keys):
+        """Cached values for whichever of keys either tier has, as a dict"""
+        found = {}
+        remote = []
+        for key in dict.fromkeys(keys):
+            value = self.local.get(key, _MISSING)
+            if value is _MISSING:
+                remote.append(key)
+            else:
+                found[key] = value
+        self.hits += len(found)
+        if remote and self.redis is not None:
+            try:
+                raws = self.redis.mget([self._redis_key(key) for key in remote])
+            except Exception as e:
+                logger.warning('Shared translation cache unavailable: %s', e)
+                raws = [None] * len(remote)
+            for key, raw in zip(remote, raws):
+                if raw is not None:
+                    found[key] = json.loads(raw)
+                    self.local.set(key, found[key])
+                    self.shared_hits += 1
+        self.misses += sum(1 for key in remote if key not in found)
+        return found
+
+    def begin_load(self):
+        """Generations (local, shared) to pass to set()/set_many() for values about to be loaded"""
+        shared = None
+        if self.redis is not None:
+            try:
+                shared = (self.redis.get(self.GENERATION_KEY) or b'').decode()
+            except Exception as e:
+                logger.warning('Shared translation cache unavailable: %s', e)
+        return self.generation, shared
+
+    def set(self, key, value, generation=None):
+        """Store value in both tiers, unless anything was invalidated since generation (from begin_load())"""
+        self.set_many({key: value}, generation)
+
+    def set_many(self, items, generation=None):
+        """Store a {key: value} mapping in both tiers (one Redis round trip), as set() does"""
+        with self._generation_lock:
+            if not self._current(generation):
+                return
+            for key, value in items.items():
+                self.local.set(key, value)
+        if self.redis is None or not items:
+            return
+        try:
+            if generation is None:
+                pipe = self.redis.pipeline(transaction=False)
+                for key, value in items.items():
+                    pipe.set(self._redis_key(key), json.dumps(value), ex=self.ttl)
+                pipe.execute()
+            elif generation[1] is not None:
+                # Checked and written atomically; an invalidation that comes later deletes what was written
+                stored = self._store(keys=[self.GENERATION_KEY] + [self._redis_key(key) for key in items],
+                                     args=[generation[1], self.ttl] + [json.dumps(value) for value in items.values()])
+                if not stored:
+                    self.stale_loads += 1
+        except Exception as e:
+            logger.warning('Shared translation cache unavailable: %s', e)
+
+    def _current(self, generation):
+        # Called with _generation_lock held
+        if generation is None or generation[0] == self.generation:
+            return True
+        self.stale_loads += 1
+        return False
+
+    def get_or_load(self, key, loader):
+        value = self.get(key)
+        if value is None:
+            generation = self.begin_load()
+            value = loader()
+            self.set(key, value, generation)
+        return value
+
+    def invalidate(self, keys, broadcast=True):
+        """Evict exactly these keys from both tiers (and other workers' tier 1)"""
+        keys = list(keys)
+        if not keys:
+            return
+        # Advanced before evicting: a load that stores after the check in
+        # set() has stored before the eviction below
+        with self._generation_lock:
+            self.generation += 1
+        for key in keys:
+            if self.local.delete(key):
+                self.invalidations += 1
+        if self.redis is None:
+            return
+        try:
+            # The shared generation first, so a store checked against the old one lands before the delete
+            pipe = self.redis.pipeline()
+            pipe.incr(self.GENERATION_KEY)
+            pipe.delete(*(self._redis_key(key) for key in keys))
+            pipe.execute()
+            if broadcast:
+                self.redis.publish(self.CHANNEL, json.dumps([list(key) for key in keys]))
+        except Exception as e:
+            logger.warning('Shared translation cache unavailable: %s', e)
+
+    def listen_for_invalidations(self):
+        """Drop tier-1 entries that other workers invalidate"""
+        if self.redis is None or self._subscriber is not None:
+            return
+
+        def listen():
+            while True:
+                try:
+                    pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                    pubsub.subscribe(self.CHANNEL)
+                    for message in pubsub.listen():
+                        keys = [tuple(key) for key in json.loads(message['data'])]
+                        self.invalidate(keys, broadcast=False)
+                except Exception as e:
+                    logger.warning('Translation cache invalidation listener restarting: %s', e)
+                    # Anything missed while disconnected may be stale
+                    with self._generation_lock:
+                        self.generation += 1
+                    self.local.clear()
+                    time.sleep(5)
+
+        self._subscriber = threading.Thread(target=listen, name='translation-cache-invalidation', daemon=True)
+        self._subscriber.start()
+
+    def stats(self):
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            'size': len(self.local),
+            'max_size': self.local.max_size,
+            'ttl_seconds': self.ttl,
+            'shared_tier': self.redis is not None,
+            'hits': self.hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'hit_ratio': round((self.hits + self.shared_hits) / lookups, 4) if lookups else None,
+            'evictions': self.local.evictions,
+            'expirations': self.local.expirations,
+            'invalidations': self.invalidations,
+            'stale_loads': self.stale_loads,
+        }
+
+
+def _on_mappings_changed(app, keys=()):
+    cache = app.extensions.get('translation_cache')
+    if cache is not None:
+        cache.invalidate(keys)
+
+
+def init_app(app):
+    redis_client = None
+    if app.config.get('REDIS_URL') and app.config.get('TRANSLATION_CACHE_SHARED', True):
+        import redis
+        redis_client = redis.Redis.from_url(app.config['REDIS_URL'])
+
+    cache = TranslationCache(
+        max_size=app.config.get('TRANSLATION_CACHE_SIZE', 10000),
+        ttl=app.config.get('TRANSLATION_CACHE_TTL', 3600),
+        redis_client=redis_client,
+    )
+    app.extensions['translation_cache'] = cache
+    terminology.mappings_changed.connect(_on_mappings_changed, sender=app, weak=False)
+    preload.start_in_worker(app, cache.listen_for_invalidations)
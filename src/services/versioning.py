@@ -0,0 +1,343 @@
+"""
+Compact version storage for FHIRResource.
+
+Every version is still one FHIRResource row, but its resource_data is
+either a snapshot (the full resource JSON) or a JSON Patch (RFC 6902)
+against the previous version. A snapshot is written whenever
+VERSION_SNAPSHOT_INTERVAL patches have followed the last one, or when the
+patch would be no smaller than the resource, so reading any version means
+loading at most that many rows and applying at most that many patches.
+With VERSION_COMPRESS_PAYLOADS on, payloads are stored zlib-compressed
+(base64 with a "z:" prefix) whenever that is shorter.
+
+Rows written before this scheme hold full documents, which read as
+snapshots; `flask fhir compact` rewrites them into snapshot + patch form.
+"""
+
+import base64
+import copy
+import json
+import time
+import zlib
+
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, func, tuple_
+
+from src.extensions import db
+
+# Values per IN (...) query
+BULK_QUERY_CHUNK = 500
+
+COMPRESSED_PREFIX = 'z:'
+
+VERSIONS_INDEX = 'ix_fhir_resource_versions'
+
+
+# -- JSON Patch ----------------------------------------------------------
+
+def _pointer(path, key):
+    return f'{path}/{str(key).replace("~", "~0").replace("/", "~1")}'
+
+
+def _same(old, new):
+    # True == 1 and 1 == 1.0 in Python, but not in JSON, at any depth
+    if type(old) is not type(new):
+        return False
+    if isinstance(old, dict):
+        return old.keys() == new.keys() and all(_same(value, new[key]) for key, value in old.items())
+    if isinstance(old, list):
+        return len(old) == len(new) and all(_same(a, b) for a, b in zip(old, new))
+    return old == new
+
+
+def make_patch(old, new, path=''):
+    """JSON Patch operations turning old into new"""
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = [{'op': 'remove', 'path': _pointer(path, key)} for key in old if key not in new]
+        for key, value in new.items():
+            if key not in old:
+                ops.append({'op': 'add', 'path': _pointer(path, key), 'value': value})
+            elif not _same(old[key], value):
+                ops.extend(make_patch(old[key], value, _pointer(path, key)))
+        return ops
+    if isinstance(old, list) and isinstance(new, list):
+        ops = []
+        for index, (a, b) in enumerate(zip(old, new)):
+            if not _same(a, b):
+                ops.extend(make_patch(a, b, _pointer(path, index)))
+        ops.extend({'op': 'add', 'path': _pointer(path, index), 'value': new[index]}
+                   for index in range(len(old), len(new)))
+        # From the end, so earlier indexes stay valid
+        ops.extend({'op': 'remove', 'path': _pointer(path, index)}
+                   for index in range(len(old) - 1, len(new) - 1, -1))
+        return ops
+    if _same(old, new):
+        return []
+    return [{'op': 'replace', 'path': path, 'value': new}]
+
+
+def apply_patch(document, ops):
+    """Apply add/remove/replace operations to document in place; returns the result"""
+    for op in ops:
+        if op['path'] == '':
+            document = op['value']
+            continue
+        *parents, last = [part.replace('~1', '/').replace('~0', '~') for part in op['path'].split('/')[1:]]
+        target = document
+        for part in parents:
+            target = target[int(part)] if isinstance(target, list) else target[part]
+        if isinstance(target, list):
+            index = len(target) if last == '-' else int(last)
+            if op['op'] == 'add':
+                target.insert(index, op['value'])
+            elif op['op'] == 'remove':
+                del target[index]
+            else:
+                target[index] = op['value']
+        elif op['op'] == 'remove':
+            del target[last]
+        else:
+            target[last] = op['value']
+    return document
+
+
+# -- payload encoding ----------------------------------------------------
+
+def _dumps(value):
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+
+def encode_payload(value, compress=False):
+    text = _dumps(value)
+    if compress:
+        packed = COMPRESSED_PREFIX + base64.b64encode(zlib.compress(text.encode('utf-8'))).decode('ascii')
+        if len(packed) < len(text):
+            return packed
+    return text
+
+
+def decode_payload(data):
+    """(is_snapshot, resource or patch) for a stored resource_data value"""
+    if data.startswith(COMPRESSED_PREFIX):
+        data = zlib.decompress(base64.b64decode(data[len(COMPRESSED_PREFIX):])).decode('utf-8')
+    value = json.loads(data)
+    return isinstance(value, dict), value
+
+
+class Head:
+    """Latest version of a resource: number, document and patches since the last snapshot"""
+
+    __slots__ = ('version', 'document', 'depth')
+
+    def __init__(self, version, document, depth):
+        self.version = version
+        self.document = document
+        self.depth = depth
+
+
+def _settings():
+    config = current_app.config
+    return config.get('VERSION_SNAPSHOT_INTERVAL', 10), config.get('VERSION_COMPRESS_PAYLOADS', False)
+
+
+def encode_version(head, version, document, interval=None, compress=None):
+    """
+    resource_data for a new version and the Head it becomes.
+
+    head is the previous version (None for the first); document is stored
+    as a patch against it unless a snapshot is due or the patch is larger.
+    """
+    if interval is None or compress is None:
+        interval, compress = _settings()
+    if head is not None and head.depth < interval:
+        patch = make_patch(head.document, document)
+        if len(_dumps(patch)) < len(_dumps(document)):
+            return encode_payload(patch, compress), Head(version, document, head.depth + 1)
+    return encode_payload(document, compress), Head(version, document, 0)
+
+
+def _rebuild(rows):
+    """Head from (version, resource_data) rows in ascending order, or None without a snapshot"""
+    start = None
+    for index in range(len(rows) - 1, -1, -1):
+        is_snapshot, value = decode_payload(rows[index][1])
+        if is_snapshot:
+            start = index
+            break
+    if start is None:
+        return None
+    document = value
+    for version, data in rows[start + 1:]:
+        document = apply_patch(document, decode_payload(data)[1])
+    return Head(rows[-1][0], document, len(rows) - 1 - start)
+
+
+def _chunks(values):
+    values = list(values)
+    for start in range(0, len(values), BULK_QUERY_CHUNK):
+        yield values[start:start + BULK_QUERY_CHUNK]
+
+
+# -- reads ---------------------------------------------------------------
+
+def read(resource_type, resource_id, version=None):
+    """(version, resource) of the given or latest version, or None if it does not exist"""
+    from src.models import FHIRResource
+
+    interval, _ = _settings()
+    query = (db.select(FHIRResource.version, FHIRResource.resource_data)
+             .where(FHIRResource.resource_type == resource_type, FHIRResource.resource_id == resource_id)
+             .order_by(FHIRResource.version.desc()))
+    if version is not None:
+        query = query.where(FHIRResource.version <= version)
+    # The snapshot is at most interval rows back, unless the interval was lowered since
+    rows = db.session.execute(query.limit(interval + 1)).all()
+    if not rows or (version is not None and rows[0].version != version):
+        return None
+    head = _rebuild(rows[::-1])
+    if head is None:
+        head = _rebuild(db.session.execute(query).all()[::-1])
+    return head.version, head.document
+
+
+def history(resource_type, resource_id):
+    """[(version, created_at, resource)] of every version, newest first"""
+    from src.models import FHIRResource
+
+    rows = db.session.execute(
+        db.select(FHIRResource.version, FHIRResource.created_at, FHIRResource.resource_data)
+        .where(FHIRResource.resource_type == resource_type, FHIRResource.resource_id == resource_id)
+        .order_by(FHIRResource.version)
+    )
+    versions = []
+    document = None
+    for version, created_at, data in rows:
+        is_snapshot, value = decode_payload(data)
+        document = value if is_snapshot else apply_patch(document, value)
+        versions.append((version, created_at, copy.deepcopy(document)))
+    return versions[::-1]
+
+
+def heads(keys):
+    """Head for each existing (resource_type, resource_id) in keys"""
+    from src.models import FHIRResource
+
+    interval, _ = _settings()
+    found = {}
+    for chunk in _chunks(keys):
+        latest = (
+            db.select(FHIRResource.resource_type, FHIRResource.resource_id,
+                      func.max(FHIRResource.version).label('version'))
+            .where(tuple_(FHIRResource.resource_type, FHIRResource.resource_id).in_(chunk))
+            .group_by(FHIRResource.resource_type, FHIRResource.resource_id)
+            .subquery()
+        )
+        rows = db.session.execute(
+            db.select(FHIRResource.resource_type, FHIRResource.resource_id, FHIRResource.version,
+                      FHIRResource.resource_data)
+            .join(latest, (FHIRResource.resource_type == latest.c.resource_type)
+                  & (FHIRResource.resource_id == latest.c.resource_id))
+            .where(tuple_(FHIRResource.resource_type, FHIRResource.resource_id).in_(chunk),
+                   FHIRResource.version >= latest.c.version - interval)
+            .order_by(FHIRResource.resource_type, FHIRResource.resource_id, FHIRResource.version)
+        )
+        grouped = {}
+        for resource_type, resource_id, version, data in rows:
+            grouped.setdefault((resource_type, resource_id), []).append((version, data))
+        for key, key_rows in grouped.items():
+            head = _rebuild(key_rows)
+            if head is None:
+                version, document = read(*key)
+                head = Head(version, document, interval)
+            found[key] = head
+    return found
+
+
+# -- migration -----------------------------------------------------------
+
+def compact(batch_size=BULK_QUERY_CHUNK):
+    """
+    Re-encode every stored version as snapshots plus patches.
+
+    Safe to run repeatedly and on partly converted data. Returns counts of
+    resources and rewritten rows, and resource_data bytes before and after.
+    """
+    from src.models import FHIRResource
+
+    versions_index().create(db.engine, checkfirst=True)
+    interval, compress = _settings()
+    stats = {'resources': 0, 'rows_rewritten': 0, 'bytes_before': 0, 'bytes_after': 0}
+    update = (FHIRResource.__table__.update()
+              .where(FHIRResource.__table__.c.id == bindparam('row_id'))
+              .values(resource_data=bindparam('data')))
+    after = None
+    while True:
+        query = (db.select(FHIRResource.resource_type, FHIRResource.resource_id).distinct()
+                 .order_by(FHIRResource.resource_type, FHIRResource.resource_id).limit(batch_size))
+        if after is not None:
+            query = query.where(tuple_(FHIRResource.resource_type, FHIRResource.resource_id) > after)
+        keys = [tuple(key) for key in db.session.execute(query)]
+        if not keys:
+            break
+        after = keys[-1]
+        rows = db.session.execute(
+            db.select(FHIRResource.id, FHIRResource.resource_type, FHIRResource.resource_id,
+                      FHIRResource.version, FHIRResource.resource_data)
+            .where(tuple_(FHIRResource.resource_type, FHIRResource.resource_id).in_(keys))
+            .order_by(FHIRResource.resource_type, FHIRResource.resource_id, FHIRResource.version)
+        ).all()
+        updates = []
+        previous_key = head = document = None
+        for row_id, resource_type, resource_id, version, data in rows:
+            if (resource_type, resource_id) != previous_key:
+                previous_key = (resource_type, resource_id)
+                head = document = None
+                stats['resources'] += 1
+            is_snapshot, value = decode_payload(data)
+            document = value if is_snapshot else apply_patch(copy.deepcopy(document), value)
+            encoded, head = encode_version(head, version, document, interval, compress)
+            # Patches rebuilt from patches may list the same operations in another order, so
+            # rows are only rewritten when their form changes or they get smaller
+            if ((is_snapshot, data.startswith(COMPRESSED_PREFIX)) != (head.depth == 0,
+                                                                      encoded.startswith(COMPRESSED_PREFIX))
+                    or len(encoded) < len(data)):
+                updates.append({'row_id': row_id, 'data': encoded})
+            else:
+                encoded = data
+            stats['bytes_before'] += len(data)
+            stats['bytes_after'] += len(encoded)
+        if updates:
+            db.session.execute(update, updates)
+            stats['rows_rewritten'] += len(updates)
+        db.session.commit()
+    return stats
+
+
+fhir_cli = AppGroup('fhir', help='FHIR resource storage maintenance.')
+
+
+@fhir_cli.command('compact')
+def compact_command():
+    """Convert stored resource versions to snapshots plus JSON Patch deltas."""
+    started = time.perf_counter()
+    stats = compact()
+    print(f'Compacted {stats["resources"]} resources ({stats["rows_rewritten"]} rows rewritten): '
+          f'{stats["bytes_before"]} -> {stats["bytes_after"]} bytes in {time.perf_counter() - started:.2f}s')
+
+
+def versions_index():
+    """The (resource_type, resource_id, version) index that reads and heads() rely on"""
+    from src.models import FHIRResource
+
+    table = FHIRResource.__table__
+    for index in table.indexes:
+        if index.name == VERSIONS_INDEX:
+            return index
+    return db.Index(VERSIONS_INDEX, table.c.resource_type, table.c.resource_id, table.c.version)
+
+
+def init_app(app):
+    # Declared on the table so db.create_all() builds it; compact() adds it to existing databases
+    versions_index()
+    app.cli.add_command(fhir_cli)
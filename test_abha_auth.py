@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Test script for cached ABHA token validation against the local stub ABHA server
+"""
+
+import hashlib
+import time
+
+from flask import g, jsonify
+
+from app import create_app
+from mock_abha_server import MockABHAServer
+from src.services import abha_auth
+
+
+def check(condition, message):
+    print(f"{'✓' if condition else '✗'} {message}")
+    assert condition, message
+    return condition
+
+
+def test_abha_auth():
+    with MockABHAServer() as mock:
+        app = create_app('testing')
+        app.config.update(
+            ABHA_AUTH_REQUIRED=True,
+            ABHA_JWKS_URL=f'{mock.url}/certs',
+            ABHA_INTROSPECTION_URL=f'{mock.url}/introspect',
+            ABHA_CLIENT_ID=mock.client_id,
+            ABHA_CLIENT_SECRET=mock.client_secret,
+            ABHA_ISSUER=mock.issuer,
+        )
+        abha_auth.init_app(app)
+        validator = app.extensions['abha_auth']
+
+        @app.route('/protected')
+        @abha_auth.require_token
+        def protected():
+            return jsonify({'user': g.user_id})
+
+        client = app.test_client()
+
+        print("JWT access tokens...")
+        token = mock.issue_jwt(subject='91-0000-0000-0001')
+        response = client.get('/protected', headers={'Authorization': f'Bearer {token}'})
+        check(response.status_code == 200 and response.json['user'] == '91-0000-0000-0001',
+              "Valid JWT accepted and its subject exposed as g.user_id")
+        for _ in range(50):
+            client.get('/protected', headers={'Authorization': f'Bearer {token}'})
+        check(mock.jwks_requests == 1, f"JWKS fetched {mock.jwks_requests} time for 51 requests")
+
+        started = time.perf_counter()
+        for _ in range(10000):
+            validator.validate(token)
+        per_call = (time.perf_counter() - started) / 10000 * 1e6
+        check(per_call < 50, f"Cached validation takes {per_call:.1f} µs per request")
+
+        print("\nRejected tokens...")
+        check(client.get('/protected').status_code == 401, "Missing token rejected with 401")
+        expired = mock.issue_jwt(expires_in=-120)
+        check(client.get('/protected', headers={'Authorization': f'Bearer {expired}'}).status_code == 401,
+              "Expired JWT rejected")
+        tampered = token[:-4] + ('AAAA' if not token.endswith('AAAA') else 'BBBB')
+        check(client.get('/protected', headers={'Authorization': f'Bearer {tampered}'}).status_code == 401,
+              "Tampered signature rejected")
+        rejected = validator.stats['rejected']
+        client.get('/protected', headers={'Authorization': f'Bearer {tampered}'})
+        check(validator.stats['rejected'] == rejected, "Repeated bad token answered from the negative cache")
+
+        print("\nKey rotation...")
+        mock.rotate_key()
+        # On-demand refreshes are rate-limited; pretend the last fetch was a while ago
+        validator.jwks._fetched_at -= validator.jwks.min_refresh_interval
+        rotated = mock.issue_jwt()
+        check(client.get('/protected', headers={'Authorization': f'Bearer {rotated}'}).status_code == 200,
+              "Token signed with a new key accepted after an on-demand JWKS refresh")
+        check(mock.jwks_requests == 2, "Unknown kid triggered exactly one JWKS refresh")
+
+        print("\nOpaque tokens (introspection)...")
+        opaque = mock.issue_opaque(subject='91-0000-0000-0002')
+        for _ in range(20):
+            response = client.get('/protected', headers={'Authorization': f'Bearer {opaque}'})
+        check(response.status_code == 200 and mock.introspection_requests == 1,
+              "Introspected once for 20 requests")
+        # Not 1s: the mock truncates the issue time, so that could lapse before introspection
+        short = mock.issue_opaque(expires_in=5)
+        validator.validate(short)
+        remaining = validator.cache._data[hashlib.sha256(short.encode()).digest()][1] - time.monotonic()
+        check(remaining <= 5 + validator.leeway, f"Cache TTL capped at the token's expiry ({remaining:.0f}s)")
+        revoked = mock.issue_opaque()
+        mock.revoke(revoked)
+        check(client.get('/protected', headers={'Authorization': f'Bearer {revoked}'}).status_code == 401,
+              "Revoked opaque token rejected")
+
+        print("\nAuth server down...")
+        mock.stop()
+        fresh = 'opaque-token-never-seen'
+        check(client.get('/protected', headers={'Authorization': f'Bearer {fresh}'}).status_code == 503,
+              "Unverifiable new token answered with 503, not cached as invalid")
+        check(client.get('/protected', headers={'Authorization': f'Bearer {token}'}).status_code == 200,
+              "Cached token still accepted while the auth server is down")
+
+
+if __name__ == "__main__":
+    print("MEDISYNC ABHA Token Validation Test")
+    print("=" * 50)
+    test_abha_auth()
+    print("=" * 50)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Test script for the batched audit writer: bulk flushes, spooling, replay and retention
+"""
+
+import json
+import os
+import tempfile
+from datetime import timedelta
+
+from app import create_app
+from src.extensions import db
+from src.services import audit
+
+
+def check(condition, message):
+    print(f"{'✓' if condition else '✗'} {message}")
+    assert condition, message
+    return condition
+
+
+def audit_count():
+    from src.models import AuditLog
+    return db.session.query(AuditLog).count()
+
+
+def test_audit_writer():
+    app = create_app('testing')
+    app.config['AUDIT_SPOOL_DIR'] = tempfile.mkdtemp()
+    with app.app_context():
+        db.create_all()
+    writer = app.extensions['audit']
+    # Drive the writer by hand so the test controls when batches are flushed
+    writer.stop()
+    writer.spool_dir = app.config['AUDIT_SPOOL_DIR']
+    client = app.test_client()
+
+    with app.app_context():
+        print("Requests queue events without touching the database...")
+        for _ in range(25):
+            client.get('/translate/cache/stats')
+        check(writer.queue.qsize() == 25 and audit_count() == 0, "25 events queued, none written yet")
+        writer.flush()
+        check(audit_count() == 25 and writer.stats['batches'] == 1, "Written in one bulk insert")
+
+        print("\nDatabase unavailable...")
+        db.session.remove()
+        original = audit._audit_table
+        audit._audit_table = lambda: db.Table('missing_audit_table', db.MetaData(), *[
+            db.Column(column.name, column.type) for column in original().columns])
+        writer._columns = None
+        for _ in range(10):
+            audit.log('search', resource_type='ValueSet')
+        writer.flush()
+        audit._audit_table = original
+        writer._columns = None
+        spooled = os.listdir(writer.spool_dir)
+        check(writer.stats['spooled'] == 10 and spooled, f"Failed batch spooled to {spooled}")
+
+        print("\nQueue full...")
+        writer.queue.maxsize = 5
+        for _ in range(8):
+            audit.log('translate', resource_type='ConceptMap')
+        check(writer.stats['spooled'] == 13, "Overflow events spooled instead of dropped")
+
+        print("\nReplay once the database is back...")
+        writer.flush()
+        replayed = writer.replay_spool()
+        check(replayed == 13 and not os.listdir(writer.spool_dir), f"Replayed {replayed} spooled events")
+        check(audit_count() == 25 + 5 + 13, "Every event reached AuditLog exactly once")
+
+        print("\nShutdown drains the queue...")
+        writer.start()
+        audit.log('shutdown-test')
+        writer.stop()
+        check(audit_count() == 44, "Queued event written on stop()")
+
+        print("\nRetention...")
+        from src.models import AuditLog
+        old = audit._utcnow() - timedelta(days=app.config['AUDIT_LOG_RETENTION_DAYS'] + 1)
+        db.session.query(AuditLog).filter(AuditLog.id <= 30).update({'timestamp': old})
+        db.session.commit()
+        deleted, _ = audit.purge_expired(chunk_size=7)
+        check(deleted == 30 and audit_count() == 14, f"Deleted {deleted} expired events in id-range chunks")
+
+        print("\nKilled worker...")
+        audit.log('journal-test')
+        journals = [name for name in os.listdir(writer.spool_dir) if name.endswith('.journal')]
+        check(len(journals) == 1 and writer.replay_spool() == 0, "Queued event journaled; own journal not replayed")
+        writer.flush()
+        check(not os.listdir(writer.spool_dir) and audit_count() == 15, "Journal deleted once its events are written")
+        pid = os.fork()
+        if pid == 0:
+            with app.test_request_context('/'):
+                for _ in range(3):
+                    audit.log('crash-test')
+            # Killed before the writer flushes anything
+            os._exit(0)
+        os.waitpid(pid, 0)
+        left = os.listdir(writer.spool_dir)
+        check(len(left) == 1 and left[0].startswith(f'{pid}.') and left[0].endswith('.journal'),
+              f"Dead worker left its journal {left}")
+        replayed = writer.replay_spool()
+        check(replayed == 3 and audit_count() == 18 and not os.listdir(writer.spool_dir),
+              f"Its {replayed} queued events recovered from the journal")
+
+        print("\nRestarted worker reusing a dead worker's pid...")
+        # As a container restart leaves it: same pid as this process, but nobody holds it
+        with open(os.path.join(writer.spool_dir, f'{os.getpid()}.1.journal'), 'w', encoding='utf-8') as f:
+            for _ in range(2):
+                f.write(json.dumps({'timestamp': audit._utcnow(), 'action': 'reused-pid'}, default=str) + '\n')
+        audit.log('live-event')
+        own = writer._journal.path
+        replayed = writer.replay_spool()
+        check(replayed == 2 and os.listdir(writer.spool_dir) == [os.path.basename(own)],
+              "Orphaned journal with this process's pid replayed; the live, locked one kept")
+        writer.flush()
+        check(audit_count() == 21 and not os.listdir(writer.spool_dir), "Live journal's event written once")
+
+
+if __name__ == "__main__":
+    print("MEDISYNC Audit Writer Test")
+    print("=" * 50)
+    test_audit_writer()
+    print("=" * 50)
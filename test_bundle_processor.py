@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Test script for set-based Bundle processing: bulk validation, per-entry statuses, transactions and references
+"""
+
+from sqlalchemy import event
+
+from app import create_app
+from src.extensions import db
+from src.services import bundle_processor, versioning
+from src.services.terminology import NAMASTE_SYSTEM, ICD11_SYSTEM
+
+
+def check(condition, message):
+    print(f"{'✓' if condition else '✗'} {message}")
+    assert condition, message
+    return condition
+
+
+def condition(namaste, icd11, **fields):
+    return dict({'resourceType': 'Condition', 'code': {'coding': [
+        {'system': NAMASTE_SYSTEM, 'code': namaste}, {'system': ICD11_SYSTEM, 'code': icd11}]}}, **fields)
+
+
+def statuses(body):
+    return [entry['response']['status'] for entry in body['entry']]
+
+
+def stored(resource_type=None):
+    from src.models import FHIRResource
+
+    query = db.select(db.func.count()).select_from(FHIRResource)
+    if resource_type:
+        query = query.where(FHIRResource.resource_type == resource_type)
+    return db.session.execute(query).scalar()
+
+
+def test_bundle_processor():
+    from src.models import ICD11Code, NAMASTECode
+
+    app = create_app('testing')
+    app.config['CONSENT_REQUIRED'] = False
+    client = app.test_client()
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([NAMASTECode(code=f'NAM{i:03d}', display=f'Concept {i}') for i in range(300)])
+        db.session.add_all([ICD11Code(code=f'SA{i:03d}', title=f'Pattern {i}') for i in range(300)])
+        db.session.commit()
+
+        print("Collection of dual-coded Conditions...")
+        queries = []
+        listener = lambda *args: queries.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            bundle = {'resourceType': 'Bundle', 'type': 'collection',
+                      'entry': [{'resource': condition(f'NAM{i:03d}', f'SA{i:03d}')} for i in range(300)]}
+            response = client.post('/bundle/process', json=bundle)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        check(response.status_code == 200 and statuses(response.json) == ['201 Created'] * 300,
+              "300 entries created")
+        lookups = [sql for sql in queries if 'FROM namaste_code' in sql or 'FROM icd11_code' in sql]
+        inserts = [sql for sql in queries if sql.startswith('INSERT INTO fhir_resource')]
+        check(len(lookups) == 2 and len(inserts) == 1,
+              f"{len(lookups)} code lookups and {len(inserts)} insert for 600 codings")
+        check(stored('Condition') == 300, "All 300 stored")
+
+        print("\nBatch: per-entry outcomes...")
+        bundle = {'resourceType': 'Bundle', 'type': 'batch', 'entry': [
+            {'resource': condition('NAM001', 'SA001', id='c1'), 'request': {'method': 'PUT', 'url': 'Condition/c1'}},
+            {'resource': condition('NAM999', 'SA001'), 'request': {'method': 'POST', 'url': 'Condition'}},
+            {'resource': condition('NAM002', 'SA002'), 'request': {'method': 'DELETE', 'url': 'Condition/x'}},
+            {'resource': condition('NAM002', 'SA002'), 'request': {'method': 'PUT', 'url': 'Observation/c2'}},
+            {'request': {'method': 'POST', 'url': 'Condition'}},
+        ]}
+        body = client.post('/bundle/process', json=bundle).json
+        check(body['type'] == 'batch-response' and statuses(body) == [
+            '201 Created', '422 Unprocessable Entity', '405 Method Not Allowed', '400 Bad Request',
+            '400 Bad Request'], f"Statuses {statuses(body)}")
+        check(f'{NAMASTE_SYSTEM}|NAM999' in body['entry'][1]['response']['outcome']['issue'][0]['details']['text'],
+              "Unknown code named in the outcome")
+        body = client.post('/bundle/process', json=bundle).json
+        check(body['entry'][0]['response'] == {'status': '200 OK', 'location': 'Condition/c1/_history/2',
+                                               'etag': 'W/"2"'} and body['entry'][0]['fullUrl'] == 'Condition/c1',
+              "PUT of an existing resource writes version 2")
+
+        print("\nTransactions...")
+        before = stored()
+        bundle = {'resourceType': 'Bundle', 'type': 'transaction', 'entry': [
+            {'fullUrl': 'urn:uuid:patient-1', 'resource': {'resourceType': 'Patient'},
+             'request': {'method': 'POST', 'url': 'Patient'}},
+            {'resource': condition('NAM003', 'SA999', subject={'reference': 'urn:uuid:patient-1'}),
+             'request': {'method': 'POST', 'url': 'Condition'}},
+        ]}
+        response = client.post('/bundle/process', json=bundle)
+        check(response.status_code == 400 and response.json['resourceType'] == 'OperationOutcome'
+              and stored() == before, "One bad entry rejects the whole transaction, nothing written")
+        bundle['entry'][1]['resource'] = condition('NAM003', 'SA003', subject={'reference': 'urn:uuid:patient-1'})
+        body = client.post('/bundle/process', json=bundle).json
+        patient = body['entry'][0]['fullUrl']
+        check(body['type'] == 'transaction-response' and statuses(body) == ['201 Created'] * 2 and stored() == before + 2,
+              "Valid transaction stored")
+        _, resource = versioning.read(*body['entry'][1]['fullUrl'].split('/'))
+        check(patient.startswith('Patient/') and resource['subject']['reference'] == patient,
+              "urn:uuid reference rewritten to the assigned id")
+
+        print("\nUnusable Bundles...")
+        for body, text in (([], 'Not a Bundle'), ({'resourceType': 'Bundle', 'type': 'searchset'}, 'Unsupported type')):
+            try:
+                bundle_processor.process_bundle(body)
+                raised = False
+            except bundle_processor.BundleError:
+                raised = True
+            check(raised, f"{text}: BundleError")
+        check(client.post('/bundle/process', json={'resourceType': 'Patient'}).status_code == 400, "HTTP 400")
+
+
+if __name__ == "__main__":
+    print("MEDISYNC Bundle Processing Test")
+    print("=" * 50)
+    test_bundle_processor()
+    print("=" * 50)
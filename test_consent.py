@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Test script for the consent engine: bulk loading, decision caching, invalidation and Server-Timing
+"""
+
+import time
+from datetime import timedelta
+
+from sqlalchemy import event
+
+from app import create_app
+from src.extensions import db
+from src.services import consent
+
+
+def check(condition, message):
+    print(f"{'✓' if condition else '✗'} {message}")
+    assert condition, message
+    return condition
+
+
+def condition_bundle(patients, bundle_type='batch'):
+    return {'resourceType': 'Bundle', 'type': bundle_type, 'entry': [{
+        'resource': {'resourceType': 'Condition', 'subject': {'reference': f'Patient/{patient}'}},
+        'request': {'method': 'POST', 'url': 'Condition'},
+    } for patient in patients]}
+
+
+def statuses(response):
+    return [entry['response']['status'] for entry in response.json['entry']]
+
+
+def test_consent():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+    engine = app.extensions['consent']
+    client = app.test_client()
+
+    with app.app_context():
+        from src.models import ConsentRecord
+
+        now = consent._utcnow()
+        db.session.add_all([ConsentRecord(patient_id=f'p{i}', purpose='treatment', status='active')
+                            for i in range(100)])
+        db.session.add_all([
+            ConsentRecord(patient_id='research-only', purpose='research', status='active'),
+            ConsentRecord(patient_id='observations-only', purpose='*', resource_types='Observation',
+                          status='active'),
+            ConsentRecord(patient_id='expired', purpose='treatment', status='active',
+                          valid_until=now - timedelta(days=1)),
+            ConsentRecord(patient_id='ending', purpose='treatment', status='active',
+                          valid_until=now + timedelta(seconds=1)),
+        ])
+        db.session.commit()
+
+        print("Bulk loading...")
+        patients = [f'p{i % 100}' for i in range(300)]
+        response = client.post('/bundle/process', json=condition_bundle(patients))
+        check(set(statuses(response)) == {'201 Created'}, "300 entries of 100 consenting patients stored")
+        check(engine.queries == 1, f"Consents loaded with {engine.queries} query")
+        timing = response.headers.get('Server-Timing', '')
+        check(timing.startswith('consent;dur=') and '300 checks, 200 cached' in timing, f"Server-Timing: {timing}")
+
+        response = client.post('/bundle/process', json=condition_bundle(patients))
+        check(engine.queries == 1 and '300 cached' in response.headers['Server-Timing'],
+              "Repeat request answered from the decision cache")
+
+        print("\nDecision rules...")
+        check(not engine.decide('research-only', 'treatment', 'Condition'), "Other purpose denied")
+        check(engine.decide('research-only', 'research', 'Condition'), "Consented purpose allowed")
+        check(engine.decide('observations-only', 'treatment', 'Observation')
+              and not engine.decide('observations-only', 'treatment', 'Condition'), "Resource types restricted")
+        check(not engine.decide('expired', 'treatment', 'Condition'), "Expired consent denied")
+        check(not engine.decide('nobody', 'treatment', 'Condition'), "Patient without consent denied")
+        check(engine.evaluate([{'resourceType': 'Organization'}], 'treatment') == [None],
+              "Resources without a patient are not consent-checked")
+
+        response = client.post('/bundle/process', json=condition_bundle(['p1', 'research-only']))
+        check(statuses(response) == ['201 Created', '403 Forbidden'], "Unconsented batch entry refused with 403")
+        response = client.post('/bundle/process?purpose=research', json=condition_bundle(['research-only']))
+        check(statuses(response) == ['201 Created'], "purpose parameter honoured")
+        response = client.post('/bundle/process', json=condition_bundle(['p1', 'nobody'], 'transaction'))
+        check(response.status_code == 400, "Transaction with an unconsented entry rejected")
+
+        print("\nInvalidation...")
+        check(engine.decide('ending', 'treatment', 'Condition'), "Consent valid until a second from now")
+        time.sleep(1.1)
+        check(not engine.decide('ending', 'treatment', 'Condition'), "Cached decision expires with the consent")
+
+        check(engine.decide('p1', 'treatment', 'Condition'), "p1 allowed before revocation")
+        record = db.session.execute(db.select(ConsentRecord).filter_by(patient_id='p1')).scalar_one()
+        record.status = 'revoked'
+        db.session.commit()
+        check(engine.invalidations == 1 and not engine.decide('p1', 'treatment', 'Condition'),
+              "Revocation evicts the patient and is seen immediately")
+
+        db.session.add(ConsentRecord(patient_id='nobody', purpose='treatment', status='active'))
+        db.session.commit()
+        check(engine.decide('nobody', 'treatment', 'Condition'), "New consent is seen immediately")
+
+        print("\nRevocation racing a load...")
+        engine.invalidate(['p3'])
+
+        def revoked_meanwhile(*args):
+            # As if p3's consent were revoked after the SELECT read it as active
+            if engine.stale_loads == 0:
+                engine.invalidate(['p3'])
+        event.listen(db.engine, 'after_cursor_execute', revoked_meanwhile)
+        loaded = engine.load(['p3'])
+        event.remove(db.engine, 'after_cursor_execute', revoked_meanwhile)
+        check('p3' in loaded and engine.patients.get('p3') is None and engine.stale_loads == 1,
+              "Rows read before an invalidation are returned but not cached")
+        uncached = consent.ConsentEngine(max_patients=0)
+        check(uncached.decide('p3', 'treatment', 'Condition') and uncached.evaluate(
+            [{'resourceType': 'Condition', 'subject': {'reference': 'Patient/p3'}}], 'treatment') == [True],
+              "Decisions do not depend on the entry still being cached")
+
+        started = time.perf_counter()
+        for _ in range(100000):
+            engine.decide('p2', 'treatment', 'Condition')
+        elapsed = (time.perf_counter() - started) / 100000
+        check(elapsed < 50e-6, f"Cached decision in {elapsed * 1e6:.1f} µs")
+
+
+if __name__ == "__main__":
+    print("MEDISYNC Consent Engine Test")
+    print("=" * 50)
+    test_consent()
+    print("=" * 50)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Test script for ValueSet $expand: keyset cursor paging across sort-key ties, offsets and streamed expansions
+"""
+
+import io
+import json
+
+from app import create_app
+from src.extensions import db
+from src.services import expansion, namaste_loader
+from src.services.terminology import NAMASTE_SYSTEM
+
+HEADER = 'code,display,definition,category,parent_code\n'
+ROOT = 'NAM200'
+# Twelve siblings at depth 1, then five grandchildren whose codes sort before them
+CHILDREN = [f'NAM{n}' for n in range(210, 222)]
+GRANDCHILDREN = [f'NAM{n}' for n in range(201, 206)]
+
+
+def check(condition, message):
+    print(f"{'✓' if condition else '✗'} {message}")
+    assert condition, message
+    return condition
+
+
+def codes(value_set):
+    return [item['code'] for item in value_set['expansion']['contains']]
+
+
+def walk(client, url, count):
+    """Every page of an expansion by following expansion.next"""
+    pages = [client.get('/ValueSet/$expand', query_string={'url': url, 'count': count}).json]
+    while 'next' in pages[-1]['expansion']:
+        pages.append(client.get(pages[-1]['expansion']['next']).json)
+    return pages
+
+
+def test_expansion():
+    app = create_app('testing')
+    client = app.test_client()
+    with app.app_context():
+        db.create_all()
+        rows = [(ROOT, '')] + [(code, ROOT) for code in CHILDREN] + [(code, CHILDREN[0]) for code in GRANDCHILDREN]
+        text = HEADER + ''.join(f'{code},Concept {code},,Ayurveda,{parent}\n' for code, parent in rows)
+        namaste_loader.load_csv(io.BytesIO(text.encode()))
+        isa = f'{NAMASTE_SYSTEM}?fhir_vs=isa/{ROOT}'
+        expected = [ROOT] + CHILDREN + GRANDCHILDREN
+
+        print("Keyset paging...")
+        pages = walk(client, isa, 5)
+        walked = [code for value_set in pages for code in codes(value_set)]
+        check(walked == expected, "Cursor pages visit every is-a code once, by depth then code")
+        check([value_set['expansion']['offset'] for value_set in pages] == [0, 5, 10, 15],
+              "Cursor pages carry their offsets")
+        check(all(value_set['expansion']['total'] == len(expected) for value_set in pages), "total on every page")
+        pages = walk(client, NAMASTE_SYSTEM, 7)
+        check([code for value_set in pages for code in codes(value_set)] == sorted(expected),
+              "Whole-system pages follow code order")
+
+        print("\nOffset paging...")
+        response = client.get('/ValueSet/$expand', query_string={'url': isa, '_count': 4, 'offset': 6})
+        check(codes(response.json) == expected[6:10], "_count and offset page the same order")
+        response = client.get('/ValueSet/$expand', query_string={'url': isa, 'count': 4, 'offset': 16})
+        check(codes(response.json) == expected[16:] and 'next' not in response.json['expansion'],
+              "Last page has no next link")
+        response = client.get('/ValueSet/$expand', query_string={'url': isa, 'count': -1})
+        check(response.status_code == 400, "Negative count: 400")
+
+        print("\nCursor errors...")
+        spec = expansion.Expansion(NAMASTE_SYSTEM, ROOT)
+        cursor = expansion.encode_cursor(spec, [1, CHILDREN[2]], 3)
+        check(expansion.decode_cursor(spec, cursor) == ([1, CHILDREN[2]], 3), "Cursor round-trips")
+        for bad, reason in ((cursor, 'different expansion'), ('not-a-cursor', 'Malformed')):
+            try:
+                expansion.decode_cursor(expansion.Expansion(NAMASTE_SYSTEM), bad)
+                check(False, f"{reason} cursor rejected")
+            except expansion.CursorError as e:
+                check(reason in str(e), f"{reason} cursor rejected")
+        response = client.get('/ValueSet/$expand', query_string={'url': NAMASTE_SYSTEM, 'cursor': cursor})
+        check(response.status_code == 400 and response.json['resourceType'] == 'OperationOutcome',
+              "Foreign cursor: 400 OperationOutcome")
+
+        print("\nStreaming...")
+        for fast in (False, True):
+            app.config['FHIR_FAST_SERIALIZER'] = fast
+            response = client.get('/ValueSet/$expand', query_string={'url': isa, '_stream': 'true'})
+            streamed = json.loads(response.get_data(as_text=True))
+            check(codes(streamed) == expected and streamed['expansion']['total'] == len(expected)
+                  and streamed['expansion']['contains'][0] == {
+                      'system': NAMASTE_SYSTEM, 'code': ROOT, 'display': f'Concept {ROOT}'},
+                  f"Streamed expansion matches the paged one (fast={fast})")
+        response = client.get('/ValueSet/$expand', query_string={'url': f'{NAMASTE_SYSTEM}?fhir_vs=isa/NAM999'})
+        check(response.status_code == 404, "Unknown root code: 404")
+
+
+if __name__ == "__main__":
+    print("MEDISYNC ValueSet Expansion Test")
+    print("=" * 50)
+    test_expansion()
+    print("=" * 50)
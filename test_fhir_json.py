@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Test script for the fast FHIR serializer: templates and expansions must match jsonify byte for byte
+"""
+
+import json
+import time
+from datetime import datetime
+
+from flask import jsonify
+
+from app import create_app
+from src.extensions import db
+from src.services import expansion, fhir_json, hierarchy
+from src.services.terminology import NAMASTE_SYSTEM
+
+TRICKY = ['Vāta doṣa', 'वात दोष', 'say "prakṛti"', 'back\\slash', '100% कफ', 'tab\there', ' ', '😀', '', None]
+
+
+def check(condition, message):
+    print(f"{'✓' if condition else '✗'} {message}")
+    assert condition, message
+    return condition
+
+
+class FrozenDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return datetime(2024, 1, 1, tzinfo=tz)
+
+
+def add_codes(count):
+    from src.models import NAMASTECode
+    codes = [NAMASTECode(code='NAM00000', display='Tridosha', category='Ayurveda')]
+    codes += [NAMASTECode(code=f'NAM{i:05d}', display=f'{TRICKY[i % len(TRICKY)] or "x"} {i}', category='Ayurveda',
+                          parent_code=f'NAM{i // 10:05d}')
+              for i in range(1, count)]
+    db.session.add_all(codes)
+    db.session.commit()
+    hierarchy.rebuild(NAMASTE_SYSTEM)
+
+
+def same_page(spec, count, **kwargs):
+    slow = jsonify(expansion.page(spec, count, **kwargs)).get_data()
+    fast = fhir_json.response(expansion.page(spec, count, fast=True, **kwargs)).get_data()
+    return slow == fast, slow, fast
+
+
+def test_templates():
+    print("Templates against json.dumps...")
+    rows = [(a, b) for a in TRICKY for b in TRICKY + [1, 2.5, True, ['x', 'ü'], {'b': 1, 'a': 'ä'}]]
+    for sort_keys in (True, False):
+        for ensure_ascii in (True, False):
+            for separators in (fhir_json.COMPACT, (', ', ': ')):
+                template = fhir_json.Template(('zeta', 'alpha'), {'system': 'urn:x%s', 'm': 'ñ'},
+                                              sort_keys=sort_keys, separators=separators,
+                                              ensure_ascii=ensure_ascii)
+                expected = json.dumps([{'system': 'urn:x%s', 'm': 'ñ', 'zeta': a, 'alpha': b} for a, b in rows],
+                                      sort_keys=sort_keys, separators=separators, ensure_ascii=ensure_ascii)
+                check('[' + template.join(rows, separators[0]) + ']' == expected,
+                      f"sort_keys={sort_keys}, ensure_ascii={ensure_ascii}, separators={separators!r}")
+
+    document = {'b': [1, fhir_json.Fragment('[{"x":1}]')], 'a': {'c': fhir_json.Fragment('"\\u00e4"')}}
+    check(fhir_json.dumps(document) == '{"a":{"c":"\\u00e4"},"b":[1,[{"x":1}]]}', "dumps splices fragments in place")
+
+
+def test_expansions():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        add_codes(3000)
+        client = app.test_client()
+        original = expansion.datetime
+        expansion.datetime = FrozenDatetime
+        try:
+            print("\nExpansion pages...")
+            with app.test_request_context():
+                whole = expansion.Expansion(NAMASTE_SYSTEM)
+                branch = expansion.Expansion(NAMASTE_SYSTEM, 'NAM00002')
+                equal, slow, fast = same_page(whole, 1000, offset=500)
+                check(equal, f"Whole system page: {len(fast)} identical bytes")
+                body = json.loads(fast)
+                next_url = lambda cursor: f'https://example.org/next?cursor={cursor}'
+                equal, slow, fast = same_page(branch, 25, next_url=next_url)
+                check(equal and json.loads(fast)['expansion'].get('next'), "Hierarchy page with a next cursor")
+                cursor = json.loads(fast)['expansion']['next'].split('cursor=')[1]
+                check(same_page(branch, 25, cursor=cursor)[0], "Hierarchy page from a cursor")
+                check(same_page(whole, 10, offset=5000)[0], "Empty page")
+                check(body['expansion']['contains'][0]['display'] == f'{TRICKY[0]} 500', "Non-ASCII displays decode")
+
+                app.json.ensure_ascii = False
+                check(same_page(whole, 1000)[0], "With ensure_ascii off")
+                app.json.sort_keys = False
+                check(same_page(whole, 1000)[0], "With sort_keys off")
+                app.json.ensure_ascii = app.json.sort_keys = True
+
+                app.json.compact = False
+                check(not fhir_json.enabled() and fhir_json.settings() is None,
+                      "Pretty-printed output: fast path disabled")
+                app.json.compact = None
+
+            print("\nStreaming and HTTP...")
+            slow = ''.join(expansion.stream(whole, 700))
+            fast = ''.join(expansion.stream(whole, 700, fast=True))
+            check(slow == fast and json.loads(fast)['expansion']['total'] == 3000, "Streamed expansion identical")
+
+            url = f'/ValueSet/$expand?url={NAMASTE_SYSTEM}&count=2000'
+            responses = {}
+            for flag in (False, True):
+                app.config['FHIR_FAST_SERIALIZER'] = flag
+                responses[flag] = client.get(url)
+            check(responses[True].data == responses[False].data
+                  and responses[True].headers['Content-Type'] == responses[False].headers['Content-Type'],
+                  "$expand responses identical with FHIR_FAST_SERIALIZER on and off")
+
+            print("\nTiming (3000 codes)...")
+            with app.test_request_context():
+                rows = db.session.execute(whole.select()).all()
+                template = expansion._contains_template(NAMASTE_SYSTEM)
+                timings = {}
+                for label, render in (
+                    ('jsonify', lambda: jsonify([expansion._contains(whole, row) for row in rows]).get_data()),
+                    ('template', lambda: template.render_list([row[:2] for row in rows])),
+                ):
+                    started = time.perf_counter()
+                    for _ in range(20):
+                        render()
+                    timings[label] = (time.perf_counter() - started) / 20 * 1000
+                print(f"  contains: jsonify {timings['jsonify']:.2f} ms, template {timings['template']:.2f} ms "
+                      f"({timings['jsonify'] / timings['template']:.1f}x)")
+                for fast_path in (False, True):
+                    started = time.perf_counter()
+                    for _ in range(10):
+                        value_set = expansion.page(whole, 3000, fast=fast_path)
+                        (fhir_json.response if fast_path else jsonify)(value_set).get_data()
+                    timings[fast_path] = (time.perf_counter() - started) / 10 * 1000
+                print(f"  whole page with its queries: jsonify {timings[False]:.1f} ms, fast {timings[True]:.1f} ms")
+        finally:
+            expansion.datetime = original
+
+
+if __name__ == "__main__":
+    print("MEDISYNC Fast FHIR Serializer Test")
+    print("=" * 50)
+    test_templates()
+    test_expansions()
+    print("=" * 50)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Test script for the code hierarchy closure table: incremental maintenance, cycles, orphans and $subsumes
+"""
+
+import io
+
+from app import create_app
+from src.extensions import db
+from src.services import hierarchy, namaste_loader
+from src.services.terminology import NAMASTE_SYSTEM
+
+HEADER = 'code,display,definition,category,parent_code\n'
+
+
+def check(condition, message):
+    print(f"{'✓' if condition else '✗'} {message}")
+    assert condition, message
+    return condition
+
+
+def ingest(*rows):
+    text = HEADER + ''.join(f'{code},Concept {code},,Ayurveda,{parent}\n' for code, parent in rows)
+    return namaste_loader.load_csv(io.BytesIO(text.encode()), chunk_size=2)
+
+
+def closure():
+    return set(db.session.execute(
+        db.select(hierarchy.CodeClosure.ancestor, hierarchy.CodeClosure.descendant, hierarchy.CodeClosure.depth)
+        .where(hierarchy.CodeClosure.system == NAMASTE_SYSTEM)).all())
+
+
+def descendants(code, include_self=True):
+    return [(row.code, row.depth) for row in db.session.execute(
+        hierarchy.descendants_query(NAMASTE_SYSTEM, code, include_self))]
+
+
+def issue_codes(result):
+    return sorted((issue['code'], issue['details']['text']) for issue in result.issues)
+
+
+def test_hierarchy():
+    app = create_app('testing')
+    client = app.test_client()
+    with app.app_context():
+        db.create_all()
+
+        print("Incremental closure...")
+        # Children first: NAM009 arrives before its parent NAM008
+        result = ingest(('NAM009', 'NAM008'), ('NAM012', 'NAM009'), ('NAM008', ''), ('NAM010', 'NAM008'),
+                        ('NAM013', ''))
+        check(result.issues == [], "Children listed before their parent raise no issues")
+        check(descendants('NAM008') == [('NAM008', 0), ('NAM009', 1), ('NAM010', 1), ('NAM012', 2)],
+              "Descendants of NAM008, shallowest first")
+        check(descendants('NAM008', include_self=False)[0] == ('NAM009', 1), "descendent-of leaves out the code")
+        outcomes = [hierarchy.subsumes(NAMASTE_SYSTEM, a, b) for a, b in
+                    (('NAM008', 'NAM012'), ('NAM012', 'NAM008'), ('NAM009', 'NAM010'), ('NAM010', 'NAM010'),
+                     ('NAM008', 'NAM999'))]
+        check(outcomes == ['subsumes', 'subsumed-by', 'not-subsumed', 'equivalent', None],
+              f"$subsumes outcomes {outcomes}")
+
+        print("\nMoves and deletes...")
+        ingest(('NAM009', 'NAM013'))
+        check(descendants('NAM013') == [('NAM013', 0), ('NAM009', 1), ('NAM012', 2)]
+              and hierarchy.subsumes(NAMASTE_SYSTEM, 'NAM008', 'NAM012') == 'not-subsumed',
+              "Moving NAM009 moves its subtree")
+        from src.models import NAMASTECode
+        db.session.delete(db.session.execute(db.select(NAMASTECode).filter_by(code='NAM010')).scalar_one())
+        db.session.commit()
+        check(descendants('NAM008') == [('NAM008', 0)], "Deleted leaf leaves the closure")
+
+        print("\nCycles and orphans...")
+        before = closure()
+        result = ingest(('NAM013', 'NAM012'), ('NAM020', 'NAM999'))
+        problems = issue_codes(result)
+        check(('business-rule', 'parent_code NAM012 of NAM013 would create a cycle; link ignored') in problems,
+              "Cycle reported at ingest")
+        check(('not-found', 'Code NAM020 has parent_code NAM999, which is not loaded') in problems,
+              "Orphan parent reported at ingest")
+        check(before <= closure() and hierarchy.subsumes(NAMASTE_SYSTEM, 'NAM013', 'NAM012') == 'subsumes',
+              "Cycle-closing link not applied; existing ancestry kept")
+        result = ingest(('NAM999', ''))
+        check(hierarchy.subsumes(NAMASTE_SYSTEM, 'NAM999', 'NAM020') == 'subsumes'
+              and not any(code == 'not-found' for code, _ in issue_codes(result)),
+              "Orphan attached once its parent is loaded")
+
+        print("\nRebuild...")
+        incremental = closure()
+        count, cycles = hierarchy.rebuild(NAMASTE_SYSTEM)
+        check(closure() == incremental and count == 6 and cycles == [('NAM013', 'NAM012')],
+              "Rebuild from the codes table matches the incremental closure and finds the cycle")
+
+        print("\n$subsumes endpoint...")
+        response = client.get('/CodeSystem/$subsumes', query_string={
+            'system': NAMASTE_SYSTEM, 'codeA': 'NAM013', 'codeB': 'NAM012'})
+        check(response.json['parameter'] == [{'name': 'outcome', 'valueCode': 'subsumes'}], "GET")
+        response = client.post('/CodeSystem/$subsumes', json={'resourceType': 'Parameters', 'parameter': [
+            {'name': 'codingA', 'valueCoding': {'system': NAMASTE_SYSTEM, 'code': 'NAM012'}},
+            {'name': 'codingB', 'valueCoding': {'system': NAMASTE_SYSTEM, 'code': 'NAM013'}}]})
+        check(response.json['parameter'][0]['valueCode'] == 'subsumed-by', "POST with codings")
+        check(client.get('/CodeSystem/$subsumes', query_string={
+            'system': NAMASTE_SYSTEM, 'codeA': 'NAM013', 'codeB': 'NOPE'}).status_code == 404, "Unknown code: 404")
+        check(client.get('/CodeSystem/$subsumes', query_string={
+            'system': 'http://example.org', 'codeA': 'a', 'codeB': 'b'}).status_code == 400, "Unknown system: 400")
+
+
+if __name__ == "__main__":
+    print("MEDISYNC Code Hierarchy Test")
+    print("=" * 50)
+    test_hierarchy()
+    print("=" * 50)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Test script for HTTP caching of terminology reads: release ETags, 304s and response compression
+"""
+
+import gzip
+import io
+import json
+import time
+
+from app import create_app
+from src.api import operations
+from src.extensions import db
+from src.services import http_cache, jobs, terminology
+from src.services.terminology import NAMASTE_SYSTEM
+
+EXPAND = f'/ValueSet/$expand?url={NAMASTE_SYSTEM}&count=500'
+
+
+@jobs.job_kind('test-release-changes')
+def release_changes_job(job, chunks):
+    for _ in range(chunks):
+        terminology.codes_changed.send(job._backend.app, upserted=[], deleted=[])
+
+
+@jobs.job_kind('test-release-etags')
+def release_etags_job(job, pause):
+    """ETags seen after a first change and after a second one inside the bump interval"""
+    app = job._backend.app
+    client = app.test_client()
+    terminology.codes_changed.send(app, upserted=[], deleted=[])
+    etags = [client.get(EXPAND).headers['ETag']]
+    terminology.codes_changed.send(app, upserted=[], deleted=[])
+    time.sleep(pause)
+    etags.append(client.get(EXPAND).headers['ETag'])
+    return {'etags': etags}
+
+
+def check(condition, message):
+    print(f"{'✓' if condition else '✗'} {message}")
+    assert condition, message
+    return condition
+
+
+def add_codes(start, count):
+    from src.models import NAMASTECode
+    db.session.add_all([NAMASTECode(code=f'NAM{i:05d}', display=f'Dosha concept {i}', category='Ayurveda')
+                        for i in range(start, start + count)])
+    db.session.commit()
+
+
+def test_http_cache():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        add_codes(0, 500)
+    client = app.test_client()
+    counter = app.extensions['terminology_release']
+    # Every change bumps straight away until the throttling checks at the end
+    counter.interval = 0
+
+    calls = []
+    page = operations.expansion.page
+
+    def counting_page(*args, **kwargs):
+        calls.append(1)
+        return page(*args, **kwargs)
+    operations.expansion.page = counting_page
+
+    try:
+        with app.app_context():
+            print("ETags from the release counter...")
+            response = client.get(EXPAND)
+            etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+            check(response.status_code == 200 and etag == '"terminology-1"', f"200 with ETag {etag}")
+            check(last_modified and 'no-cache' in response.headers.get('Cache-Control', ''),
+                  f"Last-Modified {last_modified}, Cache-Control")
+
+            calls.clear()
+            response = client.get(EXPAND, headers={'If-None-Match': etag})
+            check(response.status_code == 304 and not response.data and not calls,
+                  "If-None-Match: 304 without running the expansion")
+            response = client.get(EXPAND, headers={'If-Modified-Since': last_modified})
+            check(response.status_code == 304 and not calls, "If-Modified-Since: 304")
+            response = client.get(f'/CodeSystem/$subsumes?system={NAMASTE_SYSTEM}&codeA=NAM00001&codeB=NAM00002',
+                                  headers={'If-None-Match': etag})
+            check(response.status_code == 304, "Same release ETag on $subsumes")
+
+            add_codes(500, 1)
+            response = client.get(EXPAND, headers={'If-None-Match': etag})
+            check(response.status_code == 200 and response.headers['ETag'] == '"terminology-2"',
+                  "Ingest bumps the release; the old ETag gets a full response")
+
+            other_worker = http_cache.ReleaseCounter(ttl=0.2)
+            check(other_worker.current()[0] == 2, "Another worker reads the release from the database")
+            add_codes(501, 1)
+            stale = other_worker.current()[0]
+            time.sleep(0.25)
+            check(stale == 2 and other_worker.current()[0] == 3, "Other workers see a new release within the TTL")
+
+            print("\nCompression...")
+            plain = client.get(EXPAND)
+            response = client.get(EXPAND, headers={'Accept-Encoding': 'gzip, deflate'})
+            check(response.headers.get('Content-Encoding') == 'gzip'
+                  and json.loads(gzip.decompress(response.data))['expansion']['contains']
+                  == plain.json['expansion']['contains'],
+                  f"gzip: {len(plain.data)} -> {len(response.data)} bytes")
+            check(response.headers['ETag'] == '"terminology-3-gzip"' and 'Accept-Encoding' in response.headers['Vary'],
+                  "Compressed representation has its own ETag and Vary: Accept-Encoding")
+            response = client.get(EXPAND, headers={'Accept-Encoding': 'gzip', 'If-None-Match': '"terminology-3-gzip"'})
+            check(response.status_code == 304 and response.headers['ETag'] == '"terminology-3-gzip"',
+                  "304 for the compressed ETag")
+
+            response = client.get(f'/ValueSet/$expand?url={NAMASTE_SYSTEM}&_stream=true',
+                                  headers={'Accept-Encoding': 'gzip'})
+            body = json.loads(gzip.decompress(response.data))
+            check(response.headers.get('Content-Encoding') == 'gzip' and body['expansion']['total'] == 502,
+                  "Streamed expansion compressed on the fly")
+
+            response = client.get(f'/CodeSystem/$subsumes?system={NAMASTE_SYSTEM}&codeA=NAM00001&codeB=NAM00002',
+                                  headers={'Accept-Encoding': 'gzip'})
+            check('Content-Encoding' not in response.headers, "Small responses are not compressed")
+            response = client.get(EXPAND, headers={'Accept-Encoding': 'br'})
+            if http_cache._brotli() is None:
+                check('Content-Encoding' not in response.headers, "brotli not installed: identity for br-only clients")
+            else:
+                check(response.headers.get('Content-Encoding') == 'br', "brotli when the client prefers it")
+
+            print("\nChunked writes...")
+            csv = 'code,display\n' + ''.join(f'NAM{i:05d},Dosha concept {i}\n' for i in range(600, 650))
+            response = client.post('/ingest/csv/stream?chunk_size=10', data=io.BytesIO(csv.encode()),
+                                   content_type='text/csv')
+            check(response.status_code == 201 and counter.current()[0] == 8,
+                  "Every committed chunk of a five-chunk ingest bumps the release")
+
+            counter.interval = 0.3
+            time.sleep(counter.interval)
+            backend = app.extensions['jobs']
+            job = jobs.Job('test-release-changes', {'chunks': 5})
+            backend.save(job)
+            jobs.run_job(app, backend, job.id)
+            check(backend.load(job.id).status == jobs.COMPLETED and counter.current()[0] == 10,
+                  "Five changes inside the interval bump it twice: first change and job end")
+
+            time.sleep(counter.interval)
+            job = jobs.Job('test-release-etags', {'pause': counter.interval + 0.2})
+            backend.save(job)
+            jobs.run_job(app, backend, job.id)
+            etags = backend.load(job.id).outcome['etags']
+            check(etags == ['"terminology-11"', '"terminology-12"'],
+                  f"A second chunk changes the ETag within the interval, before the job ends: {etags}")
+    finally:
+        operations.expansion.page = page
+
+
+if __name__ == "__main__":
+    print("MEDISYNC HTTP Cache Test")
+    print("=" * 50)
+    test_http_cache()
+    print("=" * 50)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Test script for the offline ICD-11 release import: tabulation parsing, zips, diffs and pruning
+"""
+
+import os
+import shutil
+import tempfile
+import zipfile
+
+from app import create_app
+from config import TestingConfig, config
+from src.extensions import db
+from src.services import icd11_import
+
+HEADER = 'Code\tTitle\tClassKind\tChapterNo\n'
+
+
+def tabulation(rows):
+    """Chapter 01 with a block and nested categories, then the TM2 chapter"""
+    return HEADER + ''.join('\t'.join(row) + '\n' for row in rows)
+
+
+RELEASE = [
+    ('', 'Certain infectious or parasitic diseases', 'chapter', '01'),
+    ('', '- Intestinal infectious diseases', 'block', '01'),
+    ('1A00', '- - Cholera', 'category', '01'),
+    ('1A01', '- - Intestinal infection due to other Vibrio', 'category', '01'),
+    ('1A01.0', '- - - Vibrio fluvialis enteritis', 'category', '01'),
+    ('', 'Traditional medicine conditions - module 1', 'chapter', '26'),
+    ('SA00', '- Disorders of qi (TM1)', 'category', '26'),
+    ('SA01', '- - Qi deficiency pattern (TM1)', 'category', '26'),
+]
+
+
+def check(condition, message):
+    print(f"{'✓' if condition else '✗'} {message}")
+    assert condition, message
+    return condition
+
+
+def codes():
+    from src.models import ICD11Code
+
+    return {row.code: (row.title, row.parent_code, row.module)
+            for row in db.session.execute(db.select(ICD11Code)).scalars()}
+
+
+def test_icd11_import():
+    workdir = tempfile.mkdtemp(prefix='medisync-icd11-import-')
+    config['icd11-import-test'] = type('ICD11ImportTestConfig', (TestingConfig,), {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(workdir, "import.db")}',
+        'UPLOAD_FOLDER': os.path.join(workdir, 'uploads'),
+        'AUDIT_SPOOL_DIR': os.path.join(workdir, 'audit-spool'),
+    })
+    app = create_app('icd11-import-test')
+    plain = os.path.join(workdir, 'release.txt')
+    with open(plain, 'w') as f:
+        f.write(tabulation(RELEASE))
+    archive = os.path.join(workdir, 'release.zip')
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('readme.txt', 'not a tabulation')
+        z.write(plain, 'SimpleTabulation-ICD-11-MMS-en.txt')
+
+    with app.app_context():
+        db.create_all()
+        print("Tabulation parsing...")
+        result = icd11_import.import_release(plain, release='2024-01', chunk_size=2)
+        loaded = codes()
+        check(result.rows_read == 5 and result.rows_written == 5 and result.chunks == 3,
+              f"5 categories in {result.chunks} chunks; chapters and blocks skipped")
+        check(loaded['1A00'] == ('Cholera', None, 'biomedicine') and loaded['1A01.0'][1] == '1A01',
+              "Depth dashes stripped; parents from depth")
+        check(loaded['SA01'] == ('Qi deficiency pattern (TM1)', 'SA00', 'tm2'), "Chapter 26 is the TM2 module")
+
+        print("\nDiffs against the loaded release...")
+        result = icd11_import.import_release(archive, release='2024-01')
+        check(result.rows_written == 0 and result.unchanged == 5, "Same release from the zip writes nothing")
+        changed = [row for row in RELEASE if row[0] != '1A01.0']
+        changed[2] = ('1A00', '- - Cholera, unspecified', 'category', '01')
+        changed.append(('SA02', '- - Qi stagnation pattern (TM1)', 'category', '26'))
+        with open(plain, 'w') as f:
+            f.write(tabulation(changed))
+        result = icd11_import.import_release(plain, release='2025-01')
+        check(result.rows_written == 2 and result.unchanged == 3 and result.removed == 1 and result.pruned == 0,
+              "Only the retitled and the new code written; the dropped code counted")
+        check('1A01.0' in codes() and codes()['1A00'][0] == 'Cholera, unspecified', "Dropped code kept by default")
+        result = icd11_import.import_release(plain, release='2025-01', prune=True)
+        check(result.pruned == 1 and '1A01.0' not in codes(), "--prune deletes it")
+
+        print("\nUnusable files...")
+        with open(plain, 'w') as f:
+            f.write('Code\tTitle\n1A00\tCholera\n')
+        result = icd11_import.import_release(plain)
+        check(result.rows_read == 0 and result.issues[0]['code'] == 'structure', "Missing columns are fatal")
+        empty = os.path.join(workdir, 'empty.zip')
+        with zipfile.ZipFile(empty, 'w') as z:
+            z.writestr('notes.pdf', b'')
+        try:
+            icd11_import.import_release(empty)
+            raised = False
+        except ValueError:
+            raised = True
+        check(raised, "Zip without a tabulation: ValueError")
+
+    print("\nCLI and endpoint...")
+    with open(plain, 'w') as f:
+        f.write(tabulation(RELEASE))
+    output = app.test_cli_runner().invoke(args=['icd11', 'import', plain, '--chunk-size', '3']).output
+    check('Imported ICD-11 release release: 5 rows read, 2 new or changed codes written' in output,
+          "flask icd11 import restores both rows and names the release after the file")
+    with open(archive, 'rb') as f:
+        response = app.test_client().post('/ingest/icd11/release?release=2024-01', data=f.read(),
+                                          content_type='application/zip')
+    check(response.status_code == 200 and 'unchanged' in response.json['issue'][0]['details']['text']
+          and os.listdir(app.config['UPLOAD_FOLDER']) == [], "Uploaded zip imported and its spool file removed")
+    app.extensions['audit'].stop()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    print("MEDISYNC ICD-11 Import Test")
+    print("=" * 50)
+    test_icd11_import()
+    print("=" * 50)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Test script for the ICD-11 sync engine against the local mock WHO server
+"""
+
+import os
+import tempfile
+
+from app import create_app
+from mock_who_server import MockWHOServer
+from src.extensions import db
+from src.services import icd11_sync
+
+
+def check(condition, message):
+    print(f"{'✓' if condition else '✗'} {message}")
+    assert condition, message
+    return condition
+
+
+def code_count():
+    from src.models import ICD11Code
+    return db.session.query(ICD11Code).count()
+
+
+def run_sync(app, **overrides):
+    stats = icd11_sync.sync(app, **overrides)
+    print(f"  {stats.to_operation_outcome()['issue'][0]['details']['text']}")
+    return stats
+
+
+def test_icd11_sync():
+    checkpoint = os.path.join(tempfile.mkdtemp(), 'icd11_sync.json')
+
+    with MockWHOServer(throttle_rate=0.03, error_rate=0.02, token_ttl=2) as mock:
+        app = create_app('testing')
+        app.config.update(
+            ICD11_API_BASE_URL=f'{mock.url}/icd',
+            ICD11_TOKEN_ENDPOINT=f'{mock.url}/connect/token',
+            ICD11_CLIENT_ID=mock.client_id,
+            ICD11_CLIENT_SECRET=mock.client_secret,
+            ICD11_SYNC_CHECKPOINT=checkpoint,
+            ICD11_SYNC_BATCH_SIZE=25,
+        )
+
+        with app.app_context():
+            db.create_all()
+
+            print("Full sync with injected 429/503 responses...")
+            stats = run_sync(app)
+            check(stats.complete and stats.written == mock.categories,
+                  f"Wrote {stats.written} of {mock.categories} categories")
+            check(code_count() == mock.categories, "ICD11Code row count matches the release")
+            check(stats.retries > 0, f"Retried {stats.retries} throttled/failed requests")
+
+            print("\nRe-sync of the same release...")
+            check(run_sync(app).up_to_date, "Skipped an already-synced release")
+
+            print("\nNew release with two revised entities...")
+            revised = [entity_id for entity_id, entity in mock.releases[mock.latest].items()
+                       if entity['classKind'] == 'category'][:2]
+            mock.publish('2025-01', changed=revised)
+            stats = run_sync(app)
+            check(stats.written == 2, f"Wrote only the {stats.written} changed codes")
+            check(stats.unchanged == stats.fetched - 2, f"{stats.unchanged} entities answered 304 Not Modified")
+
+            print("\nOutage part-way through a sync...")
+            mock.publish('2026-01', changed=revised)
+            mock.down_after = mock.entity_requests + 40
+            stats = run_sync(app, max_retries=1)
+            check(not stats.complete, "Sync stopped incomplete during the outage")
+            mock.down_after = None
+            fetched_before = stats.fetched
+            stats = run_sync(app)
+            check(stats.resumed and stats.complete, "Resumed from the checkpoint and completed")
+            check(stats.fetched + fetched_before < mock.categories * 2,
+                  f"Resume fetched {stats.fetched} entities instead of starting over")
+
+            check(mock.token_requests > 1, f"Token refreshed {mock.token_requests} times as it expired")
+
+
+if __name__ == "__main__":
+    print("MEDISYNC ICD-11 Sync Test")
+    print("=" * 50)
+    test_icd11_sync()
+    print("=" * 50)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Test script for background jobs: 202 + GET /jobs/<id>, the bounded queue, result expiry and operation auth
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+from app import create_app
+from config import TestingConfig, config
+from mock_abha_server import MockABHAServer
+from src.extensions import db
+from src.services import abha_auth, jobs
+
+CSV = 'code,display,definition,category,parent_code\n' + ''.join(
+    f'NAM{i:05d},Dosha concept {i},,Ayurveda,\n' for i in range(500))
+
+release = threading.Event()
+
+
+@jobs.job_kind('test-wait')
+def wait_job(job):
+    release.wait(10)
+    return {'resourceType': 'OperationOutcome', 'issue': []}
+
+
+def check(condition, message):
+    print(f"{'✓' if condition else '✗'} {message}")
+    assert condition, message
+    return condition
+
+
+def wait_for(client, location, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        task = client.get(location).get_json()
+        if task['status'] in (jobs.COMPLETED, jobs.FAILED) or time.monotonic() > deadline:
+            return task
+        time.sleep(0.05)
+
+
+def make_app(workdir, **settings):
+    config['jobs-test'] = type('JobsTestConfig', (TestingConfig,), dict({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(workdir, "jobs.db")}',
+        'UPLOAD_FOLDER': os.path.join(workdir, 'uploads'),
+        'AUDIT_SPOOL_DIR': os.path.join(workdir, 'audit-spool'),
+        'JOB_MAX_WORKERS': 1,
+        'JOB_QUEUE_SIZE': 2,
+    }, **settings))
+    app = create_app('jobs-test')
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def test_async_ingest():
+    workdir = tempfile.mkdtemp(prefix='medisync-jobs-')
+    app = make_app(workdir)
+    client = app.test_client()
+
+    print("Asynchronous ingest...")
+    response = client.post('/ingest/csv/stream?chunk_size=100', data=io.BytesIO(CSV.encode()),
+                           content_type='text/csv', headers={'Prefer': 'respond-async'})
+    location = response.headers.get('Content-Location', '')
+    check(response.status_code == 202 and response.json['resourceType'] == 'Task'
+          and location == f"/jobs/{response.json['id']}", f"202 Accepted with Content-Location {location}")
+    task = wait_for(client, location)
+    outputs = {output['type']['text']: output for output in task['output']}
+    check(task['status'] == jobs.COMPLETED, f"Job {task['status']}")
+    check(outputs['rowsProcessed']['valueInteger'] == 500 and outputs['percentComplete']['valueDecimal'] == 100,
+          "Task reports 500 rows, 100% complete")
+    check(task['contained'][0]['resourceType'] == 'OperationOutcome' and 'end' in task['executionPeriod'],
+          "Outcome and execution period attached")
+    check(os.listdir(app.config['UPLOAD_FOLDER']) == [], "Spooled upload removed")
+    from src.models import NAMASTECode
+    with app.app_context():
+        check(db.session.query(NAMASTECode).count() == 500, "Codes written by the job")
+    check(client.get('/jobs/no-such-job').status_code == 404, "Unknown job: 404")
+    app.extensions['audit'].stop()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def test_queue_full():
+    workdir = tempfile.mkdtemp(prefix='medisync-jobs-')
+    app = make_app(workdir)
+    client = app.test_client()
+
+    print("\nBounded queue...")
+    release.clear()
+    queued = [jobs.submit(app, 'test-wait') for _ in range(2)]
+    try:
+        jobs.submit(app, 'test-wait')
+        full = False
+    except jobs.JobQueueFull:
+        full = True
+    check(full, "Third job raises JobQueueFull with JOB_QUEUE_SIZE=2")
+    response = client.post('/ingest/csv/stream', data=io.BytesIO(CSV.encode()), content_type='text/csv',
+                           headers={'Prefer': 'respond-async'})
+    check(response.status_code == 503 and response.headers.get('Retry-After') == '30',
+          "Full queue answered with 503 and Retry-After")
+    check(os.listdir(app.config['UPLOAD_FOLDER']) == [], "Rejected upload not left behind")
+    release.set()
+    check(all(wait_for(client, f'/jobs/{job.id}')['status'] == jobs.COMPLETED for job in queued),
+          "Queued jobs complete once released")
+    check(jobs.submit(app, 'test-wait') is not None, "Queue accepts work again")
+
+    print("\nResult expiry...")
+    backend = app.extensions['jobs']
+    job = jobs.Job('test-wait')
+    job.status = jobs.COMPLETED
+    job.finished = (jobs._now() - timedelta(seconds=backend.ttl + 1)).isoformat()
+    backend.save(job)
+    check(backend.load(job.id) is not None, "Expired result kept until the next scan")
+    backend._next_eviction = 0
+    check(backend.load(job.id) is None, "Result older than JOB_RESULT_TTL evicted")
+    check(backend.load(queued[0].id) is not None, "Recent results kept")
+    app.extensions['audit'].stop()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def test_operations_require_token():
+    workdir = tempfile.mkdtemp(prefix='medisync-jobs-')
+    with MockABHAServer() as mock:
+        app = make_app(workdir, ABHA_AUTH_REQUIRED=True, ABHA_JWKS_URL=f'{mock.url}/certs', ABHA_ISSUER=mock.issuer)
+        abha_auth.init_app(app)
+        client = app.test_client()
+
+        print("\nOperation auth...")
+        for path in ('/ingest/csv/stream', '/ingest/icd11/release', '/sync/icd11/jobs', '/bundle/process'):
+            response = client.post(path, data=b'x', content_type='text/csv')
+            check(response.status_code == 401, f"POST {path} without a token: 401")
+        headers = {'Authorization': f'Bearer {mock.issue_jwt()}'}
+        response = client.post('/ingest/csv/stream', data=io.BytesIO(CSV.encode()), content_type='text/csv',
+                               headers=headers)
+        check(response.status_code == 201, "Ingest with a valid token accepted")
+        check(client.get('/jobs/no-such-job').status_code == 404, "Job status readable without a token")
+    app.extensions['audit'].stop()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    print("MEDISYNC Background Jobs Test")
+    print("=" * 50)
+    test_async_ingest()
+    test_queue_full()
+    test_operations_require_token()
+    print("=" * 50)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Test script for the NAMASTE -> ICD-11 mapping suggestion engine and ConceptMap/$suggest-mappings
+"""
+
+import random
+import time
+
+import numpy as np
+
+from app import create_app
+from src.extensions import db
+from src.services import mapping_suggestions
+from src.services.mapping_suggestions import MappingSuggestion
+from src.services.terminology import Concept, NAMASTE_SYSTEM, ICD11_SYSTEM
+
+NAMASTE = [
+    ('NAM001', 'Jvara', 'Fever with raised body temperature and thirst'),
+    ('NAM002', 'Kasa', 'Cough with expectoration'),
+    ('NAM003', 'Amlapitta', 'Hyperacidity with sour belching and heartburn'),
+    ('NAM004', 'Shirahshula', 'Headache, pain in the head'),
+]
+ICD11 = [
+    ('SA00', 'Jwara disorder (TM2)', 'Fever pattern with raised temperature'),
+    ('SA01', 'Kasa disorder (TM2)', 'Cough pattern'),
+    ('SA02', 'Amlapitta disorder (TM2)', 'Acid dyspepsia with heartburn'),
+    ('SA03', 'Shirashula disorder (TM2)', 'Headache pattern'),
+    ('SA04', 'Kushtha disorder (TM2)', 'Skin disease pattern'),
+    ('SA05', 'Pandu disorder (TM2)', 'Pallor and anaemia pattern'),
+]
+
+
+def check(condition, message):
+    print(f"{'✓' if condition else '✗'} {message}")
+    assert condition, message
+    return condition
+
+
+def vocabularies(namaste, icd11, seed=3):
+    """Made-up words; ICD-11 code i has a respelling of NAMASTE code i's display"""
+    rng = random.Random(seed)
+    syllables = ['ka', 'ra', 'ta', 'va', 'dha', 'sha', 'ma', 'pi', 'na', 'jva', 'la', 'ha', 'su', 'ti']
+    words = sorted({''.join(rng.choice(syllables) for _ in range(3)) for _ in range(3000)})
+
+    def text(count):
+        return ' '.join(rng.choice(words) for _ in range(count))
+
+    sources = [Concept(NAMASTE_SYSTEM, f'NAM{i:05d}', text(3), text(10), None) for i in range(namaste)]
+    targets = [Concept(ICD11_SYSTEM, f'TM2.{i:05d}', sources[i].display.replace('v', 'w') if i < namaste else text(3),
+                       text(10), None) for i in range(icd11)]
+    return sources, targets
+
+
+def dense(matrix, columns):
+    rows = np.zeros((len(matrix.indptr) - 1, columns))
+    for i in range(len(rows)):
+        span = slice(matrix.indptr[i], matrix.indptr[i + 1])
+        rows[i, matrix.indices[span]] = matrix.data[span]
+    return rows
+
+
+def test_scoring():
+    print("Blocked sparse scoring...")
+    sources, targets = vocabularies(300, 3000)
+    model = mapping_suggestions.Model(sources, targets)
+    columns = len(model.vectorizer.vocabulary)
+    documents = [mapping_suggestions.features(c.display, c.definition) for c in targets]
+    target_rows = dense(model.vectorizer.transform(documents), columns)
+    norms = np.linalg.norm(target_rows, axis=1)
+    check(np.allclose(norms[norms > 0], 1), "Rows are L2-normalised")
+
+    expected = dense(model.sources, columns) @ target_rows.T
+    results = dict(model.suggest_all(5))
+    matches = all(np.allclose([score for _, score in results[c.code]], np.sort(expected[i])[::-1][:5])
+                  for i, c in enumerate(sources) if c.code in results)
+    check(len(results) == len(sources) and matches, "Top-5 scores equal a dense matrix product")
+
+    small = mapping_suggestions.blocks(model.sources, model.postings, cells=20000)
+    check(len(small) > 1 and small[0][0] == 0 and small[-1][1] == len(sources)
+          and all(a[1] == b[0] for a, b in zip(small, small[1:])), f"{len(small)} contiguous blocks for a small budget")
+    mapping_suggestions.BLOCK_CELLS, cells = 20000, mapping_suggestions.BLOCK_CELLS
+    try:
+        pooled = dict(model.suggest_all(5, workers=2))
+    finally:
+        mapping_suggestions.BLOCK_CELLS = cells
+    check(pooled == results, "Process pool gives the same candidates as inline scoring")
+
+    hits = sum(results[c.code][0][0] == i for i, c in enumerate(sources))
+    check(hits / len(sources) > 0.5, f"Respelled display ranked first for {hits}/{len(sources)} codes")
+
+
+def test_endpoints():
+    from src.models import ConceptMapping, ICD11Code, NAMASTECode
+
+    app = create_app('testing')
+    client = app.test_client()
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([NAMASTECode(code=c, display=d, definition=t) for c, d, t in NAMASTE])
+        db.session.add_all([ICD11Code(code=c, title=d, definition=t) for c, d, t in ICD11])
+        db.session.add(ConceptMapping(source_system=NAMASTE_SYSTEM, source_code='NAM002',
+                                      target_system=ICD11_SYSTEM, target_code='SA01'))
+        db.session.add(MappingSuggestion(source_code='NAM003', target_code='SA02', rank=1, score=0.9,
+                                         status=mapping_suggestions.REJECTED))
+        db.session.commit()
+
+        print("Live suggestions...")
+        response = client.get('/ConceptMap/$suggest-mappings?code=NAM001&count=3')
+        body = response.get_json()
+        matches = [p for p in body['parameter'] if p['name'] == 'match']
+        first = {part['name']: part for part in matches[0]['part']} if matches else {}
+        check(response.status_code == 200 and first.get('concept', {}).get('valueCoding', {}).get('code') == 'SA00',
+              "Jvara -> Jwara disorder ranked first despite the spelling")
+        check(first.get('equivalence', {}).get('valueCode') == 'relatedto' and first['rank']['valueInteger'] == 1
+              and 0 < first['score']['valueDecimal'] <= 1, "Match carries equivalence, score and rank")
+        check(len(matches) <= 3, f"count limits candidates ({len(matches)})")
+        check(client.get('/ConceptMap/$suggest-mappings?code=NOPE').status_code == 404, "Unknown code: 404")
+        check(client.get('/ConceptMap/$suggest-mappings').status_code == 400, "GET without code: 400")
+        check(client.get('/ConceptMap/$suggest-mappings?code=NAM001&count=x').status_code == 400, "Bad count: 400")
+
+        db.session.add(ICD11Code(code='SA06', title='Jvara fever disorder (TM2)', definition='Fever'))
+        db.session.commit()
+        from src.services import terminology
+        terminology.codes_changed.send(app, upserted=[Concept(ICD11_SYSTEM, 'SA06', 'Jvara fever disorder (TM2)',
+                                                              'Fever', None)], deleted=[])
+        check(app.extensions['mapping_suggestions']['model'] is None, "codes_changed drops the cached model")
+        body = client.get('/ConceptMap/$suggest-mappings?code=NAM001').get_json()
+        codes = [part['valueCoding']['code'] for p in body['parameter'] if p['name'] == 'match'
+                 for part in p['part'] if part['name'] == 'concept']
+        check('SA06' in codes, "Rebuilt model sees the new ICD-11 code")
+
+        app.config['ABHA_AUTH_REQUIRED'] = True
+        check(client.post('/ConceptMap/$suggest-mappings', json={}).status_code == 401
+              and client.get('/ConceptMap/$suggest-mappings?code=NAM001').status_code == 200,
+              "POST needs a bearer token; GET does not")
+        app.config['ABHA_AUTH_REQUIRED'] = False
+
+        print("Full run as a background job...")
+        response = client.post('/ConceptMap/$suggest-mappings', json={'resourceType': 'Parameters', 'parameter': []})
+        check(response.status_code == 202 and 'Content-Location' in response.headers, "POST without code: 202")
+        location = response.headers.get('Content-Location', '')
+        for _ in range(100):
+            task = client.get(location).get_json()
+            if task['status'] in ('completed', 'failed'):
+                break
+            time.sleep(0.05)
+        check(task['status'] == 'completed', f"Job {task['status']}")
+
+        db.session.expire_all()
+        proposed = db.session.execute(db.select(MappingSuggestion).where(
+            MappingSuggestion.status == mapping_suggestions.PROPOSED)).scalars().all()
+        pairs = {(row.source_code, row.target_code): row for row in proposed}
+        check(('NAM001', 'SA00') in pairs and pairs['NAM001', 'SA00'].rank in (1, 2), "Candidates written with ranks")
+        check(('NAM002', 'SA01') not in pairs, "Pair already in ConceptMapping not proposed")
+        check(('NAM003', 'SA02') not in pairs and db.session.execute(db.select(db.func.count()).where(
+            MappingSuggestion.status == mapping_suggestions.REJECTED)).scalar() == 1,
+              "Rejected pair kept and not proposed again")
+        ranked = {}
+        for row in sorted(proposed, key=lambda row: row.rank):
+            ranked.setdefault(row.source_code, []).append(row)
+        check(all([row.rank for row in rows] == list(range(1, len(rows) + 1))
+                  and all(a.score >= b.score for a, b in zip(rows, rows[1:])) for rows in ranked.values()),
+              "Ranks are 1..n by descending score")
+
+        first_run = {row.run_id for row in proposed}
+        stats = mapping_suggestions.run(workers=1)
+        db.session.expire_all()
+        runs = set(db.session.execute(db.select(MappingSuggestion.run_id).where(
+            MappingSuggestion.status == mapping_suggestions.PROPOSED)).scalars())
+        check(runs == {stats['run_id']} and runs != first_run and stats['candidates'] == len(proposed),
+              f"A new run replaces the proposals ({stats['candidates']} candidates)")
+
+
+if __name__ == "__main__":
+    print("MEDISYNC Mapping Suggestion Test")
+    print("=" * 50)
+    test_scoring()
+    test_endpoints()
+    print("=" * 50)
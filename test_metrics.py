@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Test script for Prometheus metrics: request, SQL, pool, cache and ingest instrumentation, and multi-worker /metrics
+"""
+
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+
+from prometheus_client.parser import text_string_to_metric_families
+
+from app import create_app
+from src.extensions import db
+from src.services import jobs
+from src.services.terminology import NAMASTE_SYSTEM, ICD11_SYSTEM
+
+CSV = 'code,display,definition,category,parent_code\n' + ''.join(
+    f'NAM{i:05d},Dosha concept {i},,Ayurveda,\n' for i in range(200))
+
+
+def check(condition, message):
+    print(f"{'✓' if condition else '✗'} {message}")
+    assert condition, message
+    return condition
+
+
+def scrape(client):
+    samples = {}
+    for family in text_string_to_metric_families(client.get('/metrics').get_data(as_text=True)):
+        for sample in family.samples:
+            samples[(sample.name, tuple(sorted(sample.labels.items())))] = sample.value
+    return samples
+
+
+def value(samples, name, **labels):
+    return samples.get((name, tuple(sorted(labels.items()))), 0)
+
+
+def test_metrics():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+    before = scrape(client)
+
+    print("Requests and SQL...")
+    response = client.post('/ingest/csv/stream', data=io.BytesIO(CSV.encode()), content_type='text/csv')
+    check(response.status_code == 201, "Ingested 200 codes")
+    translate = {'system': NAMASTE_SYSTEM, 'code': 'NAM00001', 'targetsystem': ICD11_SYSTEM}
+    response = client.get('/ConceptMap/$translate', query_string=translate)
+    client.get('/ConceptMap/$translate', query_string=translate)
+    check('db;dur=' in response.headers.get('Server-Timing', ''),
+          f"Server-Timing: {response.headers.get('Server-Timing')}")
+    client.get('/no/such/path')
+
+    after = scrape(client)
+    labels = {'blueprint': 'api_ops', 'endpoint': 'api_ops.concept_map_translate', 'method': 'GET'}
+    count = (value(after, 'medisync_http_request_duration_seconds_count', **labels)
+             - value(before, 'medisync_http_request_duration_seconds_count', **labels))
+    check(count == 2, f"Latency histogram per blueprint and endpoint ({count:.0f} $translate requests)")
+    check(value(after, 'medisync_http_requests_total', blueprint='', endpoint='unmatched', method='GET',
+                status='404') >= 1, "Unmatched paths share one label value")
+    queries = value(after, 'medisync_http_request_db_queries_sum', blueprint='api_ops',
+                    endpoint='api_ops.concept_map_translate')
+    check(queries >= 1, f"SQL statements per request counted ({queries:.0f} for two $translate calls)")
+    check(value(after, 'medisync_db_query_duration_seconds_count') > value(before,
+                                                                            'medisync_db_query_duration_seconds_count'),
+          "Statement latency histogram")
+    check(value(after, 'medisync_db_pool_checkout_wait_seconds_count') > 0
+          and value(after, 'medisync_db_pool_checked_out') >= 0, "Pool checkout wait and checked-out gauge")
+
+    print("\nCaches, ingest and jobs...")
+    hits = value(after, 'medisync_cache_lookups_total', cache='translation', result='hit')
+    misses = value(after, 'medisync_cache_lookups_total', cache='translation', result='miss')
+    check(hits >= 1 and misses >= 1, f"Translation cache: {hits:.0f} hit(s), {misses:.0f} miss(es)")
+    written = (value(after, 'medisync_terminology_codes_changed_total', system=NAMASTE_SYSTEM, change='upserted')
+               - value(before, 'medisync_terminology_codes_changed_total', system=NAMASTE_SYSTEM, change='upserted'))
+    check(written == 200, f"Ingest throughput: {written:.0f} codes upserted")
+
+    @jobs.job_kind('metrics-test')
+    def metrics_test(job):
+        job.progress(rows_processed=42)
+    job = jobs.submit(app, 'metrics-test')
+    for _ in range(50):
+        if jobs.get_job(app, job.id).status == jobs.COMPLETED:
+            break
+        time.sleep(0.05)
+    samples = scrape(client)
+    check(value(samples, 'medisync_jobs_total', kind='metrics-test', status='completed') == 1
+          and value(samples, 'medisync_job_rows_total', kind='metrics-test') == 42, "Finished jobs and their rows")
+
+
+def test_multiprocess():
+    print("\nSeveral workers (PROMETHEUS_MULTIPROC_DIR)...")
+    directory = tempfile.mkdtemp(prefix='medisync-metrics-')
+    worker = textwrap.dedent(f"""
+        import sys
+        sys.path[:0] = {sys.path!r}
+        from app import create_app
+        from src.extensions import db
+        app = create_app('testing')
+        with app.app_context():
+            db.create_all()
+        client = app.test_client()
+        for _ in range(int(sys.argv[1])):
+            client.get('/no/such/path')
+        if len(sys.argv) > 2:
+            sys.stdout.write(client.get('/metrics').get_data(as_text=True))
+    """)
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=directory)
+    subprocess.run([sys.executable, '-c', worker, '3'], env=env, check=True, capture_output=True)
+    output = subprocess.run([sys.executable, '-c', worker, '4', 'scrape'], env=env, check=True,
+                            capture_output=True, text=True).stdout
+    total = sum(sample.value for family in text_string_to_metric_families(output) for sample in family.samples
+                if sample.name == 'medisync_http_requests_total' and sample.labels.get('status') == '404')
+    check(total == 7, f"/metrics in one worker reports requests served by both ({total:.0f})")
+
+
+if __name__ == "__main__":
+    print("MEDISYNC Metrics Test")
+    print("=" * 50)
+    test_metrics()
+    test_multiprocess()
+    print("=" * 50)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Test script for the chunked NAMASTE CSV loader: bulk upserts, validation and de-duplication
+"""
+
+import io
+
+from app import create_app
+from src.extensions import db
+from src.services import namaste_loader
+
+HEADER = 'code,display,definition,category,parent_code\n'
+
+
+def check(condition, message):
+    print(f"{'✓' if condition else '✗'} {message}")
+    assert condition, message
+    return condition
+
+
+def load(text, chunk_size):
+    return namaste_loader.load_csv(io.BytesIO(text.encode()), chunk_size=chunk_size)
+
+
+def issues(result, code):
+    return [issue for issue in result.issues if issue['code'] == code]
+
+
+def test_namaste_loader():
+    from src.models import NAMASTECode
+
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+
+        print("Chunked upserts...")
+        chunks = []
+        result = namaste_loader.load_csv(
+            io.BytesIO((HEADER + ''.join(f'NAM{i:03d},Concept {i},,Ayurveda,\n' for i in range(250))).encode()),
+            chunk_size=100, on_chunk=lambda r: chunks.append(r.rows_written))
+        check(result.rows_read == 250 and result.rows_written == 250 and result.chunks == 3,
+              f"250 rows in {result.chunks} chunks")
+        check(chunks == [100, 200, 250], f"on_chunk called after every chunk ({chunks})")
+        check(db.session.query(NAMASTECode).count() == 250, "250 codes stored")
+
+        result = load(HEADER + 'NAM001,Vātaja jvara,Wind fever,Ayurveda,\nNAM300,New concept,,Siddha,\n', 100)
+        stored = db.session.execute(db.select(NAMASTECode).filter_by(code='NAM001')).scalar_one()
+        check(result.rows_written == 2 and stored.display == 'Vātaja jvara' and stored.definition == 'Wind fever',
+              "Existing code updated in place, new code inserted")
+        check(db.session.query(NAMASTECode).count() == 251, "No duplicate rows created by the upsert")
+
+        print("\nValidation...")
+        result = load(HEADER + ',No code,,,\nNAM400,,,,\n' + 'X' * 60 + ',Too long,,,\nNAM401,Fine,,,\n', 100)
+        check(result.rows_rejected == 3 and result.rows_written == 1, "Missing and over-long values rejected")
+        check([issue['location'] for issue in result.issues if issue['severity'] == 'error']
+              == [['line 2'], ['line 3'], ['line 4']], "Rejections located by CSV line")
+        result = load('code,name\nNAM500,Missing display column\n', 100)
+        check(result.rows_written == 0 and result.issues[0]['code'] == 'structure', "Missing column is fatal")
+
+        print("\nDuplicates...")
+        rows = ['NAM600,First,,,', 'NAM601,Other,,,', 'NAM600,Second,,,', 'NAM602,Other,,,', 'NAM603,Other,,,',
+                'NAM600,Last,,,']
+        result = load(HEADER + '\n'.join(rows) + '\n', 2)
+        check(result.duplicates == 2 and len(issues(result, 'duplicate')) == 2,
+              f"Repeats within and across chunks reported ({result.duplicates} duplicates)")
+        check([issue['location'] for issue in issues(result, 'duplicate')] == [['line 4'], ['line 7']],
+              "Each repeat located by CSV line")
+        check(result.rows_written == 4 and result.rows_read == result.rows_written + result.duplicates,
+              "Rows read = rows written + duplicates")
+        stored = db.session.execute(db.select(NAMASTECode).filter_by(code='NAM600')).scalar_one()
+        check(stored.display == 'Last', "Last occurrence kept")
+        check(all(load(HEADER + '\n'.join(rows) + '\n', size).duplicates == 2 for size in (1, 3, 100)),
+              "Same duplicates reported for any chunk size")
+
+
+if __name__ == "__main__":
+    print("MEDISYNC NAMASTE Loader Test")
+    print("=" * 50)
+    test_namaste_loader()
+    print("=" * 50)
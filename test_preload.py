@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Test script for preloaded startup: lazy imports, threads deferred to forked workers and warm()
+"""
+
+import gc
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+from app import create_app
+from config import TestingConfig, config
+from src.extensions import db
+from src.services import preload
+
+LAZY = ('numpy', 'httpx', 'jwt')
+
+
+def check(condition, message):
+    print(f"{'✓' if condition else '✗'} {message}")
+    assert condition, message
+    return condition
+
+
+def test_lazy_imports():
+    print("Lazy imports...")
+    script = ('import json, sys; from src.services import abha_auth, icd11_sync, mapping_suggestions; '
+              f'print(json.dumps([name for name in {LAZY!r} if name in sys.modules]))')
+    output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True,
+                            env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+    loaded = json.loads(output.stdout or 'null')
+    error = f'\n{output.stderr[-500:]}' if output.returncode else ''
+    check(loaded == [], f"Importing the services loads none of {', '.join(LAZY)} ({loaded}){error}")
+
+
+def in_worker(app):
+    """Fork, run after_fork() and the checks in the child; returns what the child reported"""
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        with app.app_context():
+            pool = db.engine.pool
+        preload.after_fork(app)
+        with app.app_context():
+            new_pool = db.engine.pool is not pool
+        report = {
+            'threads': sorted(thread.name for thread in threading.enumerate()),
+            'deferred': 'worker_starts' in app.extensions,
+            'new_pool': new_pool,
+            'status': app.test_client().get('/translate/cache/stats').status_code,
+            'index': len(app.extensions['search_index']),
+        }
+        os.write(write, json.dumps(report).encode())
+        os._exit(0)
+    os.close(write)
+    with os.fdopen(read) as f:
+        report = json.loads(f.read() or '{}')
+    os.waitpid(pid, 0)
+    return report
+
+
+def test_deferred_threads():
+    workdir = tempfile.mkdtemp(prefix='medisync-preload-')
+    config['preload-test'] = type('PreloadTestConfig', (TestingConfig,), {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(workdir, "preload.db")}',
+        'AUDIT_SPOOL_DIR': os.path.join(workdir, 'audit-spool'),
+        'DEFER_WORKER_THREADS': True,
+    })
+    app = create_app('preload-test')
+
+    print("Preloading master...")
+    writer = app.extensions['audit']
+    check(writer._thread is None, "Audit writer not started in the master")
+    check(len(app.extensions['worker_starts']) >= 2, f"{len(app.extensions['worker_starts'])} thread starts deferred")
+
+    print("Forked worker...")
+    report = in_worker(app)
+    check('medisync-audit-writer' in report.get('threads', []), "Audit writer running in the worker")
+    check(report.get('deferred') is False, "Deferred starts run once")
+    check(report.get('new_pool') is True, "Worker does not reuse the master's connection pool")
+    check(report.get('status') == 200, "Worker answers requests")
+    check(report.get('index') == len(app.extensions['search_index']), "Worker sees the master's search index")
+    # Other apps in the same process may run writers of their own; only this one must stay idle
+    check(writer._thread is None, "Master still owns no writer thread")
+
+    print("Warm-up before forking...")
+    preload.warm(app)
+    installed = [name for name in LAZY if name in sys.modules]
+    check(gc.get_freeze_count() > 0, f"Heap frozen ({gc.get_freeze_count()} objects); {installed} imported")
+    gc.unfreeze()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    print("MEDISYNC Preload Test")
+    print("=" * 50)
+    test_lazy_imports()
+    test_deferred_threads()
+    print("=" * 50)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Test script for token-bucket rate limiting: per-endpoint limits, client identity, refill and overhead
+"""
+
+import time
+
+from app import create_app
+from config import TestingConfig, config
+from src.extensions import db
+from mock_abha_server import MockABHAServer
+from src.services import abha_auth, rate_limit
+
+STATS = '/translate/cache/stats'
+
+
+def check(condition, message):
+    print(f"{'✓' if condition else '✗'} {message}")
+    assert condition, message
+    return condition
+
+
+def statuses(client, count, path=STATS, **kwargs):
+    return [client.get(path, **kwargs).status_code for _ in range(count)]
+
+
+def test_rate_limit():
+    print("Limit syntax...")
+    check(rate_limit.parse_limit('100/hour').rate == 100 / 3600, "100/hour")
+    check(rate_limit.parse_limit('5 per 10 minutes').rate == 5 / 600, "5 per 10 minutes")
+    check(rate_limit.parse_limit('unlimited') is None, "unlimited")
+    try:
+        rate_limit.parse_limit('lots')
+        check(False, "Invalid limit rejected")
+    except ValueError:
+        check(True, "Invalid limit rejected")
+
+    with MockABHAServer() as mock:
+        app = create_app('testing')
+        app.config.update(RATELIMIT_ENABLED=True, ABHA_JWKS_URL=f'{mock.url}/certs', ABHA_ISSUER=mock.issuer)
+        abha_auth.init_app(app)
+        with app.app_context():
+            db.create_all()
+        limiter = rate_limit.RateLimiter(
+            rate_limit.MemoryBackend(), rate_limit.parse_limit('5/minute'),
+            rate_limit.parse_endpoint_limits('api_ops.get_job=unlimited;api_ops.process_bundle=2/second'),
+        )
+        app.extensions['rate_limit'] = limiter
+        client = app.test_client()
+
+        print("\nPer client and endpoint...")
+        check(statuses(client, 6) == [200] * 5 + [429], "Sixth request within a minute gets 429")
+        response = client.get(STATS)
+        check(response.headers.get('Retry-After') and response.json['issue'][0]['code'] == 'throttled',
+              f"429 carries Retry-After: {response.headers.get('Retry-After')}s and a throttled OperationOutcome")
+        check(statuses(client, 1, environ_base={'REMOTE_ADDR': '10.0.0.2'}) == [200], "Another client has its own bucket")
+        check(statuses(client, 3, headers={'X-Forwarded-For': '10.0.0.3'}) == [429] * 3,
+              "X-Forwarded-For from the client itself is ignored")
+        response = client.post('/bundle/process', json={})
+        check(response.status_code == 400 and response.headers.get('RateLimit-Limit') == '2',
+              "Endpoint override applies (RateLimit-Limit: 2)")
+        check(all(status != 429 for status in statuses(client, 20, '/jobs/unknown')), "Unlimited endpoint exempt")
+
+        print("\nABHA subjects...")
+        alice_1, alice_2 = mock.issue_jwt(subject='alice'), mock.issue_jwt(subject='alice', jti='second')
+        bob = mock.issue_jwt(subject='bob')
+        validator = app.extensions['abha_auth']
+        misses = validator.stats['misses']
+        check(statuses(client, 3, headers={'Authorization': f'Bearer {alice_1}'}) == [429] * 3
+              and validator.stats['misses'] == misses and mock.jwks_requests == 0,
+              "A token not validated yet is keyed by IP, without validating it")
+        with app.app_context():
+            # What the auth layer does on an authenticated endpoint
+            for token in (alice_1, alice_2, bob):
+                abha_auth.validate(token)
+        results = statuses(client, 3, headers={'Authorization': f'Bearer {alice_1}'})
+        results += statuses(client, 3, headers={'Authorization': f'Bearer {alice_2}'})
+        check(results == [200] * 5 + [429], "Two tokens of one subject share a bucket")
+        check(statuses(client, 1, headers={'Authorization': f'Bearer {bob}'}) == [200],
+              "Another subject behind the same IP is not limited")
+        check(statuses(client, 1, headers={'Authorization': 'Bearer not-a-token'}) == [429],
+              "An invalid token falls back to the IP's bucket")
+
+        print("\nRefill...")
+        results = [client.post('/bundle/process', json={}).status_code for _ in range(2)]
+        check(results == [400, 429], "Second token of the 2/second bucket used up")
+        time.sleep(0.6)
+        check(client.post('/bundle/process', json={}).status_code == 400, "Bucket refills at 2 per second")
+
+        print("\nShared store unavailable...")
+
+        class DownRedis:
+            def register_script(self, script):
+                def run(keys, args):
+                    raise ConnectionError('connection refused')
+                return run
+
+        app.extensions['rate_limit'] = rate_limit.RateLimiter(rate_limit.RedisBackend(DownRedis()),
+                                                              rate_limit.parse_limit('1/hour'))
+        check(statuses(client, 3) == [200] * 3, "Requests allowed while Redis is down")
+
+        print("\nOverhead...")
+        app.extensions['rate_limit'] = limiter
+        headers = {'Authorization': f'Bearer {bob}'}
+        with app.test_request_context(STATS, headers=headers):
+            started = time.perf_counter()
+            for _ in range(10000):
+                limiter.take('api_ops.translation_cache_stats', rate_limit.client_key())
+            elapsed = (time.perf_counter() - started) / 10000
+        check(elapsed < 100e-6, f"Limit check with a cached token in {elapsed * 1e6:.1f} µs")
+
+        print("\nExempt endpoints...")
+        check({'metrics', 'static'} <= set(app.config['RATELIMIT_EXEMPT'].split(',')), "metrics and static by default")
+        app.extensions['rate_limit'] = rate_limit.RateLimiter.from_config(
+            dict(app.config, RATELIMIT_DEFAULT='2/hour', RATELIMIT_STORAGE='memory'))
+        check(statuses(client, 5, '/metrics') == [200] * 5, "Prometheus scrapes are never limited")
+        check(statuses(client, 3) == [200, 200, 429], "Other endpoints keep the default limit")
+
+    print("\nTrusted proxies...")
+    config['proxy-test'] = type('ProxyTestConfig', (TestingConfig,), {'RATELIMIT_ENABLED': True, 'TRUSTED_PROXIES': 1})
+    app = create_app('proxy-test')
+    with app.app_context():
+        db.create_all()
+    app.extensions['rate_limit'] = rate_limit.RateLimiter(rate_limit.MemoryBackend(), rate_limit.parse_limit('1/hour'))
+    client = app.test_client()
+    first = statuses(client, 2, headers={'X-Forwarded-For': '10.0.0.7'})
+    second = statuses(client, 1, headers={'X-Forwarded-For': '10.0.0.8'})
+    check(first == [200, 429] and second == [200], "Behind one proxy, its X-Forwarded-For entry is the client")
+    check(statuses(client, 1, headers={'X-Forwarded-For': '203.0.113.9, 10.0.0.7'}) == [429],
+          "Entries added before the trusted proxy are ignored")
+
+
+if __name__ == "__main__":
+    print("MEDISYNC Rate Limiter Test")
+    print("=" * 50)
+    test_rate_limit()
+    print("=" * 50)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Test script for the /valueset/search backends (memory, database, Elasticsearch)
+
+The Elasticsearch backend runs against fake_elasticsearch.FakeElasticsearch,
+so no cluster is needed.
+"""
+
+from app import create_app
+from fake_elasticsearch import FakeElasticsearch
+from src.extensions import db
+from src.services import search_backends, search_index, terminology
+from src.services.search_elasticsearch import ElasticsearchBackend
+
+
+def check(condition, message):
+    print(f"{'✓' if condition else '✗'} {message}")
+    assert condition, message
+    return condition
+
+
+def codes(app, query, **kwargs):
+    return [concept.code for concept, _ in search_backends.search(app, query, **kwargs)]
+
+
+def add_code(code, display, definition=''):
+    from src.models import NAMASTECode
+    db.session.add(NAMASTECode(code=code, display=display, definition=definition, category='Ayurveda'))
+    db.session.commit()
+
+
+def test_search_backends():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        add_code('NAM001', 'Vata Dosha', 'One of the three primary doshas')
+        add_code('NAM002', 'Pitta Dosha', 'Fire and water elements')
+        add_code('NAM003', 'Shwasa Roga', 'Breathing disorder')
+
+        for backend in (search_backends.MemoryBackend(), search_backends.DatabaseBackend()):
+            search_backends.set_backend(app, backend)
+            print(f"\n{backend.name} backend...")
+            check(codes(app, 'NAM001') == ['NAM001'], "Exact code match")
+            check(codes(app, 'dos')[:2] == ['NAM001', 'NAM002'], "Display prefix, shortest first")
+            check(codes(app, 'dosha', system=terminology.ICD11_SYSTEM) == [], "System filter")
+
+        print("\nelasticsearch backend (in-process fake)...")
+        cluster = FakeElasticsearch()
+        backend = search_backends.set_backend(app, ElasticsearchBackend(cluster, bulk_size=2))
+        check(cluster.indices.exists_alias(name=backend.alias), "Created the alias and its first index on startup")
+        check(codes(app, 'NAM001')[0] == 'NAM001', "Exact code match ranks first")
+        check(codes(app, 'pit') == ['NAM002'], "Edge n-gram prefix match on display")
+        check(codes(app, 'svaasa') == ['NAM003'], "Transliteration variant 'svaasa' finds 'Shwasa'")
+
+        add_code('NAM004', 'Kapha Dosha')
+        check('NAM004' in codes(app, 'kapha'), "Ingested code indexed through codes_changed")
+
+        print("\nZero-downtime reindex...")
+        old = set(cluster.aliases[backend.alias])
+        seen_during = []
+
+        def concepts():
+            for number, concept in enumerate(list(terminology.iter_concepts())):
+                if number == 1:
+                    # A search and a write while the new index is loading
+                    seen_during.extend(codes(app, 'dosha'))
+                    add_code('NAM005', 'Vata-Pitta Dosha')
+                yield concept
+
+        count = backend.rebuild(concepts())
+        check(count == 4, f"Reindexed {count} concepts")
+        check(len(seen_during) == 3, "The old index kept serving during the reindex")
+        check(not old & set(cluster.data), "Old index dropped after the alias swap")
+        check('NAM005' in codes(app, 'vata pitta'), "Write made during the reindex is in the new index")
+
+        print("\nCluster outage...")
+        cluster.down = True
+        check(codes(app, 'kapha') == ['NAM004'], "Search falls back to the database")
+        add_code('NAM006', 'Kapha Vriddhi')
+        check(True, "Ingest is not blocked by the outage")
+        result = search_index.search_valueset(app, 'kapha', limit=1, offset=1)
+        check([c['code'] for c in result['expansion']['contains']] == ['NAM006'], "offset pages the results")
+
+
+if __name__ == "__main__":
+    print("MEDISYNC Search Backend Test")
+    print("=" * 50)
+    test_search_backends()
+    print("=" * 50)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Test script for the in-memory autocomplete index: ranking tiers, incremental updates and ValueSet output
+"""
+
+from app import create_app
+from src.extensions import db
+from src.services import search_index
+from src.services.search_index import SearchIndex
+from src.services.terminology import Concept, NAMASTE_SYSTEM, ICD11_SYSTEM
+
+CONCEPTS = [
+    Concept(NAMASTE_SYSTEM, 'NAM001', 'Vata Dosha', 'One of the three primary doshas', None),
+    Concept(NAMASTE_SYSTEM, 'NAM002', 'Pitta Dosha', 'Fire and water elements', None),
+    Concept(NAMASTE_SYSTEM, 'NAM010', 'Vataja Jvara', 'Fever from vitiated vata', None),
+    Concept(NAMASTE_SYSTEM, 'NAM011', 'Shwasa Roga', 'Breathing disorder', None),
+    Concept(ICD11_SYSTEM, 'SA00', 'Vata pattern (TM2)', '', None),
+    Concept(ICD11_SYSTEM, 'NAMX1', 'Unrelated', '', None),
+]
+
+
+def check(condition, message):
+    print(f"{'✓' if condition else '✗'} {message}")
+    assert condition, message
+    return condition
+
+
+def ranked(index, query, **kwargs):
+    return [(concept.code, tier) for concept, tier in index.search(query, **kwargs)]
+
+
+def test_ranking():
+    index = SearchIndex()
+    index.build(CONCEPTS)
+
+    print("Ranking tiers...")
+    check(ranked(index, 'nam001') == [('NAM001', search_index.TIER_CODE_EXACT)], "Exact code first, case-folded")
+    check([code for code, _ in ranked(index, 'NAM01')] == ['NAM010', 'NAM011'], "Code prefix in code order")
+    hits = ranked(index, 'vata')
+    check(hits[0][1] == search_index.TIER_DISPLAY_EXACT and {code for code, _ in hits[:2]} == {'NAM001', 'SA00'}
+          and ('NAM010', search_index.TIER_DISPLAY_PREFIX) in hits, f"Whole words before prefixes ({hits})")
+    check(ranked(index, 'vata dosha') == [('NAM001', search_index.TIER_DISPLAY_EXACT)], "All terms must match")
+    check(ranked(index, 'hwas') == [('NAM011', search_index.TIER_DISPLAY_INFIX)], "Infix match through trigrams")
+    check(ranked(index, 'breath') == [('NAM011', search_index.TIER_DEFINITION)], "Definition words ranked last")
+    check(ranked(index, 'pita') == [('NAM002', search_index.TIER_FUZZY)], "Misspelling matched by trigram similarity")
+    check(ranked(index, 'zzzz') == [] and ranked(index, '  ') == [], "No match, empty query")
+
+    print("\nFilters and limits...")
+    check([code for code, _ in ranked(index, 'vata', system=ICD11_SYSTEM)] == ['SA00'], "System filter")
+    check(len(ranked(index, 'dosha', limit=1)) == 1 and ranked(index, 'dosha', limit=0) == [], "Limit respected")
+    check([code for code, _ in ranked(index, 'nam')] == ['NAM001', 'NAM002', 'NAM010', 'NAM011', 'NAMX1'],
+          "Code prefix spans systems")
+
+    print("\nIncremental updates...")
+    index.upsert([Concept(NAMASTE_SYSTEM, 'NAM002', 'Kapha Dosha', '', None),
+                  Concept(NAMASTE_SYSTEM, 'NAM020', 'Pittaja Jvara', '', None)])
+    check(len(index) == 7, "Upsert replaces one concept and adds another")
+    check([code for code, _ in ranked(index, 'pitta')] == ['NAM020'], "Old display words forgotten")
+    check(ranked(index, 'kapha') == [('NAM002', search_index.TIER_DISPLAY_EXACT)], "New display words found")
+    index.remove([(NAMASTE_SYSTEM, 'NAM011'), (NAMASTE_SYSTEM, 'NOPE')])
+    check(ranked(index, 'shwasa') == [] and len(index) == 6, "Removed concept no longer found")
+    index.upsert([Concept(NAMASTE_SYSTEM, 'NAM030', 'Shwasa Kasa', '', None)])
+    check(ranked(index, 'shwasa') == [('NAM030', search_index.TIER_DISPLAY_EXACT)] and len(index) == 7,
+          "Freed slot reused")
+
+
+def test_valueset():
+    from src.models import NAMASTECode
+
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        print("\nValueSet expansion...")
+        db.session.add_all([NAMASTECode(code=f'NAM{i:03d}', display=f'Jvara type {i}', category='Ayurveda')
+                            for i in range(30)])
+        db.session.commit()
+        body = search_index.search_valueset(app, 'jvara', limit=10, offset=5)
+        expansion = body['expansion']
+        check(body['resourceType'] == 'ValueSet' and len(expansion['contains']) == 10 and expansion['offset'] == 5,
+              "Page of 10 after an offset of 5")
+        first = search_index.search_valueset(app, 'jvara', limit=15)['expansion']['contains']
+        check(expansion['contains'] == first[5:], "Pages follow the ranked order")
+        check({'name': 'filter', 'valueString': 'jvara'} in expansion['parameter'], "Filter echoed as a parameter")
+
+        row = db.session.execute(db.select(NAMASTECode).filter_by(code='NAM007')).scalar_one()
+        row.display = 'Atisara'
+        db.session.commit()
+        contains = search_index.search_valueset(app, 'atisara')['expansion']['contains']
+        check([c['code'] for c in contains] == ['NAM007'], "Committed ORM changes reach the index")
+        db.session.delete(row)
+        db.session.commit()
+        check(search_index.search_valueset(app, 'atisara')['expansion']['contains'] == [], "Deletes too")
+
+
+if __name__ == "__main__":
+    print("MEDISYNC Search Index Test")
+    print("=" * 50)
+    test_ranking()
+    test_valueset()
+    print("=" * 50)
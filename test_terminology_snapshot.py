@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Test script for the memory-mapped terminology snapshot: lookups, generation swaps and staleness
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from sqlalchemy import event
+
+from app import create_app
+from config import TestingConfig, config
+from src.extensions import db
+from src.services import bundle_processor, search_backends, terminology_snapshot, translation
+from src.services.terminology import NAMASTE_SYSTEM, ICD11_SYSTEM
+
+KEYS = [
+    (NAMASTE_SYSTEM, 'NAM001', ICD11_SYSTEM),
+    (NAMASTE_SYSTEM, 'NAM002', ICD11_SYSTEM),
+    (ICD11_SYSTEM, 'SA00', NAMASTE_SYSTEM),
+    (ICD11_SYSTEM, 'SA01', NAMASTE_SYSTEM),
+    (NAMASTE_SYSTEM, 'NAM999', ICD11_SYSTEM),
+    (NAMASTE_SYSTEM, 'NAM001', NAMASTE_SYSTEM),
+]
+
+
+def check(condition, message):
+    print(f"{'✓' if condition else '✗'} {message}")
+    assert condition, message
+    return condition
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return condition()
+
+
+def from_database(app, fn, *args):
+    """fn(*args) with the snapshot switched off"""
+    store = app.extensions.pop('terminology_snapshot')
+    try:
+        return fn(*args)
+    finally:
+        app.extensions['terminology_snapshot'] = store
+
+
+def add_terminology():
+    from src.models import ConceptMapping, ICD11Code, NAMASTECode
+
+    db.session.add_all([NAMASTECode(code=f'NAM{i:03d}', display=f'Vātaja jvara {i}', definition='Fever',
+                                    parent_code='NAM000' if i else None) for i in range(200)])
+    db.session.add_all([ICD11Code(code=f'SA{i:02d}', title=f'Fever pattern {i} (TM2)') for i in range(50)])
+    db.session.add_all([
+        ConceptMapping(source_system=NAMASTE_SYSTEM, source_code='NAM001', target_system=ICD11_SYSTEM,
+                       target_code='SA00', target_display='Fever pattern 0 (TM2)', equivalence='equivalent'),
+        ConceptMapping(source_system=NAMASTE_SYSTEM, source_code='NAM001', target_system=ICD11_SYSTEM,
+                       target_code='SA01', target_display=None, equivalence='wider'),
+        ConceptMapping(source_system=ICD11_SYSTEM, source_code='SA01', target_system=NAMASTE_SYSTEM,
+                       target_code='NAM002', equivalence='narrower'),
+    ])
+    db.session.commit()
+
+
+def test_terminology_snapshot():
+    workdir = tempfile.mkdtemp(prefix='medisync-snapshot-')
+    directory = os.path.join(workdir, 'snapshots')
+    config['snapshot-test'] = type('SnapshotTestConfig', (TestingConfig,), {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(workdir, "terminology.db")}',
+        'TERMINOLOGY_SNAPSHOT_ENABLED': True,
+        'TERMINOLOGY_SNAPSHOT_DIR': directory,
+        'TERMINOLOGY_SNAPSHOT_DELAY': 0.1,
+        'TERMINOLOGY_SNAPSHOT_TTL': 0,
+        'TERMINOLOGY_RELEASE_TTL': 60,
+        'TERMINOLOGY_RELEASE_BUMP_INTERVAL': 0,
+    })
+    app = create_app('snapshot-test')
+    store = app.extensions['terminology_snapshot']
+
+    with app.app_context():
+        print("Writing a snapshot after an ingest...")
+        check(store.current() is None, "No snapshot before the tables exist")
+        db.create_all()
+        add_terminology()
+        check(terminology_snapshot.current() is None, "Database answers until the snapshot is written")
+        check(wait_for(lambda: terminology_snapshot.current() is not None), "Snapshot written after the change")
+        snapshot = terminology_snapshot.current()
+        check(len(snapshot) == 250, f"{len(snapshot)} concepts in {snapshot.size} bytes")
+
+        print("Lookups...")
+        check(all(snapshot.matches(*key) == from_database(app, translation._load_matches, *key) for key in KEYS),
+              "matches() equals the database lookup in both directions")
+        second = snapshot.matches(*KEYS[0])[1]
+        check(second['display'] is None and second['equivalence'] == 'wider', "None display and equivalence round-trip")
+        concept = snapshot.concept(NAMASTE_SYSTEM, 'NAM007')
+        check(concept is not None and concept.display == 'Vātaja jvara 7' and concept.parent_code == 'NAM000',
+              "concept() decodes UTF-8 display and parent")
+        check(snapshot.concept(NAMASTE_SYSTEM, 'NAM000').parent_code is None
+              and snapshot.concept(ICD11_SYSTEM, 'NAM007') is None and not snapshot.contains('urn:other', 'NAM007'),
+              "Missing parent is None; codes are looked up per system")
+        codings = {(NAMASTE_SYSTEM, 'NAM001'), (NAMASTE_SYSTEM, 'NOPE'), (ICD11_SYSTEM, 'SA49'), ('urn:x', 'SA01')}
+        check(bundle_processor._known_codes(codings) == from_database(app, bundle_processor._known_codes, codings),
+              "Bundle code validation equals the database lookup")
+        backend = search_backends.MemoryBackend()
+        check(backend.rebuild(terminology_snapshot.iter_concepts()) == 250
+              and backend.search('jvara 7', limit=1)[0][0].code == 'NAM007', "Search index built from the snapshot")
+
+        statements = []
+
+        def count(*args):
+            statements.append(1)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        app.extensions['translation_cache'].local.clear()
+        translation.translate_many(KEYS)
+        event.remove(db.engine, 'before_cursor_execute', count)
+        check(not statements, "translate_many answered without SQL")
+
+        print("New generations...")
+        from src.models import ConceptMapping
+        first = snapshot.generation
+        db.session.add(ConceptMapping(source_system=NAMASTE_SYSTEM, source_code='NAM003', target_system=ICD11_SYSTEM,
+                                      target_code='SA03', target_display='Fever pattern 3 (TM2)'))
+        db.session.commit()
+        check(terminology_snapshot.current() is None, "Snapshot not used once the release moves on")
+        check([m['code'] for m in translation.translate(NAMASTE_SYSTEM, 'NAM003', ICD11_SYSTEM)] == ['SA03'],
+              "New mapping visible straight away (from the database)")
+        check(wait_for(lambda: terminology_snapshot.current() is not None), "Next generation written")
+        swapped = terminology_snapshot.current()
+        codes = [m['code'] for m in swapped.matches(NAMASTE_SYSTEM, 'NAM003', ICD11_SYSTEM)]
+        check(swapped.generation > first and codes == ['SA03'], "Worker swapped to the new generation, no restart")
+        check(snapshot.matches(*KEYS[0]) == swapped.matches(*KEYS[0]), "The old generation stays readable while held")
+
+        other = terminology_snapshot.SnapshotStore(directory, ttl=0)
+        check(other.current().generation == swapped.generation, "Another worker maps the same generation")
+
+        for i in range(3):
+            db.session.add(ConceptMapping(source_system=NAMASTE_SYSTEM, source_code=f'NAM01{i}',
+                                          target_system=ICD11_SYSTEM, target_code='SA05'))
+            db.session.commit()
+            time.sleep(0.3)
+        wait_for(lambda: terminology_snapshot.current() is not None)
+        files = [name for name in os.listdir(directory) if name.endswith('.snap')]
+        check(len(files) <= terminology_snapshot.KEEP_GENERATIONS, f"Old generations removed ({len(files)} kept)")
+
+        with open(os.path.join(directory, 'broken.snap'), 'wb') as f:
+            f.write(b'not a snapshot')
+        with open(os.path.join(directory, terminology_snapshot.POINTER), 'w') as f:
+            f.write('broken.snap')
+        before = store.current()
+        check(store.current() is before and before is not None, "Unreadable generation ignored; the last one kept")
+
+        print("Other processes...")
+        script = (f'from src.services.terminology_snapshot import Snapshot; '
+                  f'print(Snapshot({before.path!r}).concept({NAMASTE_SYSTEM!r}, "NAM042").display)')
+        output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True,
+                                env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+        error = f'\n{output.stderr[-500:]}' if output.returncode else ''
+        check(output.stdout.strip() == 'Vātaja jvara 42', f"Another process maps the file without the database{error}")
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    print("MEDISYNC Terminology Snapshot Test")
+    print("=" * 50)
+    test_terminology_snapshot()
+    print("=" * 50)
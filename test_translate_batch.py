@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Test script for batch ConceptMap/$translate: input forms, ordering, per-entry errors and the batch limit
+"""
+
+from app import create_app
+from src.extensions import db
+from src.services import translation
+from src.services.terminology import NAMASTE_SYSTEM, ICD11_SYSTEM
+
+BATCH = '/ConceptMap/$translate/batch'
+
+
+def check(condition, message):
+    print(f"{'✓' if condition else '✗'} {message}")
+    assert condition, message
+    return condition
+
+
+def add_mappings(count):
+    from src.models import ConceptMapping
+
+    db.session.add_all([
+        ConceptMapping(source_system=NAMASTE_SYSTEM, source_code=f'NAM{i:03d}', target_system=ICD11_SYSTEM,
+                       target_code=f'SA{i:03d}', target_display=f'Pattern {i}', equivalence='equivalent')
+        for i in range(count)
+    ])
+    db.session.commit()
+
+
+def matched_codes(entry):
+    return [part['valueCoding']['code'] for p in entry['resource']['parameter'] if p['name'] == 'match'
+            for part in p['part'] if part['name'] == 'concept']
+
+
+def test_translate_batch():
+    app = create_app('testing')
+    app.config['TRANSLATE_BATCH_MAX'] = 50
+    client = app.test_client()
+    with app.app_context():
+        db.create_all()
+        add_mappings(40)
+
+    print("JSON array...")
+    body = [{'source_system': NAMASTE_SYSTEM, 'source_code': f'NAM{i:03d}', 'target_system': ICD11_SYSTEM}
+            for i in (5, 1, 39, 5)]
+    body.insert(2, {'source_system': NAMASTE_SYSTEM, 'source_code': 'NAM999', 'target_system': ICD11_SYSTEM})
+    body.insert(3, {'source_code': 'NAM001'})
+    response = client.post(BATCH, json=body)
+    bundle = response.get_json()
+    check(response.status_code == 200 and bundle['type'] == 'batch-response' and bundle['total'] == 6,
+          "batch-response Bundle with one entry per input")
+    statuses = [entry['response']['status'] for entry in bundle['entry']]
+    check(statuses == ['200 OK'] * 3 + ['400 Bad Request'] + ['200 OK'] * 2, f"Per-entry statuses {statuses}")
+    check([matched_codes(entry) if 'resource' in entry else None for entry in bundle['entry']]
+          == [['SA005'], ['SA001'], [], None, ['SA039'], ['SA005']], "Results in input order, repeats included")
+    unmatched = bundle['entry'][2]['resource']['parameter'][0]
+    check(unmatched == {'name': 'result', 'valueBoolean': False}, "Unmapped code answered with result=false")
+
+    print("\nParameters...")
+    parameters = {'resourceType': 'Parameters', 'parameter': [
+        {'name': 'targetsystem', 'valueUri': ICD11_SYSTEM},
+        {'name': 'coding', 'valueCoding': {'system': NAMASTE_SYSTEM, 'code': 'NAM002'}},
+        {'name': 'item', 'part': [{'name': 'system', 'valueUri': ICD11_SYSTEM}, {'name': 'code', 'valueCode': 'SA003'},
+                                  {'name': 'targetsystem', 'valueUri': NAMASTE_SYSTEM}]},
+    ]}
+    bundle = client.post(BATCH, json=parameters).get_json()
+    check([matched_codes(entry) for entry in bundle['entry']] == [['SA002'], ['NAM003']],
+          "Codings use the top-level targetsystem, items their own (reverse direction too)")
+    single = client.get('/ConceptMap/$translate', query_string={
+        'system': NAMASTE_SYSTEM, 'code': 'NAM002', 'targetsystem': ICD11_SYSTEM}).get_json()
+    check(bundle['entry'][0]['resource'] == single, "Entry matches the single-code $translate response")
+
+    print("\nSet-based lookups and the cache...")
+    cache = app.extensions['translation_cache']
+    cache.local.clear()
+    chunk, translation.BULK_QUERY_CHUNK = translation.BULK_QUERY_CHUNK, 7
+    try:
+        body = [{'source_system': NAMASTE_SYSTEM, 'source_code': f'NAM{i:03d}', 'target_system': ICD11_SYSTEM}
+                for i in range(40)]
+        misses = cache.misses
+        bundle = client.post(BATCH, json=body).get_json()
+        check([matched_codes(entry) for entry in bundle['entry']] == [[f'SA{i:03d}'] for i in range(40)],
+              "40 keys resolved across query chunks of 7")
+        check(cache.misses - misses == 40, "Every key a miss the first time")
+        hits = cache.hits
+        client.post(BATCH, json=body)
+        check(cache.hits - hits == 40 and cache.misses - misses == 40, "Served from the cache the second time")
+    finally:
+        translation.BULK_QUERY_CHUNK = chunk
+
+    print("\nRejected batches...")
+    check(client.post(BATCH, json={}).status_code == 400, "Empty body: 400")
+    check(client.post(BATCH, json={'resourceType': 'Bundle'}).status_code == 400, "Not Parameters: 400")
+    response = client.post(BATCH, json=body + body)
+    check(response.status_code == 413 and response.json['issue'][0]['code'] == 'too-costly',
+          "More than TRANSLATE_BATCH_MAX codes: 413")
+
+
+if __name__ == "__main__":
+    print("MEDISYNC Batch Translate Test")
+    print("=" * 50)
+    test_translate_batch()
+    print("=" * 50)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Test script for the translation cache: reverse equivalence, precise invalidation and stale loads
+"""
+
+from app import create_app
+from src.extensions import db
+from src.services import translation
+from src.services.terminology import NAMASTE_SYSTEM, ICD11_SYSTEM
+
+
+def check(condition, message):
+    print(f"{'✓' if condition else '✗'} {message}")
+    assert condition, message
+    return condition
+
+
+def add_mappings():
+    from src.models import ConceptMapping
+
+    db.session.add_all([
+        ConceptMapping(source_system=NAMASTE_SYSTEM, source_code='NAM001', target_system=ICD11_SYSTEM,
+                       target_code='SA00', target_display='Fever pattern 0 (TM2)', equivalence='equivalent'),
+        ConceptMapping(source_system=NAMASTE_SYSTEM, source_code='NAM001', target_system=ICD11_SYSTEM,
+                       target_code='SA01', equivalence='wider'),
+        ConceptMapping(source_system=ICD11_SYSTEM, source_code='SA05', target_system=NAMASTE_SYSTEM,
+                       target_code='NAM003', equivalence='subsumes'),
+        ConceptMapping(source_system=NAMASTE_SYSTEM, source_code='NAM004', target_system=ICD11_SYSTEM,
+                       target_code='SA06', equivalence='inexact'),
+    ])
+    db.session.commit()
+
+
+def equivalences(matches):
+    return {match['code']: match['equivalence'] for match in matches}
+
+
+def test_reverse_equivalence():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        add_mappings()
+        print("Reverse direction...")
+        check(equivalences(translation.translate(NAMASTE_SYSTEM, 'NAM001', ICD11_SYSTEM)) ==
+              {'SA00': 'equivalent', 'SA01': 'wider'}, "Forward mappings keep their equivalence")
+        check(equivalences(translation.translate(ICD11_SYSTEM, 'SA01', NAMASTE_SYSTEM)) == {'NAM001': 'narrower'},
+              "wider read from the target's side is narrower")
+        check(equivalences(translation.translate(NAMASTE_SYSTEM, 'NAM003', ICD11_SYSTEM)) == {'SA05': 'specializes'},
+              "subsumes read from the target's side is specializes")
+        check(equivalences(translation.translate(ICD11_SYSTEM, 'SA06', NAMASTE_SYSTEM)) == {'NAM004': 'inexact'},
+              "inexact is symmetric")
+        app.extensions['translation_cache'].local.clear()
+        bulk = translation.translate_many([(ICD11_SYSTEM, 'SA01', NAMASTE_SYSTEM),
+                                           (NAMASTE_SYSTEM, 'NAM003', ICD11_SYSTEM)])
+        check([equivalences(matches) for matches in bulk] == [{'NAM001': 'narrower'}, {'SA05': 'specializes'}],
+              "Bulk loads invert the same way")
+
+
+def test_invalidation():
+    from src.models import ConceptMapping
+
+    app = create_app('testing')
+    cache = app.extensions['translation_cache']
+    with app.app_context():
+        db.create_all()
+        add_mappings()
+        print("Precise invalidation...")
+        keys = [(NAMASTE_SYSTEM, 'NAM001', ICD11_SYSTEM), (ICD11_SYSTEM, 'SA09', NAMASTE_SYSTEM),
+                (NAMASTE_SYSTEM, 'NAM004', ICD11_SYSTEM)]
+        translation.translate_many(keys)
+        check(all(cache.local.get(key) is not None for key in keys), f"{len(keys)} keys cached")
+        db.session.add(ConceptMapping(source_system=NAMASTE_SYSTEM, source_code='NAM001', target_system=ICD11_SYSTEM,
+                                      target_code='SA09', equivalence='equivalent'))
+        db.session.commit()
+        check(cache.local.get(keys[0]) is None and cache.local.get(keys[1]) is None,
+              "Both directions of the new mapping evicted")
+        check(cache.local.get(keys[2]) is not None, "Unrelated key still cached")
+        check('SA09' in equivalences(translation.translate(*keys[0])), "Next lookup sees the new mapping")
+
+        print("Stale loads...")
+        key = (NAMASTE_SYSTEM, 'NAM004', ICD11_SYSTEM)
+        cache.local.clear()
+
+        def load_during_commit():
+            matches = translation._load_matches(*key)
+            # A mapping commit lands between the read and the store
+            db.session.add(ConceptMapping(source_system=NAMASTE_SYSTEM, source_code='NAM004',
+                                          target_system=ICD11_SYSTEM, target_code='SA07', equivalence='wider'))
+            db.session.commit()
+            return matches
+
+        stale = cache.get_or_load(key, load_during_commit)
+        check(equivalences(stale) == {'SA06': 'inexact'} and cache.local.get(key) is None,
+              "Load read before the commit is returned but not cached")
+        check(cache.stats()['stale_loads'] == 1, "Stale load counted")
+        check(equivalences(translation.translate(*key)) == {'SA06': 'inexact', 'SA07': 'wider'},
+              "Next lookup loads the committed mapping")
+
+        generation = cache.begin_load()
+        cache.invalidate([key])
+        cache.set_many({key: stale}, generation)
+        check(cache.local.get(key) is None and cache.stats()['stale_loads'] == 2,
+              "Bulk store after an invalidation skipped")
+        cache.set_many({key: stale}, cache.begin_load())
+        check(cache.local.get(key) == stale, "Bulk store with the current generation kept")
+
+
+if __name__ == "__main__":
+    print("MEDISYNC Translation Cache Test")
+    print("=" * 50)
+    test_reverse_equivalence()
+    test_invalidation()
+    print("=" * 50)
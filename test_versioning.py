@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Test script for FHIRResource version storage: JSON Patch round trips, vread, _history and compaction
+"""
+
+import copy
+import json
+import random
+
+from app import create_app
+from src.extensions import db
+from src.services import versioning
+
+
+def check(condition, message):
+    print(f"{'✓' if condition else '✗'} {message}")
+    assert condition, message
+    return condition
+
+
+def mutate(document, rng):
+    """A random edit somewhere in a nested document"""
+    document = copy.deepcopy(document)
+    target = document
+    while True:
+        if isinstance(target, dict) and target and rng.random() < 0.6:
+            key = rng.choice(sorted(target))
+            if isinstance(target[key], (dict, list)) and target[key]:
+                target = target[key]
+                continue
+        break
+    if isinstance(target, list):
+        choice = rng.random()
+        if choice < 0.3 and target:
+            target.pop(rng.randrange(len(target)))
+        elif choice < 0.6:
+            target.insert(rng.randrange(len(target) + 1), {'text': f'item {rng.random()}'})
+        elif target:
+            target[rng.randrange(len(target))] = rng.choice([1, True, 'x', None, {'a/b~c': [1]}])
+    else:
+        choice = rng.random()
+        if choice < 0.3 and len(target) > 1:
+            target.pop(rng.choice(sorted(target)))
+        else:
+            target[rng.choice(['status', 'note', 'a/b', 'x~y', 'count'])] = rng.choice([0, False, 'value', [1, 2], {}])
+    return document
+
+
+def put(client, resource):
+    return client.post('/bundle/process', json={'resourceType': 'Bundle', 'type': 'batch', 'entry': [
+        {'resource': resource, 'request': {'method': 'PUT', 'url': f'Condition/{resource["id"]}'}}]})
+
+
+def test_versioning():
+    print("JSON Patch...")
+    rng = random.Random(7)
+    document = {'resourceType': 'Condition', 'note': [{'text': 'a'}], 'code': {'coding': [{'code': 'X'}]}}
+    ok = True
+    for _ in range(2000):
+        changed = mutate(document, rng)
+        patch = versioning.make_patch(document, changed)
+        applied = versioning.apply_patch(copy.deepcopy(document), json.loads(json.dumps(patch)))
+        # As JSON text, so that 1 and true (equal in Python) count as different
+        ok = ok and json.dumps(applied, sort_keys=True) == json.dumps(changed, sort_keys=True)
+        document = changed
+    check(ok, "2000 random edits round-trip through make_patch/apply_patch")
+    check(versioning.make_patch({'a': 1}, {'a': True}) == [{'op': 'replace', 'path': '/a', 'value': True}],
+          "1 and true are different JSON values")
+    nested = versioning.make_patch({'a': {'b': [1, 2]}, 'c': [{'d': 1}]}, {'a': {'b': [True, 2]}, 'c': [{'d': 1.0}]})
+    check(nested == [{'op': 'replace', 'path': '/a/b/0', 'value': True},
+                     {'op': 'replace', 'path': '/c/0/d', 'value': 1.0}],
+          "Nested 1 -> true and 1 -> 1.0 changes are patched")
+
+    app = create_app('testing')
+    app.config.update(CONSENT_REQUIRED=False, VERSION_SNAPSHOT_INTERVAL=5, VERSION_COMPRESS_PAYLOADS=True)
+    with app.app_context():
+        from src.models import FHIRResource
+
+        db.create_all()
+        client = app.test_client()
+
+        print("\nVersions through /bundle/process...")
+        written = []
+        detail = {'status': 'active', 'note': [{'text': 'a'}]}
+        for version in range(1, 24):
+            detail = mutate(detail, rng)
+            resource = {'resourceType': 'Condition', 'id': 'c1', 'text': 'Vata imbalance ' * 20, 'detail': detail}
+            put(client, resource)
+            written.append(resource)
+        rows = db.session.execute(db.select(FHIRResource.version, FHIRResource.resource_data)
+                                  .order_by(FHIRResource.version)).all()
+        snapshots = [version for version, data in rows if versioning.decode_payload(data)[0]]
+        gaps = [b - a for a, b in zip(snapshots, snapshots[1:] + [len(rows) + 1])]
+        check(snapshots[0] == 1 and max(gaps) <= 6, f"Snapshots at versions {snapshots}")
+
+        def strip(resource):
+            return {key: value for key, value in resource.items() if key != 'meta'}
+
+        vreads = [client.get(f'/fhir/Condition/c1/_history/{version}') for version in range(1, 24)]
+        check(all(strip(response.json) == written[index] for index, response in enumerate(vreads)),
+              "vread returns every version exactly as written")
+        check(vreads[3].json['meta']['versionId'] == '4' and vreads[3].headers['ETag'] == 'W/"4"', "versionId and ETag")
+        check(client.get('/fhir/Condition/c1').json['meta']['versionId'] == '23', "read returns the latest version")
+        history = client.get('/fhir/Condition/c1/_history').json
+        check(history['total'] == 23 and [strip(entry['resource']) for entry in history['entry']] == written[::-1],
+              "_history lists all versions, newest first")
+        check(client.get('/fhir/Condition/c1/_history/24').status_code == 404
+              and client.get('/fhir/Condition/missing').status_code == 404, "Unknown versions and resources 404")
+
+        print("\nMigrating full-document rows...")
+        legacy = [dict(resource, meta={'versionId': str(version)}) for version, resource in enumerate(written, 1)]
+        db.session.execute(db.insert(FHIRResource), [
+            {'resource_type': 'Condition', 'resource_id': 'legacy', 'version': version, 'resource_data': json.dumps(doc)}
+            for version, doc in enumerate(legacy, 1)])
+        db.session.commit()
+        check(client.get('/fhir/Condition/legacy/_history/9').json == legacy[8], "Legacy rows read as snapshots")
+        stats = versioning.compact()
+        check(stats['bytes_after'] < stats['bytes_before'] and stats['rows_rewritten'] >= 20,
+              f"compact(): {stats['bytes_before']} -> {stats['bytes_after']} bytes, {stats['rows_rewritten']} rows")
+        check(all(client.get(f'/fhir/Condition/legacy/_history/{version}').json == doc
+                  for version, doc in enumerate(legacy, 1)), "Every legacy version reads back unchanged")
+        check(versioning.compact()['rows_rewritten'] == 0, "Running compact() again changes nothing")
+        put(client, dict(written[-1], detail={}))
+        check(client.get('/fhir/Condition/legacy').json['meta']['versionId'] == '23'
+              and client.get('/fhir/Condition/c1').json['detail'] == {}, "Writes continue on compacted history")
+
+
+if __name__ == "__main__":
+    print("MEDISYNC Version Storage Test")
+    print("=" * 50)
+    test_versioning()
+    print("=" * 50)